@@ -0,0 +1,122 @@
+"""
+Échantillonnage séquentiel des lectures d'alignement
+
+Au lieu d'un nombre fixe de lectures par piste, on arrête de lire une piste
+dès que ses statistiques ont convergé :
+- l'intervalle de confiance (95%) sur son pourcentage est assez étroit
+- le coefficient de variation (CV) des flux est assez faible
+
+Une piste bruitée continue d'être lue jusqu'au plafond max_reads. Les
+statistiques par piste sont celles de AlignmentParser.calculate_statistics.
+"""
+
+from typing import Dict, List, Iterable
+import math
+
+from .alignment_parser import AlignmentParser, AlignmentValue
+
+# Valeurs critiques de la loi de Student (bilatéral, 95%) par degré de liberté
+T_CRITICAL_95 = {
+    1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571,
+    6: 2.447, 7: 2.365, 8: 2.306, 9: 2.262, 10: 2.228,
+    12: 2.179, 15: 2.131, 20: 2.086, 30: 2.042
+}
+
+
+def t_critical(df: int) -> float:
+    """Valeur critique de Student à 95% (valeur tabulée la plus proche par défaut)"""
+    if df < 1:
+        return math.inf
+    if df > 30:
+        return 1.96
+    return T_CRITICAL_95[max(d for d in T_CRITICAL_95 if d <= df)]
+
+
+class SequentialSampler:
+    """Décide, piste par piste, quand arrêter les lectures"""
+
+    def __init__(
+        self,
+        min_reads: int = 3,
+        max_reads: int = 15,
+        ci_target: float = 1.0,
+        cv_target: float = 1.0
+    ):
+        """
+        Initialise le contrôleur
+
+        Args:
+            min_reads: Nombre minimal de lectures par piste
+            max_reads: Plafond de lectures par piste
+            ci_target: Demi-largeur maximale de l'IC à 95% sur le pourcentage (points)
+            cv_target: CV maximal des flux (azimuth_cv de calculate_statistics, en %)
+        """
+        self.min_reads = max(1, min_reads)
+        self.max_reads = max(self.min_reads, max_reads)
+        self.ci_target = ci_target
+        self.cv_target = cv_target
+        self._values: Dict[str, List[AlignmentValue]] = {}
+
+    def add(self, value: AlignmentValue):
+        """Ajoute une lecture"""
+        if value.track:
+            self._values.setdefault(value.track, []).append(value)
+
+    def count(self, track: str) -> int:
+        """Nombre de lectures d'une piste"""
+        return len(self._values.get(track, []))
+
+    def track_summary(self, track: str) -> Dict:
+        """Statistiques de décision d'une piste"""
+        values = self._values.get(track, [])
+        n = len(values)
+        summary = {
+            "track": track,
+            "reads": n,
+            "mean": None,
+            "ci_half_width": None,
+            "cv": None,
+            "converged": False
+        }
+        if n == 0:
+            return summary
+
+        percentages = [v.percentage for v in values]
+        mean = sum(percentages) / n
+        summary["mean"] = round(mean, 3)
+        if n > 1:
+            std_dev = math.sqrt(sum((p - mean) ** 2 for p in percentages) / (n - 1))
+            summary["ci_half_width"] = round(t_critical(n - 1) * std_dev / math.sqrt(n), 3)
+
+        stats = AlignmentParser.calculate_statistics(values, limit=0)
+        if stats.get("values"):
+            summary["cv"] = stats["values"][0]["azimuth_cv"]
+
+        if n >= self.max_reads:
+            summary["converged"] = True
+        elif n >= self.min_reads and summary["ci_half_width"] is not None:
+            summary["converged"] = (
+                summary["ci_half_width"] <= self.ci_target
+                and (summary["cv"] is None or summary["cv"] <= self.cv_target)
+            )
+        return summary
+
+    def is_converged(self, track: str) -> bool:
+        """True si la piste n'a plus besoin de lectures"""
+        return self.track_summary(track)["converged"]
+
+    def all_converged(self, tracks: Iterable[str]) -> bool:
+        """True si toutes les pistes données ont convergé"""
+        return all(self.is_converged(track) for track in tracks)
+
+    def summary(self) -> Dict:
+        """Bilan global : lectures effectuées et économisées par rapport au plafond"""
+        tracks = [self.track_summary(track) for track in self._values]
+        total = sum(t["reads"] for t in tracks)
+        return {
+            "tracks": len(tracks),
+            "total_reads": total,
+            "max_reads": len(tracks) * self.max_reads,
+            "reads_saved": len(tracks) * self.max_reads - total,
+            "noisy_tracks": [t["track"] for t in tracks if t["reads"] >= self.max_reads]
+        }
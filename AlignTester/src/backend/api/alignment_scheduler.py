@@ -0,0 +1,353 @@
+"""
+Planificateur de tests d'alignement multi-Greaseweazle / multi-lecteurs
+
+Chaque test est un job avec son propre état (AlignmentStateManager), son flux
+de résultats et sa propre annulation. Les jobs sont rangés dans un registre
+de sessions indexé par (device, lecteur).
+
+Les jobs qui partagent une même unité USB (lecteurs A et B sur un même
+Greaseweazle) sont exécutés l'un après l'autre : un verrou par port série.
+Ce verrou (unit_lock) est aussi pris par la tâche /align, par les plans de
+seek (/drive/test, /seek/plan, vérification Track 0) et par chaque commande
+gw du mode manuel. Les jobs sur des Greaseweazle différents
+s'exécutent en parallèle.
+
+Seuls les MAX_FINISHED_JOBS derniers jobs terminés restent dans le registre.
+"""
+
+from typing import Optional, Dict, List, Tuple, Callable, Awaitable, AsyncIterator
+from dataclasses import dataclass, field
+from datetime import datetime
+import asyncio
+import itertools
+import weakref
+
+from .greaseweazle import GreaseweazleExecutor
+from .alignment_parser import AlignmentParser
+from .alignment_state import AlignmentStateManager, AlignmentStatus
+from .adaptive_sampling import SequentialSampler
+from .alignment_survey import AlignmentSurvey
+from .results_export import export_session
+from .settings import settings_manager
+
+# Clé d'unité utilisée quand aucun port n'est connu (détection automatique par gw)
+AUTO_DEVICE = "auto"
+
+# Nombre de jobs terminés conservés (état, valeurs) dans le registre
+MAX_FINISHED_JOBS = 50
+
+EventCallback = Callable[[Dict], Awaitable[None]]
+
+
+# Verrous par unité USB. Un verrou asyncio appartient à une boucle
+# d'événements : un jeu de verrous par boucle.
+_unit_locks: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Lock]]" = \
+    weakref.WeakKeyDictionary()
+
+
+def unit_lock(device: Optional[str] = None) -> asyncio.Lock:
+    """
+    Verrou sérialisant l'accès à une unité USB
+
+    Args:
+        device: Port série (par défaut : dernier port utilisé, comme gw)
+    """
+    unit = device or settings_manager.get_last_port() or AUTO_DEVICE
+    locks = _unit_locks.setdefault(asyncio.get_running_loop(), {})
+    if unit not in locks:
+        locks[unit] = asyncio.Lock()
+    return locks[unit]
+
+
+@dataclass
+class AlignmentJob:
+    """Un test d'alignement d'un lecteur sur un Greaseweazle"""
+    job_id: str
+    device: Optional[str]
+    drive: str
+    cylinders: int = 80
+    retries: int = 3
+    format_type: str = "ibm.1440"
+    diskdefs_path: Optional[str] = None
+    adaptive: bool = False
+    survey: bool = False
+    archive_path: Optional[str] = None
+    export_path: Optional[str] = None
+    state: AlignmentStateManager = field(default_factory=AlignmentStateManager)
+    results: asyncio.Queue = field(default_factory=asyncio.Queue)
+    task: Optional[asyncio.Task] = None
+    created: datetime = field(default_factory=datetime.now)
+
+    @property
+    def unit(self) -> str:
+        """Unité USB (port série) utilisée par le job"""
+        return self.device or AUTO_DEVICE
+
+    @property
+    def session_key(self) -> Tuple[str, str]:
+        """Clé de session (device, lecteur)"""
+        return (self.unit, self.drive)
+
+    def is_active(self) -> bool:
+        """Job en attente ou en cours d'exécution"""
+        return self.task is not None and not self.task.done()
+
+    async def to_dict(self, include_values: bool = False) -> Dict:
+        """Convertit le job en dictionnaire pour la sérialisation"""
+        state = await self.state.get_state()
+        status = state.status.value
+        if state.status == AlignmentStatus.IDLE and self.is_active():
+            status = "queued"
+        data = {
+            "job_id": self.job_id,
+            "device": self.device,
+            "drive": self.drive,
+            "cylinders": self.cylinders,
+            "retries": self.retries,
+            "format_type": self.format_type,
+            "created": self.created.isoformat(),
+            "state": {**state.to_dict(), "status": status}
+        }
+        if include_values:
+            data["values"] = list(state.values)
+        return data
+
+
+class AlignmentScheduler:
+    """Registre des sessions et exécution des jobs d'alignement"""
+
+    def __init__(
+        self,
+        executor: GreaseweazleExecutor,
+        on_event: Optional[EventCallback] = None
+    ):
+        """
+        Initialise le planificateur
+
+        Args:
+            executor: Exécuteur Greaseweazle partagé
+            on_event: Callback asynchrone pour les événements (WebSocket)
+        """
+        self.executor = executor
+        self.on_event = on_event
+        self._jobs: Dict[str, AlignmentJob] = {}
+        self._sessions: Dict[Tuple[str, str], AlignmentJob] = {}
+        self._ids = itertools.count(1)
+
+    # --- Registre ---
+
+    def get_job(self, job_id: str) -> Optional[AlignmentJob]:
+        """Retourne un job par son identifiant"""
+        return self._jobs.get(job_id)
+
+    def list_jobs(self) -> List[AlignmentJob]:
+        """Liste tous les jobs, du plus ancien au plus récent"""
+        return list(self._jobs.values())
+
+    def get_session(self, device: Optional[str], drive: str) -> Optional[AlignmentJob]:
+        """Dernier job lancé pour un couple (device, lecteur)"""
+        return self._sessions.get((device or AUTO_DEVICE, drive))
+
+    def _prune(self):
+        """Retire du registre les jobs terminés au-delà de MAX_FINISHED_JOBS"""
+        finished = [job for job in self._jobs.values() if not job.is_active()]
+        for job in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job.job_id]
+            if self._sessions.get(job.session_key) is job:
+                del self._sessions[job.session_key]
+
+    # --- Jobs ---
+
+    def submit(
+        self,
+        device: Optional[str] = None,
+        drive: Optional[str] = None,
+        cylinders: int = 80,
+        retries: int = 3,
+        format_type: Optional[str] = None,
+        diskdefs_path: Optional[str] = None,
+        adaptive: bool = False,
+        survey: bool = False,
+        archive_path: Optional[str] = None,
+        export_path: Optional[str] = None
+    ) -> AlignmentJob:
+        """
+        Crée et planifie un job d'alignement
+
+        Raises:
+            ValueError: si un job est déjà actif pour ce couple (device, lecteur)
+        """
+        if device is None:
+            device = settings_manager.get_last_port()
+        if drive is None:
+            drive = settings_manager.get_drive()
+
+        job = AlignmentJob(
+            job_id=f"job-{next(self._ids)}",
+            device=device,
+            drive=drive,
+            cylinders=cylinders,
+            retries=retries,
+            format_type=format_type or "ibm.1440",
+            diskdefs_path=diskdefs_path,
+            adaptive=adaptive,
+            survey=survey,
+            archive_path=archive_path,
+            export_path=export_path
+        )
+        previous = self._sessions.get(job.session_key)
+        if previous is not None and previous.is_active():
+            raise ValueError(
+                f"Un alignement est déjà en cours sur {job.unit} lecteur {drive} ({previous.job_id})"
+            )
+
+        self._prune()
+        self._jobs[job.job_id] = job
+        self._sessions[job.session_key] = job
+        job.task = asyncio.create_task(self._run(job))
+        return job
+
+    async def cancel(self, job_id: str) -> bool:
+        """
+        Annule un job (en attente ou en cours)
+
+        Returns:
+            True si le job était actif
+        """
+        job = self._jobs.get(job_id)
+        if job is None or not job.is_active():
+            return False
+        job.task.cancel()
+        try:
+            await job.task
+        except asyncio.CancelledError:
+            pass
+        return True
+
+    async def stream(self, job_id: str) -> AsyncIterator[Dict]:
+        """Flux des valeurs d'un job, jusqu'à sa fin"""
+        job = self._jobs[job_id]
+        while True:
+            value = await job.results.get()
+            if value is None:
+                break
+            yield value
+
+    async def _emit(self, job: AlignmentJob, event: Dict):
+        """Envoie un événement étiqueté avec le job"""
+        if self.on_event is None:
+            return
+        try:
+            await self.on_event({**event, "job_id": job.job_id,
+                                 "device": job.device, "drive": job.drive})
+        except Exception as e:
+            print(f"[AlignmentScheduler] Erreur lors de l'envoi d'un événement: {e}")
+
+    async def _run(self, job: AlignmentJob):
+        """Exécute un job dès que son unité USB est libre"""
+        parser = AlignmentParser()
+        sampler = None
+        if job.adaptive:
+            sampler = SequentialSampler(min_reads=min(3, job.retries), max_reads=job.retries)
+        survey = AlignmentSurvey(self.executor, cylinders=job.cylinders) if job.survey else None
+        all_values = []
+        pending: asyncio.Queue = asyncio.Queue()
+
+        def on_output_line(line: str):
+            """Callback appelé pour chaque ligne de sortie (synchrone)"""
+            value = parser.parse_line(line)
+            if value:
+                all_values.append(value)
+                pending.put_nowait({
+                    "track": value.track,
+                    "percentage": value.percentage,
+                    "sectors_detected": value.sectors_detected,
+                    "sectors_expected": value.sectors_expected,
+                    "flux_transitions": value.flux_transitions,
+                    "time_per_rev": value.time_per_rev,
+                    "format_type": value.format_type,
+                    "line_number": value.line_number
+                })
+
+        async def forward_values():
+            """Publie les valeurs dans l'état et le flux de résultats du job"""
+            while True:
+                value_data = await pending.get()
+                if value_data is None:
+                    break
+                await job.state.add_value(value_data)
+                job.results.put_nowait(value_data)
+                await self._emit(job, {"type": "job_value", "value": value_data})
+
+        forwarder = None
+        try:
+            async with unit_lock(job.unit):
+                await job.state.start_alignment(
+                    cylinders=job.cylinders,
+                    retries=job.retries,
+                    process_task=job.task
+                )
+                await self._emit(job, {"type": "job_started"})
+                forwarder = asyncio.create_task(forward_values())
+
+                if survey is not None:
+                    result = await survey.run(
+                        retries=job.retries,
+                        format_type=job.format_type,
+                        diskdefs_path=job.diskdefs_path,
+                        on_output=on_output_line,
+                        device=job.device,
+                        drive=job.drive,
+                        sampler=sampler,
+                        archive_path=job.archive_path
+                    )
+                else:
+                    result = await self.executor.run_align(
+                        cylinders=job.cylinders,
+                        retries=job.retries,
+                        format_type=job.format_type,
+                        diskdefs_path=job.diskdefs_path,
+                        on_output=on_output_line,
+                        device=job.device,
+                        drive=job.drive,
+                        sampler=sampler,
+                        archive_path=job.archive_path
+                    )
+
+            pending.put_nowait(None)
+            await forwarder
+
+            statistics = parser.calculate_statistics(all_values, limit=job.cylinders * 2)
+            statistics["quality"] = parser.get_alignment_quality(statistics["average"])
+            if sampler is not None:
+                statistics["adaptive_sampling"] = sampler.summary()
+            if survey is not None:
+                statistics["survey"] = survey.summary()
+            if job.export_path:
+                statistics["export"] = await export_session(
+                    job.export_path, all_values, statistics,
+                    device=job.unit, drive=job.drive, format_type=job.format_type
+                )
+            await job.state.complete_alignment(statistics)
+            await self._emit(job, {
+                "type": "job_complete",
+                "success": result["success"],
+                "statistics": statistics,
+                "returncode": result["returncode"]
+            })
+        except asyncio.CancelledError:
+            if forwarder is not None:
+                forwarder.cancel()
+            # Ne pas passer par cancel_alignment(), qui annulerait cette tâche
+            await job.state.update_state(
+                status=AlignmentStatus.CANCELLED,
+                end_time=datetime.now()
+            )
+            await self._emit(job, {"type": "job_cancelled"})
+        except Exception as e:
+            if forwarder is not None:
+                forwarder.cancel()
+            await job.state.set_error(str(e))
+            await self._emit(job, {"type": "job_error", "error": str(e)})
+        finally:
+            job.results.put_nowait(None)
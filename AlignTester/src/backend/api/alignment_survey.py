@@ -0,0 +1,293 @@
+"""
+Relevé d'alignement grossier puis affiné (survey)
+
+Un balayage complet 80 x 2 coûte le même temps que le lecteur soit parfait
+ou très mal réglé. Le relevé lit d'abord un ensemble clairsemé de cylindres
+(0, 10, 20, ... et le dernier), puis n'affine que là où c'est utile :
+- chute de qualité (une face sous le seuil)
+- différence entre les deux faces
+- écart à la tendance (régression linéaire sur les cylindres lus), du
+  pourcentage et du score d'azimut
+- azimut médiocre (CV des flux trop élevé)
+- variation brusque entre deux cylindres lus
+
+Chaque tour de raffinement lit le milieu des intervalles signalés, jusqu'à
+ce qu'il n'y ait plus rien à affiner. Les statistiques finales gardent la
+structure de AlignmentParser.calculate_statistics ; le relevé y ajoute une
+carte de confiance par piste (pistes lues ou interpolées).
+"""
+
+from typing import Dict, List, Optional, Callable, Set
+
+from .alignment_parser import AlignmentParser, AlignmentValue
+from .adaptive_sampling import SequentialSampler
+from .greaseweazle import GreaseweazleExecutor
+
+HEADS = (0, 1)
+
+
+class AlignmentSurvey:
+    """Relevé d'alignement grossier puis affiné autour des anomalies"""
+
+    def __init__(
+        self,
+        executor: GreaseweazleExecutor,
+        cylinders: int = 80,
+        coarse_step: int = 10,
+        quality_threshold: float = 97.0,
+        trend_threshold: float = 1.0,
+        head_threshold: float = 2.0,
+        outlier_threshold: float = 2.0,
+        azimuth_threshold: float = 10.0,
+        azimuth_cv_threshold: float = 2.0,
+        max_rounds: int = 4
+    ):
+        """
+        Initialise le relevé
+
+        Args:
+            executor: Exécuteur Greaseweazle
+            cylinders: Nombre de cylindres du disque
+            coarse_step: Pas du relevé grossier
+            quality_threshold: Pourcentage sous lequel une face est une chute de qualité
+            trend_threshold: Variation (points) entre deux cylindres lus qui déclenche un raffinement
+            head_threshold: Écart (points) entre les deux faces qui déclenche un raffinement
+            outlier_threshold: Écart (points) à la tendance linéaire qui déclenche un raffinement
+            azimuth_threshold: Écart (points de score d'azimut) à la tendance linéaire qui déclenche un raffinement
+            azimuth_cv_threshold: CV d'azimut (%) au-delà duquel une face est signalée
+            max_rounds: Nombre maximal de tours de raffinement
+        """
+        self.executor = executor
+        self.cylinders = cylinders
+        self.coarse_step = max(1, coarse_step)
+        self.quality_threshold = quality_threshold
+        self.trend_threshold = trend_threshold
+        self.head_threshold = head_threshold
+        self.outlier_threshold = outlier_threshold
+        self.azimuth_threshold = azimuth_threshold
+        self.azimuth_cv_threshold = azimuth_cv_threshold
+        self.max_rounds = max_rounds
+        self.values: List[AlignmentValue] = []
+        self.rounds: List[List[int]] = []
+
+    # --- Plan ---
+
+    def coarse_cylinders(self) -> List[int]:
+        """Cylindres du relevé grossier (toujours le premier et le dernier)"""
+        if self.cylinders <= 0:
+            return []
+        return sorted(set(range(0, self.cylinders, self.coarse_step)) | {self.cylinders - 1})
+
+    def attempted(self) -> List[int]:
+        """Cylindres déjà lus (ou tentés)"""
+        return sorted({cyl for cylinders in self.rounds for cyl in cylinders})
+
+    def track_statistics(self) -> Dict[int, Dict[int, Dict]]:
+        """
+        Statistiques par piste (calculate_statistics) des cylindres lus,
+        par cylindre puis par face. Un cylindre tenté sans lecture est vide.
+        """
+        per_cylinder: Dict[int, Dict[int, Dict]] = {cyl: {} for cyl in self.attempted()}
+        stats = AlignmentParser.calculate_statistics(self.values, limit=0)
+        for value in stats.get("values", []):
+            try:
+                cyl, head = (int(x) for x in value["track"].split("."))
+            except (AttributeError, ValueError):
+                continue
+            per_cylinder.setdefault(cyl, {})[head] = value
+        return per_cylinder
+
+    def track_percentages(
+        self,
+        per_cylinder: Optional[Dict[int, Dict[int, Dict]]] = None
+    ) -> Dict[int, Dict[int, float]]:
+        """
+        Pourcentage de chaque face des cylindres lus. Une face sans lecture
+        vaut 0%. per_cylinder : résultat de track_statistics, s'il est déjà calculé.
+        """
+        if per_cylinder is None:
+            per_cylinder = self.track_statistics()
+        return {
+            cyl: {head: heads[head]["percentage"] if head in heads else 0.0 for head in HEADS}
+            for cyl, heads in per_cylinder.items()
+        }
+
+    @staticmethod
+    def trend_outliers(series: Dict[int, float], threshold: float) -> Set[int]:
+        """Cylindres s'écartant de plus de threshold de la droite de régression (au moins 3 points)"""
+        xs = list(series)
+        if len(xs) < 3:
+            return set()
+        mean_x = sum(xs) / len(xs)
+        mean_y = sum(series[x] for x in xs) / len(xs)
+        sxx = sum((x - mean_x) ** 2 for x in xs)
+        slope = sum((x - mean_x) * (series[x] - mean_y) for x in xs) / sxx if sxx else 0.0
+        return {x for x in xs if abs(series[x] - (mean_y + slope * (x - mean_x))) > threshold}
+
+    def flagged_cylinders(self) -> List[int]:
+        """Cylindres lus présentant une anomalie (chute, faces, azimut, tendance)"""
+        per_stats = self.track_statistics()
+        per_cylinder = self.track_percentages(per_stats)
+        flagged = set()
+        means = {cyl: sum(heads.values()) / len(heads) for cyl, heads in per_cylinder.items()}
+
+        # Score d'azimut moyen des faces qui en ont un (au moins 3 lectures)
+        azimuth = {}
+        for cyl, heads in per_stats.items():
+            scores = [v["azimuth_score"] for v in heads.values() if v.get("azimuth_score") is not None]
+            if scores:
+                azimuth[cyl] = sum(scores) / len(scores)
+
+        for cyl, heads in per_cylinder.items():
+            if min(heads.values()) < self.quality_threshold:
+                flagged.add(cyl)
+            elif abs(heads[0] - heads[1]) > self.head_threshold:
+                flagged.add(cyl)
+            elif any((v.get("azimuth_cv") or 0.0) >= self.azimuth_cv_threshold
+                     for v in per_stats[cyl].values()):
+                flagged.add(cyl)
+
+        # Écart à la tendance linéaire des cylindres sains, en qualité puis en
+        # azimut : les chutes déjà signalées ne doivent pas tirer la droite
+        healthy = [cyl for cyl in means if cyl not in flagged]
+        flagged |= self.trend_outliers({cyl: means[cyl] for cyl in healthy}, self.outlier_threshold)
+        flagged |= self.trend_outliers({cyl: azimuth[cyl] for cyl in healthy if cyl in azimuth},
+                                       self.azimuth_threshold)
+        return sorted(flagged)
+
+    def refine_cylinders(self) -> List[int]:
+        """Cylindres du prochain tour : milieux des intervalles à affiner"""
+        per_cylinder = self.track_percentages()
+        flagged = set(self.flagged_cylinders())
+        measured = sorted(per_cylinder)
+        refine = set()
+        for a, b in zip(measured, measured[1:]):
+            if b - a < 2:
+                continue
+            jump = max(abs(per_cylinder[a][h] - per_cylinder[b][h]) for h in HEADS)
+            if a in flagged or b in flagged or jump > self.trend_threshold:
+                refine.add((a + b) // 2)
+        return sorted(refine - set(measured))
+
+    # --- Exécution ---
+
+    async def run(
+        self,
+        retries: int = 3,
+        format_type: str = "ibm.1440",
+        diskdefs_path: Optional[str] = None,
+        on_output: Optional[Callable[[str], None]] = None,
+        device: Optional[str] = None,
+        drive: Optional[str] = None,
+        sampler: Optional[SequentialSampler] = None,
+        archive_path: Optional[str] = None
+    ) -> Dict:
+        """
+        Exécute le relevé : un passage grossier puis les tours de raffinement
+
+        Avec archive_path, les captures de tous les tours sont ajoutées à la
+        même archive de flux.
+
+        Returns:
+            Dict au format de GreaseweazleExecutor.run_align
+        """
+        def collect(line: str):
+            """Garde les lectures pour le plan, puis relaie la ligne"""
+            value = AlignmentParser.parse_line(line)
+            if value:
+                self.values.append(value)
+            if on_output:
+                on_output(line)
+
+        all_stdout = []
+        all_stderr = []
+        return_code = 0
+        cylinders = self.coarse_cylinders()
+        while cylinders and len(self.rounds) <= self.max_rounds:
+            self.rounds.append(cylinders)
+            print(f"[AlignmentSurvey] Tour {len(self.rounds)}: {len(cylinders)} cylindre(s) {cylinders}")
+            result = await self.executor.run_align(
+                cylinders=self.cylinders,
+                retries=retries,
+                format_type=format_type,
+                diskdefs_path=diskdefs_path,
+                on_output=collect,
+                device=device,
+                drive=drive,
+                sampler=sampler,
+                cylinder_list=cylinders,
+                archive_path=archive_path
+            )
+            if result["stdout"]:
+                all_stdout.append(result["stdout"])
+            if result["stderr"]:
+                all_stderr.append(result["stderr"])
+            if result["returncode"] != 0:
+                return_code = result["returncode"]
+            cylinders = self.refine_cylinders()
+
+        return {
+            "returncode": return_code,
+            "stdout": "\n".join(all_stdout),
+            "stderr": "\n".join(all_stderr),
+            "success": return_code == 0
+        }
+
+    # --- Résultats ---
+
+    def confidence_map(self) -> List[Dict]:
+        """
+        Carte de confiance par piste, pour tous les cylindres du disque
+
+        Une piste lue a une confiance de 1. Une piste non lue reçoit le
+        pourcentage interpolé entre ses voisins lus ; sa confiance baisse
+        avec la distance au cylindre lu le plus proche et avec l'écart
+        entre les deux voisins.
+        """
+        per_cylinder = self.track_percentages()
+        measured = sorted(per_cylinder)
+        result = []
+        for cyl in range(self.cylinders):
+            for head in HEADS:
+                entry = {"track": f"{cyl}.{head}", "cylinder": cyl, "head": head}
+                if cyl in per_cylinder:
+                    entry.update(measured=True, percentage=per_cylinder[cyl][head], confidence=1.0)
+                elif measured:
+                    below = [c for c in measured if c < cyl]
+                    above = [c for c in measured if c > cyl]
+                    a = below[-1] if below else None
+                    b = above[0] if above else None
+                    if a is not None and b is not None:
+                        pa, pb = per_cylinder[a][head], per_cylinder[b][head]
+                        percentage = pa + (pb - pa) * (cyl - a) / (b - a)
+                        distance = min(cyl - a, b - cyl)
+                        spread = abs(pb - pa)
+                    else:
+                        nearest = a if a is not None else b
+                        percentage = per_cylinder[nearest][head]
+                        distance = abs(cyl - nearest)
+                        spread = 0.0
+                    confidence = (1 / (1 + distance / self.coarse_step)) / (1 + spread / self.trend_threshold)
+                    entry.update(measured=False, percentage=round(percentage, 3),
+                                 confidence=round(confidence, 3))
+                else:
+                    entry.update(measured=False, percentage=None, confidence=0.0)
+                result.append(entry)
+        return result
+
+    def summary(self) -> Dict:
+        """Bilan du relevé, à ajouter aux statistiques (statistics["survey"])"""
+        attempted = self.attempted()
+        confidence_map = self.confidence_map()
+        confidences = [entry["confidence"] for entry in confidence_map]
+        return {
+            "coarse_step": self.coarse_step,
+            "rounds": [list(cylinders) for cylinders in self.rounds],
+            "cylinders_read": len(attempted),
+            "cylinders_total": self.cylinders,
+            "coverage": round(len(attempted) / self.cylinders, 3) if self.cylinders else 0.0,
+            "flagged": self.flagged_cylinders(),
+            "min_confidence": min(confidences) if confidences else 0.0,
+            "mean_confidence": round(sum(confidences) / len(confidences), 3) if confidences else 0.0,
+            "confidence_map": confidence_map
+        }
@@ -0,0 +1,201 @@
+"""
+Service de découverte du Greaseweazle en arrière-plan
+
+Les sondes de GreaseweazleExecutor (gw --version, gw align --help, gw info,
+liste des ports série) lancent des subprocess.run bloquants avec des timeouts
+de plusieurs secondes. Ce service les exécute hors de l'event loop et garde
+les résultats en cache avec une durée de validité (TTL), pour que les routes
+/api/info et /api/detect répondent sans bloquer les WebSockets.
+
+Le cache est invalidé :
+- quand le chemin vers gw change (executor.gw_path)
+- sur demande (changement de port, via invalidate())
+- quand la liste des ports série change (branchement/débranchement USB)
+"""
+
+from typing import Optional, Dict, List, Callable, Any, Tuple
+from dataclasses import dataclass
+import asyncio
+import threading
+import time
+
+from .greaseweazle import GreaseweazleExecutor
+
+@dataclass
+class CacheEntry:
+    """Résultat d'une sonde avec sa date et sa génération de cache"""
+    value: Any
+    timestamp: float
+    generation: int
+
+class DeviceDiscoveryService:
+    """Cache TTL des informations de découverte du Greaseweazle"""
+
+    def __init__(
+        self,
+        executor: GreaseweazleExecutor,
+        ttl: float = 30.0,
+        poll_interval: float = 2.0
+    ):
+        """
+        Initialise le service
+
+        Args:
+            executor: Exécuteur utilisé pour les sondes
+            ttl: Durée de validité d'une entrée du cache (secondes)
+            poll_interval: Intervalle de surveillance des ports série (secondes)
+        """
+        self.executor = executor
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self._entries: Dict[str, CacheEntry] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._gw_path = executor.gw_path
+        self._port_signature: Optional[Tuple[str, ...]] = None
+        self._watcher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    # --- Invalidation ---
+
+    def invalidate(self, reason: Optional[str] = None):
+        """Vide le cache ; les sondes en cours ne pourront plus y écrire"""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+        if reason:
+            print(f"[DeviceDiscovery] Cache invalidé: {reason}")
+
+    def _check_gw_path(self):
+        """Invalide le cache si le chemin vers gw a changé"""
+        gw_path = self.executor.gw_path
+        if gw_path != self._gw_path:
+            self._gw_path = gw_path
+            self.invalidate(f"chemin gw modifié ({gw_path})")
+
+    # --- Cache ---
+
+    def _fresh_entry(self, key: str) -> Optional[CacheEntry]:
+        """Retourne l'entrée si elle est valide (même génération, TTL non expiré)"""
+        entry = self._entries.get(key)
+        if (entry is not None and entry.generation == self._generation
+                and time.monotonic() - entry.timestamp < self.ttl):
+            return entry
+        return None
+
+    def _probe(self, key: str, probe: Callable[[], Any]) -> Any:
+        """
+        Exécute une sonde (dans un thread) et stocke son résultat
+
+        Une seule sonde par clé tourne à la fois : les appels concurrents
+        attendent puis lisent le résultat en cache.
+        """
+        with self._lock:
+            key_lock = self._locks.setdefault(key, threading.Lock())
+        with key_lock:
+            entry = self._fresh_entry(key)
+            if entry is not None:
+                return entry.value
+            generation = self._generation
+            value = probe()
+            with self._lock:
+                if generation == self._generation:
+                    self._entries[key] = CacheEntry(value, time.monotonic(), generation)
+            return value
+
+    def _refresh_in_background(self, key: str, probe: Callable[[], Any]):
+        """Rafraîchit une entrée expirée sans faire attendre l'appelant"""
+        def refresh():
+            try:
+                self._probe(key, probe)
+            except Exception as e:
+                print(f"[DeviceDiscovery] Erreur lors du rafraîchissement de '{key}': {e}")
+        threading.Thread(target=refresh, daemon=True).start()
+
+    async def _get(self, key: str, probe: Callable[[], Any]) -> Any:
+        """
+        Retourne la valeur en cache, ou exécute la sonde hors de l'event loop
+
+        Une entrée expirée est retournée telle quelle pendant qu'elle est
+        rafraîchie en arrière-plan ; seule une entrée absente fait attendre.
+        """
+        self._check_gw_path()
+        self.start_watcher()
+
+        entry = self._entries.get(key)
+        if entry is not None and entry.generation == self._generation:
+            if time.monotonic() - entry.timestamp >= self.ttl:
+                self._refresh_in_background(key, probe)
+            return entry.value
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._probe, key, probe)
+
+    # --- Sondes ---
+
+    async def get_version(self) -> Optional[str]:
+        """Version des host tools Greaseweazle"""
+        return await self._get("version", self.executor.check_version)
+
+    async def get_align_available(self) -> bool:
+        """Disponibilité de la commande align"""
+        return await self._get("align_available", self.executor.check_align_available)
+
+    async def get_ports(self) -> List[Dict]:
+        """Liste des ports série"""
+        return await self._get("ports", self.executor.detect_serial_ports)
+
+    async def get_device_info(self) -> Optional[Dict]:
+        """Informations du device (gw info)"""
+        return await self._get("device_info", self.executor.get_device_info)
+
+    async def get_connection(self) -> Dict:
+        """Statut de connexion du Greaseweazle"""
+        return await self._get("connection", self.executor.check_connection)
+
+    # --- Surveillance des ports (hot-plug USB) ---
+
+    def _poll_ports(self) -> bool:
+        """
+        Relève la liste des ports série et invalide le cache si elle a changé
+
+        Returns:
+            True si un changement a été détecté
+        """
+        ports = self.executor.detect_serial_ports()
+        signature = tuple(sorted(str(p.get("device")) for p in ports))
+        if self._port_signature is None:
+            self._port_signature = signature
+            return False
+        if signature == self._port_signature:
+            return False
+        self._port_signature = signature
+        self.invalidate("liste des ports série modifiée")
+        with self._lock:
+            self._entries["ports"] = CacheEntry(ports, time.monotonic(), self._generation)
+        return True
+
+    def _watch(self):
+        """Boucle du thread de surveillance"""
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self._poll_ports()
+            except Exception as e:
+                print(f"[DeviceDiscovery] Erreur lors de la surveillance des ports: {e}")
+
+    def start_watcher(self):
+        """Démarre le thread de surveillance des ports (une seule fois)"""
+        if self._watcher is not None or self.poll_interval <= 0:
+            return
+        self._stop.clear()
+        self._watcher = threading.Thread(target=self._watch, daemon=True)
+        self._watcher.start()
+
+    def stop_watcher(self):
+        """Arrête le thread de surveillance des ports"""
+        if self._watcher is None:
+            return
+        self._stop.set()
+        self._watcher.join(timeout=self.poll_interval + 1)
+        self._watcher = None
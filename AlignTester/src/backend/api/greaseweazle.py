@@ -11,9 +11,13 @@ import shutil
 from pathlib import Path
 from typing import Optional, Callable, List, Dict
 import json
+import re
 import glob
 import os
 from .settings import settings_manager
+from .alignment_parser import AlignmentParser
+from .adaptive_sampling import SequentialSampler
+from .seek_planner import SeekPlan, SeekTiming, plan_visits, plan_sweep, parse_seek_report, cylinder_spec
 
 # Pour la détection des ports série
 try:
@@ -22,6 +26,9 @@ try:
 except ImportError:
     SERIAL_AVAILABLE = False
 
+# En-tête de chaque cylindre dans la sortie de gw align
+ALIGN_CYLINDER_PATTERN = re.compile(r'Aligning T(\d+)')
+
 def _is_wsl() -> bool:
     """Détecte si on est dans WSL (Windows Subsystem for Linux)"""
     try:
@@ -118,6 +125,8 @@ class GreaseweazleExecutor:
     def __init__(self, gw_path: Optional[str] = None):
         self.platform = platform.system()
         self.gw_path = gw_path or self._detect_gw_path()
+        # Modèle de coût des seeks, affiné par chaque gw seek --report
+        self.seek_timing = SeekTiming()
     
     def _is_wsl(self) -> bool:
         """Détecte si on est dans WSL (Windows Subsystem for Linux)"""
@@ -260,9 +269,15 @@ class GreaseweazleExecutor:
         self,
         args: List[str],
         on_output: Optional[Callable[[str], None]] = None,
-        timeout: Optional[int] = None
+        timeout: Optional[int] = None,
+        should_stop: Optional[Callable[[], bool]] = None
     ) -> subprocess.CompletedProcess:
-        """Exécute une commande Greaseweazle de manière asynchrone"""
+        """
+        Exécute une commande Greaseweazle de manière asynchrone
+
+        should_stop est consulté après chaque ligne : s'il retourne True, gw
+        est arrêté et la commande est considérée comme réussie (arrêt voulu).
+        """
         # Vérifier si un port série doit être ajouté
         # Ne pas ajouter --device si déjà présent dans les args
         has_device = any(arg.startswith('--device') for arg in args)
@@ -337,25 +352,41 @@ class GreaseweazleExecutor:
         
         stdout_lines = []
         stderr_lines = []
+        stopped = False
         
-        # Lire la sortie en temps réel
-        if process.stdout:
-            while True:
-                line_bytes = await process.stdout.readline()
-                if not line_bytes:
-                    break
-                line = line_bytes.decode('utf-8', errors='replace').strip()
-                if line:  # Ignorer les lignes vides
-                    stdout_lines.append(line)
-                    if on_output:
-                        # Le callback est synchrone mais peut être appelé depuis async
-                        try:
-                            on_output(line)
-                        except Exception as e:
-                            print(f"Erreur dans on_output callback: {e}")
-        
-        # Attendre la fin du processus
-        return_code = await process.wait()
+        try:
+            # Lire la sortie en temps réel
+            if process.stdout:
+                while True:
+                    line_bytes = await process.stdout.readline()
+                    if not line_bytes:
+                        break
+                    line = line_bytes.decode('utf-8', errors='replace').strip()
+                    if line:  # Ignorer les lignes vides
+                        stdout_lines.append(line)
+                        if on_output:
+                            # Le callback est synchrone mais peut être appelé depuis async
+                            try:
+                                on_output(line)
+                            except Exception as e:
+                                print(f"Erreur dans on_output callback: {e}")
+                        if should_stop and should_stop():
+                            stopped = True
+                            break
+            
+            # Attendre la fin du processus
+            if stopped and process.returncode is None:
+                process.kill()
+                await process.wait()
+                return_code = 0
+            else:
+                return_code = await process.wait()
+        except asyncio.CancelledError:
+            # Tâche annulée : ne pas laisser gw tourner (il garderait le port USB)
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            raise
         
         # Lire stderr si disponible (normalement vide car redirigé vers stdout)
         if process.stderr:
@@ -379,19 +410,76 @@ class GreaseweazleExecutor:
             "\n".join(stderr_lines) if stderr_lines else ""
         )
     
+    def _align_args(
+        self,
+        tracks_spec: str,
+        reads: int,
+        format_type: str,
+        diskdefs_path: Optional[str] = None,
+        device: Optional[str] = None,
+        drive: Optional[str] = None,
+        archive_path: Optional[str] = None
+    ) -> List[str]:
+        """Construit les arguments d'une commande gw align"""
+        # --reads correspond au nombre de tentatives (retries)
+        # --format permet de décoder les secteurs (nécessaire pour calculer les pourcentages)
+        args = [
+            "align",
+            f"--tracks={tracks_spec}",
+            f"--reads={reads}",
+            f"--format={format_type}"
+        ]
+        if device:
+            args[1:1] = ["--device", device]
+        if drive:
+            args[1:1] = ["--drive", drive]
+        # Chaque capture est ajoutée à l'archive de flux (gw align --replay)
+        if archive_path:
+            args.append(f"--archive={archive_path}")
+        
+        # Ajouter --diskdefs si spécifié et accessible
+        if diskdefs_path:
+            try:
+                diskdefs_file = Path(diskdefs_path)
+                if diskdefs_file.exists() and diskdefs_file.is_file():
+                    # Vérifier qu'on peut lire le fichier
+                    try:
+                        with open(diskdefs_file, 'r') as f:
+                            f.read(1)  # Lire un octet pour vérifier les permissions
+                        args.append(f"--diskdefs={diskdefs_path}")
+                    except PermissionError:
+                        print(f"[GreaseweazleExecutor] Permission refusée pour diskdefs.cfg: {diskdefs_path}, gw utilisera le fichier par défaut")
+                    except Exception as e:
+                        print(f"[GreaseweazleExecutor] Erreur vérification diskdefs: {e}, gw utilisera le fichier par défaut")
+                else:
+                    print(f"[GreaseweazleExecutor] diskdefs.cfg non trouvé: {diskdefs_path}, gw utilisera le fichier par défaut")
+            except Exception as e:
+                print(f"[GreaseweazleExecutor] Erreur vérification diskdefs: {e}, gw utilisera le fichier par défaut")
+        return args
+    
     async def run_align(
         self,
         cylinders: int = 80,
         retries: int = 3,
         format_type: str = "ibm.1440",
         diskdefs_path: Optional[str] = None,
-        on_output: Optional[Callable[[str], None]] = None
+        on_output: Optional[Callable[[str], None]] = None,
+        device: Optional[str] = None,
+        drive: Optional[str] = None,
+        sampler: Optional[SequentialSampler] = None,
+        cylinder_list: Optional[List[int]] = None,
+        archive_path: Optional[str] = None
     ) -> Dict:
         """
         Exécute la commande align
         
-        IMPORTANT: gw align exige que toutes les pistes soient sur le même cylindre.
-        On teste donc un cylindre à la fois, en boucle.
+        Les cylindres sont visités dans l'ordre du plan de balayage
+        (seek_planner.plan_sweep). Sans échantillonnage adaptatif, tout le
+        balayage se fait en une seule session gw : la tête avance d'un
+        cylindre à la fois au lieu de se recalibrer sur la piste 0 à chaque
+        cylindre. Si la session échoue, les cylindres qu'elle n'a pas lus
+        entièrement (y compris celui en cours de lecture) sont testés un
+        par un.
         
         Args:
             cylinders: Nombre de cylindres à tester
@@ -399,45 +487,81 @@ class GreaseweazleExecutor:
             format_type: Format de disquette (ex: "ibm.1440", "ibm.720")
             diskdefs_path: Chemin vers diskdefs.cfg (optionnel)
             on_output: Callback pour chaque ligne de sortie
+            device: Port série du Greaseweazle (par défaut : port des settings)
+            drive: Lecteur à tester (par défaut : lecteur des settings)
+            sampler: Échantillonnage adaptatif : chaque cylindre est lu jusqu'à
+                sampler.max_reads fois par face, et gw est arrêté dès que les
+                deux faces ont convergé (retries est alors ignoré). gw étant
+                arrêté par cylindre, chaque cylindre a sa propre session.
+            cylinder_list: Cylindres à tester, dans un ordre quelconque
+                (par défaut : 0..cylinders-1)
+            archive_path: Archive de flux à laquelle chaque capture est
+                ajoutée, pour réanalyse sans le lecteur (voir run_replay)
         """
         all_stdout = []
         all_stderr = []
         return_code = 0
+        if cylinder_list is not None:
+            plan = plan_visits(cylinder_list, kind="sweep")
+        else:
+            plan = plan_sweep(cylinders)
+        remaining = list(plan.cylinders)
         
-        # Tester chaque cylindre séparément (gw align ne peut tester qu'un seul cylindre à la fois)
-        for cyl in range(cylinders):
+        if sampler is None and len(remaining) > 1:
+            started = []
+            
+            def sweep_output(line: str):
+                """Note les cylindres commencés puis relaie la ligne"""
+                match = ALIGN_CYLINDER_PATTERN.match(line)
+                if match:
+                    started.append(int(match.group(1)))
+                if on_output:
+                    on_output(line)
+            
+            args = self._align_args(f"c={cylinder_spec(remaining)}:h=0,1", retries,
+                                    format_type, diskdefs_path, device, drive,
+                                    archive_path)
+            result = await self.run_command(args, on_output=sweep_output)
+            if result.stdout:
+                all_stdout.append(result.stdout)
+            if result.stderr:
+                all_stderr.append(result.stderr)
+            if result.returncode == 0:
+                remaining = []
+            else:
+                return_code = result.returncode
+                # Un cylindre n'est terminé que lorsque le suivant commence
+                finished = set(started[:-1])
+                remaining = [cyl for cyl in remaining if cyl not in finished]
+                print(f"[GreaseweazleExecutor] Balayage interrompu, {len(remaining)} cylindre(s) restant(s) testé(s) un par un")
+        
+        # Tester les cylindres restants séparément (une session gw par cylindre)
+        for cyl in remaining:
             # Pour chaque cylindre, tester les deux têtes (0 et 1)
             tracks_spec = f"c={cyl}:h=0,1"
             
-            # --reads correspond au nombre de tentatives (retries)
-            # --format permet de décoder les secteurs (nécessaire pour calculer les pourcentages)
-            args = [
-                "align",
-                f"--tracks={tracks_spec}",
-                f"--reads={retries}",
-                f"--format={format_type}"
-            ]
-            
-            # Ajouter --diskdefs si spécifié et accessible
-            if diskdefs_path:
-                try:
-                    diskdefs_file = Path(diskdefs_path)
-                    if diskdefs_file.exists() and diskdefs_file.is_file():
-                        # Vérifier qu'on peut lire le fichier
-                        try:
-                            with open(diskdefs_file, 'r') as f:
-                                f.read(1)  # Lire un octet pour vérifier les permissions
-                            args.append(f"--diskdefs={diskdefs_path}")
-                        except PermissionError:
-                            print(f"[GreaseweazleExecutor] Permission refusée pour diskdefs.cfg: {diskdefs_path}, gw utilisera le fichier par défaut")
-                        except Exception as e:
-                            print(f"[GreaseweazleExecutor] Erreur vérification diskdefs: {e}, gw utilisera le fichier par défaut")
-                    else:
-                        print(f"[GreaseweazleExecutor] diskdefs.cfg non trouvé: {diskdefs_path}, gw utilisera le fichier par défaut")
-                except Exception as e:
-                    print(f"[GreaseweazleExecutor] Erreur vérification diskdefs: {e}, gw utilisera le fichier par défaut")
+            # En mode adaptatif, gw alterne les faces : 2 x max_reads lectures au plus
+            reads = retries if sampler is None else sampler.max_reads * 2
+            args = self._align_args(tracks_spec, reads, format_type, diskdefs_path, device, drive,
+                                    archive_path)
             
-            result = await self.run_command(args, on_output=on_output)
+            should_stop = None
+            cyl_output = on_output
+            if sampler is not None:
+                cyl_tracks = [f"{cyl}.0", f"{cyl}.1"]
+
+                def cyl_output(line: str, on_output=on_output):
+                    """Alimente l'échantillonneur puis le callback de l'appelant"""
+                    value = AlignmentParser.parse_line(line)
+                    if value:
+                        sampler.add(value)
+                    if on_output:
+                        on_output(line)
+
+                def should_stop(cyl_tracks=cyl_tracks):
+                    return sampler.all_converged(cyl_tracks)
+
+            result = await self.run_command(args, on_output=cyl_output, should_stop=should_stop)
             
             # Accumuler les sorties
             if result.stdout:
@@ -457,6 +581,89 @@ class GreaseweazleExecutor:
             "success": return_code == 0
         }
     
+    async def run_replay(
+        self,
+        archive_path: str,
+        format_type: str = "ibm.1440",
+        diskdefs_path: Optional[str] = None,
+        tracks_spec: str = "c=0-255:h=0,1",
+        jobs: int = 1,
+        on_output: Optional[Callable[[str], None]] = None,
+        timeout: Optional[int] = None
+    ) -> Dict:
+        """
+        Réanalyse une archive de flux (gw align --replay)
+        
+        Les captures enregistrées par run_align(archive_path=...) sont
+        décodées à nouveau, sans le lecteur, avec un autre format ou
+        d'autres réglages. La sortie a le même format que gw align.
+        
+        Args:
+            archive_path: Archive de flux écrite par gw align --archive
+            format_type: Format de disquette pour le décodage
+            diskdefs_path: Chemin vers diskdefs.cfg (optionnel)
+            tracks_spec: Pistes de l'archive à réanalyser
+            jobs: Nombre de processus de décodage (gw align --jobs)
+            on_output: Callback pour chaque ligne de sortie
+        """
+        args = self._align_args(tracks_spec, 1, format_type, diskdefs_path)
+        args[1:1] = [f"--replay={archive_path}", f"--jobs={max(1, jobs)}"]
+        result = await self.run_command(args, on_output=on_output, timeout=timeout)
+        return {
+            "returncode": result.returncode,
+            "stdout": result.stdout,
+            "stderr": result.stderr,
+            "success": result.returncode == 0
+        }
+    
+    async def run_seek_plan(
+        self,
+        plan: SeekPlan,
+        device: Optional[str] = None,
+        drive: Optional[str] = None,
+        timeout: Optional[int] = 30
+    ) -> Dict:
+        """
+        Exécute tous les seeks d'un plan en une seule session gw
+        
+        gw seek --report chronomètre chaque seek ; le modèle de coût
+        (self.seek_timing) est mis à jour avec les délais du lecteur et les
+        durées mesurées.
+        
+        Returns:
+            Dict avec returncode, success, seeks (seeks effectués, dans
+            l'ordre), failed_at (cylindre du premier seek en échec),
+            timing et output
+        """
+        if not plan.cylinders:
+            return {"returncode": 0, "success": True, "seeks": [], "failed_at": None,
+                    "timing": self.seek_timing.to_dict(), "output": ""}
+        
+        args = ["seek", "--motor-on", "--force", "--report"]
+        if plan.dwell_ms:
+            args.append(f"--dwell={plan.dwell_ms}")
+        if device:
+            args[1:1] = ["--device", device]
+        if drive:
+            args[1:1] = ["--drive", drive]
+        args += [str(cyl) for cyl in plan.cylinders]
+        
+        result = await self.run_command(args, timeout=timeout)
+        report = parse_seek_report(result.stdout, previous=self.seek_timing)
+        self.seek_timing = report.timing
+        
+        failed_at = None
+        if result.returncode != 0 or len(report.seeks) < len(plan.cylinders):
+            failed_at = plan.cylinders[min(len(report.seeks), len(plan.cylinders) - 1)]
+        return {
+            "returncode": result.returncode,
+            "success": failed_at is None,
+            "seeks": report.seeks,
+            "failed_at": failed_at,
+            "timing": self.seek_timing.to_dict(),
+            "output": result.stdout if result.returncode == 0 else (result.stderr or result.stdout)
+        }
+    
     def check_version(self) -> Optional[str]:
         """Vérifie la version de Greaseweazle (host tools)"""
         try:
@@ -13,6 +13,9 @@ from enum import Enum
 import re
 from .greaseweazle import GreaseweazleExecutor
 from .alignment_parser import AlignmentParser, AlignmentValue
+from .adaptive_sampling import SequentialSampler
+from .reading_history import ReadingHistory
+from .alignment_scheduler import unit_lock
 
 
 class AlignmentQuality(Enum):
@@ -28,6 +31,7 @@ class AlignmentMode(Enum):
     DIRECT = "direct"  # Faible latence (~150-200ms), précision basique
     FINE_TUNE = "fine_tune"  # Latence modérée (~500-700ms), précision modérée
     HIGH_PRECISION = "high_precision"  # Latence élevée (~2-3s), précision maximale
+    STREAM = "stream"  # Une lecture par révolution (~200ms à 300 RPM), capture continue
 
 
 # Configuration pour chaque mode
@@ -51,13 +55,26 @@ MODE_CONFIG = {
         "max_readings_history": 50,
     },
     AlignmentMode.HIGH_PRECISION: {
-        "reads": 15,
+        "reads": 15,  # Plafond : la lecture s'arrête dès que la piste a convergé
+        "adaptive": True,
+        "min_reads": 3,
         "delay_ms": 100,
         "timeout": 30,
         "calculate_consistency": True,
         "calculate_stability": True,
         "decimal_places": 3,
         "max_readings_history": 100,
+    },
+    AlignmentMode.STREAM: {
+        "reads": 1,  # Un résultat par révolution
+        "stream_revs": 5,  # Révolutions par capture (gw align --stream)
+        "stream_reads": 18000,  # Révolutions par session gw (~1 h à 300 RPM)
+        "delay_ms": 0,  # Sessions enchaînées sans attente
+        "timeout": 5,
+        "calculate_consistency": False,
+        "calculate_stability": False,
+        "decimal_places": 1,
+        "max_readings_history": 20,
     }
 }
 
@@ -93,13 +110,22 @@ class ManualAlignmentState:
     is_running: bool = False
     current_track: int = 0
     current_head: int = 0
-    readings: List[TrackReading] = field(default_factory=list)
+    # Historique borné : fenêtre circulaire par (piste, tête) avec agrégats glissants,
+    # dimensionnée par max_readings_history du mode (voir set_alignment_mode)
+    history: ReadingHistory = field(default_factory=lambda: ReadingHistory(
+        MODE_CONFIG[AlignmentMode.DIRECT]["max_readings_history"]))
     last_reading: Optional[TrackReading] = None
     auto_analyze: bool = True  # Analyse automatique après chaque déplacement
     num_reads: int = 3  # Nombre de lectures pour l'analyse
     format_type: str = "ibm.1440"  # Format de disquette
     diskdefs_path: Optional[str] = None  # Chemin vers diskdefs.cfg
     alignment_mode: AlignmentMode = AlignmentMode.DIRECT  # Mode d'alignement actif
+    archive_path: Optional[str] = None  # Archive de flux de toutes les captures (gw align --archive)
+
+    @property
+    def readings(self) -> List[TrackReading]:
+        """Dernières lectures, toutes pistes confondues (de la plus ancienne à la plus récente)"""
+        return list(self.history.recent)
 
 
 class ManualAlignmentMode:
@@ -129,6 +155,11 @@ class ManualAlignmentMode:
             except Exception as e:
                 print(f"Erreur dans callback de mise à jour: {e}")
     
+    async def _run_gw(self, args: List[str], **kwargs) -> subprocess.CompletedProcess:
+        """Lance gw en tenant le verrou de l'unité USB (partagé avec /align et les jobs)"""
+        async with unit_lock():
+            return await self.executor.run_command(args, **kwargs)
+
     async def start(self, initial_track: int = 0, initial_head: int = 0):
         """Démarre le mode manuel avec flux continu de lectures"""
         if self.state.is_running:
@@ -137,7 +168,7 @@ class ManualAlignmentMode:
         self.state.is_running = True
         self.state.current_track = initial_track
         self.state.current_head = initial_head
-        self.state.readings = []
+        self.state.history.clear()
         self.state.last_reading = None
         
         # Effectuer un recal initial (seek vers track 0)
@@ -183,6 +214,8 @@ class ManualAlignmentMode:
                     try:
                         if self.state.alignment_mode == AlignmentMode.DIRECT:
                             await self._read_track_direct()
+                        elif self.state.alignment_mode == AlignmentMode.STREAM:
+                            await self._read_track_stream()
                         else:
                             await self._read_track_once()
                     except Exception as e:
@@ -229,7 +262,7 @@ class ManualAlignmentMode:
                 f"--tracks={tracks_spec}",
                 f"--reads={config['reads']}",  # 1 lecture
                 f"--format={self.state.format_type}"
-            ]
+            ] + self._archive_args()
             
             # Ajouter --diskdefs si spécifié et accessible
             # Vérifier les permissions avant d'ajouter --diskdefs
@@ -265,7 +298,7 @@ class ManualAlignmentMode:
             
             # Exécution avec timeout réduit
             command_start_time = time.time()
-            result = await self.executor.run_command(args, on_output=on_output, timeout=config["timeout"])
+            result = await self._run_gw(args, on_output=on_output, timeout=config["timeout"])
             command_duration = (time.time() - command_start_time) * 1000  # en ms
             
             # Vérifier si la commande a échoué à cause de permissions sur diskdefs
@@ -285,7 +318,7 @@ class ManualAlignmentMode:
                             readings_data_retry.append(line)
                             # ❌ NE PAS notifier ici non plus
                         
-                        result_retry = await self.executor.run_command(args_without_diskdefs, on_output=on_output_retry, timeout=config["timeout"])
+                        result_retry = await self._run_gw(args_without_diskdefs, on_output=on_output_retry, timeout=config["timeout"])
                         readings_data = readings_data_retry
                         result = result_retry
                     except Exception as e:
@@ -319,10 +352,7 @@ class ManualAlignmentMode:
                 )
                 
                 # Ajouter à l'historique (garder seulement les N dernières pour le mode Direct)
-                self.state.readings.append(reading)
-                max_history = config["max_readings_history"]
-                if len(self.state.readings) > max_history:
-                    self.state.readings = self.state.readings[-max_history:]
+                self.state.history.add(reading)
                 
                 self.state.last_reading = reading
                 
@@ -378,6 +408,108 @@ class ManualAlignmentMode:
             })
             # ✅ Toujours continuer - ne jamais interrompre la boucle sauf arrêt explicite
     
+    async def _read_track_stream(self):
+        """
+        Lit la piste en mode Stream (une lecture par révolution)
+        Une seule session gw align --stream, longue, capture les révolutions
+        d'affilée : chaque révolution est décodée et publiée dès que
+        l'impulsion d'index suivante arrive. gw n'est relancé (ouverture USB,
+        sélection du lecteur, démarrage du moteur) qu'après un arrêt, une
+        pause, un changement de piste ou de mode.
+        """
+        track = self.state.current_track
+        head = self.state.current_head
+        config = MODE_CONFIG[AlignmentMode.STREAM]
+
+        args = [
+            "align",
+            f"--tracks=c={track}:h={head}",
+            f"--reads={config['stream_reads']}",
+            f"--revs={config['stream_revs']}",
+            "--stream",
+            f"--format={self.state.format_type}"
+        ] + self._archive_args()
+        if self.state.diskdefs_path:
+            from pathlib import Path
+            if Path(self.state.diskdefs_path).is_file():
+                args.append(f"--diskdefs={self.state.diskdefs_path}")
+
+        last_time = time.time()
+        revolution = 0
+
+        def on_output(line: str):
+            """Publie chaque révolution dès que gw l'a décodée"""
+            nonlocal last_time, revolution
+            parsed = AlignmentParser.parse_line(line)
+            if not parsed or parsed.sectors_expected is None:
+                return
+            now = time.time()
+            interval = (now - last_time) * 1000  # en ms
+            last_time = now
+            revolution += 1
+
+            expected_sectors = parsed.sectors_expected or 18
+            sectors_detected = parsed.sectors_detected or 0
+            percentage = self._calculate_direct_percentage(sectors_detected, expected_sectors)
+            reading = TrackReading(
+                track=track,
+                head=head,
+                percentage=percentage,
+                sectors_detected=sectors_detected,
+                sectors_expected=expected_sectors,
+                quality=self._get_quality_from_percentage(percentage),
+                flux_transitions=parsed.flux_transitions,
+                time_per_rev=parsed.time_per_rev,
+                raw_output=line
+            )
+
+            self.state.history.add(reading)
+            self.state.last_reading = reading
+
+            self._notify_update({
+                "type": "direct_reading_complete",
+                "reading": self._reading_to_dict(reading),
+                "indicator": self._get_direct_indicator(reading),
+                "timing": {
+                    "command_duration_ms": round(interval, 1),
+                    "total_latency_ms": round(interval, 1),
+                    "delay_ms": config["delay_ms"],
+                    "timestamp": datetime.now().isoformat(),
+                    "flux_transitions": parsed.flux_transitions,
+                    "time_per_rev_ms": parsed.time_per_rev,
+                    "revolution": revolution
+                },
+                "state": self._get_state_dict()
+            })
+
+        def should_stop() -> bool:
+            """Arrête la session à l'arrêt, en pause ou au changement de piste/mode"""
+            return (not self.state.is_running
+                    or self._reading_paused
+                    or self.state.alignment_mode != AlignmentMode.STREAM
+                    or self.state.current_track != track
+                    or self.state.current_head != head)
+
+        try:
+            result = await self._run_gw(args, on_output=on_output, should_stop=should_stop)
+            if result.returncode != 0 and revolution == 0:
+                self._notify_update({
+                    "type": "reading_error",
+                    "error": result.stderr or result.stdout or "Unknown error",
+                    "track": track,
+                    "head": head,
+                    "state": self._get_state_dict()
+                })
+        except Exception as e:
+            print(f"[ManualAlignment] Erreur mode Stream: {e}")
+            self._notify_update({
+                "type": "reading_error",
+                "error": str(e),
+                "track": track,
+                "head": head,
+                "state": self._get_state_dict()
+            })
+
     async def _read_track_once(self):
         """
         Lit la piste actuelle une seule fois (pour la boucle continue)
@@ -394,7 +526,7 @@ class ManualAlignmentMode:
                 f"--tracks={tracks_spec}",
                 f"--reads={config['reads']}",  # Nombre de lectures selon le mode
                 f"--format={self.state.format_type}"
-            ]
+            ] + self._archive_args()
             print(f"[ManualAlignment] Lecture piste {track}:h={head} avec format {self.state.format_type} (mode: {self.state.alignment_mode.value}, reads: {config['reads']})")
             
             # Ajouter --diskdefs si spécifié et accessible
@@ -416,6 +548,17 @@ class ManualAlignmentMode:
             readings_data = []
             reading_start_time = time.time()  # Temps de début de la lecture
             
+            # Mode adaptatif : arrêter gw dès que les statistiques de la piste ont convergé
+            sampler = None
+            should_stop = None
+            if config.get("adaptive"):
+                sampler = SequentialSampler(
+                    min_reads=config.get("min_reads", 3),
+                    max_reads=config["reads"]
+                )
+                track_key = f"{track}.{head}"
+                should_stop = lambda: sampler.is_converged(track_key)
+            
             def on_output(line: str):
                 """Callback pour traiter la sortie en temps réel"""
                 readings_data.append(line)
@@ -425,6 +568,8 @@ class ManualAlignmentMode:
                     # Forcer le format_type à celui spécifié dans la commande
                     # (le parser peut détecter un format différent dans la sortie)
                     parsed.format_type = self.state.format_type
+                    if sampler is not None:
+                        sampler.add(parsed)
                     
                     # Calculer le temps écoulé depuis le début de la lecture
                     elapsed_time = (time.time() - reading_start_time) * 1000  # en ms
@@ -449,7 +594,8 @@ class ManualAlignmentMode:
                     })
             
             command_start_time = time.time()
-            result = await self.executor.run_command(args, on_output=on_output, timeout=config.get("timeout", 10))
+            result = await self._run_gw(args, on_output=on_output, timeout=config.get("timeout", 10),
+                                        should_stop=should_stop)
             command_duration = (time.time() - command_start_time) * 1000  # en ms
             
             # Parser toutes les lectures même si la commande a échoué
@@ -484,7 +630,7 @@ class ManualAlignmentMode:
                                         "time_per_rev": parsed.time_per_rev
                                     }
                                 })
-                        result_retry = await self.executor.run_command(args_without_diskdefs, on_output=on_output_retry, timeout=10)
+                        result_retry = await self._run_gw(args_without_diskdefs, on_output=on_output_retry, timeout=10)
                         all_readings = AlignmentParser.parse_output("\n".join(readings_data_retry))
                         if result_retry.returncode == 0 or all_readings:
                             # Succès avec la retry, continuer normalement
@@ -591,14 +737,10 @@ class ManualAlignmentMode:
                     raw_output="\n".join(readings_data)
                 )
                 
-                # Ajouter à l'historique
-                self.state.readings.append(reading)
+                # Ajouter à l'historique (max_readings_history du mode)
+                self.state.history.add(reading)
                 self.state.last_reading = reading
                 
-                # Garder seulement les 100 dernières lectures
-                if len(self.state.readings) > 100:
-                    self.state.readings = self.state.readings[-100:]
-                
                 # Calculer la latence totale (temps de commande + délai)
                 total_latency = command_duration + config.get("delay_ms", 100)
                 
@@ -692,7 +834,7 @@ class ManualAlignmentMode:
             async with lock:
                 # Utiliser gw seek pour déplacer la tête
                 args = ["seek", str(track)]
-                result = await self.executor.run_command(args, timeout=15)
+                result = await self._run_gw(args, timeout=15)
                 
                 if result.returncode == 0:
                     self.state.current_track = track
@@ -779,7 +921,7 @@ class ManualAlignmentMode:
             async with self._operation_lock:
                 # Seek vers track 0, head 0
                 args = ["seek", "0"]
-                result = await self.executor.run_command(args, timeout=15)
+                result = await self._run_gw(args, timeout=15)
                 
                 if result.returncode == 0:
                     self.state.current_track = 0
@@ -876,7 +1018,7 @@ class ManualAlignmentMode:
                     f"--tracks={tracks_spec}",
                     f"--reads={self.state.num_reads}",
                     f"--format={self.state.format_type}"
-                ]
+                ] + self._archive_args()
                 
                 # Ajouter --diskdefs si spécifié et accessible
                 # Note: gw align peut aussi trouver diskdefs.cfg automatiquement
@@ -917,7 +1059,7 @@ class ManualAlignmentMode:
                             }
                         })
                 
-                result = await self.executor.run_command(args, on_output=on_output, timeout=30)
+                result = await self._run_gw(args, on_output=on_output, timeout=30)
                 
                 # Log pour déboguer
                 raw_output = "\n".join(readings_data)
@@ -955,7 +1097,7 @@ class ManualAlignmentMode:
                                     })
                             
                             print(f"[DEBUG] Réessai sans --diskdefs: {' '.join(args_without_diskdefs)}")
-                            result_retry = await self.executor.run_command(args_without_diskdefs, on_output=on_output_retry, timeout=30)
+                            result_retry = await self._run_gw(args_without_diskdefs, on_output=on_output_retry, timeout=30)
                             raw_output_retry = "\n".join(readings_data_retry)
                             
                             if result_retry.returncode == 0:
@@ -1055,14 +1197,10 @@ class ManualAlignmentMode:
                         raw_output="\n".join(readings_data)
                     )
                 
-                # Ajouter à l'historique
-                self.state.readings.append(reading)
+                # Ajouter à l'historique (max_readings_history du mode)
+                self.state.history.add(reading)
                 self.state.last_reading = reading
                 
-                # Garder seulement les 100 dernières lectures
-                if len(self.state.readings) > 100:
-                    self.state.readings = self.state.readings[-100:]
-                
                 # Notifier la mise à jour
                 self._notify_update({
                     "type": "analysis_complete",
@@ -1192,8 +1330,8 @@ class ManualAlignmentMode:
         # Indicateur de direction (si on s'éloigne ou se rapproche)
         # Basé sur la comparaison avec la lecture précédente
         direction = "stable"
-        if len(self.state.readings) > 1:
-            prev_reading = self.state.readings[-2]
+        prev_reading = self.state.history.previous
+        if prev_reading is not None:
             if percentage > prev_reading.percentage:
                 direction = "improving"
             elif percentage < prev_reading.percentage:
@@ -1245,6 +1383,12 @@ class ManualAlignmentMode:
         else:
             return "Alignement faible, ajustement nécessaire"
     
+    def _estimated_latency_ms(self, config: Dict) -> int:
+        """Latence estimée entre deux résultats pour un mode"""
+        if "stream_revs" in config:
+            return config["delay_ms"] + 200  # Une révolution à 300 RPM
+        return config["delay_ms"] + (600 if config["reads"] == 1 else config["reads"] * 600)
+
     def _get_state_dict(self) -> Dict:
         """Retourne l'état actuel sous forme de dictionnaire"""
         config = MODE_CONFIG[self.state.alignment_mode]
@@ -1256,15 +1400,18 @@ class ManualAlignmentMode:
             "num_reads": self.state.num_reads,
             "format_type": self.state.format_type,
             "diskdefs_path": self.state.diskdefs_path,
+            "archive_path": self.state.archive_path,
             "alignment_mode": self.state.alignment_mode.value,
             "alignment_mode_config": {
                 "reads": config["reads"],
                 "delay_ms": config["delay_ms"],
                 "timeout": config["timeout"],
-                "estimated_latency_ms": config["delay_ms"] + (600 if config["reads"] == 1 else config["reads"] * 600)
+                "estimated_latency_ms": self._estimated_latency_ms(config)
             },
             "last_reading": self._reading_to_dict(self.state.last_reading) if self.state.last_reading else None,
-            "total_readings": len(self.state.readings)
+            "total_readings": len(self.state.history),
+            # Agrégats glissants de la piste courante (O(1), sans reparcourir l'historique)
+            "history": self.state.history.snapshot(self.state.current_track, self.state.current_head)
         }
     
     def get_state(self) -> Dict:
@@ -1284,7 +1431,7 @@ class ManualAlignmentMode:
         self.state.num_reads = num_reads
     
     def set_alignment_mode(self, mode: AlignmentMode):
-        """Définit le mode d'alignement (Direct, Fine Tune, High Precision)"""
+        """Définit le mode d'alignement (Direct, Fine Tune, High Precision, Stream)"""
         if not isinstance(mode, AlignmentMode):
             # Si c'est une string, convertir
             try:
@@ -1297,8 +1444,11 @@ class ManualAlignmentMode:
         
         print(f"[ManualAlignment] Changement de mode: {old_mode.value} -> {mode.value}")
         
-        # Notifier le changement de mode
+        # Redimensionner l'historique une fois, au changement de mode
         config = MODE_CONFIG[mode]
+        self.state.history.set_capacity(config["max_readings_history"])
+        
+        # Notifier le changement de mode
         self._notify_update({
             "type": "mode_changed",
             "old_mode": old_mode.value,
@@ -1307,11 +1457,21 @@ class ManualAlignmentMode:
                 "reads": config["reads"],
                 "delay_ms": config["delay_ms"],
                 "timeout": config["timeout"],
-                "estimated_latency_ms": config["delay_ms"] + (600 if config["reads"] == 1 else config["reads"] * 600)
+                "estimated_latency_ms": self._estimated_latency_ms(config)
             },
             "state": self._get_state_dict()
         })
     
+    def set_archive_path(self, archive_path: Optional[str]):
+        """Active (chemin) ou désactive (None) l'archivage du flux de chaque capture"""
+        self.state.archive_path = archive_path or None
+
+    def _archive_args(self) -> List[str]:
+        """Arguments gw align pour l'archive de flux (aucun si désactivée)"""
+        if self.state.archive_path:
+            return [f"--archive={self.state.archive_path}"]
+        return []
+
     def set_format(self, format_type: str, diskdefs_path: Optional[str] = None):
         """Définit le format de disquette et le chemin vers diskdefs.cfg"""
         print(f"[ManualAlignment] Changement de format: {self.state.format_type} -> {format_type}")
@@ -1338,7 +1498,7 @@ class ManualAlignmentMode:
         sans affecter le format, la position actuelle, ou l'état de fonctionnement
         """
         # Réinitialiser uniquement les lectures, pas l'état complet
-        self.state.readings = []
+        self.state.history.clear()
         self.state.last_reading = None
         
         # Notifier la réinitialisation
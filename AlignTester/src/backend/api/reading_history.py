@@ -0,0 +1,227 @@
+"""
+Historique borné des lectures du mode manuel
+
+Une longue session manuelle (des heures de lectures continues pendant le
+réglage d'un lecteur) doit rester constante en mémoire et en temps CPU par
+mise à jour :
+- une fenêtre circulaire de capacité fixe par (piste, tête), stockée dans
+  des tableaux compacts (array 'd')
+- min, max, moyenne, écart-type, CV et pente de tendance maintenus à chaque
+  insertion (O(1) amorti), sans reparcourir la fenêtre
+- les instantanés (snapshot) sont produits en O(1)
+"""
+
+from typing import Deque, Dict, List, Optional, Tuple, Any
+from array import array
+from collections import deque
+import math
+
+
+class RunningWindow:
+    """Fenêtre circulaire de valeurs avec agrégats glissants"""
+
+    def __init__(self, capacity: int):
+        self.capacity = max(1, capacity)
+        self._data = array('d', bytes(8 * self.capacity))
+        self._start = 0  # Index de la valeur la plus ancienne
+        self.count = 0
+        self._seq = 0  # Numéro de la prochaine valeur insérée
+        self._sum = 0.0
+        self._sum_sq = 0.0
+        self._sum_iy = 0.0  # Somme de i * y, i = rang dans la fenêtre (0 = plus ancienne)
+        self._evictions = 0
+        # Files monotones (numéro, valeur) pour le min et le max glissants
+        self._min: Deque[Tuple[int, float]] = deque()
+        self._max: Deque[Tuple[int, float]] = deque()
+
+    def push(self, value: float):
+        """Ajoute une valeur, en retirant la plus ancienne si la fenêtre est pleine"""
+        value = float(value)
+        if self.count == self.capacity:
+            oldest = self._data[self._start]
+            self._sum -= oldest
+            self._sum_sq -= oldest * oldest
+            # Les rangs restants diminuent de 1
+            self._sum_iy -= self._sum
+            self._data[self._start] = value
+            self._start = (self._start + 1) % self.capacity
+            self._evictions += 1
+        else:
+            self._data[(self._start + self.count) % self.capacity] = value
+            self.count += 1
+        self._sum += value
+        self._sum_sq += value * value
+        self._sum_iy += (self.count - 1) * value
+
+        seq = self._seq
+        self._seq += 1
+        while self._min and self._min[-1][1] >= value:
+            self._min.pop()
+        self._min.append((seq, value))
+        while self._max and self._max[-1][1] <= value:
+            self._max.pop()
+        self._max.append((seq, value))
+        first = seq - self.count + 1
+        while self._min[0][0] < first:
+            self._min.popleft()
+        while self._max[0][0] < first:
+            self._max.popleft()
+
+        # Les sommes glissantes accumulent des erreurs d'arrondi : on les
+        # recalcule une fois par tour complet de la fenêtre (O(1) amorti)
+        if self._evictions >= self.capacity:
+            self._resum()
+
+    def _resum(self):
+        """Recalcule les sommes exactement à partir des valeurs"""
+        values = self.values()
+        self._sum = math.fsum(values)
+        self._sum_sq = math.fsum(v * v for v in values)
+        self._sum_iy = math.fsum(i * v for i, v in enumerate(values))
+        self._evictions = 0
+
+    def values(self) -> List[float]:
+        """Valeurs de la fenêtre, de la plus ancienne à la plus récente (O(n))"""
+        return [self._data[(self._start + i) % self.capacity] for i in range(self.count)]
+
+    @property
+    def last(self) -> Optional[float]:
+        """Valeur la plus récente"""
+        if self.count == 0:
+            return None
+        return self._data[(self._start + self.count - 1) % self.capacity]
+
+    @property
+    def mean(self) -> Optional[float]:
+        """Moyenne de la fenêtre"""
+        return self._sum / self.count if self.count else None
+
+    @property
+    def std_dev(self) -> Optional[float]:
+        """Écart-type (population, comme dans AlignmentParser)"""
+        if self.count == 0:
+            return None
+        mean = self._sum / self.count
+        return math.sqrt(max(0.0, self._sum_sq / self.count - mean * mean))
+
+    @property
+    def cv(self) -> Optional[float]:
+        """Coefficient de variation en %"""
+        mean = self.mean
+        if mean is None or mean == 0:
+            return None
+        return self.std_dev / abs(mean) * 100
+
+    @property
+    def slope(self) -> Optional[float]:
+        """Pente de la droite de tendance, par lecture (moindres carrés)"""
+        n = self.count
+        if n < 2:
+            return None
+        sum_i = n * (n - 1) / 2
+        sum_ii = (n - 1) * n * (2 * n - 1) / 6
+        return (n * self._sum_iy - sum_i * self._sum) / (n * sum_ii - sum_i * sum_i)
+
+    def snapshot(self, decimals: int = 3) -> Dict[str, Any]:
+        """Agrégats de la fenêtre (O(1))"""
+        def rnd(x: Optional[float]) -> Optional[float]:
+            return round(x, decimals) if x is not None else None
+        return {
+            "count": self.count,
+            "last": rnd(self.last),
+            "min": rnd(self._min[0][1]) if self.count else None,
+            "max": rnd(self._max[0][1]) if self.count else None,
+            "mean": rnd(self.mean),
+            "std_dev": rnd(self.std_dev),
+            "cv": rnd(self.cv),
+            "slope": rnd(self.slope)
+        }
+
+    def resized(self, capacity: int) -> "RunningWindow":
+        """Copie de la fenêtre avec une autre capacité (garde les valeurs les plus récentes)"""
+        window = RunningWindow(capacity)
+        for value in self.values()[-window.capacity:]:
+            window.push(value)
+        return window
+
+
+class TrackHistory:
+    """Fenêtres d'une piste (tête donnée) : pourcentage et flux"""
+
+    def __init__(self, capacity: int):
+        self.percentage = RunningWindow(capacity)
+        self.flux_transitions = RunningWindow(capacity)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Agrégats des deux fenêtres (O(1))"""
+        return {
+            "percentage": self.percentage.snapshot(),
+            "flux_transitions": self.flux_transitions.snapshot(decimals=1)
+        }
+
+    def resize(self, capacity: int):
+        """Change la capacité des deux fenêtres"""
+        self.percentage = self.percentage.resized(capacity)
+        self.flux_transitions = self.flux_transitions.resized(capacity)
+
+
+class ReadingHistory:
+    """
+    Historique des lectures : fenêtre par (piste, tête) et dernières lectures
+    toutes pistes confondues (pour l'affichage)
+    """
+
+    def __init__(self, capacity: int = 100):
+        self.capacity = max(1, capacity)
+        self.total = 0  # Lectures depuis le démarrage ou la réinitialisation
+        self.recent: Deque[Any] = deque(maxlen=self.capacity)
+        self._tracks: Dict[Tuple[int, int], TrackHistory] = {}
+
+    def set_capacity(self, capacity: int):
+        """Change la capacité (O(n) seulement lors d'un changement)"""
+        capacity = max(1, capacity)
+        if capacity == self.capacity:
+            return
+        self.capacity = capacity
+        self.recent = deque(self.recent, maxlen=capacity)
+        for track in self._tracks.values():
+            track.resize(capacity)
+
+    def add(self, reading: Any, capacity: Optional[int] = None):
+        """
+        Ajoute une lecture (TrackReading)
+
+        Args:
+            reading: Lecture avec track, head, percentage, flux_transitions
+            capacity: Nombre de lectures à conserver (max_readings_history du mode)
+        """
+        if capacity is not None:
+            self.set_capacity(capacity)
+        self.recent.append(reading)
+        self.total += 1
+        key = (reading.track, reading.head)
+        track = self._tracks.get(key)
+        if track is None:
+            track = self._tracks[key] = TrackHistory(self.capacity)
+        track.percentage.push(reading.percentage)
+        if reading.flux_transitions is not None:
+            track.flux_transitions.push(reading.flux_transitions)
+
+    @property
+    def previous(self) -> Optional[Any]:
+        """Avant-dernière lecture (toutes pistes)"""
+        return self.recent[-2] if len(self.recent) > 1 else None
+
+    def snapshot(self, track: int, head: int) -> Optional[Dict[str, Any]]:
+        """Agrégats d'une piste (O(1)), None si elle n'a pas été lue"""
+        history = self._tracks.get((track, head))
+        return history.snapshot() if history is not None else None
+
+    def clear(self):
+        """Vide l'historique"""
+        self.total = 0
+        self.recent.clear()
+        self._tracks.clear()
+
+    def __len__(self) -> int:
+        return len(self.recent)
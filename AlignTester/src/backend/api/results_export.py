@@ -0,0 +1,446 @@
+"""
+Export colonnaire des résultats d'alignement
+
+Pour suivre des centaines de lecteurs, les résultats de chaque session sont
+ajoutés à un magasin colonnaire : une colonne typée par métrique, lisible
+d'un bloc (numpy.load, puis pandas ou pyarrow) sans reparcourir du JSON.
+
+Le magasin est un répertoire, écrit sans dépendance externe (zipfile et le
+format .npy 1.0, https://numpy.org/doc/stable/reference/generated/numpy.lib.format.html) :
+- schema.json : manifeste. Version, tables, colonnes (nom, dtype,
+  description), dictionnaires des colonnes texte, nombre de lignes et
+  parties de chaque table
+- <table>/<n>.npz : une partie par ajout (session), archive NumPy non
+  compressée, un tableau 1-D <colonne>.npy par colonne, petit-boutiste, de
+  type fixe (dtype : <f8, <i4, <i2, <i1). Une table est la concaténation de
+  ses parties, dans l'ordre du manifeste
+
+Valeurs absentes :
+- flottants : NaN
+- entiers et booléens (0/1) : -1
+- texte : codes de dictionnaire (<i4, -1 = absent), le dictionnaire de la
+  colonne étant dans schema.json
+
+Tables :
+- sessions : une ligne par session (statistiques globales)
+- reads : une ligne par lecture (sortie brute de gw align)
+- tracks : une ligne par piste et face (moyennes, scores multi-critères)
+
+Mode ajout : chaque session écrit une nouvelle partie par table, avec ses
+seules lignes (les parties existantes ne sont ni relues ni réécrites), puis
+remplace schema.json atomiquement. Le manifeste fait foi : les parties d'un
+ajout interrompu avant la sauvegarde du schéma sont ignorées à la lecture
+et écrasées à l'ajout suivant.
+
+Un magasin de version 1 (une archive <table>.npz par table) est lu comme
+une table d'une seule partie, puis complété par parties.
+"""
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from array import array
+from datetime import datetime
+from pathlib import Path
+import ast
+import asyncio
+import functools
+import json
+import math
+import os
+import struct
+import sys
+import threading
+import uuid
+import zipfile
+
+from .alignment_parser import AlignmentValue
+
+SCHEMA_VERSION = 2
+SCHEMA_FILE = "schema.json"
+NPY_MAGIC = b"\x93NUMPY\x01\x00"  # Format .npy version 1.0
+
+# dtype NumPy -> code array et valeur absente
+DTYPES: Dict[str, Tuple[str, Any]] = {
+    "<f8": ("d", math.nan),
+    "<i4": ("i", -1),
+    "<i2": ("h", -1),
+    "<i1": ("b", -1),
+}
+
+# Type logique -> dtype stocké
+KINDS = {
+    "float": "<f8",
+    "int": "<i4",
+    "int16": "<i2",
+    "bool": "<i1",
+    "str": "<i4",  # Codes de dictionnaire
+}
+
+CRITERIA = ("sector", "quality", "azimuth", "asymmetry")
+
+# (nom, type logique, description) des colonnes de chaque table
+TABLES: Dict[str, List[Tuple[str, str, str]]] = {
+    "sessions": [
+        ("session_id", "str", "Identifiant de la session"),
+        ("timestamp", "float", "Fin de la session (secondes depuis l'epoch)"),
+        ("device", "str", "Port série du Greaseweazle"),
+        ("drive", "str", "Lecteur (A, B, 0, 1, 2)"),
+        ("format_type", "str", "Format de disquette"),
+        ("total_values", "int", "Nombre de lectures"),
+        ("total_tracks_tested", "int", "Nombre de pistes testées"),
+        ("tracks_in_range", "int", "Pistes dans les limites du format"),
+        ("average", "float", "Pourcentage moyen d'alignement"),
+        ("min", "float", "Pourcentage minimum"),
+        ("max", "float", "Pourcentage maximum"),
+        ("quality", "str", "Qualité (Perfect, Good, Average, Poor)"),
+    ],
+    "reads": [
+        ("session_id", "str", "Identifiant de la session"),
+        ("cylinder", "int16", "Cylindre (-1 si inconnu)"),
+        ("head", "int16", "Face (-1 si inconnue)"),
+        ("percentage", "float", "Pourcentage d'alignement de la lecture"),
+        ("base", "float", "Valeur de base en us (format dtc)"),
+        ("sectors_detected", "int", "Secteurs détectés"),
+        ("sectors_expected", "int", "Secteurs attendus"),
+        ("flux_transitions", "int", "Transitions de flux"),
+        ("time_per_rev", "float", "Temps par révolution en ms"),
+        ("format_type", "str", "Format de disquette"),
+        ("line_number", "int", "Ligne de la sortie de gw align"),
+    ],
+    "tracks": [
+        ("session_id", "str", "Identifiant de la session"),
+        ("cylinder", "int16", "Cylindre (-1 si inconnu)"),
+        ("head", "int16", "Face (-1 si inconnue)"),
+        ("percentage", "float", "Pourcentage multi-critères de la piste"),
+        ("sectors_detected", "int", "Secteurs détectés (moyenne arrondie)"),
+        ("sectors_expected", "int", "Secteurs attendus"),
+        ("flux_transitions", "int", "Transitions de flux (moyenne)"),
+        ("time_per_rev", "float", "Temps par révolution en ms (moyenne)"),
+        ("format_type", "str", "Format de disquette"),
+        ("consistency", "float", "Cohérence entre lectures (0-100)"),
+        ("stability", "float", "Stabilité des timings (0-100)"),
+        ("positioning_status", "str", "correct, unstable, poor"),
+        ("azimuth_score", "float", "Score d'azimut (0-100)"),
+        ("azimuth_status", "str", "excellent, good, acceptable, poor"),
+        ("azimuth_cv", "float", "Coefficient de variation pour l'azimut"),
+        ("asymmetry_score", "float", "Score d'asymétrie (0-100)"),
+        ("asymmetry_status", "str", "excellent, good, acceptable, poor"),
+        ("asymmetry_percent", "float", "Pourcentage d'asymétrie"),
+        ("is_in_format_range", "bool", "Piste dans les limites du format"),
+        ("is_formatted", "bool", "Piste formatée"),
+        ("format_confidence", "float", "Confiance du formatage (0-100)"),
+        ("num_readings", "int", "Lectures moyennées pour la piste"),
+    ] + [
+        (f"{prefix}_{criterion}", "float", f"{label} ({criterion})")
+        for prefix, label in (
+            ("score_raw", "Score brut"),
+            ("score_penalized", "Score pénalisé"),
+            ("weight", "Poids"),
+            ("confidence", "Facteur de confiance"),
+        )
+        for criterion in CRITERIA
+    ],
+}
+
+# Un verrou par magasin : les jobs de plusieurs lecteurs peuvent exporter
+# dans le même répertoire
+_locks: Dict[str, threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+
+def _store_lock(path: Path) -> threading.Lock:
+    key = str(path.resolve())
+    with _locks_guard:
+        return _locks.setdefault(key, threading.Lock())
+
+
+def new_session_id() -> str:
+    """Identifiant de session unique et triable par date"""
+    return f"{datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:6]}"
+
+
+def npy_bytes(col: array, dtype: str) -> bytes:
+    """Encode une colonne en fichier .npy 1.0 (tableau 1-D)"""
+    header = "{'descr': '%s', 'fortran_order': False, 'shape': (%d,), }" % (dtype, len(col))
+    # En-tête complété par des espaces et '\n' : les données sont alignées sur 64 octets
+    header += " " * (-(len(NPY_MAGIC) + 2 + len(header) + 1) % 64) + "\n"
+    if sys.byteorder == "big":
+        col = array(col.typecode, col)
+        col.byteswap()
+    return NPY_MAGIC + struct.pack("<H", len(header)) + header.encode("latin1") + col.tobytes()
+
+
+def npy_column(data: bytes, dtype: str) -> array:
+    """Décode un fichier .npy 1.0 écrit par npy_bytes"""
+    if data[:len(NPY_MAGIC)] != NPY_MAGIC:
+        raise ValueError("fichier .npy invalide")
+    header_len, = struct.unpack("<H", data[8:10])
+    header = ast.literal_eval(data[10:10 + header_len].decode("latin1"))
+    if header.get("descr") != dtype or header.get("fortran_order") or len(header.get("shape", ())) != 1:
+        raise ValueError(f"colonne .npy incompatible : {header}")
+    col = array(DTYPES[dtype][0])
+    col.frombytes(data[10 + header_len:])
+    if sys.byteorder == "big":
+        col.byteswap()
+    return col
+
+
+def parse_track(track: Optional[str]) -> Tuple[int, int]:
+    """Convertit une piste "XX.Y" en (cylindre, face), (-1, -1) si inconnue"""
+    try:
+        cyl, head = (track or "").split(".")
+        return int(cyl), int(head)
+    except ValueError:
+        return -1, -1
+
+
+class ResultsStore:
+    """Magasin colonnaire des résultats d'alignement (voir docstring du module)"""
+
+    def __init__(self, path: str):
+        """
+        Ouvre (ou prépare) un magasin
+
+        Args:
+            path: Répertoire du magasin, créé au premier ajout
+        """
+        self.path = Path(path)
+        self.schema = self._load_schema()
+
+    def _load_schema(self) -> Dict[str, Any]:
+        """Charge schema.json, ou le schéma vide d'un nouveau magasin"""
+        schema_path = self.path / SCHEMA_FILE
+        if not schema_path.exists():
+            return {
+                "version": SCHEMA_VERSION,
+                "byte_order": "little",
+                "tables": {
+                    table: {
+                        "rows": 0,
+                        "parts": [],
+                        "columns": [
+                            {"name": name, "type": kind, "dtype": KINDS[kind],
+                             "description": description}
+                            for name, kind, description in columns
+                        ]
+                    }
+                    for table, columns in TABLES.items()
+                },
+                "dictionaries": {},
+            }
+        with open(schema_path, "r", encoding="utf-8") as f:
+            schema = json.load(f)
+        if schema.get("version") == 1:
+            # Une archive par table : la première partie
+            for table, info in schema.get("tables", {}).items():
+                info["parts"] = [{"file": f"{table}.npz", "rows": info["rows"]}] if info.get("rows") else []
+            schema["version"] = SCHEMA_VERSION
+        if schema.get("version") != SCHEMA_VERSION:
+            raise ValueError(
+                f"{schema_path}: version de schéma {schema.get('version')} non supportée"
+            )
+        for table, columns in TABLES.items():
+            stored = [c["name"] for c in schema["tables"].get(table, {}).get("columns", [])]
+            if stored != [name for name, _, _ in columns]:
+                raise ValueError(f"{schema_path}: colonnes de la table {table} incompatibles")
+        return schema
+
+    def _save_schema(self):
+        """Remplace schema.json atomiquement"""
+        schema_path = self.path / SCHEMA_FILE
+        tmp_path = schema_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.schema, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, schema_path)
+
+    def rows(self, table: str) -> int:
+        """Nombre de lignes d'une table"""
+        return self.schema["tables"][table]["rows"]
+
+    def parts(self, table: str) -> List[Dict[str, Any]]:
+        """Parties d'une table ({"file", "rows"}, fichier relatif au magasin)"""
+        return self.schema["tables"][table]["parts"]
+
+    def _encode(self, table: str, column: str, kind: str, values: Iterable[Any]) -> array:
+        """Convertit des valeurs Python en colonne typée"""
+        typecode, missing = DTYPES[KINDS[kind]]
+        if kind == "str":
+            dictionary = self.schema["dictionaries"].setdefault(f"{table}.{column}", [])
+            codes = {s: i for i, s in enumerate(dictionary)}
+            out = array(typecode)
+            for value in values:
+                if value is None:
+                    out.append(missing)
+                    continue
+                value = str(value)
+                if value not in codes:
+                    codes[value] = len(dictionary)
+                    dictionary.append(value)
+                out.append(codes[value])
+            return out
+        if kind == "float":
+            return array(typecode, (missing if v is None else float(v) for v in values))
+        return array(typecode, (missing if v is None else int(round(v)) for v in values))
+
+    def append(self, table: str, records: List[Dict[str, Any]]):
+        """
+        Ajoute des lignes à une table dans une nouvelle partie (schema.json
+        n'est pas sauvegardé)
+
+        Les colonnes absentes d'un enregistrement sont des valeurs absentes.
+        """
+        if not records:
+            return
+        parts = self.parts(table)
+        # La partie d'un ajout interrompu (absente du manifeste) est écrasée
+        part = {"file": f"{table}/{len(parts):06d}.npz", "rows": len(records)}
+        part_path = self.path / part["file"]
+        part_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = part_path.with_suffix(".tmp")
+        with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_STORED) as z:
+            for name, kind, _ in TABLES[table]:
+                col = self._encode(table, name, kind, (r.get(name) for r in records))
+                z.writestr(f"{name}.npy", npy_bytes(col, KINDS[kind]))
+        os.replace(tmp_path, part_path)
+        parts.append(part)
+        self.schema["tables"][table]["rows"] += len(records)
+
+    def append_session(
+        self,
+        values: List[AlignmentValue],
+        statistics: Dict,
+        session_id: Optional[str] = None,
+        device: Optional[str] = None,
+        drive: Optional[str] = None,
+        format_type: Optional[str] = None
+    ) -> str:
+        """
+        Ajoute une session : ses lectures, ses pistes et ses statistiques
+
+        Args:
+            values: Lectures brutes (AlignmentParser.parse_line)
+            statistics: Résultat de AlignmentParser.calculate_statistics
+            session_id: Identifiant (par défaut : new_session_id())
+            device: Port série du Greaseweazle
+            drive: Lecteur
+            format_type: Format de disquette
+
+        Returns:
+            L'identifiant de la session
+        """
+        session_id = session_id or new_session_id()
+        reads = [read_record(session_id, v) for v in values]
+        tracks = [track_record(session_id, t) for t in statistics.get("values", [])]
+        session = {
+            "session_id": session_id,
+            "timestamp": datetime.now().timestamp(),
+            "device": device,
+            "drive": drive,
+            "format_type": format_type,
+            "total_values": statistics.get("total_values"),
+            "total_tracks_tested": statistics.get("total_tracks_tested"),
+            "tracks_in_range": statistics.get("tracks_in_range"),
+            "average": statistics.get("average"),
+            "min": statistics.get("min"),
+            "max": statistics.get("max"),
+            "quality": statistics.get("quality"),
+        }
+        with _store_lock(self.path):
+            # Un autre ajout a pu modifier le magasin depuis l'ouverture
+            self.schema = self._load_schema()
+            self.path.mkdir(parents=True, exist_ok=True)
+            self.append("reads", reads)
+            self.append("tracks", tracks)
+            self.append("sessions", [session])
+            self._save_schema()
+        return session_id
+
+    def columns(self, table: str) -> Dict[str, array]:
+        """Lit toutes les colonnes typées brutes d'une table (codes de dictionnaire pour le texte)"""
+        columns = {name: array(DTYPES[KINDS[kind]][0]) for name, kind, _ in TABLES[table]}
+        for part in self.parts(table):
+            with zipfile.ZipFile(self.path / part["file"]) as z:
+                for name, kind, _ in TABLES[table]:
+                    columns[name].extend(npy_column(z.read(f"{name}.npy"), KINDS[kind])[:part["rows"]])
+        return columns
+
+    def column(self, table: str, column: str) -> array:
+        """Lit une colonne typée brute (codes de dictionnaire pour le texte)"""
+        kind = next(k for name, k, _ in TABLES[table] if name == column)
+        dtype = KINDS[kind]
+        col = array(DTYPES[dtype][0])
+        for part in self.parts(table):
+            with zipfile.ZipFile(self.path / part["file"]) as z:
+                col.extend(npy_column(z.read(f"{column}.npy"), dtype)[:part["rows"]])
+        return col
+
+    def read(self, table: str) -> Dict[str, List[Any]]:
+        """Lit une table en listes Python (None pour les valeurs absentes)"""
+        result = {}
+        columns = self.columns(table)
+        for name, kind, _ in TABLES[table]:
+            col = columns[name]
+            if kind == "str":
+                dictionary = self.schema["dictionaries"].get(f"{table}.{name}", [])
+                result[name] = [dictionary[c] if c >= 0 else None for c in col]
+            elif kind == "float":
+                result[name] = [None if math.isnan(v) else v for v in col]
+            elif kind == "bool":
+                result[name] = [None if v < 0 else bool(v) for v in col]
+            else:
+                result[name] = [None if v < 0 else v for v in col]
+        return result
+
+
+def read_record(session_id: str, value: AlignmentValue) -> Dict[str, Any]:
+    """Ligne de la table reads pour une lecture"""
+    cylinder, head = parse_track(value.track)
+    return {
+        "session_id": session_id,
+        "cylinder": cylinder,
+        "head": head,
+        "percentage": value.percentage,
+        "base": value.base,
+        "sectors_detected": value.sectors_detected,
+        "sectors_expected": value.sectors_expected,
+        "flux_transitions": value.flux_transitions,
+        "time_per_rev": value.time_per_rev,
+        "format_type": value.format_type,
+        "line_number": value.line_number,
+    }
+
+
+def track_record(session_id: str, track: Dict[str, Any]) -> Dict[str, Any]:
+    """Ligne de la table tracks pour une piste de calculate_statistics"""
+    cylinder, head = parse_track(track.get("track"))
+    record = {"session_id": session_id, "cylinder": cylinder, "head": head}
+    for name, _, _ in TABLES["tracks"]:
+        if name in track:
+            record[name] = track[name]
+    details = track.get("calculation_details") or {}
+    record["num_readings"] = details.get("num_readings")
+    for prefix, key in (("score_raw", "scores_raw"), ("score_penalized", "scores_penalized"),
+                        ("weight", "weights"), ("confidence", "confidence_factors")):
+        group = details.get(key) or {}
+        for criterion in CRITERIA:
+            record[f"{prefix}_{criterion}"] = group.get(criterion)
+    return record
+
+
+async def export_session(path: str, values: List[AlignmentValue], statistics: Dict, **kwargs) -> Dict:
+    """
+    Ajoute une session au magasin de path, hors de la boucle d'événements
+
+    Une erreur d'export n'interrompt pas la session : elle est retournée
+    dans le résultat.
+
+    Returns:
+        {"path", "session_id"} ou {"path", "error"}
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        session_id = await loop.run_in_executor(
+            None, functools.partial(ResultsStore(path).append_session, values, statistics, **kwargs)
+        )
+    except (OSError, ValueError) as e:
+        return {"path": path, "error": str(e)}
+    return {"path": path, "session_id": session_id}
@@ -4,19 +4,25 @@ Routes API pour AlignTester
 
 from fastapi import APIRouter, HTTPException, Body
 from pydantic import BaseModel
-from typing import Optional, Dict
+from typing import Optional, Dict, List
 import platform
 import subprocess
 from pathlib import Path
 import asyncio
 
 from .greaseweazle import GreaseweazleExecutor
+from .device_discovery import DeviceDiscoveryService
 from .alignment_parser import AlignmentParser
 from .alignment_state import alignment_state_manager, AlignmentStatus
+from .alignment_scheduler import AlignmentScheduler, unit_lock
+from .adaptive_sampling import SequentialSampler
+from .alignment_survey import AlignmentSurvey
+from .seek_planner import plan_visits, plan_sweep, plan_track0_verify, plan_sequence
 from .websocket import websocket_manager
 from .settings import settings_manager
 from .manual_alignment import get_manual_alignment
 from .diskdefs_parser import get_diskdefs_parser
+from .results_export import export_session
 
 router = APIRouter()
 
@@ -28,6 +34,23 @@ class AlignmentRequest(BaseModel):
     timeout: Optional[int] = None
     format_type: Optional[str] = "ibm.1440"  # Format de disquette
     diskdefs_path: Optional[str] = None  # Chemin vers diskdefs.cfg
+    adaptive: bool = False  # Arrêter les lectures d'une piste dès que ses statistiques convergent
+    survey: bool = False  # Relevé grossier (1 cylindre sur 10) affiné autour des anomalies
+    archive_path: Optional[str] = None  # Archive de flux de toutes les captures (gw align --archive)
+    export_path: Optional[str] = None  # Magasin colonnaire des résultats (voir results_export)
+
+class AlignmentJobRequest(AlignmentRequest):
+    """Paramètres d'un job d'alignement sur un device et un lecteur donnés"""
+    device: Optional[str] = None  # Port série (par défaut : dernier port utilisé)
+    drive: Optional[str] = None  # Lecteur (par défaut : lecteur des settings)
+
+class ReplayRequest(BaseModel):
+    """Paramètres pour la réanalyse d'une archive de flux"""
+    archive_path: str
+    format_type: Optional[str] = "ibm.1440"  # Format de décodage
+    diskdefs_path: Optional[str] = None  # Chemin vers diskdefs.cfg
+    jobs: int = 1  # Processus de décodage en parallèle
+    export_path: Optional[str] = None  # Magasin colonnaire des résultats (voir results_export)
 
 class GreaseweazleInfo(BaseModel):
     """Informations sur Greaseweazle"""
@@ -48,10 +71,25 @@ class GwPathRequest(BaseModel):
 class Track0VerifyRequest(BaseModel):
     """Paramètres pour la vérification Track 0"""
     format_type: Optional[str] = "ibm.1440"  # Format de disquette à utiliser
+    adaptive: bool = False  # Arrêter les lectures de piste 0 dès que les statistiques convergent
+
+class SeekPlanRequest(BaseModel):
+    """Paramètres pour la planification de seeks"""
+    kind: str = "spot_check"  # spot_check, sweep, track0_verify, sequence
+    cylinders: List[int]
+    start: Optional[int] = None  # Position actuelle de la tête (inconnue : piste 0)
+    dwell_ms: int = 0  # Pause entre deux seeks (sequence)
+    execute: bool = False  # Exécuter le plan en une session gw seek
 
 # Instance globale de l'exécuteur Greaseweazle
 executor = GreaseweazleExecutor()
 
+# Découverte du device en arrière-plan (cache TTL, hors de l'event loop)
+device_discovery = DeviceDiscoveryService(executor)
+
+# Jobs d'alignement par device/lecteur (parallèles entre Greaseweazle différents)
+alignment_scheduler = AlignmentScheduler(executor, on_event=websocket_manager.broadcast)
+
 # Détection de la plateforme et du chemin gw
 def detect_gw_path() -> str:
     """Détecte le chemin vers gw.exe ou gw selon la plateforme"""
@@ -65,10 +103,21 @@ def check_align_available(gw_path: str) -> bool:
     """Vérifie si la commande align est disponible (PR #592)"""
     return executor.check_align_available()
 
-async def run_alignment_task(cylinders: int, retries: int, format_type: Optional[str] = None, diskdefs_path: Optional[str] = None):
+async def run_alignment_task(cylinders: int, retries: int, format_type: Optional[str] = None, diskdefs_path: Optional[str] = None, adaptive: bool = False, survey: bool = False, archive_path: Optional[str] = None, export_path: Optional[str] = None):
     """
     Exécute l'alignement en arrière-plan et envoie les mises à jour via WebSocket
+
+    En mode adaptatif, retries est le plafond de lectures par face : une piste
+    stable n'est lue que 3 fois.
+    En mode relevé, seuls quelques cylindres sont lus, puis le relevé est
+    affiné autour des anomalies (voir alignment_survey).
+    Avec archive_path, chaque capture est enregistrée dans une archive de
+    flux, réanalysable ensuite sans le lecteur (POST /align/replay).
+    Avec export_path, les lectures et les pistes de la session sont ajoutées
+    au magasin colonnaire des résultats (voir results_export).
     """
+    sampler = SequentialSampler(min_reads=min(3, retries), max_reads=retries) if adaptive else None
+    alignment_survey = AlignmentSurvey(executor, cylinders=cylinders) if survey else None
     try:
         # Parser pour traiter les résultats
         parser = AlignmentParser()
@@ -131,14 +180,28 @@ async def run_alignment_task(cylinders: int, retries: int, format_type: Optional
         update_task = asyncio.create_task(send_updates())
         
         try:
-            # Exécuter la commande align
-            result = await executor.run_align(
-                cylinders=cylinders,
-                retries=retries,
-                format_type=format_type or "ibm.1440",
-                diskdefs_path=diskdefs_path,
-                on_output=on_output_line
-            )
+            # Exécuter la commande align, une fois l'unité USB libre (jobs,
+            # mode manuel)
+            async with unit_lock():
+                if alignment_survey is not None:
+                    result = await alignment_survey.run(
+                        retries=retries,
+                        format_type=format_type or "ibm.1440",
+                        diskdefs_path=diskdefs_path,
+                        on_output=on_output_line,
+                        sampler=sampler,
+                        archive_path=archive_path
+                    )
+                else:
+                    result = await executor.run_align(
+                        cylinders=cylinders,
+                        retries=retries,
+                        format_type=format_type or "ibm.1440",
+                        diskdefs_path=diskdefs_path,
+                        on_output=on_output_line,
+                        sampler=sampler,
+                        archive_path=archive_path
+                    )
             
             # Attendre que toutes les mises à jour soient envoyées
             await asyncio.sleep(0.5)  # Donner du temps pour les dernières mises à jour
@@ -151,6 +214,14 @@ async def run_alignment_task(cylinders: int, retries: int, format_type: Optional
             # Calculer les statistiques
             statistics = parser.calculate_statistics(all_values, limit=cylinders * 2)
             statistics["quality"] = parser.get_alignment_quality(statistics["average"])
+            if sampler is not None:
+                statistics["adaptive_sampling"] = sampler.summary()
+            if alignment_survey is not None:
+                statistics["survey"] = alignment_survey.summary()
+            if export_path:
+                statistics["export"] = await export_session(
+                    export_path, all_values, statistics, format_type=format_type
+                )
             
             # Mettre à jour l'état
             await alignment_state_manager.complete_alignment(statistics)
@@ -191,11 +262,12 @@ async def get_info():
         if path.is_absolute() and path.exists():
             settings_manager.set_gw_path(gw_path)
     
-    version = check_gw_version(gw_path)
-    align_available = check_align_available(gw_path)
-    
-    # Récupérer les informations détaillées du device
-    device_info = executor.get_device_info()
+    # Sondes en parallèle, depuis le cache de découverte
+    version, align_available, device_info = await asyncio.gather(
+        device_discovery.get_version(),
+        device_discovery.get_align_available(),
+        device_discovery.get_device_info()
+    )
     
     return GreaseweazleInfo(
         platform=platform.system(),
@@ -238,7 +310,11 @@ async def start_alignment(request: AlignmentRequest):
             request.cylinders, 
             request.retries,
             request.format_type,
-            request.diskdefs_path
+            request.diskdefs_path,
+            request.adaptive,
+            request.survey,
+            request.archive_path,
+            request.export_path
         )
     )
     
@@ -263,6 +339,36 @@ async def start_alignment(request: AlignmentRequest):
         "retries": request.retries
     }
 
+@router.post("/align/replay")
+async def replay_alignment(request: ReplayRequest):
+    """Réanalyse une archive de flux sans le lecteur (gw align --replay)"""
+    if not Path(request.archive_path).is_file():
+        raise HTTPException(
+            status_code=404,
+            detail=f"Archive de flux introuvable : {request.archive_path}"
+        )
+    result = await executor.run_replay(
+        request.archive_path,
+        format_type=request.format_type or "ibm.1440",
+        diskdefs_path=request.diskdefs_path,
+        jobs=request.jobs
+    )
+    values = AlignmentParser.parse_output(result["stdout"])
+    statistics = AlignmentParser.calculate_statistics(values, limit=len(values) or 1)
+    statistics["quality"] = AlignmentParser.get_alignment_quality(statistics["average"])
+    response = {
+        "success": result["success"],
+        "returncode": result["returncode"],
+        "error": None if result["success"] else (result["stderr"] or result["stdout"]),
+        "reads": len(values),
+        "statistics": statistics
+    }
+    if request.export_path and result["success"]:
+        response["export"] = await export_session(
+            request.export_path, values, statistics, format_type=request.format_type
+        )
+    return response
+
 @router.post("/align/reset")
 async def reset_alignment_data():
     """Réinitialise les données d'alignement (statistiques, valeurs) sans affecter le format"""
@@ -338,6 +444,48 @@ async def cancel_alignment():
         "message": "Alignement annulé"
     }
 
+@router.post("/jobs")
+async def submit_alignment_job(request: AlignmentJobRequest):
+    """Planifie un test d'alignement sur un device et un lecteur"""
+    try:
+        job = alignment_scheduler.submit(
+            device=request.device,
+            drive=request.drive,
+            cylinders=request.cylinders,
+            retries=request.retries,
+            format_type=request.format_type,
+            diskdefs_path=request.diskdefs_path,
+            adaptive=request.adaptive,
+            survey=request.survey,
+            archive_path=request.archive_path,
+            export_path=request.export_path
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return await job.to_dict()
+
+@router.get("/jobs")
+async def list_alignment_jobs():
+    """Liste les jobs d'alignement"""
+    return {"jobs": [await job.to_dict() for job in alignment_scheduler.list_jobs()]}
+
+@router.get("/jobs/{job_id}")
+async def get_alignment_job(job_id: str):
+    """Récupère l'état et les valeurs d'un job d'alignement"""
+    job = alignment_scheduler.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job inconnu: {job_id}")
+    return await job.to_dict(include_values=True)
+
+@router.post("/jobs/{job_id}/cancel")
+async def cancel_alignment_job(job_id: str):
+    """Annule un job d'alignement"""
+    job = alignment_scheduler.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job inconnu: {job_id}")
+    cancelled = await alignment_scheduler.cancel(job_id)
+    return {"cancelled": cancelled, "job": await job.to_dict()}
+
 @router.get("/status")
 async def get_status():
     """Récupère le statut actuel de l'application"""
@@ -353,7 +501,12 @@ async def detect_greaseweazle():
     OPTIMISATION: Limite le nombre de ports retournés pour éviter de surcharger
     """
     # Détecter les ports série disponibles (mais limiter l'affichage)
-    all_ports = executor.detect_serial_ports()
+    # Ports, connexion et disponibilité de align viennent du cache de découverte
+    all_ports, connection_status, align_available = await asyncio.gather(
+        device_discovery.get_ports(),
+        device_discovery.get_connection(),
+        device_discovery.get_align_available()
+    )
     
     # Filtrer pour ne garder que les ports potentiellement intéressants
     # (Greaseweazle ou ports USB série)
@@ -379,9 +532,6 @@ async def detect_greaseweazle():
     if len(interesting_ports) == 0 and len(all_ports) > 0:
         interesting_ports = all_ports[:5]
     
-    # Vérifier la connexion (rapide, utilise directement gw info)
-    connection_status = executor.check_connection()
-    
     return {
         "ports_detected": len(all_ports),
         "ports_shown": len(interesting_ports),
@@ -389,8 +539,8 @@ async def detect_greaseweazle():
         "greaseweazle_found": connection_status["connected"],
         "connection": connection_status,
         "gw_path": executor.gw_path,
-        "gw_available": executor.check_align_available(),  # Si align est disponible, gw est disponible
-        "align_available": executor.check_align_available()
+        "gw_available": align_available,  # Si align est disponible, gw est disponible
+        "align_available": align_available
     }
 
 @router.get("/detect/ports")
@@ -399,7 +549,7 @@ async def detect_ports():
     Liste tous les ports série disponibles
     Utile pour le débogage
     """
-    ports = executor.detect_serial_ports()
+    ports = await device_discovery.get_ports()
     return {
         "ports": ports,
         "count": len(ports)
@@ -421,6 +571,8 @@ class LastPortRequest(BaseModel):
 @router.post("/settings/last_port")
 async def set_last_port(request: LastPortRequest):
     """Définit le dernier port utilisé (appelé depuis le frontend)"""
+    if request.port != settings_manager.get_last_port():
+        device_discovery.invalidate(f"port modifié ({request.port})")
     settings_manager.set_last_port(request.port)
     return {
         "status": "saved",
@@ -457,7 +609,8 @@ class ManualAlignmentSettingsRequest(BaseModel):
     num_reads: Optional[int] = None
     format_type: Optional[str] = None
     diskdefs_path: Optional[str] = None
-    alignment_mode: Optional[str] = None  # "direct", "fine_tune", "high_precision"
+    alignment_mode: Optional[str] = None  # "direct", "fine_tune", "high_precision", "stream"
+    archive_path: Optional[str] = None  # Archive de flux des captures ("" : désactivée)
 
 class ManualAlignmentAnalyzeRequest(BaseModel):
     """Paramètres optionnels pour l'analyse"""
@@ -628,6 +781,9 @@ async def set_manual_settings(request: ManualAlignmentSettingsRequest):
     if request.format_type is not None:
         manual_mode.set_format(request.format_type, request.diskdefs_path)
     
+    if request.archive_path is not None:
+        manual_mode.set_archive_path(request.archive_path)
+    
     if request.alignment_mode is not None:
         from .manual_alignment import AlignmentMode
         try:
@@ -698,12 +854,11 @@ async def set_drive(request: DriveRequest):
 @router.post("/drive/test")
 async def test_drive():
     """Teste le lecteur en envoyant une séquence de commandes seek pour un retour audible clair
-    Séquence: 0 → 20 → 0 → 10 → 0 → 20 → 0"""
-    from .settings import settings_manager
-    from .greaseweazle import GreaseweazleExecutor
+    Séquence: 0 → 20 → 0 → 10 → 0 → 20 → 0
     
+    Toute la séquence est envoyée en une seule session gw seek (pas de
+    recalibrage ni de démarrage moteur entre deux mouvements)"""
     # Vérifier que Greaseweazle est connecté
-    executor = GreaseweazleExecutor()
     connection_status = executor.check_connection()
     if not connection_status["connected"]:
         raise HTTPException(
@@ -715,64 +870,35 @@ async def test_drive():
         # Séquence de pistes pour un retour audible clair
         # 0 → 20 → 0 → 10 → 0 → 20 → 0
         tracks_sequence = [0, 20, 0, 10, 0, 20, 0]
-        results = []
-        errors = []
+        # 100ms de pause entre les mouvements pour un retour audible plus clair
+        plan = plan_sequence(tracks_sequence, dwell_ms=100)
         
         print(f"[test_drive] Début de la séquence de test: {tracks_sequence}")
+        async with unit_lock():
+            seek_result = await executor.run_seek_plan(plan)
+        done = len(seek_result["seeks"])
+        print(f"[test_drive] {done}/{len(tracks_sequence)} seeks effectués: returncode={seek_result['returncode']}")
         
+        results = []
+        errors = []
         for i, track in enumerate(tracks_sequence):
-            try:
-                # Envoyer la commande seek avec --motor-on pour activer le moteur
-                # Syntaxe: gw seek [--device DEVICE] [--drive DRIVE] [--motor-on] [--force] CYLINDER
-                args = ["seek", "--motor-on", "--force", str(track)]
-                result = await executor.run_command(args, timeout=10)
-                
-                print(f"[test_drive] Seek vers piste {track} ({i+1}/{len(tracks_sequence)}): returncode={result.returncode}")
-                
-                if result.returncode != 0:
-                    error_msg = result.stderr or result.stdout or 'Unknown error'
-                    errors.append(f"Piste {track}: {error_msg}")
-                    print(f"[test_drive] Erreur sur piste {track}: {error_msg}")
-                
-                results.append({
-                    "track": track,
-                    "success": result.returncode == 0,
-                    "step": i + 1
-                })
-                
-                # Petite pause entre les mouvements pour un retour audible plus clair
-                if i < len(tracks_sequence) - 1:  # Pas de pause après le dernier
-                    await asyncio.sleep(0.1)  # 100ms de pause entre les mouvements (réduit de 300ms pour accélérer)
-                    
-            except asyncio.TimeoutError:
-                errors.append(f"Piste {track}: Timeout")
-                results.append({
-                    "track": track,
-                    "success": False,
-                    "error": "Timeout",
-                    "step": i + 1
-                })
-                break  # Arrêter la séquence en cas de timeout
-            except Exception as e:
-                errors.append(f"Piste {track}: {str(e)}")
-                results.append({
-                    "track": track,
-                    "success": False,
-                    "error": str(e),
-                    "step": i + 1
-                })
-                break  # Arrêter la séquence en cas d'erreur
+            if i < done:
+                results.append({"track": track, "success": True, "step": i + 1})
+            elif i == done:
+                error_msg = seek_result["output"] or 'Unknown error'
+                errors.append(f"Piste {track}: {error_msg}")
+                print(f"[test_drive] Erreur sur piste {track}: {error_msg}")
+                results.append({"track": track, "success": False, "error": error_msg, "step": i + 1})
+                break  # gw arrête la séquence au premier seek en échec
         
-        # Vérifier si toutes les commandes ont réussi
-        all_success = all(r["success"] for r in results)
-        
-        if all_success:
+        if seek_result["success"]:
             return {
                 "success": True,
                 "message": f"Séquence de test terminée avec succès. Vous devriez avoir entendu le lecteur se déplacer {len(tracks_sequence)} fois.",
                 "sequence": tracks_sequence,
                 "results": results,
-                "total_steps": len(tracks_sequence)
+                "total_steps": len(tracks_sequence),
+                "seek_timing": seek_result["timing"]
             }
         else:
             return {
@@ -781,9 +907,14 @@ async def test_drive():
                 "sequence": tracks_sequence,
                 "results": results,
                 "total_steps": len(tracks_sequence),
-                "completed_steps": len([r for r in results if r["success"]])
+                "completed_steps": done
             }
             
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=504,
+            detail="Timeout lors du test du lecteur"
+        )
     except Exception as e:
         import traceback
         error_trace = traceback.format_exc()
@@ -794,6 +925,39 @@ async def test_drive():
             detail=f"Erreur lors du test du lecteur: {str(e)}"
         )
 
+@router.post("/seek/plan")
+async def plan_seeks(request: SeekPlanRequest):
+    """
+    Planifie (et exécute si demandé) un ensemble de seeks
+    
+    - spot_check : pistes à contrôler, ordre libre (trajet minimal)
+    - sweep : balayage des cylindres 0..N-1 (N = max(cylinders) + 1)
+    - track0_verify : aller-retour vers la piste 0 depuis chaque piste
+    - sequence : ordre imposé
+    
+    La durée estimée utilise les temps de step et de stabilisation mesurés
+    lors des derniers seeks.
+    """
+    if request.kind == "spot_check":
+        plan = plan_visits(request.cylinders, start=request.start)
+    elif request.kind == "sweep":
+        plan = plan_sweep(max(request.cylinders, default=-1) + 1, start=request.start)
+    elif request.kind == "track0_verify":
+        plan = plan_track0_verify(request.cylinders, start=request.start)
+    elif request.kind == "sequence":
+        plan = plan_sequence(request.cylinders, start=request.start, dwell_ms=request.dwell_ms)
+    else:
+        raise HTTPException(status_code=400, detail=f"Type de plan inconnu: {request.kind}")
+    
+    response = {
+        "plan": plan.to_dict(executor.seek_timing),
+        "timing": executor.seek_timing.to_dict()
+    }
+    if request.execute:
+        async with unit_lock():
+            response["result"] = await executor.run_seek_plan(plan)
+    return response
+
 @router.get("/settings/gw-path")
 async def get_gw_path():
     """Récupère le chemin vers gw.exe sauvegardé"""
@@ -884,6 +1048,7 @@ async def verify_track0_sensor(request: Track0VerifyRequest = Track0VerifyReques
     
     Args:
         request: Paramètres de vérification, incluant le format_type de disquette
+            et le mode adaptatif des lectures de piste 0
     """
     from .track0_verifier import Track0Verifier
     
@@ -900,7 +1065,8 @@ async def verify_track0_sensor(request: Track0VerifyRequest = Track0VerifyReques
         results = await verifier.verify_track0_sensor(
             test_positions=[10, 20, 40, 79],  # Positions de test
             reads_per_test=5,  # 5 lectures pour vérifier la cohérence
-            format_type=request.format_type  # Format de disquette sélectionné
+            format_type=request.format_type,  # Format de disquette sélectionné
+            adaptive=request.adaptive  # 5 lectures au plus si la piste 0 est stable
         )
         
         return {
@@ -0,0 +1,230 @@
+"""
+Planification des déplacements de tête (seeks)
+
+Chaque plan de test (balayage d'alignement, pistes de contrôle, vérification
+Track 0, séquence de test du lecteur) est réduit à une liste ordonnée de
+cylindres à visiter :
+- l'ordre minimise le trajet total de la tête depuis sa position actuelle
+- tous les seeks d'un plan sont envoyés en une seule session gw
+  (gw seek c1 c2 c3 ...), au lieu d'une commande gw par seek : pas de
+  recalibrage sur la piste 0 ni de démarrage moteur à chaque déplacement
+- les temps de step et de stabilisation viennent du lecteur (gw seek --report)
+  et non d'attentes fixes ; le firmware attend déjà la stabilisation après
+  chaque seek
+"""
+
+from typing import Dict, List, Optional, Iterable, Tuple
+from dataclasses import dataclass, field
+import re
+
+# Délais par défaut du firmware Greaseweazle (gw delays)
+DEFAULT_STEP_MS = 3.0
+DEFAULT_SETTLE_MS = 15.0
+
+# Sortie de gw seek --report
+DELAYS_PATTERN = re.compile(r'Delays:\s*step=(\d+)us\s+settle=(\d+)ms')
+SEEK_PATTERN = re.compile(r'Seek\s+(\?|\d+)\s*->\s*(\d+):\s*([\d.]+)ms')
+
+
+@dataclass
+class SeekTiming:
+    """Modèle de coût d'un seek : distance x step + stabilisation"""
+    step_ms: float = DEFAULT_STEP_MS
+    settle_ms: float = DEFAULT_SETTLE_MS
+    source: str = "default"  # "default", "drive" (gw delays) ou "measured"
+
+    def cost_ms(self, from_cyl: int, to_cyl: int) -> float:
+        """Durée estimée d'un seek"""
+        steps = abs(to_cyl - from_cyl)
+        if steps == 0:
+            return 0.0
+        return steps * self.step_ms + self.settle_ms
+
+    @classmethod
+    def fit(cls, samples: Iterable[Tuple[int, float]],
+            fallback: Optional["SeekTiming"] = None) -> "SeekTiming":
+        """
+        Ajuste le modèle sur des seeks mesurés (moindres carrés)
+
+        Args:
+            samples: Couples (nombre de steps, durée en ms)
+            fallback: Modèle utilisé si les mesures ne suffisent pas
+        """
+        samples = [(steps, ms) for steps, ms in samples if steps > 0]
+        fallback = fallback or cls()
+        distinct = {steps for steps, _ in samples}
+        if len(distinct) < 2:
+            return fallback
+        n = len(samples)
+        mean_x = sum(steps for steps, _ in samples) / n
+        mean_y = sum(ms for _, ms in samples) / n
+        sxx = sum((steps - mean_x) ** 2 for steps, _ in samples)
+        sxy = sum((steps - mean_x) * (ms - mean_y) for steps, ms in samples)
+        step_ms = sxy / sxx
+        settle_ms = mean_y - step_ms * mean_x
+        if step_ms <= 0 or settle_ms < 0:
+            return fallback
+        return cls(step_ms=round(step_ms, 3), settle_ms=round(settle_ms, 3),
+                   source="measured")
+
+    def to_dict(self) -> Dict:
+        """Convertit le modèle en dictionnaire pour la sérialisation"""
+        return {
+            "step_ms": self.step_ms,
+            "settle_ms": self.settle_ms,
+            "source": self.source
+        }
+
+
+@dataclass
+class SeekReport:
+    """Résultat parsé de gw seek --report"""
+    timing: SeekTiming
+    seeks: List[Dict] = field(default_factory=list)
+
+
+def parse_seek_report(output: str, previous: Optional[SeekTiming] = None) -> SeekReport:
+    """
+    Parse la sortie de gw seek --report et met à jour le modèle de coût
+
+    Les délais annoncés par le lecteur servent de base ; si assez de seeks
+    ont été chronométrés, le modèle est ajusté sur les mesures.
+    """
+    timing = previous or SeekTiming()
+    match = DELAYS_PATTERN.search(output)
+    if match:
+        timing = SeekTiming(step_ms=int(match.group(1)) / 1000,
+                            settle_ms=float(match.group(2)), source="drive")
+
+    seeks = []
+    for match in SEEK_PATTERN.finditer(output):
+        from_cyl = None if match.group(1) == '?' else int(match.group(1))
+        seeks.append({
+            "from": from_cyl,
+            "to": int(match.group(2)),
+            "ms": float(match.group(3))
+        })
+
+    samples = [(abs(s["to"] - s["from"]), s["ms"]) for s in seeks if s["from"] is not None]
+    return SeekReport(timing=SeekTiming.fit(samples, fallback=timing), seeks=seeks)
+
+
+@dataclass
+class SeekPlan:
+    """Liste ordonnée des cylindres à visiter"""
+    kind: str
+    start: Optional[int]
+    cylinders: List[int]
+    dwell_ms: int = 0  # Pause entre deux seeks (retour audible)
+
+    def travel(self) -> int:
+        """Trajet total de la tête, en pistes"""
+        position = self.start if self.start is not None else 0
+        total = 0
+        for cyl in self.cylinders:
+            total += abs(cyl - position)
+            position = cyl
+        return total
+
+    def estimated_ms(self, timing: SeekTiming) -> float:
+        """Durée estimée du plan"""
+        position = self.start if self.start is not None else 0
+        total = 0.0
+        for i, cyl in enumerate(self.cylinders):
+            total += timing.cost_ms(position, cyl)
+            if i:
+                total += self.dwell_ms
+            position = cyl
+        return round(total, 1)
+
+    def to_dict(self, timing: Optional[SeekTiming] = None) -> Dict:
+        """Convertit le plan en dictionnaire (avec la durée estimée si timing est fourni)"""
+        data = {
+            "kind": self.kind,
+            "start": self.start,
+            "cylinders": list(self.cylinders),
+            "travel": self.travel()
+        }
+        if timing is not None:
+            data["estimated_ms"] = self.estimated_ms(timing)
+        return data
+
+
+def cylinder_spec(cylinders: Iterable[int]) -> str:
+    """Liste de cylindres au format TSPEC de gw (ex: [0, 1, 2, 5] -> "0-2,5")"""
+    runs: List[List[int]] = []
+    for cyl in cylinders:
+        if runs and cyl == runs[-1][1] + 1:
+            runs[-1][1] = cyl
+        else:
+            runs.append([cyl, cyl])
+    return ",".join(str(a) if a == b else f"{a}-{b}" for a, b in runs)
+
+
+def _drop_repeats(cylinders: Iterable[int], start: Optional[int]) -> List[int]:
+    """Supprime les seeks vers la position courante"""
+    result: List[int] = []
+    position = start
+    for cyl in cylinders:
+        if cyl != position:
+            result.append(cyl)
+            position = cyl
+    return result
+
+
+def plan_visits(cylinders: Iterable[int], start: Optional[int] = None,
+                kind: str = "spot_check") -> SeekPlan:
+    """
+    Ordre de visite d'un ensemble de cylindres (ordre libre)
+
+    Sur une ligne, le trajet minimal part vers l'extrémité la plus proche
+    de la tête puis repart vers l'autre, en visitant les pistes au passage.
+    Position inconnue : le firmware recalibre sur la piste 0, on part donc de 0.
+    """
+    targets = sorted(set(cylinders))
+    position = start if start is not None else 0
+    if not targets:
+        return SeekPlan(kind=kind, start=start, cylinders=[])
+    lo, hi = targets[0], targets[-1]
+    below = [c for c in targets if c <= position]
+    above = [c for c in targets if c > position]
+    if position - lo <= hi - position:
+        order = below[::-1] + above
+    else:
+        order = above + below[::-1]
+    return SeekPlan(kind=kind, start=start, cylinders=_drop_repeats(order, start))
+
+
+def plan_sweep(cylinders: int, start: Optional[int] = None) -> SeekPlan:
+    """Balayage d'alignement des cylindres 0..cylinders-1"""
+    return plan_visits(range(cylinders), start=start, kind="sweep")
+
+
+def plan_track0_verify(positions: Iterable[int], start: Optional[int] = None) -> SeekPlan:
+    """
+    Vérification Track 0 : aller-retour position -> 0 pour chaque position
+
+    Le trajet des allers-retours ne dépend pas de l'ordre ; seul le premier
+    aller compte, on commence donc par la position la plus proche de la tête.
+    La séquence se termine sur la piste 0.
+    """
+    targets = sorted(set(p for p in positions if p > 0))
+    position = start if start is not None else 0
+    if targets:
+        first = min(targets, key=lambda p: abs(p - position))
+        targets.remove(first)
+        targets.insert(0, first)
+    cylinders: List[int] = []
+    for pos in targets:
+        cylinders += [pos, 0]
+    if not cylinders:
+        cylinders = [0]
+    return SeekPlan(kind="track0_verify", start=start,
+                    cylinders=_drop_repeats(cylinders, start))
+
+
+def plan_sequence(cylinders: Iterable[int], start: Optional[int] = None,
+                  dwell_ms: int = 0) -> SeekPlan:
+    """Séquence imposée (test audible du lecteur) : l'ordre est conservé"""
+    return SeekPlan(kind="sequence", start=start,
+                    cylinders=_drop_repeats(cylinders, start), dwell_ms=dwell_ms)
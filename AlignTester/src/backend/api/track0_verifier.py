@@ -7,7 +7,10 @@ import asyncio
 from typing import Dict, List, Optional, Any
 from .greaseweazle import GreaseweazleExecutor
 from .alignment_parser import AlignmentParser
+from .adaptive_sampling import SequentialSampler
+from .seek_planner import plan_track0_verify
 from .diskdefs_parser import get_diskdefs_parser
+from .alignment_scheduler import unit_lock
 
 
 class Track0Verifier:
@@ -21,7 +24,8 @@ class Track0Verifier:
         self,
         test_positions: Optional[List[int]] = None,
         reads_per_test: int = 5,
-        format_type: Optional[str] = None
+        format_type: Optional[str] = None,
+        adaptive: bool = False
     ) -> Dict[str, Any]:
         """
         Vérifie le capteur Track 0 (Section 9.9 du manuel Panasonic)
@@ -31,6 +35,8 @@ class Track0Verifier:
             test_positions: Liste des positions de départ pour tester (défaut: [10, 20, 40, 79])
             reads_per_test: Nombre de lectures à effectuer pour chaque test (défaut: 5)
             format_type: Format de disquette à utiliser pour les lectures (défaut: "ibm.1440")
+            adaptive: Arrêter les lectures de piste 0 dès que les statistiques convergent
+                (reads_per_test devient un plafond)
         
         Returns:
             Dict avec:
@@ -90,63 +96,56 @@ class Track0Verifier:
         }
         
         # Test 1: Seek vers piste 0 depuis différentes positions
-        print(f"[Track0Verifier] Début des tests de seek depuis {len(test_positions)} positions: {test_positions} (format: {format_type}, max: {max_track})")
-        for start_pos in test_positions:
-            try:
-                # Seek vers la position de départ avec --motor-on et --force pour activer le moteur
-                # Syntaxe: gw seek [--device DEVICE] [--drive DRIVE] [--motor-on] [--force] CYLINDER
-                seek_result_start = await self.executor.run_command(
-                    ['seek', '--motor-on', '--force', str(start_pos)],
-                    timeout=10
-                )
-                
-                if seek_result_start.returncode != 0:
+        # Tous les allers-retours (position -> 0) sont planifiés et envoyés en une
+        # seule session gw seek : le firmware attend la stabilisation après chaque
+        # seek (délais mesurés du lecteur), inutile d'ajouter des pauses fixes
+        plan = plan_track0_verify(test_positions)
+        print(f"[Track0Verifier] Début des tests de seek depuis {len(test_positions)} positions: {test_positions} (format: {format_type}, max: {max_track}, plan: {plan.cylinders})")
+        try:
+            async with unit_lock():
+                seek_result = await self.executor.run_seek_plan(plan)
+            results['seek_timing'] = seek_result['timing']
+            done = seek_result['seeks']
+            failed_at = seek_result['failed_at']
+            # Le plan alterne position de départ et piste 0 ; gw s'arrête au
+            # premier seek en échec, les suivants ne sont pas testés
+            for i in range(0, len(plan.cylinders) - 1, 2):
+                start_pos = plan.cylinders[i]
+                if i >= len(done):
                     results['seek_tests'].append({
                         'from_track': start_pos,
                         'to_track': start_pos,
                         'success': False,
-                        'error': f"Impossible de seek vers piste {start_pos}: {seek_result_start.stderr or seek_result_start.stdout}",
+                        'error': f"Impossible de seek vers piste {start_pos}: {seek_result['output']}"
+                                 if failed_at == start_pos else "Non testé (séquence interrompue)",
                         'step': 'initial_seek'
                     })
                     continue
-                
-                # Attendre un peu pour que le lecteur se stabilise
-                await asyncio.sleep(0.3)
-                
-                # Seek vers piste 0 avec --motor-on et --force
-                seek_result_0 = await self.executor.run_command(
-                    ['seek', '--motor-on', '--force', '0'],
-                    timeout=10
-                )
-                
-                # Attendre un peu après le seek pour que le lecteur se stabilise
-                await asyncio.sleep(0.3)
-                
+                back_ok = i + 1 < len(done)
                 results['seek_tests'].append({
                     'from_track': start_pos,
                     'to_track': 0,
-                    'success': seek_result_0.returncode == 0,
-                    'message': seek_result_0.stdout if seek_result_0.returncode == 0 else None,
-                    'error': seek_result_0.stderr if seek_result_0.returncode != 0 else None,
-                    'step': 'seek_to_track0'
-                })
-                
-            except asyncio.TimeoutError:
-                results['seek_tests'].append({
-                    'from_track': start_pos,
-                    'to_track': 0,
-                    'success': False,
-                    'error': f"Timeout lors du seek depuis piste {start_pos}",
-                    'step': 'seek_to_track0'
-                })
-            except Exception as e:
-                results['seek_tests'].append({
-                    'from_track': start_pos,
-                    'to_track': 0,
-                    'success': False,
-                    'error': f"Erreur: {str(e)}",
+                    'success': back_ok,
+                    'message': f"{done[i + 1]['ms']:.1f}ms" if back_ok else None,
+                    'error': None if back_ok else seek_result['output'],
                     'step': 'seek_to_track0'
                 })
+        except asyncio.TimeoutError:
+            results['seek_tests'].append({
+                'from_track': test_positions[0],
+                'to_track': 0,
+                'success': False,
+                'error': "Timeout lors des tests de seek",
+                'step': 'seek_to_track0'
+            })
+        except Exception as e:
+            results['seek_tests'].append({
+                'from_track': test_positions[0],
+                'to_track': 0,
+                'success': False,
+                'error': f"Erreur: {str(e)}",
+                'step': 'seek_to_track0'
+            })
         
         # Vérifier si tous les seeks ont réussi
         all_seeks_ok = all(test['success'] for test in results['seek_tests'])
@@ -161,10 +160,8 @@ class Track0Verifier:
         # Test 2: Lecture de la piste 0 (plusieurs lectures pour cohérence)
         print(f"[Track0Verifier] Début des lectures de piste 0 ({reads_per_test} lectures)")
         try:
-            # S'assurer qu'on est bien sur la piste 0 avec --motor-on et --force
-            await self.executor.run_command(['seek', '--motor-on', '--force', '0'], timeout=10)
-            await asyncio.sleep(0.3)
-            
+            # Pas de seek préalable vers la piste 0 : gw align recalibre sur la
+            # piste 0 en début de session puis lit le cylindre 0
             # Effectuer plusieurs lectures de la piste 0
             # Utiliser align avec seulement la piste 0 pour plusieurs lectures
             track0_readings = []
@@ -172,12 +169,17 @@ class Track0Verifier:
                 # Utiliser align avec plusieurs lectures de la piste 0 uniquement
                 # Format: gw align --tracks=c=0:h=0 --reads=N --format=XXX
                 # Utiliser run_align avec cylinders=1 (piste 0) et retries=reads_per_test
-                align_result = await self.executor.run_align(
-                    cylinders=1,  # Seulement la piste 0
-                    retries=reads_per_test,  # Nombre de lectures
-                    format_type=format_type,  # Format sélectionné par l'utilisateur
-                    on_output=None
-                )
+                async with unit_lock():
+                    align_result = await self.executor.run_align(
+                        cylinders=1,  # Seulement la piste 0
+                        retries=reads_per_test,  # Nombre de lectures
+                        format_type=format_type,  # Format sélectionné par l'utilisateur
+                        on_output=None,
+                        sampler=SequentialSampler(
+                            min_reads=min(3, reads_per_test),
+                            max_reads=reads_per_test
+                        ) if adaptive else None
+                    )
                 
                 # Parser les résultats
                 # run_align() retourne un dictionnaire, pas un objet avec attributs
@@ -27,7 +27,7 @@ interface ManualAlignmentState {
   num_reads: number;
   format_type: string;
   diskdefs_path: string | null;
-  alignment_mode?: string;  // "direct", "fine_tune", "high_precision"
+  alignment_mode?: string;  // "direct", "fine_tune", "high_precision", "stream"
   alignment_mode_config?: AlignmentModeConfig;
   last_reading: ManualReading | null;
   total_readings: number;
@@ -277,7 +277,7 @@ export function ManualAlignment({ alignAvailable, selectedFormat: propSelectedFo
         setIsReading(false);
         
         // Traiter la lecture complète pour le mode Direct
-        if (data.reading && data.state?.alignment_mode === 'direct') {
+        if (data.reading && (data.state?.alignment_mode === 'direct' || data.state?.alignment_mode === 'stream')) {
           // Mettre à jour l'état avec la dernière lecture
           if (data.state && Object.keys(data.state).length > 0) {
             setState(prevState => {
@@ -307,7 +307,7 @@ export function ManualAlignment({ alignAvailable, selectedFormat: propSelectedFo
         setIsReading(true);
         
         // Ajouter à l'historique des lectures en temps réel pour les autres modes
-        if (state?.alignment_mode && state.alignment_mode !== 'direct') {
+        if (state?.alignment_mode && state.alignment_mode !== 'direct' && state.alignment_mode !== 'stream') {
           const now = Date.now();
           readingCounterRef.current += 1;
           const newCounter = readingCounterRef.current;
@@ -347,7 +347,7 @@ export function ManualAlignment({ alignAvailable, selectedFormat: propSelectedFo
         setIsReading(false);
         
         // Mettre à jour la dernière lecture avec les timings complets et les données de reading
-        if (state?.alignment_mode && state.alignment_mode !== 'direct') {
+        if (state?.alignment_mode && state.alignment_mode !== 'direct' && state.alignment_mode !== 'stream') {
           setLiveReadings(prevReadings => {
             if (prevReadings.length > 0) {
               const updated = [...prevReadings];
@@ -961,6 +961,31 @@ export function ManualAlignment({ alignAvailable, selectedFormat: propSelectedFo
                   <div className="text-xs text-gray-500">{t('perTrack')}</div>
                 </div>
               </button>
+
+              {/* Mode Stream : une lecture par révolution */}
+              <button
+                onClick={() => handleModeChange('stream')}
+                disabled={analyzing || isReading}
+                className={`flex items-center justify-between p-2 rounded border-2 transition-all ${
+                  state?.alignment_mode === 'stream'
+                    ? 'border-blue-500 bg-blue-900/30'
+                    : 'border-gray-600 bg-gray-800 hover:border-gray-500'
+                } disabled:opacity-50 disabled:cursor-not-allowed`}
+              >
+                <div className="flex items-center gap-2">
+                  <span className="text-lg">🌀</span>
+                  <div className="text-left">
+                    <div className="font-semibold text-white text-sm">{t('streamMode')}</div>
+                    <div className="text-xs text-gray-400">{t('streamDescription')}</div>
+                  </div>
+                </div>
+                <div className="text-right">
+                  <div className="text-xs font-mono text-blue-400">
+                    ~200ms
+                  </div>
+                  <div className="text-xs text-gray-500">{t('latency')}</div>
+                </div>
+              </button>
             </div>
           </div>
 
@@ -999,7 +1024,7 @@ export function ManualAlignment({ alignAvailable, selectedFormat: propSelectedFo
     </div>
 
     {/* Affichage en temps réel pour le Mode Direct - Simple et efficace - Version compacte */}
-    {state && state.is_running && state.alignment_mode === 'direct' && (
+    {state && state.is_running && (state.alignment_mode === 'direct' || state.alignment_mode === 'stream') && (
       <div className="bg-gray-700 rounded-lg p-2 mb-2 border-2 border-blue-500">
         <div className="flex items-center justify-between mb-2">
           <h3 className="text-sm font-semibold text-blue-400">
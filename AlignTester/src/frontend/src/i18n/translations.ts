@@ -255,6 +255,8 @@ export const translations = {
     highPrecisionMode: "Grande Précision",
     fineTuneDescription: "Ajustements précis",
     highPrecisionDescription: "Validation finale",
+    streamMode: "Flux Continu",
+    streamDescription: "Une lecture par révolution",
     timings: "Timings",
     averageDuration: "Durée moyenne:",
     averageLatency: "Latence moyenne:",
@@ -581,6 +583,8 @@ export const translations = {
     highPrecisionMode: "High Precision",
     fineTuneDescription: "Precise adjustments",
     highPrecisionDescription: "Final validation",
+    streamMode: "Stream",
+    streamDescription: "One reading per revolution",
     timings: "Timings",
     averageDuration: "Average duration:",
     averageLatency: "Average latency:",
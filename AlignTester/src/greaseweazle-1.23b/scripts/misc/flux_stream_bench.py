@@ -0,0 +1,71 @@
+# flux_stream_bench.py
+#
+# Times the incremental ReadFlux stream decoder (usb.FluxStreamDecoder)
+# against the optimised whole-stream decoder, feeding it random streams
+# split at random points. Equivalence is checked by
+# scripts/tests/test_flux_stream.py.
+#
+# Usage: python3 flux_stream_bench.py [nr_streams]
+
+import random, sys, time
+
+from greaseweazle import optimised
+from greaseweazle.usb import FluxOp, FluxStreamDecoder
+from greaseweazle.sim import encode_read_stream, write_28bit
+
+def random_stream():
+    """A few revolutions of flux, including long intervals (two-byte and
+    Space-escaped samples), bare Space opcodes and index pulses."""
+    dat = bytearray()
+    for _ in range(random.randint(1, 4)):
+        for _ in range(random.randint(1000, 20000)):
+            r = random.random()
+            if r < 0.01:
+                encode_read_stream(dat, random.randint(1525, 1<<24))
+            elif r < 0.05:
+                encode_read_stream(dat, random.randint(250, 1524))
+            elif r < 0.055:
+                dat.append(255)
+                dat.append(FluxOp.Space)
+                write_28bit(dat, random.randint(0, 1<<27))
+            else:
+                encode_read_stream(dat, random.randint(1, 249))
+        dat.append(255)
+        dat.append(FluxOp.Index)
+        write_28bit(dat, random.randint(0, 300))
+    encode_read_stream(dat, random.randint(1, 249))
+    dat.append(0)
+    return bytes(dat)
+
+def main(argv):
+    nr = int(argv[1]) if len(argv) > 1 else 50
+    t_ref = t_inc = 0.0
+    for i in range(nr):
+        dat = random_stream()
+
+        t = time.perf_counter()
+        ref = optimised.decode_flux(dat)
+        t_ref += time.perf_counter() - t
+
+        # Feed in random-sized chunks, some as small as a single byte.
+        decoder = FluxStreamDecoder()
+        flux, index = [], []
+        t = time.perf_counter()
+        pos = 0
+        while pos < len(dat):
+            n = random.choice((1, 2, 5, 64, 4096, 65536))
+            f, x = decoder.feed(memoryview(dat)[pos:pos+n])
+            flux += f
+            index += x
+            pos += n
+        t_inc += time.perf_counter() - t
+
+    print(f'{nr} streams')
+    print('optimised: %.3fs, incremental: %.3fs' % (t_ref, t_inc))
+
+if __name__ == "__main__":
+    main(sys.argv)
+
+# Local variables:
+# python-indent: 4
+# End:
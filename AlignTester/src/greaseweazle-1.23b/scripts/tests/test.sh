@@ -2,6 +2,13 @@ set -e
 
 GW="gw --bt"
 
+python3 "$(dirname "$0")/test_encode_flux.py"
+python3 "$(dirname "$0")/test_gcr.py"
+python3 "$(dirname "$0")/test_scp_codec.py"
+python3 "$(dirname "$0")/test_kryoflux.py"
+python3 "$(dirname "$0")/test_flux_stream.py"
+python3 "$(dirname "$0")/test_track.py"
+
 rm -rf .test
 mkdir -p .test
 pushd .test
@@ -26,12 +33,64 @@ mkdir a
 $GW convert a.adf a/00.0.raw
 $GW convert a/00.0.raw b.adf
 diff -u a.adf b.adf
+$GW convert --jobs 3 a/00.0.raw::jobs=2 c.adf
+diff -u a.adf c.adf
+$GW read --device sim:a/00.0.raw::realtime=0 --tracks c=0-1 --revs 1 d.adf
+cmp -n 22528 a.adf d.adf
+$GW align --device sim:a/00.0.raw::realtime=0 --format=amiga.amigados \
+    --tracks c=1:h=0,1 --reads 4 --revs 2 --stream 2>&1 | tee align.log
+[ $(grep -c "(11/11 sectors)" align.log) = 4 ]
+$GW align --device sim:a/00.0.raw::realtime=0 --format=amiga.amigados \
+    --tracks c=0-1:h=0,1 --reads 2 --revs 1 2>&1 | tee align.log
+[ $(grep -c "(11/11 sectors)" align.log) = 4 ]
+$GW align --device sim:a/00.0.raw::realtime=0 --format=amiga.amigados \
+    --tracks c=1:h=0,1 --reads 2 --revs 3 --per-rev --jobs 2 2>&1 \
+    | tee align.log
+[ $(grep -c "(11/11 sectors)" align.log) = 2 ]
+[ $(grep -c "^  Rev [1-3]: \.\{11\} 11/11$" align.log) = 6 ]
+# The index falls 5% into the track data: A sector straddling the index
+# is counted in the revolution in which it starts
+$GW align --device sim:a/00.0.raw::realtime=0:index=0.05 \
+    --format=amiga.amigados --tracks c=1:h=0 --reads 2 --revs 3 --per-rev \
+    2>&1 | tee align.log
+[ $(grep -c "^  Rev [1-3]: \.\{11\} 11/11$" align.log) = 6 ]
+$GW align --device sim:a/00.0.raw::realtime=0 --format=amiga.amigados \
+    --tracks c=1:h=0 --jobs 2 2>&1 | grep -q "jobs requires --per-rev"
+$GW align --device sim:a/00.0.raw::realtime=0 --format=amiga.amigados \
+    --tracks c=1:h=0,1 --reads 3 --revs 2 --archive align.gwfa 2>&1 \
+    | tee align.log
+$GW align --replay align.gwfa --format=amiga.amigados --tracks c=1:h=0,1 \
+    --jobs 2 2>&1 | tee replay.log
+diff -u <(grep "^T" align.log) <(grep "^T" replay.log)
+# A torn final chunk (killed session) is dropped before appending
+truncate -s -100 align.gwfa
+$GW align --device sim:a/00.0.raw::realtime=0 --format=amiga.amigados \
+    --tracks c=1:h=0,1 --reads 1 --revs 2 --archive align.gwfa
+$GW align --replay align.gwfa --format=amiga.amigados --tracks c=1:h=0,1 \
+    2>&1 | tee replay.log
+[ $(grep -c "(11/11 sectors)" replay.log) = 3 ]
+$GW seek --device sim:a/00.0.raw::realtime=0 --report 1 0 1 0 2>&1 | tee seek.log
+[ $(grep -c "^Seek" seek.log) = 4 ]
+$GW write --device sim:a/00.0.raw::realtime=0 --tracks c=0-2 b.adf 2>&1 \
+    | tee write.log
+[ $(grep -c "Writing Track" write.log) = 6 ]
+grep -q "All tracks verified" write.log
 
 # C64
 dd if=/dev/urandom of=a.d64 bs=256 count=683
 $GW convert --tracks=c=0-34 a.d64 a.scp::revs=1
 $GW convert a.scp b.d64
 diff -u a.d64 b.d64
+# A bad image checksum is reported once, after the track output
+cp a.scp bad.scp
+printf '\377\377\377\377' | dd of=bad.scp bs=1 seek=12 conv=notrunc
+$GW convert --jobs 2 bad.scp c.d64 2>&1 | tee convert.log
+[ $(grep -c "Bad image checksum" convert.log) = 1 ]
+tail -n 1 convert.log | grep -q "Bad image checksum"
+diff -u a.d64 c.d64
+# convert --jobs prints just what a serial convert does
+$GW convert bad.scp d.d64 > serial.log 2>&1
+diff -u serial.log convert.log
 
 # Mac
 dd if=/dev/urandom of=a.img bs=1024 count=800
@@ -0,0 +1,119 @@
+# scripts/tests/test_encode_flux.py
+#
+# Property tests: FluxStreamEncoder output must be byte-identical to the
+# original per-value write-stream encoder, for random flux lists covering
+# every encoding form and its boundaries.
+#
+# This is free and unencumbered software released into the public domain.
+# See the file COPYING for more details, or visit <http://unlicense.org>.
+
+import random
+
+from greaseweazle.usb import FluxOp, FluxStreamEncoder
+
+# The original Unit._encode_flux, kept as the reference.
+def reference_encode_flux(flux, sample_freq):
+    nfa_thresh = round(150e-6 * sample_freq)  # 150us
+    nfa_period = round(1.25e-6 * sample_freq) # 1.25us
+    dat = bytearray()
+    def _write_28bit(x):
+        dat.append(1 | (x<<1) & 255)
+        dat.append(1 | (x>>6) & 255)
+        dat.append(1 | (x>>13) & 255)
+        dat.append(1 | (x>>20) & 255)
+    dummy_flux = round(100e-6 * sample_freq)
+    for val in flux + [dummy_flux]:
+        if val == 0:
+            pass
+        elif val < 250:
+            dat.append(val)
+        elif val > nfa_thresh:
+            dat.append(255)
+            dat.append(FluxOp.Space)
+            _write_28bit(val)
+            dat.append(255)
+            dat.append(FluxOp.Astable)
+            _write_28bit(nfa_period)
+        else:
+            high = (val-250) // 255
+            if high < 5:
+                dat.append(250 + high)
+                dat.append(1 + (val-250) % 255)
+            else:
+                dat.append(255)
+                dat.append(FluxOp.Space)
+                _write_28bit(val - 249)
+                dat.append(249)
+    dat.append(0) # End of Stream
+    return dat
+
+SAMPLE_FREQS = [ 72000000, 84000000, 24000000, 8000000, 1000000 ]
+
+def boundaries(sample_freq):
+    nfa_thresh = round(150e-6 * sample_freq)
+    return [ 0, 1, 249, 250, 251, 504, 505, 1524, 1525, 1526,
+             nfa_thresh-1, nfa_thresh, nfa_thresh+1, (1<<28)-1 ]
+
+def random_flux(rng, sample_freq):
+    n = rng.choice([ 0, 1, 2, 10, 1000, 20000 ])
+    mode = rng.choice([ 'short', 'mfm', 'mixed', 'boundary' ])
+    b = boundaries(sample_freq)
+    nfa_thresh = round(150e-6 * sample_freq)
+    flux = []
+    for _ in range(n):
+        if mode == 'short':
+            flux.append(rng.randrange(1, 250))
+        elif mode == 'mfm':
+            # 2/3/4us cells with jitter.
+            us = rng.choice([2, 3, 4])
+            flux.append(max(1, round(us * 1e-6 * sample_freq
+                                     * rng.gauss(1, 0.02))))
+        elif mode == 'boundary':
+            flux.append(rng.choice(b))
+        else:
+            r = rng.random()
+            if r < 0.8:
+                flux.append(rng.randrange(0, 1525))
+            elif r < 0.95:
+                flux.append(rng.randrange(0, 2*nfa_thresh))
+            else:
+                flux.append(rng.randrange(0, 1<<28))
+    return flux
+
+def test_encode_identical():
+    rng = random.Random(2024)
+    for sample_freq in SAMPLE_FREQS:
+        encoder = FluxStreamEncoder(sample_freq)
+        for _ in range(200):
+            flux = random_flux(rng, sample_freq)
+            assert (encoder.encode(flux)
+                    == reference_encode_flux(flux, sample_freq)), flux[:20]
+
+def test_encode_every_value():
+    for sample_freq in SAMPLE_FREQS:
+        encoder = FluxStreamEncoder(sample_freq)
+        nfa_thresh = round(150e-6 * sample_freq)
+        flux = list(range(max(2000, nfa_thresh+10)))
+        assert encoder.encode(flux) == reference_encode_flux(flux, sample_freq)
+
+def test_encode_negative():
+    # The reference fails on bytearray.append(): So must the encoder.
+    for flux in ([ -1 ], [ 100, 3000, -250 ], [ -(1<<28) ]):
+        for encode in (FluxStreamEncoder(72000000).encode,
+                       lambda f: reference_encode_flux(f, 72000000)):
+            try:
+                encode(flux)
+            except ValueError:
+                pass
+            else:
+                assert False, flux
+
+if __name__ == "__main__":
+    test_encode_identical()
+    test_encode_every_value()
+    test_encode_negative()
+    print("encode_flux: OK")
+
+# Local variables:
+# python-indent: 4
+# End:
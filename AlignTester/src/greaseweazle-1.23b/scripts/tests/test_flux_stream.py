@@ -0,0 +1,99 @@
+# scripts/tests/test_flux_stream.py
+#
+# Differential tests: the incremental ReadFlux stream decoder
+# (usb.FluxStreamDecoder) must decode exactly what the whole-stream decoder
+# (optimised.decode_flux) does, wherever the stream is split into chunks:
+# in particular between the two bytes of a long sample and inside the
+# 28-bit field of a 255-escaped opcode (Space, Index).
+#
+# Usage: python3 test_flux_stream.py [nr_streams]
+#
+# This is free and unencumbered software released into the public domain.
+# See the file COPYING for more details, or visit <http://unlicense.org>.
+
+import random, sys
+
+from greaseweazle import optimised
+from greaseweazle.usb import FluxOp, FluxStreamDecoder
+from greaseweazle.sim import encode_read_stream, write_28bit
+
+def random_stream(rng, revs, nr_flux):
+    """Revolutions of flux, including long intervals (two-byte and
+    Space-escaped samples), bare Space opcodes and index pulses."""
+    dat = bytearray()
+    for _ in range(revs):
+        for _ in range(nr_flux):
+            r = rng.random()
+            if r < 0.01:
+                encode_read_stream(dat, rng.randint(1525, 1<<24))
+            elif r < 0.05:
+                encode_read_stream(dat, rng.randint(250, 1524))
+            elif r < 0.055:
+                dat.append(255)
+                dat.append(FluxOp.Space)
+                write_28bit(dat, rng.randint(0, 1<<27))
+            else:
+                encode_read_stream(dat, rng.randint(1, 249))
+        dat.append(255)
+        dat.append(FluxOp.Index)
+        write_28bit(dat, rng.randint(0, 300))
+    encode_read_stream(dat, rng.randint(1, 249))
+    dat.append(0)
+    return bytes(dat)
+
+def decode_chunks(dat, splits):
+    """Feeds @dat to a FluxStreamDecoder, split at the given offsets."""
+    decoder = FluxStreamDecoder()
+    flux, index = [], []
+    for s, e in zip([0] + splits, splits + [len(dat)]):
+        f, x = decoder.feed(memoryview(dat)[s:e])
+        flux += f
+        index += x
+    assert decoder.done, 'stream not terminated'
+    assert (decoder.flux_list, decoder.index_list) == (flux, index)
+    return flux, index
+
+def test_random_chunks(nr_streams):
+    # Random-sized chunks, some as small as a single byte.
+    rng = random.Random(2024)
+    for nr in range(nr_streams):
+        dat = random_stream(rng, rng.randint(1, 4), rng.randint(1000, 20000))
+        ref = optimised.decode_flux(dat)
+        splits, pos = [], 0
+        while True:
+            pos += rng.choice((1, 2, 5, 64, 4096, 65536))
+            if pos >= len(dat):
+                break
+            splits.append(pos)
+        assert decode_chunks(dat, splits) == ref, f'stream #{nr}'
+
+def test_every_split():
+    # One split at every offset of a short stream, then every byte on its
+    # own: each multi-byte encoding is cut at each of its boundaries.
+    rng = random.Random(2025)
+    dat = bytearray()
+    for val in (1, 249, 250, 251, 1524, 1525, 1526, 100000, (1<<28)-1):
+        encode_read_stream(dat, val)
+    dat.append(255)
+    dat.append(FluxOp.Space)
+    write_28bit(dat, 1234567)
+    encode_read_stream(dat, 3)
+    dat.append(255)
+    dat.append(FluxOp.Index)
+    write_28bit(dat, 77)
+    dat += random_stream(rng, 2, 50)
+    dat = bytes(dat)
+    ref = optimised.decode_flux(dat)
+    for pos in range(1, len(dat)):
+        assert decode_chunks(dat, [pos]) == ref, f'split at {pos}'
+    assert decode_chunks(dat, list(range(1, len(dat)))) == ref, 'bytewise'
+
+if __name__ == "__main__":
+    nr_streams = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    test_random_chunks(nr_streams)
+    test_every_split()
+    print("flux_stream: OK")
+
+# Local variables:
+# python-indent: 4
+# End:
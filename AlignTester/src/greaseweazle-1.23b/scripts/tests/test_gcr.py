@@ -0,0 +1,95 @@
+# scripts/tests/test_gcr.py
+#
+# Differential tests: the pure-Python GCR codecs in greaseweazle.optimised.gcr
+# must return exactly what the optimised C extension returns, for random
+# input including invalid codes and slipped bits.
+#
+# This is free and unencumbered software released into the public domain.
+# See the file COPYING for more details, or visit <http://unlicense.org>.
+
+import random
+
+from greaseweazle.optimised import gcr
+
+try:
+    from greaseweazle.optimised import optimised as c
+except ImportError:
+    c = None
+
+ROUNDS = 200
+
+def randbytes(n):
+    return bytes(random.getrandbits(8) for _ in range(n))
+
+def randgcr(n):
+    # Mostly valid disk bytes, with the occasional invalid one.
+    valid = gcr.apple_gcr_6a2_code
+    return bytes(random.choice(valid) if random.random() < 0.98
+                 else random.getrandbits(8) for _ in range(n))
+
+def test_mac_gcr():
+    for _ in range(ROUNDS):
+        dat = randbytes(random.randint(0, 800))
+        assert gcr.decode_mac_gcr(dat) == c.decode_mac_gcr(dat)
+        assert gcr.encode_mac_gcr(dat) == c.encode_mac_gcr(dat)
+
+def test_mac_sector():
+    for _ in range(ROUNDS):
+        dat = randbytes(gcr.MAC_SECTOR_LENGTH)
+        enc = gcr.encode_mac_sector(dat)
+        assert enc == c.encode_mac_sector(dat)
+        assert gcr.decode_mac_sector(enc) == c.decode_mac_sector(enc) \
+            == (dat, 0)
+        bad = bytes(x & 0x3f for x in randbytes(len(enc)))
+        assert gcr.decode_mac_sector(bad) == c.decode_mac_sector(bad)
+
+def test_c64_gcr():
+    for _ in range(ROUNDS):
+        dat = randbytes(4 * random.randint(0, 80))
+        enc = gcr.encode_c64_gcr(dat)
+        assert enc == c.encode_c64_gcr(dat)
+        assert gcr.decode_c64_gcr(enc) == c.decode_c64_gcr(enc) == dat
+        bad = randbytes(len(enc))
+        assert gcr.decode_c64_gcr(bad) == c.decode_c64_gcr(bad)
+
+def test_apple2_sector():
+    for _ in range(ROUNDS):
+        dat = randbytes(gcr.APPLE2_SECTOR_LENGTH)
+        enc = gcr.encode_apple2_sector(dat)
+        assert enc == c.encode_apple2_sector(dat)
+        assert gcr.decode_apple2_sector(enc) == c.decode_apple2_sector(enc) \
+            == (dat, 0)
+        bad = randgcr(len(enc) + random.randint(-2, 8))
+        sec, status = gcr.decode_apple2_sector(bad)
+        c_sec, c_status = c.decode_apple2_sector(bad)
+        assert status == c_status
+        # The C output is undefined if too few disk bytes are found.
+        if len(bad) >= len(enc) and all(x & 0x80 for x in bad):
+            assert sec == c_sec
+
+def test_apple2_slipped_bits():
+    # Insert a zero bit before some disk bytes: both decoders resync.
+    for _ in range(ROUNDS):
+        dat = randbytes(gcr.APPLE2_SECTOR_LENGTH)
+        enc = gcr.encode_apple2_sector(dat)
+        bits = ''.join(('0' if random.random() < 0.1 else '') + f'{x:08b}'
+                       for x in enc)
+        bits += '0' * (-len(bits) % 8)
+        slipped = int(bits, 2).to_bytes(len(bits)//8, 'big')
+        assert gcr.decode_apple2_sector(slipped) == \
+            c.decode_apple2_sector(slipped) == (dat, 0)
+
+if __name__ == "__main__":
+    if c is None:
+        print("gcr: optimised C extension not built, skipped")
+    else:
+        test_mac_gcr()
+        test_mac_sector()
+        test_c64_gcr()
+        test_apple2_sector()
+        test_apple2_slipped_bits()
+        print("gcr: OK")
+
+# Local variables:
+# python-indent: 4
+# End:
@@ -0,0 +1,71 @@
+# scripts/tests/test_kryoflux.py
+#
+# Differential tests: KryoFlux stream files read ahead in worker processes
+# (file option jobs=N) must give the same flux as serial decoding, whatever
+# order the tracks are read in, and closing the image must stop the workers.
+#
+# Usage: python3 test_kryoflux.py [nr_cyls]
+#
+# This is free and unencumbered software released into the public domain.
+# See the file COPYING for more details, or visit <http://unlicense.org>.
+
+import os, random, sys, tempfile
+
+from greaseweazle.flux import Flux
+from greaseweazle.image.kryoflux import KryoFlux, def_sck
+
+def random_flux(revs):
+    """Revolutions of 300RPM MFM at the KryoFlux sample clock, with a few
+    long intervals (unformatted areas, Ovl16 opcodes)."""
+    rev_ticks = def_sck / 5
+    flux_list, index_list = [], []
+    for _ in range(revs):
+        tot = 0
+        while tot < rev_ticks:
+            x = random.choice((2, 3, 4)) * round(def_sck / 500000)
+            x += random.randint(-5, 5)
+            if random.random() < 0.001:
+                x = random.randint(0x800, 0x30000)
+            flux_list.append(x)
+            tot += x
+        index_list.append(tot)
+    return Flux(index_list, flux_list, def_sck)
+
+def test_jobs(nr_cyls, jobs):
+    with tempfile.TemporaryDirectory() as d:
+        name = os.path.join(d, 'track00.0.raw')
+        with KryoFlux.to_file(name, None, False, dict()) as image:
+            for cyl in range(nr_cyls):
+                for head in range(2):
+                    image.emit_track(cyl, head,
+                                     random_flux(random.randint(1, 3)))
+        tracks = [(cyl, head) for cyl in range(nr_cyls) for head in range(2)]
+        # In order (read-ahead hits), then shuffled and with missing tracks.
+        order = tracks + random.sample(tracks, len(tracks)) + [(nr_cyls, 0)]
+        serial = KryoFlux.from_file(name, None, dict())
+        ahead = KryoFlux.from_file(name, None, {'jobs': str(jobs)})
+        for cyl, head in order:
+            ref = serial.get_track(cyl, head)
+            res = ahead.get_track(cyl, head)
+            if ref is None:
+                assert res is None, f'T{cyl}.{head}: unexpected track'
+                continue
+            assert res.index_list == ref.index_list, f'T{cyl}.{head}: index'
+            assert res.list == ref.list, f'T{cyl}.{head}: flux'
+            assert res.sample_freq == ref.sample_freq, f'T{cyl}.{head}: sck'
+        # Leave read-ahead in flight: close() must cancel it.
+        ahead.cache.tracks.clear()
+        ahead.get_track(0, 0)
+        ahead.close()
+        assert ahead.pool is None and not ahead.pending
+        serial.close()
+
+if __name__ == "__main__":
+    nr_cyls = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    for jobs in (1, 3):
+        test_jobs(nr_cyls, jobs)
+    print("kryoflux: OK")
+
+# Local variables:
+# python-indent: 4
+# End:
@@ -0,0 +1,225 @@
+# scripts/tests/test_track.py
+#
+# Differential tests: MasterTrack flux generation (bits_to_flux, uniform
+# bitcells without a dummy bit_ticks array) and write precompensation
+# (Precomp.apply, _uniform_precomp_ticks) must give exactly the results of
+# the original per-bitcell conversion and per-match precompensation, value
+# types included, for random tracks covering weak regions, splice positions,
+# revolutions, cueing and every precompensation type.
+#
+# Usage: python3 test_track.py [nr_tracks]
+#
+# This is free and unencumbered software released into the public domain.
+# See the file COPYING for more details, or visit <http://unlicense.org>.
+
+import random, sys
+
+from bitarray import bitarray
+
+from greaseweazle.flux import Flux, WriteoutFlux
+from greaseweazle.track import MasterTrack, Precomp
+
+# The original Precomp.apply, kept as the reference.
+def reference_precomp(self, bits, bit_ticks, scale):
+    t = self.ns * scale
+    if self.type == Precomp.MFM:
+        for i in bits.search(bitarray('10100', endian='big')):
+            bit_ticks[i+2] -= t
+            bit_ticks[i+3] += t
+        for i in bits.search(bitarray('00101', endian='big')):
+            bit_ticks[i+2] += t
+            bit_ticks[i+3] -= t
+    for i in bits.search(bitarray('110', endian='big')):
+        bit_ticks[i+1] -= t
+        bit_ticks[i+2] += t
+    for i in bits.search(bitarray('011', endian='big')):
+        bit_ticks[i+1] += t
+        bit_ticks[i+2] -= t
+
+# The original MasterTrack._flux, kept as the reference.
+def reference_flux(self, for_writeout, cue_at_index, revs=None):
+
+    bits = self.bits.copy()
+    bitlen = len(bits)
+
+    bit_ticks = self.bit_ticks.copy() if self.bit_ticks else [1] * bitlen
+    ticks_to_index = sum(bit_ticks)
+
+    for s, n in self.weak:
+        if n < 2: continue
+        e = s + n
+        assert 0 <= s < e <= bitlen
+        pattern = bitarray(endian="big")
+        if n < 400 or self.force_random_weak:
+            pattern.frombytes(b"\x80\x00\x00\x00")
+            bits[s:e] = (pattern * (n//32+1))[:n]
+        else:
+            pattern.frombytes(b"\x12\xA5")
+            bits[s:e] = (pattern * (n//16+1))[:n]
+            for i in range(0, n-10, 16):
+                x, y = bit_ticks[s+i+10], bit_ticks[s+i+11]
+                bit_ticks[s+i+10], bit_ticks[s+i+11] = x+y*0.5, y*0.5
+        bits[s] = not bits[s-1]
+        bits[e-1] = not(bits[e-2] or bits[e % bitlen])
+
+    if cue_at_index:
+        index = -self.splice % bitlen
+        if index != 0:
+            bits = bits[index:] + bits[:index]
+            bit_ticks = bit_ticks[index:] + bit_ticks[:index]
+        splice_at_index = index < 4 or bitlen - index < 4
+    else:
+        assert for_writeout
+        splice_at_index = False
+
+    if not for_writeout:
+        pass
+    elif not cue_at_index:
+        pos = 4
+        rep = bitlen // (10 * 32)
+        bit_ticks = bit_ticks[pos:pos+32] * rep + bit_ticks[pos:]
+        bits = bits[pos:pos+32] * rep + bits[pos:]
+    elif splice_at_index:
+        pos = (self.splice - 4) % bitlen
+        rep = bitlen // (10 * 32)
+        bit_ticks = bit_ticks[:pos] + bit_ticks[pos-32:pos] * rep
+        bits = bits[:pos] + bits[pos-32:pos] * rep
+    else:
+        bit_ticks += bit_ticks[:self.splice-4]
+        bits += bits[:self.splice-4]
+        pos = self.splice+4
+        fill_pattern = bits[pos:pos+32]
+        while pos >= 32:
+            pos -= 32
+            bits[pos:pos+32] = fill_pattern
+
+    if for_writeout and self.precomp is not None:
+        reference_precomp(self.precomp, bits, bit_ticks,
+                          ticks_to_index / (self.time_per_rev*1e9))
+
+    bit_ticks_i = iter(bit_ticks)
+    flux_list = []
+    flux_ticks = 0
+    for bit in bits:
+        flux_ticks += next(bit_ticks_i)
+        if bit:
+            flux_list.append(flux_ticks)
+            flux_ticks = 0
+
+    if for_writeout:
+        if flux_ticks:
+            flux_list.append(flux_ticks)
+        return WriteoutFlux(
+            ticks_to_index, flux_list,
+            sample_freq = ticks_to_index / self.time_per_rev,
+            index_cued = cue_at_index,
+            terminate_at_index = splice_at_index)
+
+    index_list = [ticks_to_index]
+    if revs is None:
+        revs = 1 if splice_at_index else 2
+    if revs > 1:
+        l = flux_list
+        for i in range(revs-1):
+            flux_list = l + [flux_ticks+flux_list[0]] + flux_list[1:]
+        index_list *= revs
+    flux = Flux(index_list, flux_list,
+                sample_freq = ticks_to_index / self.time_per_rev,
+                index_cued = True)
+    flux.splice = sum(bit_ticks[:self.splice])
+    return flux
+
+# Equal values of the same types: ints must not become floats, nor vice versa.
+def same(a, b):
+    return a == b and type(a) is type(b)
+
+def same_list(a, b):
+    return len(a) == len(b) and all(map(same, a, b))
+
+def check(track, what, res, ref):
+    assert type(res) is type(ref), what
+    assert same_list(res.list, ref.list), what + ': flux'
+    assert same(res.sample_freq, ref.sample_freq), what + ': sample_freq'
+    assert res.index_cued == ref.index_cued, what + ': index_cued'
+    if isinstance(ref, WriteoutFlux):
+        assert same(res.ticks_to_index, ref.ticks_to_index), what + ': index'
+        assert (res.terminate_at_index == ref.terminate_at_index), \
+            what + ': terminate_at_index'
+    else:
+        assert same_list(res.index_list, ref.index_list), what + ': index'
+        assert same(res.splice, ref.splice), what + ': splice'
+
+def random_track(rng):
+    bitlen = rng.choice([ 3200, 50000, 100000 ]) + rng.randrange(32)
+    # MFM-ish data with occasional adjacent 1s and long runs of 0s.
+    bits = bitarray(endian='big')
+    while len(bits) < bitlen:
+        r = rng.random()
+        if r < 0.9:
+            bits += bitarray(rng.choice([ '10', '100', '1000' ]))
+        elif r < 0.95:
+            bits += bitarray('11')
+        else:
+            bits += bitarray('1' + '0' * rng.randrange(40))
+    del bits[bitlen:]
+    bit_ticks = None
+    if rng.random() < 0.5:
+        bit_ticks = [ rng.choice([ 1, 1.0, 0.75, 1.5, rng.uniform(0.9, 1.1) ])
+                      for _ in range(bitlen) ]
+    splice = rng.choice([ 0, rng.randrange(1, 4), bitlen - rng.randrange(1, 4),
+                          rng.randrange(4, bitlen - 4) ])
+    weak = []
+    for _ in range(rng.choice([ 0, 0, 1, 2 ])):
+        n = rng.choice([ 1, rng.randrange(2, 400), rng.randrange(400, 2000) ])
+        s = rng.randrange(0, bitlen - n)
+        weak.append((s, n))
+    track = MasterTrack(bits, rng.choice([ 0.2, 0.1667 ]), bit_ticks,
+                        splice, weak)
+    track.force_random_weak = rng.random() < 0.3
+    if rng.random() < 0.7:
+        track.precomp = Precomp(rng.choice([ Precomp.MFM, Precomp.FM,
+                                             Precomp.GCR ]),
+                                rng.choice([ 0, 140, 125.5 ]))
+    return track
+
+def test_flux_identical(nr_tracks):
+    rng = random.Random(2024)
+    for nr in range(nr_tracks):
+        track = random_track(rng)
+        for revs in (None, 1, 2, 3):
+            check(track, f'#{nr} revs={revs}', track.flux(revs),
+                  reference_flux(track, False, True, revs))
+        for cue in (True, False):
+            check(track, f'#{nr} writeout cue={cue}',
+                  track.flux_for_writeout(cue),
+                  reference_flux(track, True, cue))
+
+def test_precomp_identical(nr_tracks):
+    rng = random.Random(2025)
+    for nr in range(nr_tracks):
+        track = random_track(rng)
+        bits = track.bits
+        for type in (Precomp.MFM, Precomp.FM, Precomp.GCR):
+            precomp = Precomp(type, rng.choice([ 0, 140, 125.5 ]))
+            scale = rng.choice([ 1, 0.0072, rng.uniform(0.001, 0.1) ])
+            what = f'#{nr} {precomp} scale={scale}'
+            ref = [ 1 ] * len(bits)
+            reference_precomp(precomp, bits, ref, scale)
+            # Uniform bitcells: the precompensated ticks are a new list.
+            assert same_list(precomp.apply(bits, None, scale), ref), what
+            # Variable bitcells: the ticks are adjusted in place.
+            bit_ticks = [ rng.uniform(0.9, 1.1) for _ in range(len(bits)) ]
+            ref = bit_ticks.copy()
+            reference_precomp(precomp, bits, ref, scale)
+            res = precomp.apply(bits, bit_ticks, scale)
+            assert res is bit_ticks and same_list(res, ref), what
+
+if __name__ == "__main__":
+    nr_tracks = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    test_flux_identical(nr_tracks)
+    test_precomp_identical(nr_tracks // 4)
+    print("track: OK")
+
+# Local variables:
+# python-indent: 4
+# End:
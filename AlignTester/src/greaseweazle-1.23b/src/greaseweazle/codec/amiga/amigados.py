@@ -14,6 +14,7 @@ from bitarray import bitarray
 from greaseweazle import error
 from greaseweazle.codec import codec
 from greaseweazle.codec.ibm import ibm
+from greaseweazle.codec.scan import SectorScan
 from greaseweazle.track import MasterTrack, PLL, PLLTrack
 from greaseweazle.flux import Flux, HasFlux
 
@@ -80,38 +81,41 @@ class AmigaDOS(codec.Codec):
         return totsize
 
     def decode_flux(self, track: HasFlux, pll: Optional[PLL]=None) -> None:
+        scan = SectorScan(self, sync, 544*16, self.decode_sector)
         raw = PLLTrack(time_per_rev = self.time_per_rev,
-                       clock = self.clock, data = track, pll = pll)
+                       clock = self.clock, data = track, pll = pll,
+                       scan = scan)
         bits, _ = raw.get_all_data()
+        scan(bits, final = True)
 
-        for offs in bits.search(sync):
-
-            if self.nr_missing() == 0:
-                break
+    # private
+    def decode_sector(self, bits: bitarray, offs: int) -> None:
+        if offs+544*16 > len(bits):
+            return
 
-            sec = bits[offs:offs+544*16].tobytes()
-            if len(sec) != 1088:
-                continue
+        # Check the header before extracting the rest of the sector, so
+        # that copies of sectors we already hold are skipped cheaply.
+        header = decode(bits[offs+4*8:offs+12*8].tobytes())
+        format, track, sec_id, togo = tuple(header)
+        if format != 0xff or track != self.tracknr \
+           or not(sec_id < self.nsec and 0 < togo <= self.nsec) \
+           or self.exists(sec_id, togo):
+            return
 
-            header = decode(sec[4:12])
-            format, track, sec_id, togo = tuple(header)
-            if format != 0xff or track != self.tracknr \
-               or not(sec_id < self.nsec and 0 < togo <= self.nsec) \
-               or self.exists(sec_id, togo):
-                continue
+        sec = bits[offs:offs+544*16].tobytes()
 
-            label = decode(sec[12:44])
-            hsum, = struct.unpack('>I', decode(sec[44:52]))
-            if hsum != checksum(header + label):
-                continue
+        label = decode(sec[12:44])
+        hsum, = struct.unpack('>I', decode(sec[44:52]))
+        if hsum != checksum(header + label):
+            return
 
-            dsum, = struct.unpack('>I', decode(sec[52:60]))
-            data = decode(sec[60:1084])
-            gap = decode(sec[1084:1088])
-            if dsum != checksum(data):
-                continue;
+        dsum, = struct.unpack('>I', decode(sec[52:60]))
+        data = decode(sec[60:1084])
+        gap = decode(sec[1084:1088])
+        if dsum != checksum(data):
+            return
 
-            self.add(sec_id, togo, label, data)
+        self.add(sec_id, togo, label, data)
 
 
     def master_track(self) -> MasterTrack:
@@ -13,6 +13,7 @@ from bitarray import bitarray
 from greaseweazle import error
 from greaseweazle import optimised
 from greaseweazle.codec import codec
+from greaseweazle.codec.scan import SectorScan
 from greaseweazle.track import MasterTrack, PLL, PLLTrack
 from greaseweazle.flux import Flux, HasFlux
 
@@ -31,6 +32,9 @@ data_sync.frombytes(b'\xd5\xaa\xad')
 trailer = bitarray(endian='big')
 trailer.frombytes(b'\xde\xaa\xeb')
 
+# Bits following a sector sync which decode_sector() may examine
+scan_span = 3*8 + 8*8 + 100*8 + 400*8
+
 bad_sector = b'-=[BAD SECTOR]=-' * 16
 
 class Apple2GCR(codec.Codec):
@@ -46,8 +50,6 @@ class Apple2GCR(codec.Codec):
         self.sector: List[Optional[bytes]]
         self.sector = [None] * self.nsec
         self.vol_id: Optional[int] = None
-        error.check(optimised.enabled,
-                    'Apple2 GCR requires optimised C extension')
 
     @property
     def nsec(self) -> int:
@@ -93,56 +95,57 @@ class Apple2GCR(codec.Codec):
         return totsize
 
     def decode_flux(self, track: HasFlux, pll: Optional[PLL]=None) -> None:
+        scan = SectorScan(self, addr_sync, scan_span,
+                          self.decode_sector)
         raw = PLLTrack(time_per_rev = self.time_per_rev,
                        clock = self.clock, data = track, pll = pll,
-                       lowpass_thresh = 2.5e-6)
+                       lowpass_thresh = 2.5e-6,
+                       scan = scan)
         bits, _ = raw.get_all_data()
+        scan(bits, final = True)
+
+    # private
+    def decode_sector(self, bits: bitarray, offs: int) -> None:
+        # Decode header
+        offs += 3*8
+        sec = bits[offs:offs+8*8].tobytes()
+        if len(sec) != 8:
+            return
+        hdr = map(lambda x: (x & x>>7) & 255,
+                  list(struct.unpack('>4H', sec)))
+        vol_id, trk_id, sec_id, csum = tuple(hdr)
+
+        # Validate header
+        if csum != vol_id ^ trk_id ^ sec_id:
+            return
+        if (trk_id != self.tracknr() or sec_id >= self.nsec):
+            print('T%d.%d: Ignoring unexpected sector C:%d S:%d ID:%04x'
+                  % (self.cyl, self.head, trk_id, sec_id, vol_id))
+            return
+        if self.vol_id is None:
+            self.vol_id = vol_id
+        elif self.vol_id != vol_id:
+            print('T%d.%d: Expected ID %04x in sector C:%d S:%d ID:%04x'
+                  % (self.cyl, self.head, self.vol_id,
+                     trk_id, sec_id, vol_id))
+            return
+        if self.has_sec(sec_id):
+            return
+
+        # Find data
+        offs += 8*8
+        dat_offs = list(bits.search(data_sync, offs, offs+100*8))
+        if len(dat_offs) != 1:
+            return
+        offs = dat_offs[0]
+
+        # Decode data
+        sec, csum = optimised.decode_apple2_sector(
+            bits[offs+3*8:offs+400*8].tobytes())
+        if csum != 0:
+            return
 
-        for offs in bits.search(addr_sync):
-
-            if self.nr_missing() == 0:
-                break
-
-            # Decode header
-            offs += 3*8
-            sec = bits[offs:offs+8*8].tobytes()
-            if len(sec) != 8:
-                continue
-            hdr = map(lambda x: (x & x>>7) & 255,
-                      list(struct.unpack('>4H', sec)))
-            vol_id, trk_id, sec_id, csum = tuple(hdr)
-
-            # Validate header
-            if csum != vol_id ^ trk_id ^ sec_id:
-                continue
-            if (trk_id != self.tracknr() or sec_id >= self.nsec):
-                print('T%d.%d: Ignoring unexpected sector C:%d S:%d ID:%04x'
-                      % (self.cyl, self.head, trk_id, sec_id, vol_id))
-                continue
-            if self.vol_id is None:
-                self.vol_id = vol_id
-            elif self.vol_id != vol_id:
-                print('T%d.%d: Expected ID %04x in sector C:%d S:%d ID:%04x'
-                      % (self.cyl, self.head, self.vol_id,
-                         trk_id, sec_id, vol_id))
-                continue
-            if self.has_sec(sec_id):
-                continue
-
-            # Find data
-            offs += 8*8
-            dat_offs = list(bits[offs:offs+100*8].search(data_sync))
-            if len(dat_offs) != 1:
-                continue
-            offs += dat_offs[0]
-
-            # Decode data
-            sec, csum = optimised.decode_apple2_sector(
-                bits[offs+3*8:offs+400*8].tobytes())
-            if csum != 0:
-                continue
-
-            self.add(sec_id, sec)
+        self.add(sec_id, sec)
 
 
     def master_track(self) -> MasterTrack:
@@ -13,6 +13,7 @@ from bitarray import bitarray
 from greaseweazle import error
 from greaseweazle import optimised
 from greaseweazle.codec import codec
+from greaseweazle.codec.scan import SectorScan
 from greaseweazle.track import MasterTrack, PLL, PLLTrack
 from greaseweazle.flux import Flux, HasFlux
 
@@ -28,6 +29,9 @@ data_sync = bitarray(endian='big')
 data_sync.frombytes(b'\xff\xd5\x70')
 data_sync = data_sync[:20]
 
+# Bits following a sector sync which decode_sector() may examine
+scan_span = 10 + 8*8 + 100*8 + 10 + 260*10
+
 bad_sector = b'-=[BAD SECTOR]=-' * 16
 
 class C64GCR(codec.Codec):
@@ -43,8 +47,6 @@ class C64GCR(codec.Codec):
         self.sector: List[Optional[bytes]]
         self.sector = [None] * self.nsec
         self.disk_id: Optional[int] = None
-        error.check(optimised.enabled,
-                    'Commodore GCR requires optimised C extension')
 
     @property
     def nsec(self) -> int:
@@ -89,64 +91,65 @@ class C64GCR(codec.Codec):
         return totsize
 
     def decode_flux(self, track: HasFlux, pll: Optional[PLL]=None) -> None:
+        scan = SectorScan(self, sector_sync, scan_span,
+                          self.decode_sector)
         raw = PLLTrack(time_per_rev = self.time_per_rev,
                        clock = self.clock, data = track, pll = pll,
-                       lowpass_thresh = 2.5e-6)
+                       lowpass_thresh = 2.5e-6,
+                       scan = scan)
         bits, _ = raw.get_all_data()
+        scan(bits, final = True)
 
-        for offs in bits.search(sector_sync):
+    # private
+    def decode_sector(self, bits: bitarray, offs: int) -> None:
+        # Decode header, 8 bytes (=10 bytes GCR):
+        # 0x08, csum, sector, track, disk_id[2], gap[2]
+        offs += 10
+        sec = bits[offs:offs+10*8].tobytes()
+        if len(sec) != 10:
+            return
+        hdr = optimised.decode_c64_gcr(sec)
+        sum = 0
+        for x in hdr[1:6]:
+            sum ^= x
+        if sum != 0:
+            return
+        sec_id, cyl, disk_id = struct.unpack('>2BH', hdr[2:6])
+        if (cyl != self.tracknr() or sec_id >= self.nsec):
+            print('T%d.%d: Ignoring unexpected sector C:%d S:%d ID:%04x'
+                  % (self.cyl, self.head, cyl, sec_id, disk_id))
+            return
+        if self.disk_id is None:
+            self.disk_id = disk_id
+        elif self.disk_id != disk_id:
+            print('T%d.%d: Expected ID %04x in sector C:%d S:%d ID:%04x'
+                  % (self.cyl, self.head, self.disk_id,
+                     cyl, sec_id, disk_id))
+            return
+        if self.has_sec(sec_id):
+            return
 
-            if self.nr_missing() == 0:
-                break
+        # Find data
+        offs += 8*8
+        dat_offs = list(bits.search(data_sync, offs, offs+100*8))
+        if len(dat_offs) != 1:
+            return
+        offs = dat_offs[0]
 
-            # Decode header, 8 bytes (=10 bytes GCR):
-            # 0x08, csum, sector, track, disk_id[2], gap[2]
-            offs += 10
-            sec = bits[offs:offs+10*8].tobytes()
-            if len(sec) != 10:
-                continue
-            hdr = optimised.decode_c64_gcr(sec)
-            sum = 0
-            for x in hdr[1:6]:
-                sum ^= x
-            if sum != 0:
-                continue
-            sec_id, cyl, disk_id = struct.unpack('>2BH', hdr[2:6])
-            if (cyl != self.tracknr() or sec_id >= self.nsec):
-                print('T%d.%d: Ignoring unexpected sector C:%d S:%d ID:%04x'
-                      % (self.cyl, self.head, cyl, sec_id, disk_id))
-                continue
-            if self.disk_id is None:
-                self.disk_id = disk_id
-            elif self.disk_id != disk_id:
-                print('T%d.%d: Expected ID %04x in sector C:%d S:%d ID:%04x'
-                      % (self.cyl, self.head, self.disk_id,
-                         cyl, sec_id, disk_id))
-                continue
-            if self.has_sec(sec_id):
-                continue
-
-            # Find data
-            offs += 8*8
-            dat_offs = list(bits[offs:offs+100*8].search(data_sync))
-            if len(dat_offs) != 1:
-                continue
-            offs += dat_offs[0]
-
-            # Decode data, 260 bytes (=325 bytes GCR):
-            # 0x07, data[256], csum, gap[2]
-            offs += 10
-            sec = bits[offs:offs+260*10].tobytes()
-            if len(sec) != 325:
-                continue
-            sec = optimised.decode_c64_gcr(sec)
-            sum = 0
-            for x in sec[1:258]:
-                sum ^= x
-            if sum != 0:
-                continue
+        # Decode data, 260 bytes (=325 bytes GCR):
+        # 0x07, data[256], csum, gap[2]
+        offs += 10
+        sec = bits[offs:offs+260*10].tobytes()
+        if len(sec) != 325:
+            return
+        sec = optimised.decode_c64_gcr(sec)
+        sum = 0
+        for x in sec[1:258]:
+            sum ^= x
+        if sum != 0:
+            return
 
-            self.add(sec_id, sec[1:257])
+        self.add(sec_id, sec[1:257])
 
 
     def master_track(self) -> MasterTrack:
@@ -6,7 +6,7 @@
 # See the file COPYING for more details, or visit <http://unlicense.org>.
 
 from __future__ import annotations
-from typing import Any, List, Optional, Union, Tuple
+from typing import Any, List, Optional, Set, Union, Tuple
 
 import re
 import copy, heapq, struct, functools
@@ -441,171 +441,16 @@ class IBMTrack(codec.Codec):
 
     @staticmethod
     def mfm_decode_raw(raw: PLLTrack) -> List[TrackArea]:
-
-        bits, _ = raw.get_all_data()
-        areas: List[TrackArea] = []
-        idam = None
-
-        ## 1. Calculate offsets within dump
-        
-        for offs in bits.search(mfm_iam_sync):
-            if len(bits) < offs+4*16:
-                continue
-            mark = decode(bits[offs+3*16:offs+4*16].tobytes())[0]
-            if mark == Mark.IAM:
-                areas.append(IAM(offs, offs+4*16))
-
-        for offs in bits.search(mfm_sync):
-
-            if len(bits) < offs+4*16:
-                continue
-            mark = decode(bits[offs+3*16:offs+4*16].tobytes())[0]
-            if mark == Mark.IDAM:
-                s, e = offs, offs+10*16
-                if len(bits) < e:
-                    continue
-                b = decode(bits[s:e].tobytes())
-                c,h,r,n = struct.unpack(">4x4B2x", b)
-                crc = crc16.new(b).crcValue
-                if idam is not None:
-                    areas.append(idam)
-                idam = IDAM(s, e, crc, c=c, h=h, r=r, n=n)
-            elif mark == Mark.DAM or mark == Mark.DDAM:
-                if idam is None or offs - idam.end > 1000:
-                    areas.append(DAM(offs, offs+4*16, 0xffff, mark=mark))
-                else:
-                    sz = 128 << idam.n
-                    s, e = offs, offs+(4+sz+2)*16
-                    if len(bits) < e:
-                        continue
-                    b = decode(bits[s:e].tobytes())
-                    crc = crc16.new(b).crcValue
-                    dam = DAM(s, e, crc, mark=mark, data=b[4:-2])
-                    areas.append(Sector(idam, dam))
-                idam = None
-            else:
-                print("Unknown mark %02x" % mark)
-
-        if idam is not None:
-            areas.append(idam)
-
-        # Convert to offsets within track
-        areas.sort(key=lambda x:x.start)
-        index = iter([x.nr_bits for x in raw.revolutions])
-        p, n = 0, next(index)
-        for a in areas:
-            if a.start >= n:
-                p = n
-                try:
-                    n += next(index)
-                except StopIteration:
-                    n = float('inf')
-            a.delta(p)
-        areas.sort(key=lambda x:x.start)
-
-        return areas
+        scan = AreaScan(Mode.MFM)
+        scan.finish(raw)
+        return scan.areas
 
     @staticmethod
     def fm_decode_raw(raw: PLLTrack,
                       mmfm_raw: Optional[PLLTrack] = None) -> List[TrackArea]:
-
-        bits, times = raw.get_all_data()
-        areas: List[TrackArea] = []
-        idam = None
-
-        if mmfm_raw is not None:
-            mmfm_bits, mmfm_times = mmfm_raw.get_all_data()
-            mmfm_iter = mmfm_bits.search(dec_mmfm.sync_prefix)
-            mmfm_offs = next(mmfm_iter, None)
-            fm_time, prev_fm_offs = 0.0, 0
-            mmfm_time, prev_mmfm_offs = 0.0, 0
-
-        ## 1. Calculate offsets within dump
-        
-        for offs in bits.search(fm_iam_sync):
-            offs += 16
-            areas.append(IAM(offs, offs+1*16))
-
-        for offs in bits.search(fm_sync_prefix):
-
-            # DEC MMFM track: Ensure this looks like an FM mark even at
-            # double rate. This also finds the equivalent point in the
-            # double-rate bitstream.
-            if mmfm_raw is not None:
-                fm_time += sum(times[prev_fm_offs:offs])
-                prev_fm_offs = offs
-                while mmfm_offs is not None:
-                    mmfm_time += sum(mmfm_times[prev_mmfm_offs:mmfm_offs])
-                    prev_mmfm_offs = mmfm_offs
-                    delta = fm_time - mmfm_time
-                    if delta < 1e-5:
-                        break
-                    mmfm_offs = next(mmfm_iter, None)
-                # We require a match within 10us in the double-rate bitstream.
-                if mmfm_offs is None or abs(delta) > 1e-5:
-                    continue
-
-            offs += 16
-            if len(bits) < offs+1*16:
-                continue
-            mark = decode(bits[offs:offs+1*16].tobytes())[0]
-            clock = decode(bits[offs-1:offs+1*16-1].tobytes())[0]
-            if clock != 0xc7:
-                continue
-            if mark == Mark.IDAM:
-                s, e = offs, offs+7*16
-                if len(bits) < e:
-                    continue
-                b = decode(bits[s:e].tobytes())
-                c,h,r,n = struct.unpack(">x4B2x", b)
-                crc = crc16.new(b).crcValue
-                if idam is not None:
-                    areas.append(idam)
-                idam = IDAM(s, e, crc, c=c, h=h, r=r, n=n)
-            elif (mark == Mark.DAM or mark == Mark.DDAM
-                  or mark == Mark.DAM_TRS80_DIR
-                  or ((mark & 0xfb) == Mark.DDAM_DEC_MMFM
-                      and mmfm_raw is not None)):
-                if idam is None or offs - idam.end > 1000:
-                    areas.append(DAM(offs, offs+4*16, 0xffff, mark=mark))
-                    continue
-                sz = 128 << idam.n
-                s, e = offs, offs+(1+sz+2)*16
-                if (mark & 0xfb) != Mark.DDAM_DEC_MMFM:
-                    if len(bits) < e:
-                        continue
-                    b = decode(bits[s:e].tobytes())
-                else:
-                    assert mmfm_offs is not None
-                    ds, de = mmfm_offs+64+1, mmfm_offs+64+1+(sz*2+2)*16
-                    if len(mmfm_bits) < de:
-                        continue
-                    b = bytes([mark]) + dec_mmfm.decode(mmfm_bits[ds:de])
-                crc = crc16.new(b).crcValue
-                dam = DAM(s, e, crc, mark=mark, data=b[1:-2])
-                areas.append(Sector(idam, dam))
-                idam = None
-            else:
-                print("Unknown mark %02x" % mark)
-
-        if idam is not None:
-            areas.append(idam)
-
-        # Convert to offsets within track
-        areas.sort(key=lambda x:x.start)
-        index = iter([x.nr_bits for x in raw.revolutions])
-        p, n = 0, next(index)
-        for a in areas:
-            if a.start >= n:
-                p = n
-                try:
-                    n += next(index)
-                except StopIteration:
-                    n = float('inf')
-            a.delta(p)
-        areas.sort(key=lambda x:x.start)
-
-        return areas
+        scan = AreaScan(Mode.FM, mmfm_raw = mmfm_raw)
+        scan.finish(raw)
+        return scan.areas
 
     def decode_flux(self, track: HasFlux, pll: Optional[PLL]=None) -> None:
         flux = track.flux()
@@ -614,6 +459,22 @@ class IBMTrack(codec.Codec):
                        clock = self.clock, data = flux, pll = pll)
         self.decode_raw(raw, pll, flux)
 
+    # As decode_flux(), but the PLL stops as soon as good copies of all the
+    # wanted sectors (c,h,r,n) have been found.
+    def decode_flux_until(self, track: HasFlux,
+                          want: Set[Tuple[int,int,int,int]],
+                          pll: Optional[PLL]=None) -> None:
+        if self.mode is Mode.DEC_RX02:
+            return self.decode_flux(track, pll)
+        flux = track.flux()
+        flux.cue_at_index()
+        scan = AreaScan(self.mode, want = want)
+        raw = PLLTrack(time_per_rev = self.time_per_rev,
+                       clock = self.clock, data = flux, pll = pll,
+                       scan = scan)
+        scan.finish(raw)
+        self.add_areas(scan.areas)
+
     def decode_raw(self, raw: PLLTrack, pll: Optional[PLL],
                    flux: Flux) -> None:
 
@@ -625,6 +486,9 @@ class IBMTrack(codec.Codec):
             mmfm_raw = PLLTrack(time_per_rev = self.time_per_rev,
                                 clock = self.clock/2, data = flux, pll = pll)
             areas = self.fm_decode_raw(raw, mmfm_raw)
+        self.add_areas(areas)
+
+    def add_areas(self, areas: List[TrackArea]) -> None:
 
         # Add to the deduped lists
         for a in areas:
@@ -647,6 +511,225 @@ class IBMTrack(codec.Codec):
         self.sectors.sort(key=lambda x:x.start)
 
 
+class AreaScan:
+
+    # Search of a PLL bitstream for IBM track areas (IAMs and sectors).
+    # As a PLLTrack scan callback it is called at each revolution, and looks
+    # only at the bitcells decoded since the previous call. A mark whose
+    # area is not yet fully decoded is left until the next call, so the
+    # areas found are exactly those of a single search of the whole
+    # bitstream. finish() searches to the end of the bitstream.
+    def __init__(self, mode: Mode,
+                 want: Optional[Set[Tuple[int,int,int,int]]] = None,
+                 mmfm_raw: Optional[PLLTrack] = None):
+        self.mode = mode
+        self.want = set(want) if want is not None else None
+        self.mmfm_raw = mmfm_raw
+        self.areas: List[TrackArea] = []
+        self.idam: Optional[IDAM] = None
+        self.iam_offs = 0 # Next IAM sync offset to search from
+        self.sync_offs = 0 # Next mark sync offset to search from
+        if mmfm_raw is not None:
+            self.mmfm_bits, self.mmfm_times = mmfm_raw.get_all_data()
+            self.mmfm_iter = self.mmfm_bits.search(dec_mmfm.sync_prefix)
+            self.mmfm_offs = next(self.mmfm_iter, None)
+            self.fm_time, self.prev_fm_offs = 0.0, 0
+            self.mmfm_time, self.prev_mmfm_offs = 0.0, 0
+
+    # PLLTrack scan callback: Returns True when all wanted sectors are found.
+    def __call__(self, bits: bitarray) -> bool:
+        nr = len(self.areas)
+        self.search(bits, [], final = False)
+        if self.want is None:
+            return False
+        for a in self.areas[nr:]:
+            if isinstance(a, Sector) and a.crc == 0:
+                self.want.discard((a.idam.c, a.idam.h, a.idam.r, a.idam.n))
+        return not self.want
+
+    def finish(self, raw: PLLTrack) -> None:
+        bits, times = raw.get_all_data()
+        self.search(bits, times, final = True)
+        if self.idam is not None:
+            self.areas.append(self.idam)
+            self.idam = None
+
+        # Convert to offsets within track
+        areas = self.areas
+        areas.sort(key=lambda x:x.start)
+        index = iter([x.nr_bits for x in raw.revolutions])
+        # An early exit from the PLL may leave no complete revolution.
+        p: float = 0
+        n: float = next(index, float('inf'))
+        for a in areas:
+            if a.start >= n:
+                p = n
+                try:
+                    n += next(index)
+                except StopIteration:
+                    n = float('inf')
+            a.delta(p)
+        areas.sort(key=lambda x:x.start)
+
+    def search(self, bits: bitarray, times: List[float], final: bool) -> None:
+        assert final or self.mmfm_raw is None
+        if self.mode is Mode.MFM:
+            iam_sync, sync = mfm_iam_sync, mfm_sync
+            decode_mark, need = self.mfm_decode_mark, self.mfm_need
+        else:
+            iam_sync, sync = fm_iam_sync, fm_sync_prefix
+            decode_mark, need = self.fm_decode_mark, self.fm_need
+
+        ## 1. Calculate offsets within dump
+
+        for offs in bits.search(iam_sync, self.iam_offs):
+            if not final and len(bits) < offs+4*16:
+                self.iam_offs = offs
+                break
+            if self.mode is Mode.MFM:
+                if len(bits) < offs+4*16:
+                    continue
+                mark = decode(bits[offs+3*16:offs+4*16].tobytes())[0]
+                if mark == Mark.IAM:
+                    self.areas.append(IAM(offs, offs+4*16))
+            else:
+                offs += 16
+                self.areas.append(IAM(offs, offs+1*16))
+        else:
+            self.iam_offs = max(self.iam_offs, len(bits)-len(iam_sync)+1)
+
+        for offs in bits.search(sync, self.sync_offs):
+            if not final and len(bits) < need(bits, offs):
+                self.sync_offs = offs
+                break
+            decode_mark(bits, times, offs)
+        else:
+            self.sync_offs = max(self.sync_offs, len(bits)-len(sync)+1)
+
+    # Bitcells needed to decode the area at a mark sync (an upper bound).
+    def mfm_need(self, bits: bitarray, offs: int) -> int:
+        if len(bits) < offs+4*16:
+            return offs+4*16
+        mark = decode(bits[offs+3*16:offs+4*16].tobytes())[0]
+        if mark == Mark.IDAM:
+            return offs+10*16
+        if self.idam is not None and offs - self.idam.end <= 1000:
+            return offs+(4+(128 << self.idam.n)+2)*16
+        return offs+4*16
+
+    def fm_need(self, bits: bitarray, offs: int) -> int:
+        offs += 16
+        if len(bits) < offs+1*16:
+            return offs+1*16
+        mark = decode(bits[offs:offs+1*16].tobytes())[0]
+        if mark == Mark.IDAM:
+            return offs+7*16
+        if self.idam is not None and offs - self.idam.end <= 1000:
+            return offs+(1+(128 << self.idam.n)+2)*16
+        return offs+1*16
+
+    def mfm_decode_mark(self, bits: bitarray, times: List[float],
+                        offs: int) -> None:
+
+        areas, idam = self.areas, self.idam
+
+        if len(bits) < offs+4*16:
+            return
+        mark = decode(bits[offs+3*16:offs+4*16].tobytes())[0]
+        if mark == Mark.IDAM:
+            s, e = offs, offs+10*16
+            if len(bits) < e:
+                return
+            b = decode(bits[s:e].tobytes())
+            c,h,r,n = struct.unpack(">4x4B2x", b)
+            crc = crc16.new(b).crcValue
+            if idam is not None:
+                areas.append(idam)
+            self.idam = IDAM(s, e, crc, c=c, h=h, r=r, n=n)
+        elif mark == Mark.DAM or mark == Mark.DDAM:
+            if idam is None or offs - idam.end > 1000:
+                areas.append(DAM(offs, offs+4*16, 0xffff, mark=mark))
+            else:
+                sz = 128 << idam.n
+                s, e = offs, offs+(4+sz+2)*16
+                if len(bits) < e:
+                    return
+                b = decode(bits[s:e].tobytes())
+                crc = crc16.new(b).crcValue
+                dam = DAM(s, e, crc, mark=mark, data=b[4:-2])
+                areas.append(Sector(idam, dam))
+            self.idam = None
+        else:
+            print("Unknown mark %02x" % mark)
+
+    def fm_decode_mark(self, bits: bitarray, times: List[float],
+                       offs: int) -> None:
+
+        areas, idam, mmfm_raw = self.areas, self.idam, self.mmfm_raw
+
+        # DEC MMFM track: Ensure this looks like an FM mark even at
+        # double rate. This also finds the equivalent point in the
+        # double-rate bitstream.
+        if mmfm_raw is not None:
+            self.fm_time += sum(times[self.prev_fm_offs:offs])
+            self.prev_fm_offs = offs
+            while self.mmfm_offs is not None:
+                self.mmfm_time += sum(
+                    self.mmfm_times[self.prev_mmfm_offs:self.mmfm_offs])
+                self.prev_mmfm_offs = self.mmfm_offs
+                delta = self.fm_time - self.mmfm_time
+                if delta < 1e-5:
+                    break
+                self.mmfm_offs = next(self.mmfm_iter, None)
+            # We require a match within 10us in the double-rate bitstream.
+            if self.mmfm_offs is None or abs(delta) > 1e-5:
+                return
+
+        offs += 16
+        if len(bits) < offs+1*16:
+            return
+        mark = decode(bits[offs:offs+1*16].tobytes())[0]
+        clock = decode(bits[offs-1:offs+1*16-1].tobytes())[0]
+        if clock != 0xc7:
+            return
+        if mark == Mark.IDAM:
+            s, e = offs, offs+7*16
+            if len(bits) < e:
+                return
+            b = decode(bits[s:e].tobytes())
+            c,h,r,n = struct.unpack(">x4B2x", b)
+            crc = crc16.new(b).crcValue
+            if idam is not None:
+                areas.append(idam)
+            self.idam = IDAM(s, e, crc, c=c, h=h, r=r, n=n)
+        elif (mark == Mark.DAM or mark == Mark.DDAM
+              or mark == Mark.DAM_TRS80_DIR
+              or ((mark & 0xfb) == Mark.DDAM_DEC_MMFM
+                  and mmfm_raw is not None)):
+            if idam is None or offs - idam.end > 1000:
+                areas.append(DAM(offs, offs+4*16, 0xffff, mark=mark))
+                return
+            sz = 128 << idam.n
+            s, e = offs, offs+(1+sz+2)*16
+            if (mark & 0xfb) != Mark.DDAM_DEC_MMFM:
+                if len(bits) < e:
+                    return
+                b = decode(bits[s:e].tobytes())
+            else:
+                assert self.mmfm_offs is not None
+                ds = self.mmfm_offs+64+1
+                de = ds+(sz*2+2)*16
+                if len(self.mmfm_bits) < de:
+                    return
+                b = bytes([mark]) + dec_mmfm.decode(self.mmfm_bits[ds:de])
+            crc = crc16.new(b).crcValue
+            dam = DAM(s, e, crc, mark=mark, data=b[1:-2])
+            areas.append(Sector(idam, dam))
+            self.idam = None
+        else:
+            print("Unknown mark %02x" % mark)
+
+
 class IBMTrack_Fixed(IBMTrack):
 
     def __init__(self, cyl: int, head: int, mode: Mode):
@@ -657,7 +740,9 @@ class IBMTrack_Fixed(IBMTrack):
     def decode_flux(self, track: HasFlux, pll: Optional[PLL]=None) -> None:
         self.raw.clock = self.clock
         self.raw.time_per_rev = self.time_per_rev
-        self.raw.decode_flux(track, pll)
+        self.raw.decode_flux_until(track, {
+            (s.idam.c, s.idam.h, s.idam.r, s.idam.n)
+            for s in self.sectors if s.crc != 0 }, pll)
         mismatches = set()
         for r in self.raw.sectors:
             if r.idam.crc != 0:
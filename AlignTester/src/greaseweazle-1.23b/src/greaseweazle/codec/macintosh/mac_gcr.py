@@ -19,6 +19,7 @@ from bitarray import bitarray
 from greaseweazle import error
 from greaseweazle import optimised
 from greaseweazle.codec import codec
+from greaseweazle.codec.scan import SectorScan
 from greaseweazle.codec.ibm import ibm
 from greaseweazle.track import MasterTrack, PLL, PLLTrack
 from greaseweazle.flux import Flux, HasFlux
@@ -38,6 +39,9 @@ data_sync.frombytes(data_sync_bytes)
 seclen = 524
 enc_seclen = 703
 
+# Bits following a sector sync which decode_sector() may examine
+scan_span = 3*8 + 5*8 + 100*8 + 4*8 + 703*8
+
 bad_sector = b'-=[BAD SECTOR]=-' * 32
 
 class MacGCR(codec.Codec):
@@ -59,8 +63,6 @@ class MacGCR(codec.Codec):
             sec_map[pos] = i
             pos = (pos + config.interleave) % self.nsec
         self.sec_map = sec_map
-        error.check(optimised.enabled,
-                    'Macintosh GCR requires optimised C extension')
 
     @property
     def nsec(self) -> int:
@@ -97,55 +99,56 @@ class MacGCR(codec.Codec):
         return totsize
 
     def decode_flux(self, track: HasFlux, pll: Optional[PLL]=None) -> None:
+        scan = SectorScan(self, sector_sync, scan_span,
+                          self.decode_sector)
         raw = PLLTrack(time_per_rev = self.time_per_rev,
-                       clock = self.clock, data = track, pll = pll)
+                       clock = self.clock, data = track, pll = pll,
+                       scan = scan)
         bits, _ = raw.get_all_data()
+        scan(bits, final = True)
 
-        for offs in bits.search(sector_sync):
+    # private
+    def decode_sector(self, bits: bitarray, offs: int) -> None:
+        # Decode header
+        offs += 3*8
+        sec = bits[offs:offs+5*8].tobytes()
+        if len(sec) != 5:
+            return
+        hdr = optimised.decode_mac_gcr(sec)
+        sum = 0
+        for x in hdr:
+            sum ^= x
+        if sum != 0:
+            return
+        cyl, sec_id, side, fmt = tuple(hdr[:4])
+        cyl |= (side & 1) << 6
+        side >>= 5
+        if (cyl != self.cyl or side != self.head or sec_id >= self.nsec):
+            print('T%d.%d: Ignoring unexpected sector '
+                  'C:%d H:%d R:%d F:0x%x'
+                  % (self.cyl, self.head, cyl, side, sec_id, fmt))
+            return
+        if self.has_sec(sec_id):
+            return
 
-            if self.nr_missing() == 0:
-                break
+        # Find data
+        offs += 5*8
+        dat_offs = list(bits.search(data_sync, offs, offs+100*8))
+        if len(dat_offs) != 1:
+            return
+        offs = dat_offs[0]
 
-            # Decode header
-            offs += 3*8
-            sec = bits[offs:offs+5*8].tobytes()
-            if len(sec) != 5:
-                continue
-            hdr = optimised.decode_mac_gcr(sec)
-            sum = 0
-            for x in hdr:
-                sum ^= x
-            if sum != 0:
-                continue
-            cyl, sec_id, side, fmt = tuple(hdr[:4])
-            cyl |= (side & 1) << 6
-            side >>= 5
-            if (cyl != self.cyl or side != self.head or sec_id >= self.nsec):
-                print('T%d.%d: Ignoring unexpected sector '
-                      'C:%d H:%d R:%d F:0x%x'
-                      % (self.cyl, self.head, cyl, side, sec_id, fmt))
-                continue
-            if self.has_sec(sec_id):
-                continue
-
-            # Find data
-            offs += 5*8
-            dat_offs = list(bits[offs:offs+100*8].search(data_sync))
-            if len(dat_offs) != 1:
-                continue
-            offs += dat_offs[0]
-
-            # Decode data
-            offs += 4*8
-            sec = bits[offs:offs+703*8].tobytes()
-            if len(sec) != 703:
-                continue
-            sec = optimised.decode_mac_gcr(sec)
-            sec, csum = optimised.decode_mac_sector(sec)
-            if csum != 0:
-                continue
-
-            self.add(sec_id, sec)
+        # Decode data
+        offs += 4*8
+        sec = bits[offs:offs+703*8].tobytes()
+        if len(sec) != 703:
+            return
+        sec = optimised.decode_mac_gcr(sec)
+        sec, csum = optimised.decode_mac_sector(sec)
+        if csum != 0:
+            return
+
+        self.add(sec_id, sec)
 
 
     def master_track(self) -> MasterTrack:
@@ -0,0 +1,49 @@
+# greaseweazle/codec/scan.py
+#
+# Sync-mark sector scan shared by the AmigaDOS and GCR codecs.
+#
+# The scan is driven by PLLTrack at each index pulse, so that it sees the
+# bitcells of each revolution as soon as they are decoded, and so that the
+# PLL can stop as soon as the codec holds every sector.
+#
+# This is free and unencumbered software released into the public domain.
+# See the file COPYING for more details, or visit <http://unlicense.org>.
+
+from typing import Callable
+
+from bitarray import bitarray
+
+from greaseweazle.codec import codec
+
+class SectorScan:
+
+    # codec: Track being decoded (provides nr_missing())
+    # sync: Sync mark preceding each sector
+    # span: Bits following a sync mark needed to decode its sector
+    # decode_sector: Called with the bitcells and the offset of a sync mark
+    def __init__(self, codec: codec.Codec, sync: bitarray, span: int,
+                 decode_sector: Callable[[bitarray, int], None]) -> None:
+        self.codec = codec
+        self.sync = sync
+        self.span = span
+        self.decode_sector = decode_sector
+        self.offs = 0 # First sync offset not yet scanned
+
+    # Scan the sync marks found since the last call. Unless this is the
+    # final call, a sync mark is deferred until its sector has been fully
+    # decoded by the PLL. Returns True when no sectors are missing.
+    def __call__(self, bits: bitarray, final: bool = False) -> bool:
+        limit = len(bits) if final else len(bits) - self.span
+        for offs in bits.search(self.sync, self.offs):
+            if self.codec.nr_missing() == 0:
+                return True
+            if offs > limit:
+                self.offs = offs
+                return False
+            self.decode_sector(bits, offs)
+        self.offs = max(self.offs, len(bits) - len(self.sync) + 1)
+        return self.codec.nr_missing() == 0
+
+# Local variables:
+# python-indent: 4
+# End:
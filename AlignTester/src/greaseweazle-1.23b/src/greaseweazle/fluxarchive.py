@@ -0,0 +1,133 @@
+# greaseweazle/fluxarchive.py
+#
+# Flux archive: Every capture of a session, in the order it was read, so
+# that it can be decoded again later without the drive.
+#
+# This is free and unencumbered software released into the public domain.
+# See the file COPYING for more details, or visit <http://unlicense.org>.
+
+# File layout (all values little endian):
+#  File header: 'GWFA', version (u8), 3 pad bytes
+#  Then one chunk per capture, appended as it is read:
+#   Chunk header: 'GWFC', cyl (u8), head (u8), index_cued (u8),
+#                 tick width in bytes (u8: 2 or 4), sample_freq (f64),
+#                 nr index values (u32), nr flux values (u32),
+#                 compressed payload length (u32)
+#   Payload (zlib): Index times (f64 ticks), then flux (u16 or u32 ticks).
+#  Flux values are the ticks between transitions, rounded to integers.
+#  There is no trailer: The chunk headers are the track index, and an
+#  archive cut short by an interrupted session is valid up to its last
+#  complete chunk. A torn final chunk is discarded when the archive is
+#  next opened for append.
+
+from typing import BinaryIO, Dict, Iterator, List, Tuple
+
+import os, struct, sys, zlib
+from array import array
+
+from greaseweazle import error
+from greaseweazle.flux import Flux
+
+file_header = struct.Struct('<4sB3x')
+chunk_header = struct.Struct('<4sBBBBdIII')
+version = 1
+
+def _le(a: array) -> array:
+    if sys.byteorder == 'big':
+        a.byteswap()
+    return a
+
+# Walk the chunk headers of an open archive. Returns (cyl, head, offset) of
+# each complete chunk, and the offset just past the last complete chunk.
+def _walk_chunks(f: BinaryIO, name: str) -> Tuple[List[Tuple[int,int,int]], int]:
+    f.seek(0)
+    dat = f.read(file_header.size)
+    error.check(len(dat) == file_header.size
+                and file_header.unpack(dat) == (b'GWFA', version),
+                '%s: Not a flux archive' % name)
+    chunks: List[Tuple[int,int,int]] = []
+    size = os.fstat(f.fileno()).st_size
+    offs = file_header.size
+    while offs + chunk_header.size <= size:
+        f.seek(offs)
+        sig, cyl, head, _, _, _, _, _, clen = chunk_header.unpack(
+            f.read(chunk_header.size))
+        error.check(sig == b'GWFC',
+                    '%s: Bad chunk at offset %d' % (name, offs))
+        if offs + chunk_header.size + clen > size:
+            break # Truncated final chunk
+        chunks.append((cyl, head, offs))
+        offs += chunk_header.size + clen
+    return chunks, offs
+
+
+class FluxArchiveWriter:
+
+    def __init__(self, name: str) -> None:
+        self.f = open(name, 'ab')
+        if self.f.tell() == 0:
+            self.f.write(file_header.pack(b'GWFA', version))
+        else:
+            # A session killed mid-chunk leaves a torn final chunk, whose
+            # length would otherwise swallow the chunks appended after it.
+            with open(name, 'rb') as f:
+                _, end = _walk_chunks(f, name)
+            self.f.truncate(end)
+
+    def append(self, cyl: int, head: int, flux: Flux) -> None:
+        ticks = [round(x) for x in flux.list]
+        width = 2 if max(ticks, default = 0) < 0x10000 else 4
+        index = _le(array('d', flux.index_list)).tobytes()
+        dat = _le(array('H' if width == 2 else 'I', ticks)).tobytes()
+        payload = zlib.compress(index + dat, 1)
+        self.f.write(chunk_header.pack(
+            b'GWFC', cyl, head, int(flux.index_cued), width,
+            flux.sample_freq, len(flux.index_list), len(ticks),
+            len(payload)))
+        self.f.write(payload)
+        # Each capture is on disk before the next is read.
+        self.f.flush()
+
+    def close(self) -> None:
+        self.f.close()
+
+
+class FluxArchive:
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.f = open(name, 'rb')
+        # Track index: (cyl, head, offset) of each chunk, in capture order.
+        self.chunks, _ = _walk_chunks(self.f, name)
+
+    def index(self) -> Dict[Tuple[int,int],List[int]]:
+        """Chunk offsets of each track's captures, in capture order."""
+        index: Dict[Tuple[int,int],List[int]] = dict()
+        for cyl, head, offs in self.chunks:
+            index.setdefault((cyl, head), []).append(offs)
+        return index
+
+    def read(self, offs: int) -> Tuple[int, int, Flux]:
+        self.f.seek(offs)
+        (_, cyl, head, index_cued, width, sample_freq,
+         nr_index, nr_flux, clen) = chunk_header.unpack(
+             self.f.read(chunk_header.size))
+        dat = zlib.decompress(self.f.read(clen))
+        index = _le(array('d', dat[:nr_index*8]))
+        ticks = _le(array('H' if width == 2 else 'I', dat[nr_index*8:]))
+        error.check(len(ticks) == nr_flux,
+                    '%s: Bad chunk at offset %d' % (self.name, offs))
+        flux = Flux(index.tolist(), ticks.tolist(), sample_freq,
+                    index_cued = bool(index_cued))
+        return cyl, head, flux
+
+    def __iter__(self) -> Iterator[Tuple[int, int, Flux]]:
+        for _, _, offs in self.chunks:
+            yield self.read(offs)
+
+    def close(self) -> None:
+        self.f.close()
+
+# Local variables:
+# python-indent: 4
+# End:
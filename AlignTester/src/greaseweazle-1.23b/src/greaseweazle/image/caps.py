@@ -8,7 +8,7 @@
 from __future__ import annotations
 from typing import cast, List, Tuple, Optional, Generator
 
-import os, sys
+import os, sys, copy
 import platform
 import ctypes as ct
 import itertools as it
@@ -16,7 +16,7 @@ from bitarray import bitarray
 from greaseweazle.track import MasterTrack, PLLTrack
 from greaseweazle.flux import Flux
 from greaseweazle import error
-from .image import Image, OptDict
+from .image import Image, OptDict, TrackCache
 
 class CapsDateTimeExt(ct.Structure):
     _pack_ = 1
@@ -168,6 +168,7 @@ class CAPS(Image):
     def __init__(self, name: str, _fmt) -> None:
         self.filename = name
         self.lib = get_libcaps()
+        self.cache: TrackCache[Optional[IPFTrack]] = TrackCache()
 
     def __del__(self) -> None:
         try:
@@ -316,6 +317,16 @@ class IPF(CAPS):
         return s
 
     def get_track(self, cyl: int, head: int) -> Optional[MasterTrack]:
+        _track = self.cache.get(cyl, head,
+                                lambda: self.decode_track(cyl, head))
+        if _track is None:
+            return None
+        # Callers may modify the track: Give them their own copy.
+        track = copy.copy(_track)
+        track.verify = track
+        return track
+
+    def decode_track(self, cyl: int, head: int) -> Optional[IPFTrack]:
 
         try:
             ti = CAPSTrackInfo(self, cyl, head)
@@ -390,6 +401,10 @@ class IPF(CAPS):
         data = clip_and_sort_ranges(data)
         weak = clip_and_sort_ranges(weak)
 
+        # We have copied out everything we need: Let the library free its
+        # decoded copy of the track.
+        self.lib.CAPSUnlockTrack(self.iid, cyl, head)
+
         track = IPFTrack(
             bits = ti.bits,
             time_per_rev = 60/ti.rpm,
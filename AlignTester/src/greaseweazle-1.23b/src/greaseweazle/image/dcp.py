@@ -35,8 +35,7 @@ class DCP(IMG_AutoFormat):
             if cyl > 80:
                 break
             if header[cyl * 2 + head] == 1:
-                pos += track.set_img_track(dat[pos:])
-                self.to_track[cyl,head] = track
+                pos = self.add_img_track(cyl, head, track, dat, pos)
             elif header[cyl * 2 + head] != 0:
                 raise error.Fatal("DCP: Corrupt header.")
 
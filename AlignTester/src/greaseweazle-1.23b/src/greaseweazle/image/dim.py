@@ -45,8 +45,7 @@ class DIM(IMG_AutoFormat):
                 head ^= 1
             track = fmt.mk_track(cyl, head)
             if track is not None:
-                pos += track.set_img_track(dat[pos:])
-                self.to_track[cyl,head] = track
+                pos = self.add_img_track(cyl, head, track, dat, pos)
 
 # Local variables:
 # python-indent: 4
@@ -33,8 +33,7 @@ class FDI(IMG):
                 head ^= 1
             track = self.fmt.mk_track(cyl, head)
             if track is not None:
-                pos += track.set_img_track(dat[pos:])
-                self.to_track[cyl,head] = track
+                pos = self.add_img_track(cyl, head, track, dat, pos)
 
 # Local variables:
 # python-indent: 4
@@ -8,7 +8,7 @@
 from __future__ import annotations
 from typing import cast, Dict, Tuple, Optional, List
 
-import struct
+import struct, copy
 import itertools as it
 
 from greaseweazle import error
@@ -18,7 +18,7 @@ from greaseweazle.codec.ibm import ibm
 from greaseweazle.codec.apple2 import apple2_gcr
 from greaseweazle.track import MasterTrack, PLLTrack
 from bitarray import bitarray
-from .image import Image, ImageOpts
+from .image import Image, ImageOpts, TrackCache
 
 InterfaceMode = {
     'IBMPC_DD':             0x00,
@@ -163,6 +163,7 @@ class HFETrack:
 class HFE(Image):
 
     opts: HFEOpts
+    lazy = True
 
     def __init__(self, name: str, _fmt) -> None:
         self.opts = HFEOpts()
@@ -170,6 +171,11 @@ class HFE(Image):
         # Each track is (bitlen, rawbytes).
         # rawbytes is a bytes() object in little-endian bit order.
         self.to_track: Dict[Tuple[int,int], HFETrack] = dict()
+        # Image data, and (block offset, length) of each track in it,
+        # when reading an existing image.
+        self.hfe_dat = bytes()
+        self.hfe_offs: Dict[Tuple[int,int], Tuple[int,int]] = dict()
+        self.cache: TrackCache[HFETrack] = TrackCache()
 
 
     def from_bytes(self, dat: bytes) -> None:
@@ -188,28 +194,34 @@ class HFE(Image):
         self.opts.bitrate = bitrate
         self.opts.version = version
 
+        # Only the track LUT is parsed here. Track data stays in the
+        # (possibly memory-mapped) image until get_track decodes it.
         tlut = dat[tlut_base*512:tlut_base*512+n_cyl*4]
-        
+        self.hfe_dat = dat
         for cyl in range(n_cyl):
+            offset, length = struct.unpack("<2H", tlut[cyl*4:(cyl+1)*4])
             for side in range(n_side):
-                offset, length = struct.unpack("<2H", tlut[cyl*4:(cyl+1)*4])
-                todo = length // 2
-                tdat = bytes()
-                while todo:
-                    d_off = offset*512 + side*256
-                    d_nr = 256 if todo > 256 else todo
-                    tdat += dat[d_off:d_off+d_nr]
-                    todo -= d_nr
-                    offset += 1
-                track_v1 = HFETrack.from_hfe_bytes(tdat, bitrate)
-                if version == 1:
-                    self.to_track[cyl,side] = track_v1
-                else:
-                    self.to_track[cyl,side] = hfev3_mk_track(
-                        cyl, side, track_v1)
+                self.hfe_offs[cyl,side] = (offset, length)
+
+
+    def decode_track(self, cyl: int, side: int) -> HFETrack:
+        offset, length = self.hfe_offs[cyl,side]
+        assert self.opts.bitrate is not None # mypy
+        # The two sides of a cylinder are interleaved in 256-byte blocks.
+        dat = memoryview(self.hfe_dat)[offset*512:]
+        tdat = b''.join(dat[b+side*256:b+side*256+256]
+                        for b in range(0, length, 512))[:length//2]
+        track_v1 = HFETrack.from_hfe_bytes(tdat, self.opts.bitrate)
+        if self.opts.version == 1:
+            return track_v1
+        return hfev3_mk_track(cyl, side, track_v1)
 
 
     def get_track(self, cyl: int, side: int) -> Optional[MasterTrack]:
+        if (cyl,side) in self.hfe_offs:
+            # Callers may modify the track: Give them their own copy.
+            return copy.copy(self.cache.get(
+                cyl, side, lambda: self.decode_track(cyl, side)).track)
         if (cyl,side) not in self.to_track:
             return None
         return self.to_track[cyl,side].track
@@ -6,9 +6,11 @@
 # See the file COPYING for more details, or visit <http://unlicense.org>.
 
 from __future__ import annotations
-from typing import Optional, List, Dict
+from typing import cast, Callable, Generic, Optional, List, Dict, Tuple
+from typing import TypeVar
 
-import os
+import os, mmap
+from collections import OrderedDict
 
 from greaseweazle import error
 from greaseweazle.codec import codec
@@ -16,6 +18,39 @@ from greaseweazle.flux import HasFlux
 
 OptDict = Dict[str,str]
 
+T = TypeVar('T')
+
+def map_file(f) -> bytes:
+    """Memory-maps open file @f read-only. The result can be indexed and
+    sliced like bytes, but only pages that are actually accessed get read."""
+    try:
+        return cast(bytes, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    except (ValueError, OSError):
+        # Empty files, pipes, etc. cannot be mapped.
+        return f.read()
+
+
+class TrackCache(Generic[T]):
+    """Least-recently-used cache of decoded tracks, keyed by (cyl, side).
+    Lazily-decoded images use this so that re-reading a track does not
+    decode it again, without keeping every decoded track in memory."""
+
+    def __init__(self, size: int = 4) -> None:
+        self.size = size
+        self.tracks: OrderedDict[Tuple[int,int], T] = OrderedDict()
+
+    def get(self, cyl: int, side: int, decode: Callable[[], T]) -> T:
+        key = (cyl, side)
+        if key in self.tracks:
+            self.tracks.move_to_end(key)
+            return self.tracks[key]
+        track = decode()
+        self.tracks[key] = track
+        if len(self.tracks) > self.size:
+            self.tracks.popitem(last = False)
+        return track
+
+
 class ImageOpts:
     r_settings: List[str] = [] # r_set()
     w_settings: List[str] = [] # w_set()
@@ -44,6 +79,20 @@ class Image:
     write_on_ctrl_c = False
     opts = ImageOpts() # empty
 
+    # Lazy images are passed a read-only memory map of the file by
+    # from_file(), rather than a copy of its contents. They parse only
+    # their headers up front, and decode each track on first access.
+    lazy = False
+
+    # The memory map handed to a lazy image by from_file(), if any. It is
+    # released by close().
+    mapped: Optional[mmap.mmap] = None
+
+    # Streaming writers append each track to the open output file as it is
+    # emitted, rather than buffering the whole image for get_image(). They
+    # provide stream_open() and stream_close() instead of get_image().
+    streaming = False
+
     def __init__(self, name: str, fmt) -> None:
         raise NotImplementedError
 
@@ -59,11 +108,23 @@ class Image:
 
     def __enter__(self) -> Image:
         self.file = open(self.filename, ('wb','xb')[self.noclobber])
+        if self.streaming:
+            self.stream_open()
         return self
 
     def __exit__(self, type, value, tb):
         save = (type is None or
                 (type is KeyboardInterrupt and self.write_on_ctrl_c))
+        if self.streaming:
+            # Tracks are already on disk: Always finalise what we have, so
+            # that an interrupted write leaves a usable partial image.
+            try:
+                keep = self.stream_close(complete = save)
+            finally:
+                self.file.close()
+            if not keep:
+                os.remove(self.filename)
+            return
         try:
             if save:
                 # No error: Normal writeout.
@@ -93,9 +154,24 @@ class Image:
         obj = cls(name, fmt)
         obj.apply_r_opts(opts)
         with open(name, "rb") as f:
-            obj.from_bytes(f.read())
+            dat = map_file(f) if cls.lazy else f.read()
+            if isinstance(dat, mmap.mmap):
+                obj.mapped = dat
+            obj.from_bytes(dat)
         return obj
 
+    ## Releases the memory map of an image created using .from_file().
+    ## No tracks can be read afterwards.
+    def close(self) -> None:
+        if self.mapped is not None:
+            self.mapped.close()
+            self.mapped = None
+
+    ## Checks the integrity of an image created using .from_file(), once
+    ## its tracks have been read. Prints a warning if it is damaged.
+    def verify(self) -> None:
+        pass
+
     ## Used by default .from_file constructor
     def from_bytes(self, dat: bytes) -> None:
         raise NotImplementedError
@@ -124,6 +200,14 @@ class Image:
     def get_image(self) -> bytes:
         raise NotImplementedError
 
+    ## Streaming write support (if cls.streaming):
+    def stream_open(self) -> None:
+        raise NotImplementedError
+    ## Finalise the image in self.file. Returns False if the file should be
+    ## removed (eg. an error occurred before any track was written).
+    def stream_close(self, complete: bool) -> bool:
+        raise NotImplementedError
+
 
 # Local variables:
 # python-indent: 4
@@ -14,12 +14,15 @@ from .image import Image, OptDict
 
 class IMG(Image):
 
+    lazy = True
     sides_swapped = False
     sequential = False
     min_cyls: Optional[int] = None
 
     def __init__(self, name: str, fmt):
         self.to_track: Dict[Tuple[int,int],codec.Codec] = dict()
+        # Tracks whose sector data is still to be read from the image file.
+        self.img_pending: Dict[Tuple[int,int],Tuple[bytes,int,int]] = dict()
         error.check(fmt is not None, """\
 Sector image requires a disk format to be specified""")
         self.filename = name
@@ -46,14 +49,29 @@ Sector image requires a disk format to be specified""")
                 head ^= 1
             track = self.fmt.mk_track(cyl, head)
             if track is not None:
-                pos += track.set_img_track(dat[pos:])
-                self.to_track[cyl,head] = track
+                pos = self.add_img_track(cyl, head, track, dat, pos)
+
+
+    def add_img_track(self, cyl: int, head: int, track: codec.Codec,
+                      dat: bytes, pos: int) -> int:
+        """Adds @track, whose sector data is at offset @pos of the image
+        data @dat. The data is copied into the track on first access.
+        Returns the offset of the following track's data."""
+        # Loading an empty buffer zero-fills the track and sizes it.
+        size = track.set_img_track(bytes())
+        self.to_track[cyl,head] = track
+        self.img_pending[cyl,head] = (dat, pos, size)
+        return pos + size
 
 
     def get_track(self, cyl: int, side: int) -> Optional[codec.Codec]:
         if (cyl,side) not in self.to_track:
             return None
-        return self.to_track[cyl,side]
+        track = self.to_track[cyl,side]
+        if (cyl,side) in self.img_pending:
+            dat, pos, size = self.img_pending.pop((cyl,side))
+            track.set_img_track(dat[pos:pos+size])
+        return track
 
 
     def emit_track(self, cyl: int, side: int, track) -> None:
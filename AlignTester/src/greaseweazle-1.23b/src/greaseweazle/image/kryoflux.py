@@ -5,15 +5,16 @@
 # This is free and unencumbered software released into the public domain.
 # See the file COPYING for more details, or visit <http://unlicense.org>.
 
-from typing import Optional
+from typing import cast, Optional, Tuple, List, Dict
 
-import struct, re, math, os, datetime
+import struct, re, math, os, datetime, bisect, glob, multiprocessing
 import itertools as it
+from concurrent.futures import Future, ProcessPoolExecutor
 
 from greaseweazle import __version__
 from greaseweazle import error
 from greaseweazle.flux import Flux
-from .image import Image, ImageOpts, OptDict
+from .image import Image, ImageOpts, OptDict, TrackCache
 
 def_mck = 18432000 * 73 / 14 / 2
 def_sck = def_mck / 2
@@ -33,17 +34,135 @@ class OOB:
     KFInfo     =  4
     EOF        = 13
 
+# A run of Flux1 opcodes.
+flux1_run = re.compile(rb'[\x0e-\xff]+')
+
+def decode_stream(name: str, sck: float
+                  ) -> Optional[Tuple[List[float], List[float], float]]:
+    """Reads and parses KryoFlux stream file @name in a single pass.
+    Returns (index_list, flux_list, sck), or None if there is no such file.
+    """
+
+    try:
+        with open(name, 'rb') as f:
+            dat = f.read()
+    except FileNotFoundError:
+        return None
+
+    # Flux values, and the stream positions of their opcodes. Runs of
+    # Flux1 opcodes are copied straight from the stream in one go, so each
+    # run is recorded only by the position of its first opcode.
+    flux: List[int] = []
+    run_pos: List[int] = []
+    run_nr: List[int] = []
+    index: List[int] = []
+    val, stream_idx, idx, end = 0, 0, 0, len(dat)
+
+    while idx < end:
+        op = dat[idx]
+        if op > Op.OOB and val == 0:
+            # Flux1 run
+            run = flux1_run.match(dat, idx)
+            assert run is not None # mypy
+            run_pos.append(stream_idx)
+            run_nr.append(len(flux))
+            flux += dat[idx:run.end()]
+            stream_idx += run.end() - idx
+            idx = run.end()
+        elif op <= 7:
+            # Flux2
+            run_pos.append(stream_idx)
+            run_nr.append(len(flux))
+            flux.append(val + (op << 8) + dat[idx+1])
+            val = 0
+            stream_idx += 2
+            idx += 2
+        elif op <= 10:
+            # Nop1, Nop2, Nop3
+            nr = op-7
+            stream_idx += nr
+            idx += nr
+        elif op == Op.Ovl16:
+            val += 0x10000
+            stream_idx += 1
+            idx += 1
+        elif op == Op.Flux3:
+            run_pos.append(stream_idx)
+            run_nr.append(len(flux))
+            flux.append(val + (dat[idx+1] << 8) + dat[idx+2])
+            val = 0
+            stream_idx += 3
+            idx += 3
+        elif op == Op.OOB:
+            oob_op, oob_sz = struct.unpack('<BH', dat[idx+1:idx+4])
+            idx += 4
+            if oob_op == OOB.Index:
+                pos, = struct.unpack('<I', dat[idx:idx+4])
+                index.append(pos)
+            elif oob_op == OOB.StreamInfo or oob_op == OOB.StreamEnd:
+                pos, = struct.unpack('<I', dat[idx:idx+4])
+                error.check(pos == stream_idx,
+                            "Out-of-sync during KryoFlux stream read")
+            elif oob_op == OOB.EOF:
+                break
+            elif oob_op == OOB.KFInfo:
+                info = dat[idx:idx+oob_sz-1].decode('utf-8', 'ignore')
+                m = re.search(r'sck=([^,]+)', info)
+                if m is not None:
+                    sck = float(m.group(1))
+            idx += oob_sz
+        else:
+            # Flux1 following an overflow
+            run_pos.append(stream_idx)
+            run_nr.append(len(flux))
+            flux.append(val + op)
+            val = 0
+            stream_idx += 1
+            idx += 1
+
+    # An index mark falls just before the first opcode at or beyond its
+    # stream position. Marks beyond the end of the stream are ignored.
+    run_nr.append(len(flux))
+    cuts = []
+    for pos in index:
+        if pos > stream_idx:
+            break
+        i = bisect.bisect_left(run_pos, pos) - 1
+        if i < 0:
+            cuts.append(0)
+        else:
+            cuts.append(run_nr[i] + min(pos - run_pos[i],
+                                        run_nr[i+1] - run_nr[i]))
+
+    # Index timings are differences of the running flux total at each cut.
+    total = [0]
+    total += it.accumulate(flux)
+    index_list: List[float] = [total[j] - total[i]
+                               for i, j in zip([0] + cuts, cuts)]
+    flux_list = cast(List[float], flux)
+
+    # Crop partial first revolution.
+    if len(index_list) > 1:
+        index_list = index_list[1:]
+        flux_list = flux_list[cuts[0]:]
+
+    return index_list, flux_list, sck
+
+
 class KFOpts(ImageOpts):
     """sck: Sample clock to use for flux timings.
     Suffix 'm' for MHz. For example: sck=72m
     revs: Number of revolutions to output per track.
+    jobs: Number of stream files to read ahead, in as many processes.
     """
 
+    r_settings = [ 'jobs' ]
     w_settings = [ 'sck', 'revs' ]
 
     def __init__(self) -> None:
         self._sck: float = def_sck
         self._revs: Optional[int] = None
+        self._jobs: Optional[int] = None
 
     @property
     def sck(self) -> float:
@@ -71,6 +190,18 @@ class KFOpts(ImageOpts):
         except ValueError:
             raise error.Fatal("Kryoflux: Invalid revs: '%s'" % revs)
 
+    @property
+    def jobs(self) -> Optional[int]:
+        return self._jobs
+    @jobs.setter
+    def jobs(self, jobs: str) -> None:
+        try:
+            self._jobs = int(jobs)
+            if self._jobs < 1:
+                raise ValueError
+        except ValueError:
+            raise error.Fatal("Kryoflux: Invalid jobs: '%s'" % jobs)
+
 
 class KryoFlux(Image):
 
@@ -86,6 +217,11 @@ class KryoFlux(Image):
         self.basename = name[:m.start()]
         self.filename = name
         self.opts = KFOpts()
+        self.cache: TrackCache[Optional[
+            Tuple[List[float], List[float], float]]] = TrackCache()
+        self.pool: Optional[ProcessPoolExecutor] = None
+        self.pending: Dict[str, Future] = dict()
+        self.stream_names: List[str] = []
 
 
     @classmethod
@@ -99,110 +235,43 @@ class KryoFlux(Image):
 
 
     def get_track(self, cyl, side):
-
-        name = self.basename + '%02d.%d.raw' % (cyl, side)
-        try:
-            with open(name, 'rb') as f:
-                dat = f.read()
-        except FileNotFoundError:
+        track = self.cache.get(cyl, side,
+                               lambda: self.decode_track(cyl, side))
+        if track is None:
             return None
+        index_list, flux_list, sck = track
+        # Callers may modify the Flux: Give them their own copy of the lists.
+        return Flux(index_list.copy(), flux_list.copy(), sck)
 
-        # Parse the index-pulse stream positions and KFInfo blocks.
-        index, idx = [], 0
-        sck, ick = self.opts.sck, self.opts.sck/8
-        while idx < len(dat):
-            op = dat[idx]
-            if op == Op.OOB:
-                oob_op, oob_sz = struct.unpack('<BH', dat[idx+1:idx+4])
-                idx += 4
-                if oob_op == OOB.Index:
-                    pos, = struct.unpack('<I', dat[idx:idx+4])
-                    index.append(pos)
-                elif oob_op == OOB.EOF:
-                    break
-                elif oob_op == OOB.KFInfo:
-                    info = dat[idx:idx+oob_sz-1].decode('utf-8', 'ignore')
-                    m = re.search(r'sck=([^,]+)', info)
-                    if m is not None:
-                        sck = float(m.group(1))
-                    m = re.search(r'ick=([^,]+)', info)
-                    if m is not None:
-                        ick = float(m.group(1))
-                idx += oob_sz
-            elif op == Op.Nop3 or op == Op.Flux3:
-                idx += 3
-            elif op <= 7 or op == Op.Nop2:
-                idx += 2
-            else:
-                idx += 1
-
-        # Build the flux and index lists for the Flux object.
-        flux, flux_list, index_list = [], [], []
-        val, index_idx, stream_idx, idx = 0, 0, 0, 0
-        while idx < len(dat):
-            if index_idx < len(index) and stream_idx >= index[index_idx]:
-                # We've passed an index marker.
-                index_list.append(sum(flux))
-                flux_list += flux
-                flux = []
-                index_idx += 1
-            op = dat[idx]
-            if op <= 7:
-                # Flux2
-                val += (op << 8) + dat[idx+1]
-                flux.append(val)
-                val = 0
-                stream_idx += 2
-                idx += 2
-            elif op <= 10:
-                # Nop1, Nop2, Nop3
-                nr = op-7
-                stream_idx += nr
-                idx += nr
-            elif op == Op.Ovl16:
-                # Ovl16
-                val += 0x10000
-                stream_idx += 1
-                idx += 1
-            elif op == Op.Flux3:
-                # Flux3
-                val += (dat[idx+1] << 8) + dat[idx+2]
-                flux.append(val)
-                val = 0
-                stream_idx += 3
-                idx += 3
-            elif op == Op.OOB:
-                # OOB
-                oob_op, oob_sz = struct.unpack('<BH', dat[idx+1:idx+4])
-                idx += 4
-                if oob_op == OOB.StreamInfo or oob_op == OOB.StreamEnd:
-                    pos, = struct.unpack('<I', dat[idx:idx+4])
-                    error.check(pos == stream_idx,
-                                "Out-of-sync during KryoFlux stream read")
-                elif oob_op == OOB.EOF:
-                    break
-                idx += oob_sz
-            else:
-                # Flux1
-                val += op
-                flux.append(val)
-                val = 0
-                stream_idx += 1
-                idx += 1
-
-        flux_list += flux
 
-        # Crop partial first revolution.
-        if len(index_list) > 1:
-            short_index, index_list = index_list[0], index_list[1:]
-            flux = 0
-            for i in range(len(flux_list)):
-                if flux >= short_index:
-                    break
-                flux += flux_list[i]
-            flux_list = flux_list[i:]
-
-        return Flux(index_list, flux_list, sck)
+    def decode_track(self, cyl, side):
+        name = self.basename + '%02d.%d.raw' % (cyl, side)
+        # A pool worker (eg. convert --jobs) is itself one of several
+        # decoding in parallel, and cannot shut down while it has worker
+        # processes of its own: It reads its stream files serially.
+        if (self.opts.jobs is None
+            or multiprocessing.parent_process() is not None):
+            return decode_stream(name, self.opts.sck)
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(self.opts.jobs)
+            self.stream_names = sorted(
+                glob.glob(glob.escape(self.basename) + '[0-9][0-9].[01].raw'))
+        # Collect this track's result, and read ahead on the stream files
+        # that follow it, so that up to @jobs files are in flight at once.
+        fut = self.pending.pop(name, None)
+        if fut is None:
+            fut = self.pool.submit(decode_stream, name, self.opts.sck)
+        try:
+            i = self.stream_names.index(name) + 1
+        except ValueError:
+            i = len(self.stream_names)
+        for n in self.stream_names[i:]:
+            if len(self.pending) >= self.opts.jobs:
+                break
+            if n not in self.pending:
+                self.pending[n] = self.pool.submit(
+                    decode_stream, n, self.opts.sck)
+        return fut.result()
 
 
     def emit_track(self, cyl, side, track):
@@ -293,10 +362,21 @@ class KryoFlux(Image):
                 f.write(dat)
 
 
+    def close(self) -> None:
+        # Drop any read-ahead, and stop the worker processes.
+        if self.pool is not None:
+            for fut in self.pending.values():
+                fut.cancel()
+            self.pending.clear()
+            self.pool.shutdown()
+            self.pool = None
+        super().close()
+
+
     def __enter__(self):
         return self
     def __exit__(self, type, value, tb):
-        pass
+        self.close()
 
 
 # Local variables:
@@ -5,9 +5,9 @@
 # This is free and unencumbered software released into the public domain.
 # See the file COPYING for more details, or visit <http://unlicense.org>.
 
-from typing import Dict, Tuple, Optional, List
+from typing import cast, Dict, Tuple, Optional, List
 
-import struct, time
+import struct, time, os, sys, array, bisect, itertools
 from enum import IntFlag
 
 from greaseweazle import __version__
@@ -16,7 +16,7 @@ from greaseweazle.codec import codec
 from greaseweazle.flux import Flux, HasFlux
 from greaseweazle.tools import util
 from greaseweazle.track import MasterTrack
-from .image import Image, ImageOpts
+from .image import Image, ImageOpts, TrackCache
 
 #  SCP image specification can be found at Jim Drew's site:
 #  https://www.cbmstuff.com/downloads/scp/scp_image_specs.txt
@@ -59,6 +59,10 @@ DiskType = {
 }
 
 
+# Size of the EXTS block containing a WRSP chunk for 168 tracks.
+WRSP_LEN = (2+2+169)*4
+
+
 class SCPHeaderFlags(IntFlag):
     INDEXED       = 1<<0  # image used the index mark to cue tracks
     TPI_96        = 1<<1  # drive is 96 TPI, otherwise 48 TPI
@@ -112,6 +116,59 @@ class SCPOpts(ImageOpts):
             raise error.Fatal("Kryoflux: Invalid revs: '%s'" % revs)
 
 
+def decode_cells(dat: bytes) -> List[float]:
+    """Decodes SCP big-endian 16-bit flux cells into a list of flux times.
+    A zero cell adds 65536 to the following flux time."""
+    cells = array.array('H')
+    cells.frombytes(dat[:len(dat)&~1])
+    if sys.byteorder == 'little':
+        cells.byteswap()
+    flux_list: List[float] = cast(List[float], cells.tolist())
+    if 0 not in flux_list:
+        return flux_list
+    # Rare: Fold each run of zero cells into the following flux time.
+    res: List[float] = []
+    pos, n = 0, len(flux_list)
+    while True:
+        try:
+            z = flux_list.index(0, pos)
+        except ValueError:
+            res += flux_list[pos:]
+            return res
+        res += flux_list[pos:z]
+        pos = z
+        while pos < n and flux_list[pos] == 0:
+            pos += 1
+        if pos == n:
+            return res
+        res.append(flux_list[pos] + (pos-z)*65536)
+        pos += 1
+
+
+def encode_cells(vals: List[int],
+                 ends: List[int]) -> Tuple[bytes, List[int]]:
+    """Encodes flux times @vals (none a multiple of 65536) as SCP 16-bit
+    flux cells. @ends lists sample counts at revolution boundaries: These
+    are returned remapped to cell counts."""
+    if vals and max(vals) >= 65536:
+        # Rare: Each 65536 ticks of a long flux time is a zero cell.
+        cells: List[int] = []
+        cell_ends, start = [], 0
+        for end in ends:
+            for val in vals[start:end]:
+                if val >= 65536:
+                    cells += [0] * (val >> 16)
+                    val &= 65535
+                cells.append(val)
+            cell_ends.append(len(cells))
+            start = end
+        vals, ends = cells, cell_ends
+    dat = array.array('H', vals)
+    if sys.byteorder == 'little':
+        dat.byteswap()
+    return dat.tobytes(), ends
+
+
 class SCPTrack:
 
     def __init__(self, tdh, dat, splice=None):
@@ -125,6 +182,8 @@ class SCP(Image):
     # 40MHz
     sample_freq = 40000000
     opts: SCPOpts
+    streaming = True
+    lazy = True
 
 
     def __init__(self, name: str, _fmt) -> None:
@@ -133,6 +192,11 @@ class SCP(Image):
         self.to_track: Dict[int, SCPTrack] = dict()
         self.index_cued = True
         self.filename = name
+        self.cache: TrackCache[Tuple[List[float], List[float]]] = TrackCache()
+        # The image contents and their checksum, until verified.
+        self.checksum: Optional[Tuple[memoryview, int]] = None
+        # File offset of each track written so far, when streaming.
+        self.stream_offs: Optional[Dict[int, int]] = None
 
 
     def side_count(self) -> List[int]:
@@ -150,8 +214,14 @@ class SCP(Image):
          checksum) = struct.unpack("<3s9BI", dat[0:16])
         error.check(sig == b"SCP", "SCP: Bad signature")
 
-        if sum(dat[16:]) & 0xffffffff != checksum:
-            print('SCP: WARNING: Bad image checksum')
+        # Track data is sliced out of the (possibly memory-mapped) image
+        # without copying, and decoded on demand by get_track.
+        view = memoryview(dat)
+
+        # Verifying the checksum reads the entire file. It is deferred to
+        # verify(), so that opening an image to look at a few tracks stays
+        # cheap.
+        self.checksum = (view, checksum)
 
         index_cued = (flags & 1) == 1 or nr_revs == 1
 
@@ -228,7 +298,7 @@ class SCP(Image):
                 # Bail on them here.
                 continue
 
-            tdat = dat[trk_off+s_off:trk_off+e_off]
+            tdat = view[trk_off+s_off:trk_off+e_off]
             track = SCPTrack(thdr, tdat)
             if splices is not None:
                 track.splice = splices[trknr]
@@ -254,39 +324,72 @@ class SCP(Image):
             print('SCP: Imported legacy single-sided image')
 
 
+    def verify(self) -> None:
+        if self.checksum is None:
+            return
+        view, checksum = self.checksum
+        self.checksum = None
+        if sum(view[16:]) & 0xffffffff != checksum:
+            print('SCP: WARNING: Bad image checksum')
+        view.release()
+
+
+    def close(self) -> None:
+        # Track data are views into the memory map: Release them first.
+        for track in self.to_track.values():
+            if isinstance(track.dat, memoryview):
+                track.dat.release()
+        if self.checksum is not None:
+            self.checksum[0].release()
+            self.checksum = None
+        self.to_track.clear()
+        self.cache.tracks.clear()
+        super().close()
+
+
     def get_track(self, cyl: int, side: int) -> Optional[Flux]:
         tracknr = cyl * 2 + side
         if not tracknr in self.to_track:
             return None
         track = self.to_track[tracknr]
+        index_list, flux_list = self.cache.get(
+            cyl, side, lambda: self.decode_track(track))
+        # Callers may modify the Flux: Give them their own copy of the lists.
+        flux = Flux(index_list.copy(), flux_list.copy(), SCP.sample_freq)
+        flux.splice = track.splice
+        return flux
+
+
+    @staticmethod
+    def decode_track(track: SCPTrack) -> Tuple[List[float], List[float]]:
         tdh, dat = track.tdh, track.dat
 
-        index_list = []
+        index_list: List[float] = []
         while tdh:
             ticks, _, _ = struct.unpack("<3I", tdh[:12])
             index_list.append(ticks)
             tdh = tdh[12:]
         
         # Decode the SCP flux data into a simple list of flux times.
-        flux_list = []
-        val = 0
-        for i in range(0, len(dat), 2):
-            x = dat[i]*256 + dat[i+1]
-            if x == 0:
-                val += 65536
-                continue
-            flux_list.append(val + x)
-            val = 0
+        flux_list = decode_cells(dat)
 
-        flux = Flux(index_list, flux_list, SCP.sample_freq)
-        flux.splice = track.splice
-        return flux
+        return index_list, flux_list
 
 
     def emit_track(self, cyl: int, side: int, track: HasFlux) -> None:
         """Converts @track into a Supercard Pro Track and appends it to
         the current image-in-progress.
         """
+        tnr = cyl*2 + side
+        scp_track = self.scp_track(track)
+        if self.stream_offs is None:
+            self.to_track[tnr] = scp_track
+        else:
+            self.stream_track(tnr, scp_track)
+
+
+    def scp_track(self, track: HasFlux) -> SCPTrack:
+        """Converts @track into a Supercard Pro Track."""
 
         if isinstance(track, codec.Codec):
             track = track.master_track()
@@ -318,65 +421,155 @@ class SCP(Image):
         factor = SCP.sample_freq / flux.sample_freq
         splice = None if flux.splice is None else round(flux.splice * factor)
 
-        tdh, dat = bytearray(), bytearray()
-        len_at_index = rev = 0
-        to_index = flux.index_list[0]
-        rem = 0.0
-
-        for x in flux.list:
-
-            # Does the next flux interval cross the index mark?
-            while to_index < x:
-                # Append to the TDH for the previous full revolution
-                tdh += struct.pack("<III",
-                                   round(flux.index_list[rev]*factor),
-                                   (len(dat) - len_at_index) // 2,
-                                   4 + nr_revs*12 + len_at_index)
-                # Set up for the next revolution
-                len_at_index = len(dat)
-                rev += 1
-                if rev >= nr_revs:
-                    # We're done: We simply discard any surplus flux samples
-                    self.to_track[cyl*2+side] = SCPTrack(tdh, dat, splice)
-                    return
-                to_index += flux.index_list[rev]
-
-            # Process the current flux sample into SCP "bitcell" format
-            to_index -= x
-            y = x * factor + rem
-            val = round(y)
-            if (val & 65535) == 0:
-                val += 1
-            rem = y - val
-            while val >= 65536:
-                dat.append(0)
-                dat.append(0)
-                val -= 65536
-            dat.append(val>>8)
-            dat.append(val&255)
-
-        # Header for last track(s) in case we ran out of flux timings.
-        while rev < nr_revs:
+        # Resample the flux into SCP ticks, noting the number of samples
+        # at each index mark. Rounding carries a remainder from one sample
+        # to the next, so this is necessarily a sequential loop: We keep it
+        # as tight as possible and leave all encoding to encode_cells().
+        # Only 40MHz flux (nothing to resample) skips the loop: Rounding
+        # the running totals in bulk instead was measured no faster for
+        # 72/84MHz captures, the per-sample cost being the same.
+        index_list = flux.index_list
+        flux_list = flux.list
+        vals: List[int]
+        ends: List[int] = []
+
+        if (isinstance(sum(flux_list), int)
+            and isinstance(sum(index_list), int)):
+            # Integer timings (the usual case): Index positions are exact,
+            # so locate them by bisecting the running flux total.
+            acc = list(itertools.accumulate(flux_list))
+            pos: float = 0
+            for rev in range(nr_revs):
+                pos += index_list[rev]
+                ends.append(bisect.bisect_right(acc, pos))
+            # We simply discard any surplus flux samples.
+            flux_list = flux_list[:ends[-1]]
+            if (factor == 1 and flux_list
+                and min(flux_list) > 0 and max(flux_list) < 65536):
+                # Nothing to resample.
+                vals = cast(List[int], flux_list)
+            else:
+                vals = []
+                append = vals.append
+                rem = 0.0
+                for x in flux_list:
+                    y = x * factor + rem
+                    val = round(y)
+                    if (val & 65535) == 0:
+                        val += 1
+                    rem = y - val
+                    append(val)
+            dat, ends = encode_cells(vals, ends)
+        else:
+            vals = []
+            append = vals.append
+            to_index = index_list[0]
+            rem = 0.0
+            for x in flux_list:
+                # Does the next flux interval cross the index mark?
+                while to_index < x:
+                    ends.append(len(vals))
+                    if len(ends) >= nr_revs:
+                        # We're done: We simply discard any surplus samples
+                        break
+                    to_index += index_list[len(ends)]
+                else:
+                    # Process the current flux sample into SCP ticks
+                    to_index -= x
+                    y = x * factor + rem
+                    val = round(y)
+                    if (val & 65535) == 0:
+                        val += 1
+                    rem = y - val
+                    append(val)
+                    continue
+                break
+            # Index marks for last track(s) in case we ran out of flux.
+            while len(ends) < nr_revs:
+                ends.append(len(vals))
+            dat, ends = encode_cells(vals, ends)
+
+        tdh = bytearray()
+        start = 0
+        for rev in range(nr_revs):
             tdh += struct.pack("<III",
-                               round(flux.index_list[rev]*factor),
-                               (len(dat) - len_at_index) // 2,
-                               4 + nr_revs*12 + len_at_index)
-            len_at_index = len(dat)
-            rev += 1
+                               round(index_list[rev]*factor),
+                               ends[rev] - start,
+                               4 + nr_revs*12 + start*2)
+            start = ends[rev]
 
-        self.to_track[cyl*2+side] = SCPTrack(tdh, dat, splice)
+        return SCPTrack(tdh, dat, splice)
 
 
-    def get_image(self) -> bytes:
-
-        # Work out the single-sided byte code
+    def single_sided(self) -> int:
+        """Work out the single-sided byte code."""
         s = self.side_count()
         if s[0] and s[1]:
-            single_sided = 0
-        elif s[0]:
-            single_sided = 1
-        else:
-            single_sided = 2
+            return 0
+        if s[0]:
+            return 1
+        return 2
+
+
+    @staticmethod
+    def wrsp_block(to_track: Dict[int, SCPTrack]) -> bytes:
+        """EXTS block containing a WRSP chunk: One 32-bit write-splice
+        position per track, preceded by a zero flags field."""
+        wrsp = bytearray(WRSP_LEN)
+        struct.pack_into('<4sI4s2I', wrsp, 0,
+                         b'EXTS', WRSP_LEN- 8,  # EXTS header
+                         b'WRSP', WRSP_LEN-16,  # WRSP header
+                         0)                     # WRSP flags field
+        for tnr, track in to_track.items():
+            if track.splice is not None:
+                struct.pack_into('<I', wrsp, 20 + tnr*4, track.splice)
+        return bytes(wrsp)
+
+
+    def header(self, ntracks: int, single_sided: int,
+               flags: SCPHeaderFlags, checksum: int) -> bytes:
+        if self.index_cued:
+            flags |= SCPHeaderFlags.INDEXED
+        nr_revs = self.nr_revs if self.nr_revs is not None else 0
+        return struct.pack("<3s9BI",
+                           b"SCP",    # Signature
+                           0,
+                           self.opts.disktype,
+                           nr_revs,
+                           0,         # start track
+                           ntracks-1, # end track
+                           flags,
+                           0,         # 16-bit cell width
+                           single_sided,
+                           0,         # 25ns capture
+                           checksum & 0xffffffff)
+
+
+    @staticmethod
+    def footer(footer_offs: int) -> bytes:
+        creation_time = round(time.time())
+        app_name = f'Greaseweazle {__version__}'.encode()
+        footer = struct.pack('<H', len(app_name)) + app_name + b'\0'
+        footer += struct.pack('<6I2Q4B4s',
+                              0, # drive manufacturer
+                              0, # drive model
+                              0, # drive serial
+                              0, # creator name
+                              footer_offs, # application name
+                              0, # comments
+                              creation_time, # creation time
+                              creation_time, # modification time
+                              0, # application version
+                              0, # hardware version
+                              0, # firmware version
+                              0x24, # format version (v2.4)
+                              b'FPCS')
+        return footer
+
+
+    def get_image(self) -> bytes:
+
+        single_sided = self.single_sided()
 
         to_track = self.to_track
         if single_sided and self.opts.legacy_ss:
@@ -392,78 +585,117 @@ class SCP(Image):
         for track in to_track.values():
             if track.splice is not None:
                 emit_wrsp = True
-        wrsp, wrsp_len = bytearray(), 0
-        if emit_wrsp:
-            wrsp_len = (2+2+169)*4
-            wrsp += struct.pack('<4sI4s2I',
-                                b'EXTS', wrsp_len- 8,  # EXTS header
-                                b'WRSP', wrsp_len-16,  # WRSP header
-                                0)                     # WRSP flags field
+        wrsp = self.wrsp_block(to_track) if emit_wrsp else b''
 
         # Generate the TLUT and concatenate all the tracks together.
         trk_offs, trk_offs_len = bytearray(), 0x2a0
         trk_dat = bytearray()
-        trk_start = 0x10 + trk_offs_len + wrsp_len
+        trk_start = 0x10 + trk_offs_len + len(wrsp)
         for tnr in range(ntracks):
             if tnr in to_track:
                 track = to_track[tnr]
                 trk_offs += struct.pack("<I", trk_start + len(trk_dat))
                 trk_dat += struct.pack("<3sB", b"TRK", tnr)
                 trk_dat += track.tdh + track.dat
-                splice = 0 if track.splice is None else track.splice
             else:
                 trk_offs += struct.pack("<I", 0)
-                splice = 0
-            if emit_wrsp:
-                wrsp += struct.pack("<I", splice)
         error.check(len(trk_offs) <= trk_offs_len, "SCP: Too many tracks")
         trk_offs += bytes(trk_offs_len - len(trk_offs))
-        wrsp += bytes(wrsp_len - len(wrsp))
 
-        creation_time = round(time.time())
-        footer_offs = trk_start + len(trk_dat)
-        app_name = f'Greaseweazle {__version__}'.encode()
-        footer = struct.pack('<H', len(app_name)) + app_name + b'\0'
-        footer += struct.pack('<6I2Q4B4s',
-                              0, # drive manufacturer
-                              0, # drive model
-                              0, # drive serial
-                              0, # creator name
-                              footer_offs, # application name
-                              0, # comments
-                              creation_time, # creation time
-                              creation_time, # modification time
-                              0, # application version
-                              0, # hardware version
-                              0, # firmware version
-                              0x24, # format version (v2.4)
-                              b'FPCS')
+        footer = self.footer(trk_start + len(trk_dat))
 
         # Concatenate all data together for checksumming.
         data = trk_offs + wrsp + trk_dat + footer
 
         # Generate the image header.
         flags = SCPHeaderFlags.TPI_96 | SCPHeaderFlags.FOOTER
-        if self.index_cued:
-            flags |= SCPHeaderFlags.INDEXED
-        nr_revs = self.nr_revs if self.nr_revs is not None else 0
-        header = struct.pack("<3s9BI",
-                             b"SCP",    # Signature
-                             0,
-                             self.opts.disktype,
-                             nr_revs,
-                             0,         # start track
-                             ntracks-1, # end track
-                             flags,
-                             0,         # 16-bit cell width
-                             single_sided,
-                             0,         # 25ns capture
-                             sum(data) & 0xffffffff)
+        header = self.header(ntracks, single_sided, flags, sum(data))
 
         # Concatenate it all together and send it back.
         return header + data
 
 
+    ## Streaming writer: Each track is appended to the output file as it is
+    ## emitted, and only its file offset is remembered. The header and TLUT
+    ## are rewritten after every track, so that the file on disk is always a
+    ## valid (if partial) SCP image. The footer is appended on close.
+
+    def stream_open(self) -> None:
+        self.stream_offs = dict()
+        self.stream_sum = 0 # Sum of all bytes after header, TLUT and WRSP
+        self.stream_wrsp: Optional[bool] = None # Decided by the first track
+        self.stream_sync(SCPHeaderFlags(0))
+
+
+    def stream_track(self, tnr: int, track: SCPTrack) -> None:
+        assert self.stream_offs is not None
+        error.check(tnr < 0x2a0//4, "SCP: Too many tracks")
+        if self.stream_wrsp is None:
+            # The WRSP block sits between the TLUT and the first track.
+            # Reserve space for it iff the first track has a splice point.
+            self.stream_wrsp = track.splice is not None
+            if self.stream_wrsp:
+                self.file.write(bytes(WRSP_LEN))
+        elif track.splice is not None and not self.stream_wrsp:
+            print('SCP: WARNING: No space for write splice of T%d.%d'
+                  % (tnr//2, tnr&1))
+        self.file.seek(0, os.SEEK_END)
+        self.stream_offs[tnr] = self.file.tell()
+        trk_dat = struct.pack("<3sB", b"TRK", tnr) + track.tdh + track.dat
+        self.file.write(trk_dat)
+        self.stream_sum += sum(trk_dat)
+        # Keep only the track metadata: The flux data is now on disk.
+        self.to_track[tnr] = SCPTrack(b'', b'', track.splice)
+        self.stream_sync(SCPHeaderFlags(0))
+
+
+    def stream_sync(self, flags: SCPHeaderFlags,
+                    single_sided: Optional[int] = None) -> None:
+        """Rewrites the image header, TLUT and WRSP block to describe all
+        tracks streamed so far."""
+        assert self.stream_offs is not None
+        if single_sided is None:
+            single_sided = self.single_sided()
+        ntracks = max(self.stream_offs, default=0) + 1
+        tlut = bytearray(0x2a0)
+        for tnr, off in self.stream_offs.items():
+            struct.pack_into('<I', tlut, tnr*4, off)
+        wrsp = self.wrsp_block(self.to_track) if self.stream_wrsp else b''
+        checksum = self.stream_sum + sum(tlut) + sum(wrsp)
+        header = self.header(ntracks, single_sided,
+                             flags | SCPHeaderFlags.TPI_96, checksum)
+        self.file.seek(0)
+        self.file.write(header + tlut + wrsp)
+        self.file.seek(0, os.SEEK_END)
+        self.file.flush()
+
+
+    def stream_close(self, complete: bool) -> bool:
+        assert self.stream_offs is not None
+        if not complete:
+            if not self.stream_offs:
+                return False
+            print('SCP: Saved partial image (%d tracks)'
+                  % len(self.stream_offs))
+        single_sided = self.single_sided()
+        if single_sided and self.opts.legacy_ss:
+            print('SCP: Generated legacy single-sided image')
+            offs, to_track = dict(), dict()
+            for tnr, off in self.stream_offs.items():
+                # Patch the track number in the TRK header.
+                self.file.seek(off + 3)
+                self.file.write(bytes([tnr//2]))
+                self.stream_sum += tnr//2 - tnr
+                offs[tnr//2], to_track[tnr//2] = off, self.to_track[tnr]
+            self.stream_offs, self.to_track = offs, to_track
+        self.file.seek(0, os.SEEK_END)
+        footer = self.footer(self.file.tell())
+        self.file.write(footer)
+        self.stream_sum += sum(footer)
+        self.stream_sync(SCPHeaderFlags.FOOTER, single_sided)
+        return True
+
+
 # Local variables:
 # python-indent: 4
 # End:
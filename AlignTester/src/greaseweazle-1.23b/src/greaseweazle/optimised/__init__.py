@@ -7,6 +7,9 @@
 
 import os
 
+# Pure-Python GCR codecs, replaced below by the C versions when available.
+from .gcr import *
+
 gw_opt = os.environ.get('GW_OPT')
 enabled = gw_opt is None or gw_opt.lower().startswith('y')
 if enabled:
@@ -0,0 +1,255 @@
+# greaseweazle/optimised/gcr.py
+#
+# Pure-Python GCR codecs, used when the optimised C extension is unavailable
+# (or disabled by GW_OPT). Results are byte-for-byte identical to the C
+# routines in c64.c, mac.c, apple2.c and apple_gcr_6a2.c, including the
+# handling of invalid codes.
+#
+# This is free and unencumbered software released into the public domain.
+# See the file COPYING for more details, or visit <http://unlicense.org>.
+
+from typing import Tuple
+
+from bitarray import bitarray
+from bitarray.util import ba2int
+
+__all__ = ['decode_mac_gcr', 'encode_mac_gcr',
+           'decode_mac_sector', 'encode_mac_sector',
+           'decode_c64_gcr', 'encode_c64_gcr',
+           'decode_apple2_sector', 'encode_apple2_sector']
+
+MAC_SECTOR_LENGTH = 524
+MAC_ENCODED_SECTOR_LENGTH = 703
+APPLE2_SECTOR_LENGTH = 256
+APPLE2_ENCODED_SECTOR_LENGTH = 342
+
+# Apple 6-and-2 GCR: data value 0x00-0x3f -> disk byte (apple_gcr_6a2_code.h)
+apple_gcr_6a2_code = bytes([
+    0x96, 0x97, 0x9a, 0x9b, 0x9d, 0x9e, 0x9f, 0xa6,
+    0xa7, 0xab, 0xac, 0xad, 0xae, 0xaf, 0xb2, 0xb3,
+    0xb4, 0xb5, 0xb6, 0xb7, 0xb9, 0xba, 0xbb, 0xbc,
+    0xbd, 0xbe, 0xbf, 0xcb, 0xcd, 0xce, 0xcf, 0xd3,
+    0xd6, 0xd7, 0xd9, 0xda, 0xdb, 0xdc, 0xdd, 0xde,
+    0xdf, 0xe5, 0xe6, 0xe7, 0xe9, 0xea, 0xeb, 0xec,
+    0xed, 0xee, 0xef, 0xf2, 0xf3, 0xf4, 0xf5, 0xf6,
+    0xf7, 0xf9, 0xfa, 0xfb, 0xfc, 0xfd, 0xfe, 0xff ])
+
+# Commodore 4-to-5 GCR: data nibble 0x0-0xf -> 5-bit code (c64_gcr_code.h)
+c64_gcr_code = bytes([
+    0x0a, 0x0b, 0x12, 0x13, 0x0e, 0x0f, 0x16, 0x17,
+    0x09, 0x19, 0x1a, 0x1b, 0x0d, 0x1d, 0x1e, 0x15 ])
+
+# Byte translation tables. Invalid codes map to 0xff, as the C routines
+# truncate their -1 return value to a uint8_t.
+_6a2_dec = bytearray([0xff]*256)
+for _d, _g in enumerate(apple_gcr_6a2_code):
+    _6a2_dec[_g] = _d
+_6a2_decode = bytes(_6a2_dec)
+_6a2_encode = apple_gcr_6a2_code + bytes([0xff]*(256-64))
+
+# C64: 10-bit code -> data byte, and data byte -> 10-bit code.
+_c64_nibble = [-1] * 32
+for _d, _g in enumerate(c64_gcr_code):
+    _c64_nibble[_g] = _d
+_c64_decode = bytes([((_c64_nibble[x>>5] << 4) | _c64_nibble[x&0x1f]) & 0xff
+                     for x in range(1024)])
+_c64_encode = [(c64_gcr_code[x>>4] << 5) | c64_gcr_code[x&15]
+               for x in range(256)]
+
+
+def decode_mac_gcr(dat: bytes) -> bytes:
+    return bytes(dat).translate(_6a2_decode)
+
+
+def encode_mac_gcr(dat: bytes) -> bytes:
+    return bytes(dat).translate(_6a2_encode)
+
+
+def decode_c64_gcr(dat: bytes) -> bytes:
+    if len(dat) % 5:
+        raise ValueError('C64 GCR length %d is not a multiple of 5'
+                         % len(dat))
+    # Each 5-byte group holds four 10-bit codes, MSB first.
+    dec, out = _c64_decode, bytearray()
+    for i in range(0, len(dat), 5):
+        x = int.from_bytes(dat[i:i+5], 'big')
+        out += bytes((dec[x>>30], dec[(x>>20)&0x3ff],
+                      dec[(x>>10)&0x3ff], dec[x&0x3ff]))
+    return bytes(out)
+
+
+def encode_c64_gcr(dat: bytes) -> bytes:
+    if len(dat) % 4:
+        raise ValueError('C64 data length %d is not a multiple of 4'
+                         % len(dat))
+    enc, out = _c64_encode, bytearray()
+    for i in range(0, len(dat), 4):
+        a, b, c, d = dat[i:i+4]
+        x = (enc[a] << 30) | (enc[b] << 20) | (enc[c] << 10) | enc[d]
+        out += x.to_bytes(5, 'big')
+    return bytes(out)
+
+
+def decode_mac_sector(dat: bytes) -> Tuple[bytes, int]:
+    if len(dat) < MAC_ENCODED_SECTOR_LENGTH:
+        raise ValueError('Mac sector too short (%d bytes)' % len(dat))
+    lookup_len = MAC_SECTOR_LENGTH // 3
+
+    # Unpack 6-bit nibbles into three byte streams.
+    b1, b2, b3 = [], [], []
+    pos = 0
+    for i in range(lookup_len + 1):
+        w4, w1, w2 = dat[pos], dat[pos+1], dat[pos+2]
+        pos += 3
+        w3 = 0
+        if i != lookup_len:
+            w3 = dat[pos]
+            pos += 1
+        b1.append((w1 & 0x3f) | ((w4 << 2) & 0xc0))
+        b2.append((w2 & 0x3f) | ((w4 << 4) & 0xc0))
+        b3.append((w3 & 0x3f) | ((w4 << 6) & 0xc0))
+
+    # Unscramble while computing the three-byte data checksum.
+    out = bytearray()
+    c1 = c2 = c3 = 0
+    count = 0
+    while True:
+        c1 = (c1 & 0xff) << 1
+        if c1 & 0x100:
+            c1 += 1
+        val = (b1[count] ^ c1) & 0xff
+        c3 += val
+        if c1 & 0x100:
+            c3 += 1
+            c1 &= 0xff
+        out.append(val)
+        val = (b2[count] ^ c3) & 0xff
+        c2 += val
+        if c3 > 0xff:
+            c2 += 1
+            c3 &= 0xff
+        out.append(val)
+        if len(out) == MAC_SECTOR_LENGTH:
+            break
+        val = (b3[count] ^ c2) & 0xff
+        c1 += val
+        if c2 > 0xff:
+            c1 += 1
+            c2 &= 0xff
+        out.append(val)
+        count += 1
+
+    c4 = ((c1 & 0xc0) >> 6) | ((c2 & 0xc0) >> 4) | ((c3 & 0xc0) >> 2)
+    csum = bytes([c4 & 0x3f, c3 & 0x3f, c2 & 0x3f, c1 & 0x3f])
+    status = 0 if dat[pos:pos+4] == csum else 1
+    return bytes(out), status
+
+
+def encode_mac_sector(dat: bytes) -> bytes:
+    if len(dat) < MAC_SECTOR_LENGTH:
+        raise ValueError('Mac sector too short (%d bytes)' % len(dat))
+    lookup_len = MAC_SECTOR_LENGTH // 3
+
+    # Scramble into three byte streams while computing the checksum.
+    b1, b2, b3 = [], [], []
+    c1 = c2 = c3 = 0
+    pos = 0
+    while True:
+        c1 = (c1 & 0xff) << 1
+        if c1 & 0x100:
+            c1 += 1
+        val = dat[pos]
+        c3 += val
+        if c1 & 0x100:
+            c3 += 1
+            c1 &= 0xff
+        b1.append((val ^ c1) & 0xff)
+        val = dat[pos+1]
+        c2 += val
+        if c3 > 0xff:
+            c2 += 1
+            c3 &= 0xff
+        b2.append((val ^ c3) & 0xff)
+        pos += 2
+        if pos == MAC_SECTOR_LENGTH:
+            break
+        val = dat[pos]
+        pos += 1
+        c1 += val
+        if c2 > 0xff:
+            c1 += 1
+            c2 &= 0xff
+        b3.append((val ^ c2) & 0xff)
+    c4 = ((c1 & 0xc0) >> 6) | ((c2 & 0xc0) >> 4) | ((c3 & 0xc0) >> 2)
+    b3.append(0)
+
+    # Pack into 6-bit nibbles.
+    out = bytearray()
+    for i in range(lookup_len + 1):
+        w4 = ((b1[i] & 0xc0) >> 2) | ((b2[i] & 0xc0) >> 4) | (b3[i] >> 6)
+        out += bytes((w4, b1[i] & 0x3f, b2[i] & 0x3f))
+        if i != lookup_len:
+            out.append(b3[i] & 0x3f)
+    out += bytes([c4 & 0x3f, c3 & 0x3f, c2 & 0x3f, c1 & 0x3f])
+    return bytes(out)
+
+
+def decode_apple2_sector(dat: bytes) -> Tuple[bytes, int]:
+    # Resynchronise on each disk byte's top bit, skipping any slipped zero
+    # bits between bytes (see apple2.c).
+    bits = bitarray(endian='big')
+    bits.frombytes(bytes(dat))
+    mid = bytearray()
+    pos = 0
+    while len(mid) < APPLE2_ENCODED_SECTOR_LENGTH+1:
+        pos = bits.find(1, pos)
+        if pos < 0 or pos + 8 > len(bits):
+            return bytes(APPLE2_SECTOR_LENGTH), 1
+        mid.append(ba2int(bits[pos:pos+8]))
+        pos += 8
+    mid = mid.translate(_6a2_decode)
+
+    out = bytearray(APPLE2_SECTOR_LENGTH)
+    checksum = 0
+    for i in range(APPLE2_ENCODED_SECTOR_LENGTH):
+        checksum ^= mid[i]
+        if i >= 86:
+            # 6 bit
+            out[i-86] |= (checksum << 2) & 0xff
+        else:
+            # 3 * 2 bit
+            out[i] = ((checksum >> 1) & 0x01) | ((checksum << 1) & 0x02)
+            out[i+86] = ((checksum >> 3) & 0x01) | ((checksum >> 1) & 0x02)
+            if i + 172 < APPLE2_SECTOR_LENGTH:
+                out[i+172] = (((checksum >> 5) & 0x01)
+                              | ((checksum >> 3) & 0x02))
+
+    checksum &= 0x3f
+    return bytes(out), int(checksum != mid[APPLE2_ENCODED_SECTOR_LENGTH])
+
+
+def encode_apple2_sector(dat: bytes) -> bytes:
+    if len(dat) < APPLE2_SECTOR_LENGTH:
+        raise ValueError('Apple2 sector too short (%d bytes)' % len(dat))
+    twobit_count = 0x56
+    values = bytearray()
+    for i in range(APPLE2_ENCODED_SECTOR_LENGTH):
+        if i >= twobit_count:
+            value = dat[i-twobit_count] >> 2
+        else:
+            tmp = dat[i]
+            value = ((tmp & 1) << 1) | ((tmp & 2) >> 1)
+            tmp = dat[i+twobit_count]
+            value |= ((tmp & 1) << 3) | ((tmp & 2) << 1)
+            if i + 2*twobit_count < APPLE2_SECTOR_LENGTH:
+                tmp = dat[i+2*twobit_count]
+                value |= ((tmp & 1) << 5) | ((tmp & 2) << 3)
+        values.append(value)
+    # Each disk byte encodes the XOR of adjacent values; the final byte is
+    # the checksum (the last value).
+    chained = bytes(a ^ b for a, b in zip(values, b'\x00' + values))
+    return (chained + values[-1:]).translate(_6a2_encode)
+
+# Local variables:
+# python-indent: 4
+# End:
@@ -11,7 +11,8 @@ def flux_to_bitcells(bit_array, time_array, revolutions,
                      pll_period_adj, pll_phase_adj) -> None:
     ...
 
-def decode_flux(dat: bytes) -> Tuple[List[float], List[float]]:
+def decode_flux(dat: Union[bytes, memoryview]
+                ) -> Tuple[List[float], List[float]]:
     ...
 
 def decode_mac_gcr(dat: bytes) -> bytes:
@@ -0,0 +1,614 @@
+# greaseweazle/sim.py
+#
+# Virtual Greaseweazle device, backed by a disk image.
+#
+# This is free and unencumbered software released into the public domain.
+# See the file COPYING for more details, or visit <http://unlicense.org>.
+#
+# The simulator speaks the Greaseweazle serial protocol (see usb.py) and
+# serves flux from any readable image (SCP, KryoFlux, HFE, ...). It may be
+# used in-process, by passing a device name of the form
+#   sim:<image>[::opt=val[:opt=val...]]
+# to any gw command (eg. gw read --device sim:disk.scp::realtime=0 ...),
+# or served on a pseudo-terminal for use by other programs:
+#   python3 -m greaseweazle.sim disk.scp::misalign=0.3
+#
+# Options:
+#  realtime=0|1: Delay responses as a real drive would (default: 1)
+#  step=N:       Step delay in microseconds (default: 3000)
+#  settle=N:     Head-settle delay in milliseconds (default: 15)
+#  rpm=N:        Spindle speed (default: the speed of the image)
+#  jitter=N:     Standard deviation of per-revolution speed, in percent
+#  misalign=N:   Head offset as a fraction of the track pitch. Offsets of
+#                0.5 or more read the neighbouring cylinder; smaller offsets
+#                add proportional noise to every flux interval.
+#  index=N:      Index pulse position, as a fraction of a revolution into
+#                the track data (default: 0, at the start of the data)
+#  cyls=N:       Number of cylinders the drive can reach (default: 84)
+#  format=F:     Disk format, for sector images (eg. format=ibm.1440)
+#  seed=N:       Random seed, for reproducible jitter and noise
+#  wrprot:       Report the disk as write protected
+
+from typing import Dict, List, Optional, Tuple, Iterator
+
+import os, sys, struct, time, random, select
+
+from greaseweazle import error
+from greaseweazle.flux import Flux
+from greaseweazle.usb import Cmd, Ack, GetInfo, Params, FluxOp
+
+# Firmware identity reported by Cmd.GetInfo.
+SIM_VERSION = (1, 6)
+SIM_SAMPLE_FREQ = 72000000
+SIM_HW_MODEL = (7, 0)
+
+# Default Params.Delays, as in the Greaseweazle firmware:
+# select (us), step (us), seek_settle (ms), motor (ms), watchdog (ms),
+# pre_write (us), post_write (us), index_mask (us)
+DEFAULT_DELAYS = (10, 3000, 15, 750, 10000, 100, 1000, 200)
+
+class SimOpts:
+
+    def __init__(self) -> None:
+        self.realtime = True
+        self.step: Optional[int] = None
+        self.settle: Optional[int] = None
+        self.rpm: Optional[float] = None
+        self.jitter = 0.0
+        self.misalign = 0.0
+        self.index = 0.0
+        self.cyls = 84
+        self.format: Optional[str] = None
+        self.seed: Optional[int] = None
+        self.wrprot = False
+
+    def set(self, opt: str, val: str) -> None:
+        try:
+            if opt == 'realtime':
+                self.realtime = val.lower() not in ['0', 'no', 'off']
+            elif opt in ['step', 'settle', 'cyls', 'seed']:
+                setattr(self, opt, int(val))
+            elif opt in ['rpm', 'jitter', 'misalign', 'index']:
+                setattr(self, opt, float(val))
+            elif opt == 'format':
+                self.format = val
+            elif opt == 'wrprot':
+                self.wrprot = val.lower() not in ['0', 'no', 'off']
+            else:
+                raise error.Fatal("Simulator: Invalid option: %s" % opt)
+        except ValueError:
+            raise error.Fatal("Simulator: Bad value for %s: '%s'"
+                              % (opt, val))
+
+
+class SimPortInfo:
+    """Stands in for a pyserial ListPortInfo."""
+
+    def __init__(self, name: str) -> None:
+        self.device = name
+        self.name = name
+        self.description = 'Greaseweazle Simulator'
+        self.manufacturer = 'Keir Fraser'
+        self.product = 'Greaseweazle'
+        self.serial_number = 'GWSIM'
+        self.location = None
+        self.vid = self.pid = None
+
+
+def write_28bit(dat: bytearray, x: int) -> None:
+    dat.append(1 | (x<<1) & 255)
+    dat.append(1 | (x>>6) & 255)
+    dat.append(1 | (x>>13) & 255)
+    dat.append(1 | (x>>20) & 255)
+
+
+def read_28bit(dat: bytes, i: int) -> int:
+    val =  (dat[i] & 254) >>  1
+    val += (dat[i+1] & 254) <<  6
+    val += (dat[i+2] & 254) << 13
+    val += (dat[i+3] & 254) << 20
+    return val
+
+
+def encode_read_stream(dat: bytearray, val: int) -> None:
+    """Appends one flux interval to a ReadFlux data stream."""
+    if val < 250:
+        dat.append(val)
+    elif val < 1525:
+        high, low = divmod(val-250, 255)
+        dat.append(250 + high)
+        dat.append(1 + low)
+    else:
+        dat.append(255)
+        dat.append(FluxOp.Space)
+        write_28bit(dat, val - 249)
+        dat.append(249)
+
+
+def decode_write_stream(dat: bytes) -> List[float]:
+    """Decodes a WriteFlux data stream (without its terminator)."""
+    flux: List[float] = []
+    ticks, i = 0, 0
+    while i < len(dat):
+        x = dat[i]
+        if x == 255:
+            if dat[i+1] == FluxOp.Space:
+                ticks += read_28bit(dat, i+2)
+            i += 6
+            continue
+        if x < 250:
+            ticks += x
+            i += 1
+        else:
+            ticks += 250 + (x-250)*255 + dat[i+1] - 1
+            i += 2
+        flux.append(ticks)
+        ticks = 0
+    return flux
+
+
+class SimDrive:
+    """A floppy drive containing the disk described by an image."""
+
+    def __init__(self, image, opts: SimOpts) -> None:
+        self.image = image
+        self.opts = opts
+        self.rng = random.Random(opts.seed)
+        self.cyl = 0
+        # Like the firmware, forget the head position on reset: the next
+        # seek first recalibrates against Track 0.
+        self.cyl_valid = False
+        self.head = 0
+        self.motor = False
+        # Tracks written via WriteFlux/EraseFlux, overriding the image.
+        self.written: Dict[Tuple[int,int], Flux] = dict()
+        # Revolutions of the most recently read tracks, at SIM_SAMPLE_FREQ.
+        self.revs: Dict[Tuple[int,int], List[List[float]]] = dict()
+        # Statistics, for benchmarks.
+        self.nr_steps = 0
+        self.nr_reads = 0
+
+    def source_track(self) -> Tuple[int,int]:
+        """The track under the head, taking misalignment into account."""
+        m = self.opts.misalign
+        cyl = self.cyl + int(m + (0.5 if m > 0 else -0.5))
+        return max(0, min(cyl, self.opts.cyls-1)), self.head
+
+    def revolutions(self, cyl: int, head: int) -> List[List[float]]:
+        """Returns the track's revolutions of flux, at SIM_SAMPLE_FREQ."""
+        revs = self.revs.get((cyl, head))
+        if revs is not None:
+            return revs
+        flux: Optional[Flux]
+        if (cyl, head) in self.written:
+            flux = self.written[cyl, head]
+        else:
+            track = self.image.get_track(cyl, head)
+            flux = None if track is None else track.flux()
+        revs = []
+        if flux is not None and flux.list:
+            if not flux.index_cued and len(flux.index_list) >= 2:
+                flux.cue_at_index()
+            factor = SIM_SAMPLE_FREQ / flux.sample_freq
+            i = 0
+            for rev_ticks in flux.index_list:
+                rev, to_index = [], rev_ticks
+                while i < len(flux.list) and to_index > 0:
+                    to_index -= flux.list[i]
+                    rev.append(flux.list[i] * factor)
+                    i += 1
+                if rev:
+                    revs.append(rev)
+            if not revs:
+                revs.append([x*factor for x in flux.list])
+            if self.opts.index:
+                revs = [self.rotate(rev) for rev in revs]
+        if not revs:
+            # Unformatted: No flux at all, but the index still turns.
+            revs.append([SIM_SAMPLE_FREQ * 0.2])
+        if len(self.revs) >= 4:
+            del self.revs[next(iter(self.revs))]
+        self.revs[cyl, head] = revs
+        return revs
+
+    def rotate(self, rev: List[float]) -> List[float]:
+        """Rotates a revolution so that its index pulse falls the
+        configured fraction of a revolution into its data."""
+        to_index = (self.opts.index % 1) * sum(rev)
+        for i, x in enumerate(rev):
+            to_index -= x
+            if to_index < 0:
+                return rev[i+1:] + rev[:i+1]
+        return rev
+
+    def stream(self) -> Iterator[Tuple[int, bool]]:
+        """Generates (flux interval, index-follows) forever, starting at a
+        random rotational position."""
+        revs = self.revolutions(*self.source_track())
+        o = self.opts
+        noise = abs(o.misalign) * 0.1 if abs(o.misalign) < 0.5 else 0
+        nr = self.rng.randrange(len(revs))
+        skip = self.rng.random() * sum(revs[nr])
+        while True:
+            rev = revs[nr]
+            scale = 1.0
+            if o.rpm is not None:
+                scale = (60 / o.rpm) * SIM_SAMPLE_FREQ / sum(rev)
+            if o.jitter:
+                scale *= 1 + self.rng.gauss(0, o.jitter / 100)
+            for j, x in enumerate(rev):
+                x *= scale
+                if noise:
+                    x *= 1 + self.rng.gauss(0, noise)
+                if skip > 0:
+                    skip -= x
+                    if skip >= 0:
+                        continue
+                    x, skip = -skip, 0
+                yield max(1, round(x)), j == len(rev)-1
+            nr = (nr + 1) % len(revs)
+
+    def read_flux(self, ticks: int,
+                  max_index: int) -> Tuple[bytearray, int]:
+        """Returns a ReadFlux data stream and its duration in ticks."""
+        dat = bytearray()
+        total, nr_index = 0, 0
+        self.nr_reads += 1
+        for val, index in self.stream():
+            encode_read_stream(dat, val)
+            total += val
+            if index:
+                dat.append(255)
+                dat.append(FluxOp.Index)
+                write_28bit(dat, 0)
+                nr_index += 1
+                if max_index and nr_index >= max_index:
+                    break
+            if ticks and total >= ticks:
+                break
+        dat.append(0)
+        return dat, total
+
+    def rev_ticks(self) -> float:
+        """Duration of one revolution of the current track."""
+        return sum(self.revolutions(self.cyl, self.head)[0])
+
+    def write_flux(self, dat: bytes, terminate_at_index: bool) -> None:
+        """Replaces the current track with flux written from the index.
+        Flux written past the next index wraps round and overwrites the
+        start of the track."""
+        flux = decode_write_stream(dat)
+        rev_ticks = self.rev_ticks()
+        head: List[float] = []
+        tail: List[float] = []
+        total = 0.0
+        for x in flux:
+            total += x
+            if total <= rev_ticks:
+                head.append(x)
+            elif not terminate_at_index:
+                tail.append(x)
+        if tail:
+            wrap = sum(tail)
+            while head and wrap > 0:
+                wrap -= head.pop(0)
+            head = tail + head
+        if sum(head) < rev_ticks:
+            head.append(rev_ticks - sum(head))
+        key = (self.cyl, self.head)
+        self.written[key] = Flux([rev_ticks], head, SIM_SAMPLE_FREQ)
+        self.revs.pop(key, None)
+
+    def erase_flux(self) -> None:
+        rev_ticks = self.rev_ticks()
+        key = (self.cyl, self.head)
+        self.written[key] = Flux([rev_ticks], [], SIM_SAMPLE_FREQ)
+        self.revs.pop(key, None)
+
+
+class SimSerial:
+    """An in-process stand-in for the pyserial Serial object of a
+    Greaseweazle device. Commands are executed as soon as they are written,
+    and their responses queued for reading."""
+
+    def __init__(self, name: str) -> None:
+        from greaseweazle.tools import util
+        from greaseweazle.codec import codec
+        self.name = name
+        spec = name[4:] if name.startswith('sim:') else name
+        filename, opts = util.split_opts(spec)
+        self.opts = SimOpts()
+        for opt, val in opts.items():
+            self.opts.set(opt, val)
+        fmt_cls = None
+        if self.opts.format is not None:
+            fmt_cls = codec.get_diskdef(self.opts.format)
+            error.check(fmt_cls is not None,
+                        "Simulator: Unknown format '%s'" % self.opts.format)
+        image_class = util.get_image_class(filename)
+        image = image_class.from_file(filename, fmt_cls, dict())
+        self.drive = SimDrive(image, self.opts)
+        self.port_info = SimPortInfo(name)
+        self.baudrate = 9600
+        self.is_open = True
+        self.unit: Optional[int] = None
+        self.bus_type = 0
+        self.delays = self.default_delays()
+        self.flux_status = Ack.Okay
+        self.cmd = bytearray()
+        self.out = bytearray()
+        # Bulk data expected after the current command: (cmd, nr bytes).
+        # nr is None for a flux stream, which runs up to a zero byte.
+        self.sink: Optional[Tuple[int, Optional[int]]] = None
+        self.terminate_at_index = False
+        self.bw = (0, 1, 0, 1)
+
+    # pyserial interface
+
+    @property
+    def in_waiting(self) -> int:
+        return len(self.out)
+
+    def open(self) -> None:
+        self.is_open = True
+
+    def close(self) -> None:
+        self.is_open = False
+
+    def reset_input_buffer(self) -> None:
+        self.out = bytearray()
+
+    def reset_output_buffer(self) -> None:
+        self.cmd = bytearray()
+        self.sink = None
+
+    def read(self, size: int = 1) -> bytes:
+        dat, self.out = bytes(self.out[:size]), self.out[size:]
+        return dat
+
+    def readinto(self, b) -> int:
+        dat = self.read(len(b))
+        b[:len(dat)] = dat
+        return len(dat)
+
+    def write(self, dat: bytes) -> int:
+        self.cmd += dat
+        while self.cmd:
+            if self.sink is not None:
+                if not self.sink_data():
+                    break
+            elif len(self.cmd) < 2 or len(self.cmd) < self.cmd[1]:
+                break
+            else:
+                n = self.cmd[1]
+                cmd, self.cmd = bytes(self.cmd[:n]), self.cmd[n:]
+                self.command(cmd)
+        return len(dat)
+
+    # Device implementation
+
+    def default_delays(self) -> bytearray:
+        delays = bytearray(struct.pack('<8H', *DEFAULT_DELAYS))
+        if self.opts.step is not None:
+            delays[2:4] = struct.pack('<H', self.opts.step)
+        if self.opts.settle is not None:
+            delays[4:6] = struct.pack('<H', self.opts.settle)
+        return delays
+
+    def delay(self, secs: float) -> None:
+        if self.opts.realtime and secs > 0:
+            time.sleep(secs)
+
+    def ack(self, cmd: bytes, code: int = Ack.Okay) -> None:
+        self.out += struct.pack('2B', cmd[0], code)
+
+    def sink_data(self) -> bool:
+        """Consumes bulk data following a command. Returns False if more
+        data is needed."""
+        assert self.sink is not None
+        c, nr = self.sink
+        if nr is None:
+            end = self.cmd.find(0)
+            if end < 0:
+                return False
+            dat, self.cmd = bytes(self.cmd[:end]), self.cmd[end+1:]
+        else:
+            if len(self.cmd) < nr:
+                return False
+            dat, self.cmd = bytes(self.cmd[:nr]), self.cmd[nr:]
+        self.sink = None
+        if c == Cmd.WriteFlux:
+            self.drive.write_flux(dat, self.terminate_at_index)
+            self.delay(sum(decode_write_stream(dat)) / SIM_SAMPLE_FREQ)
+            self.out.append(0)
+        elif c == Cmd.SinkBytes:
+            self.bw = (len(dat), 1000, len(dat), 1000)
+            self.out.append(0)
+        return True
+
+    def command(self, cmd: bytes) -> None:
+        c = cmd[0]
+        drive = self.drive
+        if c == Cmd.GetInfo:
+            idx = cmd[2]
+            if idx == GetInfo.Firmware:
+                self.ack(cmd)
+                self.out += struct.pack(
+                    '<4BI4B3H14x', SIM_VERSION[0], SIM_VERSION[1], 1,
+                    Cmd.NoClickStep, SIM_SAMPLE_FREQ,
+                    SIM_HW_MODEL[0], SIM_HW_MODEL[1], 1, 0, 216, 64, 0)
+            elif idx == GetInfo.BandwidthStats:
+                self.ack(cmd)
+                self.out += struct.pack('<4I16x', *self.bw)
+            elif idx == GetInfo.CurrentDrive:
+                if self.unit is None:
+                    self.ack(cmd, Ack.NoUnit)
+                    return
+                self.ack(cmd)
+                self.out += struct.pack('<Ii24x',
+                                        (1 if drive.cyl_valid else 0)
+                                        | (2 if drive.motor else 0),
+                                        drive.cyl)
+            else:
+                self.ack(cmd, Ack.BadCommand)
+        elif c == Cmd.Seek:
+            cyl, = struct.unpack('<b' if len(cmd) == 3 else '<h', cmd[2:])
+            if self.unit is None:
+                self.ack(cmd, Ack.NoUnit)
+            elif not 0 <= cyl < self.opts.cyls:
+                self.ack(cmd, Ack.BadCylinder)
+            else:
+                step_us, settle_ms = struct.unpack('<2H', self.delays[2:6])
+                if drive.cyl_valid:
+                    steps = abs(cyl - drive.cyl)
+                else:
+                    steps = drive.cyl + cyl
+                drive.nr_steps += steps
+                drive.cyl, drive.cyl_valid = cyl, True
+                if steps:
+                    self.delay(steps*step_us*1e-6 + settle_ms*1e-3)
+                self.ack(cmd)
+        elif c == Cmd.Head:
+            if cmd[2] > 1:
+                self.ack(cmd, Ack.BadCommand)
+            else:
+                drive.head = cmd[2]
+                self.ack(cmd)
+        elif c == Cmd.SetParams:
+            if cmd[2] != Params.Delays:
+                self.ack(cmd, Ack.BadCommand)
+            else:
+                params = cmd[3:]
+                self.delays[:len(params)] = params
+                self.ack(cmd)
+        elif c == Cmd.GetParams:
+            if cmd[2] != Params.Delays or cmd[3] > len(self.delays):
+                self.ack(cmd, Ack.BadCommand)
+            else:
+                self.ack(cmd)
+                self.out += self.delays[:cmd[3]]
+        elif c == Cmd.Motor:
+            if self.bus_type == 0:
+                self.ack(cmd, Ack.NoBus)
+                return
+            state = bool(cmd[3])
+            if state and not drive.motor:
+                motor_ms, = struct.unpack('<H', self.delays[6:8])
+                self.delay(motor_ms*1e-3)
+            drive.motor = state
+            self.ack(cmd)
+        elif c == Cmd.ReadFlux:
+            ticks, max_index = struct.unpack('<IH', cmd[2:8])
+            if self.unit is None:
+                self.ack(cmd, Ack.NoUnit)
+                return
+            t = time.time()
+            dat, total = drive.read_flux(ticks, max_index)
+            self.delay(total/SIM_SAMPLE_FREQ - (time.time()-t))
+            self.ack(cmd)
+            self.out += dat
+            self.flux_status = Ack.Okay
+        elif c == Cmd.WriteFlux:
+            if self.unit is None:
+                self.ack(cmd, Ack.NoUnit)
+            elif self.opts.wrprot:
+                self.ack(cmd, Ack.Wrprot)
+            else:
+                self.ack(cmd)
+                self.terminate_at_index = bool(cmd[3])
+                self.sink = (c, None)
+        elif c == Cmd.EraseFlux:
+            ticks, = struct.unpack('<I', cmd[2:6])
+            if self.unit is None:
+                self.ack(cmd, Ack.NoUnit)
+            elif self.opts.wrprot:
+                self.ack(cmd, Ack.Wrprot)
+            else:
+                self.ack(cmd)
+                drive.erase_flux()
+                self.delay(ticks/SIM_SAMPLE_FREQ)
+                self.out.append(0)
+        elif c == Cmd.GetFluxStatus:
+            self.ack(cmd, self.flux_status)
+        elif c == Cmd.Select:
+            if cmd[2] > 3:
+                self.ack(cmd, Ack.BadUnit)
+            elif self.bus_type == 0:
+                self.ack(cmd, Ack.NoBus)
+            else:
+                self.unit = cmd[2]
+                self.ack(cmd)
+        elif c == Cmd.Deselect:
+            self.unit = None
+            self.ack(cmd)
+        elif c == Cmd.SetBusType:
+            self.bus_type = cmd[2]
+            self.ack(cmd)
+        elif c == Cmd.SetPin:
+            self.ack(cmd)
+        elif c == Cmd.GetPin:
+            pin = cmd[2]
+            if pin == 26: # /TRK0
+                level = drive.cyl != 0
+            elif pin == 28: # /WRPROT
+                level = not self.opts.wrprot
+            else:
+                level = True
+            self.ack(cmd)
+            self.out.append(int(level))
+        elif c == Cmd.Reset:
+            self.unit, self.bus_type = None, 0
+            drive.motor = False
+            drive.cyl_valid = False
+            self.delays[:] = self.default_delays()
+            self.ack(cmd)
+        elif c == Cmd.SourceBytes:
+            nr, seed = struct.unpack('<2I', cmd[2:10])
+            self.ack(cmd)
+            r = seed
+            for i in range(nr):
+                self.out.append(r&255)
+                r = (r>>1) ^ 0x80000062 if r & 1 else r>>1
+            self.bw = (nr, 1000, nr, 1000)
+        elif c == Cmd.SinkBytes:
+            nr, seed = struct.unpack('<2I', cmd[2:10])
+            self.ack(cmd)
+            self.sink = (c, nr)
+        elif c == Cmd.NoClickStep:
+            self.ack(cmd)
+        else:
+            self.ack(cmd, Ack.BadCommand)
+
+
+def serve_pty(ser: SimSerial) -> None:
+    """Serves the simulated device on a pseudo-terminal until interrupted."""
+    import tty
+    master, slave = os.openpty()
+    tty.setraw(master)
+    print('Greaseweazle simulator on %s' % os.ttyname(slave))
+    try:
+        while True:
+            select.select([master], [], [])
+            ser.write(os.read(master, 65536))
+            while ser.in_waiting:
+                os.write(master, ser.read(ser.in_waiting))
+    finally:
+        os.close(master)
+        os.close(slave)
+
+
+def main(argv) -> None:
+    error.check(len(argv) == 2,
+                'Usage: python3 -m greaseweazle.sim <image>[::opts]')
+    try:
+        serve_pty(SimSerial(argv[1]))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main(sys.argv)
+
+# Local variables:
+# python-indent: 4
+# End:
@@ -9,21 +9,24 @@
 
 description = "Repeatedly read the same track for floppy drive alignment."
 
-from typing import cast, Dict, Tuple, List, Type, Optional
+from typing import cast, Callable, Dict, Tuple, List, Type, Optional
 
-import sys, copy, time
+import sys, copy, time, io, re, contextlib
+import itertools as it
+from concurrent.futures import ProcessPoolExecutor
 
 from greaseweazle.tools import util
 from greaseweazle import error
 from greaseweazle import usb as USB
 from greaseweazle.flux import Flux, HasFlux
+from greaseweazle.fluxarchive import FluxArchive, FluxArchiveWriter
 from greaseweazle.codec import codec
 from greaseweazle.image import image
 
 from greaseweazle import track
 plls = track.plls
 
-def read_and_normalise(usb: USB.Unit, args, revs: int, ticks=0) -> Flux:
+def read_flux(usb: USB.Unit, args, revs: int, ticks=0) -> Flux:
     if args.fake_index is not None:
         drive_tpr = int(args.drive_ticks_per_rev)
         pre_index = int(usb.sample_freq * 0.5e-3)
@@ -34,6 +37,10 @@ def read_and_normalise(usb: USB.Unit, args, revs: int, ticks=0) -> Flux:
         flux.index_list = cast(List[float], index_list) # mypy
     else:
         flux = usb.read_track(revs=revs, ticks=ticks)
+    return flux
+
+
+def normalise(args, flux: Flux) -> None:
     flux._ticks_per_rev = args.drive_ticks_per_rev
     if args.reverse:
         flux.reverse()
@@ -41,7 +48,6 @@ def read_and_normalise(usb: USB.Unit, args, revs: int, ticks=0) -> Flux:
         flux.identify_hard_sectors()
     if args.adjust_speed is not None:
         flux.scale(args.adjust_speed / flux.time_per_rev)
-    return flux
 
 
 def align_track(usb: USB.Unit, args) -> None:
@@ -82,11 +88,32 @@ def align_track(usb: USB.Unit, args) -> None:
     if len(track_list) == 0:
         raise error.Fatal("Align command requires at least one track (e.g., c=40:h=0)")
     
-    if len(track_list) > 1:
-        cyl = track_list[0][0]  
-        for track_info in track_list[1:]:
-            if track_info[0] != cyl:
-                raise error.Fatal("All tracks must be on the same cylinder for alignment")
+    # Tracks are in physical order: group them by cylinder. A sweep over
+    # several cylinders runs in this one session, so the head moves at most
+    # one cylinder at a time and recalibrates against Track 0 only once.
+    cyl_groups: List[List[Tuple[int,int,int,int]]] = []
+    for track_info in track_list:
+        if cyl_groups and cyl_groups[-1][0][0] == track_info[0]:
+            cyl_groups[-1].append(track_info)
+        else:
+            cyl_groups.append([track_info])
+
+    args.pool = None
+    if args.per_rev and args.jobs > 1:
+        with ProcessPoolExecutor(
+                args.jobs, initializer=init_worker,
+                initargs=(args.fmt_cls, plls)) as args.pool:
+            for group in cyl_groups:
+                align_cylinder(usb, args, group)
+    else:
+        for group in cyl_groups:
+            align_cylinder(usb, args, group)
+
+
+def align_cylinder(usb: USB.Unit, args,
+                   track_list: List[Tuple[int,int,int,int]]) -> None:
+    """Repeatedly reads the tracks of one cylinder, alternating heads.
+    """
 
     cyl = track_list[0][0]
     
@@ -106,6 +133,10 @@ def align_track(usb: USB.Unit, args) -> None:
     if args.gen_tg43:
         usb.set_pin(2, cyl < 60)
 
+    if args.stream:
+        stream_track(usb, args, cyl, track_list)
+        return
+
     for read_num in range(1, args.reads + 1):
         _, head, physical_cyl, physical_head = track_list[(read_num - 1) % len(track_list)]
         
@@ -115,36 +146,334 @@ def align_track(usb: USB.Unit, args) -> None:
         
         usb.seek(physical_cyl, physical_head)
      
-        flux = read_and_normalise(usb, args, args.revs, args.ticks)
-        
-        if args.fmt_cls is None:
-            print(f'{tspec}: {flux.summary_string()}')
+        revs, ticks = args.revs, args.ticks
+        if args.per_rev:
+            # The extra revolution completes any sector straddling the
+            # final index.
+            revs += 1
+            if ticks:
+                ticks += int(args.drive_ticks_per_rev)
+        flux = read_flux(usb, args, revs, ticks)
+        if args.flux_archive is not None:
+            args.flux_archive.append(cyl, head, flux)
+        normalise(args, flux)
+        if args.per_rev:
+            report_revolutions(args, tspec, cyl, head, flux)
         else:
-            dat = args.fmt_cls.decode_flux(cyl, head, flux)
-            if dat is None:
-                print("%s: WARNING: Out of range for format '%s': No format "
-                      "conversion applied: %s" % (tspec, args.format,
-                        flux.summary_string()))
-            else:
-                for pll in plls[1:]:
-                    if dat.nr_missing() == 0:
-                        break
-                    dat.decode_flux(flux, pll)
-                
-                print("%s: %s from %s" % (tspec, dat.summary_string(),
-                                            flux.summary_string()))
+            report_flux(args, tspec, cyl, head, flux)
                 
         if read_num < args.reads:
             time.sleep(0.1)
 
 
+def report_flux(args, tspec: str, cyl: int, head: int, flux: Flux) -> None:
+    if args.fmt_cls is None:
+        print(f'{tspec}: {flux.summary_string()}')
+    else:
+        dat = args.fmt_cls.decode_flux(cyl, head, flux)
+        if dat is None:
+            print("%s: WARNING: Out of range for format '%s': No format "
+                  "conversion applied: %s" % (tspec, args.format,
+                    flux.summary_string()))
+        else:
+            for pll in plls[1:]:
+                if dat.nr_missing() == 0:
+                    break
+                dat.decode_flux(flux, pll)
+            
+            print("%s: %s from %s" % (tspec, dat.summary_string(),
+                                        flux.summary_string()))
+    sys.stdout.flush()
+
+
+# Flux preceding each index pulse which is included in a --per-rev
+# revolution, for the PLL to lock in on.
+rev_overlap = 1e-3 # seconds
+
+# Flux following each revolution's closing index which is included in a
+# --per-rev revolution, in sector lengths. A sector which straddles the
+# index is then read in full, in the revolution in which it starts.
+rev_tail_sectors = 1.5
+
+def rev_tail(fmt_cls, cyl: int, head: int, ticks_per_rev: float) -> float:
+    """Returns the flux following a revolution's closing index, in sample
+    ticks, which is needed to read a sector straddling that index."""
+    t = fmt_cls.mk_track(cyl, head)
+    nsec = 0 if t is None else t.nsec
+    if nsec == 0:
+        return ticks_per_rev
+    return min(ticks_per_rev, ticks_per_rev * rev_tail_sectors / nsec)
+
+
+def split_revolutions(flux: Flux, tail: float) -> List[Tuple[Flux, int]]:
+    """Splits flux at its index pulses, into one Flux per full revolution,
+    and the number of its flux samples which precede the closing index.
+    Each revolution is preceded by up to rev_overlap of the flux before its
+    index, and followed by tail ticks of the flux after its closing index.
+    Revolutions which are not followed by enough flux are omitted.
+    """
+    index_list = flux.index_list
+    if flux.index_cued:
+        index_list = [0] + index_list
+    index_pos = list(it.accumulate(index_list))
+    overlap = rev_overlap * flux.sample_freq
+    revs: List[Tuple[Flux, int]] = []
+    # Find the first flux sample following each index pulse, and each
+    # revolution's tail.
+    pos, stop, t, i = [], [], 0.0, 0
+    for index in index_pos:
+        while i < len(flux.list) and t < index:
+            t += flux.list[i]
+            i += 1
+        if t < index:
+            break
+        pos.append(i)
+    t, i = 0.0, 0
+    for index in index_pos[1:len(pos)]:
+        while i < len(flux.list) and t < index + tail:
+            t += flux.list[i]
+            i += 1
+        if t < index + tail:
+            break
+        stop.append(i)
+    for start, end, last, ticks in zip(pos, pos[1:], stop, index_list[1:]):
+        pre, s = 0.0, start
+        while s > 0 and pre + flux.list[s-1] <= overlap:
+            s -= 1
+            pre += flux.list[s]
+        # The revolution is index-cued so that codecs which cue at the
+        # index do not clip the lead-in.
+        revs.append((Flux([ticks], flux.list[s:last],
+                          flux.sample_freq), end - s))
+    return revs
+
+
+def decode_window(fmt_cls, cyl: int, head: int,
+                  flux: Flux) -> Optional[codec.Codec]:
+    """Decodes flux, with each PLL in turn until no sector is missing.
+    """
+    dat = fmt_cls.decode_flux(cyl, head, flux)
+    if dat is None:
+        return None
+    for pll in plls[1:]:
+        if dat.nr_missing() == 0:
+            break
+        dat.decode_flux(flux, pll)
+    return dat
+
+
+def decode_revolution(fmt_cls, cyl: int, head: int, flux: Flux,
+                      nr: int) -> Optional[Tuple[str, List[bool]]]:
+    """Decodes one revolution from split_revolutions(), of which the first
+    nr flux samples precede the closing index. Returns its summary and
+    its sector map, of the sectors which start in this revolution.
+    """
+    def window(flux_list: List[float]) -> Flux:
+        return Flux(flux.index_list, flux_list, flux.sample_freq)
+    # Sectors which end before the closing index.
+    dat = decode_window(fmt_cls, cyl, head, window(flux.list[:nr]))
+    if dat is None:
+        return None
+    secs = [dat.has_sec(i) for i in range(dat.nsec)]
+    if all(secs):
+        return dat.summary_string(), secs
+    # Sectors which straddle the closing index are read in full from the
+    # tail. Sectors which start in the tail belong to the next revolution
+    # and are discounted.
+    whole = decode_window(fmt_cls, cyl, head, flux)
+    assert whole is not None
+    extra = [whole.has_sec(i) and not secs[i] for i in range(dat.nsec)]
+    if any(extra):
+        tail = decode_window(fmt_cls, cyl, head, window(flux.list[nr:]))
+        assert tail is not None
+        for i in range(dat.nsec):
+            secs[i] = secs[i] or (extra[i] and not tail.has_sec(i))
+    return dat.summary_string(), secs
+
+
+# Per-process state of a --jobs worker: The format to decode.
+worker_fmt_cls = None
+
+def init_worker(fmt_cls, _plls) -> None:
+    global worker_fmt_cls
+    plls[:] = _plls
+    worker_fmt_cls = fmt_cls
+
+
+def decode_revolution_worker(
+        cyl: int, head: int, flux: Flux, nr: int
+) -> Tuple[str, Optional[Tuple[str, List[bool]]]]:
+    """Runs decode_revolution() in a --jobs worker. Console output is
+    captured and handed back along with the result."""
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        res = decode_revolution(worker_fmt_cls, cyl, head, flux, nr)
+    return out.getvalue(), res
+
+
+def report_revolutions(args, tspec: str, cyl: int, head: int,
+                       flux: Flux) -> None:
+    """Decodes each revolution of flux independently (in args.pool, if
+    any). Reports the merged result, then each revolution's sector map.
+    """
+    revs = split_revolutions(flux, rev_tail(args.fmt_cls, cyl, head,
+                                            flux.ticks_per_rev))
+    if not revs:
+        print("%s: WARNING: No complete revolution to decode: %s"
+              % (tspec, flux.summary_string()))
+        sys.stdout.flush()
+        return
+    if args.pool is None:
+        results = [('', decode_revolution(args.fmt_cls, cyl, head, f, nr))
+                   for f, nr in revs]
+    else:
+        results = list(args.pool.map(decode_revolution_worker,
+                                     it.repeat(cyl), it.repeat(head),
+                                     *zip(*revs)))
+    for output, _ in results:
+        print(output, end='')
+    decoded = [res for _, res in results if res is not None]
+    if not decoded:
+        print("%s: WARNING: Out of range for format '%s': No format "
+              "conversion applied: %s" % (tspec, args.format,
+                                          flux.summary_string()))
+        sys.stdout.flush()
+        return
+
+    # A sector is good if it is good in any revolution.
+    maps = [m for _, m in decoded]
+    nsec = max(map(len, maps))
+    good = sum(any(m[i] for m in maps if i < len(m)) for i in range(nsec))
+    summary = re.sub(r'\(\d+/\d+ sectors\)', f'({good}/{nsec} sectors)',
+                     decoded[0][0], count = 1)
+    print("%s: %s from %s" % (tspec, summary, flux.summary_string()))
+    # Revolutions are numbered as read, including any that did not decode.
+    for i, (_, res) in enumerate(results, 1):
+        if res is None:
+            continue
+        _, m = res
+        print("  Rev %d: %s %d/%d" % (i, ''.join('.' if x else 'X' for x in m),
+                                      sum(m), len(m)))
+    sys.stdout.flush()
+
+
+class RevolutionStream(USB.FluxStreamDecoder):
+    """Splits a flux stream at its index pulses, handing each revolution
+    to a callback as soon as it has been received.
+    """
+
+    def __init__(self, sample_freq: float,
+                 on_rev: Callable[[Flux], None]) -> None:
+        self.sample_freq = sample_freq
+        self.on_rev = on_rev
+        super().__init__()
+
+    def feed(self, dat) -> Tuple[List[float], List[float]]:
+        nr = len(self.index_list)
+        flux, index = super().feed(dat)
+        # The flux preceding the first index pulse is a partial revolution.
+        for i in range(max(nr, 1), len(self.index_list)):
+            start, end = self.index_pos[i-1], self.index_pos[i]
+            self.on_rev(Flux([self.index_list[i]], self.flux_list[start:end],
+                             self.sample_freq))
+        return flux, index
+
+
+def stream_track(usb: USB.Unit, args, cyl: int,
+                 track_list: List[Tuple[int,int,int,int]]) -> None:
+    """Reads revolutions in long back-to-back captures, reporting each
+    revolution as it completes. Reports args.reads revolutions in total.
+    """
+
+    error.check(args.fake_index is None and not args.hard_sectors,
+                "--stream requires a drive with a single index pulse")
+    nr_reported, nr_captures = 0, 0
+    while nr_reported < args.reads:
+        _, head, physical_cyl, physical_head = track_list[
+            nr_captures % len(track_list)]
+        tspec = f'T{cyl}.{head}'
+        if physical_cyl != cyl or physical_head != head:
+            tspec += f' <- Drive {physical_cyl}.{physical_head}'
+        usb.seek(physical_cyl, physical_head)
+        revs = min(args.reads - nr_reported, args.revs)
+        def on_rev(flux: Flux) -> None:
+            nonlocal nr_reported
+            if nr_reported >= args.reads:
+                return
+            nr_reported += 1
+            if args.flux_archive is not None:
+                args.flux_archive.append(cyl, head, flux)
+            if args.reverse:
+                flux.reverse()
+            if args.adjust_speed is not None:
+                flux.scale(args.adjust_speed / flux.time_per_rev)
+            report_flux(args, tspec, cyl, head, flux)
+        usb.read_track(revs=revs,
+                       decoder=RevolutionStream(usb.sample_freq, on_rev))
+        nr_captures += 1
+
+def replay_read(args, archive: FluxArchive, offs: int) -> None:
+    cyl, head, flux = archive.read(offs)
+    normalise(args, flux)
+    if args.per_rev:
+        report_revolutions(args, f'T{cyl}.{head}', cyl, head, flux)
+    else:
+        report_flux(args, f'T{cyl}.{head}', cyl, head, flux)
+
+
+# Per-process state of a --replay --jobs worker.
+worker_args = None
+worker_archive: Optional[FluxArchive] = None
+
+def init_replay_worker(args, _plls) -> None:
+    global worker_args, worker_archive
+    plls[:] = _plls
+    worker_args = args
+    worker_archive = FluxArchive(args.replay)
+
+
+def replay_read_worker(offs: int) -> str:
+    """Runs replay_read() in a --jobs worker, returning its console
+    output for the parent to print in capture order."""
+    assert worker_archive is not None
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        replay_read(worker_args, worker_archive, offs)
+    return out.getvalue()
+
+
+def replay_archive(args) -> None:
+    """Decodes the archived captures of the selected tracks again, in
+    capture order, as though they were being read from the drive.
+    """
+    args.drive_ticks_per_rev, args.pool = None, None
+    archive = FluxArchive(args.replay)
+    offsets = [offs for cyl, head, offs in archive.chunks
+               if (cyl, head) in args.tracks]
+    print(f"Replaying {len(offsets)} reads from {args.replay}")
+    if args.format:
+        print("Format " + args.format)
+    if args.jobs > 1:
+        with ProcessPoolExecutor(
+                args.jobs, initializer=init_replay_worker,
+                initargs=(args, plls)) as pool:
+            for output in pool.map(replay_read_worker, offsets):
+                print(output, end='')
+                sys.stdout.flush()
+    else:
+        for offs in offsets:
+            replay_read(args, archive, offs)
+    archive.close()
+
+
 def main(argv) -> None:
 
     epilog = (util.drive_desc + "\n"
               + util.speed_desc + "\n" + util.tspec_desc
               + "\n" + util.pllspec_desc
               + "\nFORMAT options:\n" + codec.print_formats()
-              + "\n\nNote: TRACKS can specify one track (e.g., c=40:h=0) or multiple heads on same cylinder (e.g., c=40:h=0,1) to alternate between heads")
+              + "\n\nNote: TRACKS can specify one track (e.g., c=40:h=0) or multiple heads on same cylinder (e.g., c=40:h=0,1) to alternate between heads."
+              + "\nSeveral cylinders (e.g., c=0-79:h=0,1) are aligned one after the other, in a single sweep")
     parser = util.ArgumentParser(usage='%(prog)s [options]',
                                  epilog=epilog)
     parser.add_argument("--device", help="device name (COM/serial port)")
@@ -155,11 +484,25 @@ def main(argv) -> None:
     parser.add_argument("--revs", type=util.min_int(1), metavar="N", default=3,
                         help="number of revolutions to read per attempt")
     parser.add_argument("--tracks", type=util.TrackSet, metavar="TSPEC", required=True,
-                        help="which track(s) to read (single track or multiple heads on same cylinder)")
+                        help="which track(s) to read (heads of a cylinder alternate; cylinders are swept in order)")
     parser.add_argument("--reads", type=util.min_int(1), metavar="N", default=10,
                         help="number of times to read the track(s)")
     parser.add_argument("--raw", action="store_true",
                         help="read raw flux (no format decoding)")
+    parser.add_argument("--stream", action="store_true",
+                        help="report every revolution as it is read "
+                        "(READS counts revolutions, REVS per capture)")
+    parser.add_argument("--per-rev", action="store_true",
+                        help="decode each revolution separately, "
+                        "reporting its sector map")
+    parser.add_argument("--jobs", type=util.min_int(1), default=1,
+                        metavar="N", help="decode --per-rev revolutions, "
+                        "or --replay reads, in N processes")
+    parser.add_argument("--archive", metavar="FILE",
+                        help="append every capture to flux archive FILE")
+    parser.add_argument("--replay", metavar="FILE",
+                        help="decode the captures in flux archive FILE "
+                        "instead of reading the drive")
     index_group = parser.add_mutually_exclusive_group(required=False)
     index_group.add_argument("--fake-index", type=util.period, metavar="SPEED",
                              help="fake index pulses at SPEED")
@@ -184,7 +527,6 @@ def main(argv) -> None:
         plls.insert(0, args.pll)
 
     try:
-        usb = util.usb_open(args.device)
         def_tracks, args.fmt_cls = None, None
         if args.format:
             args.fmt_cls = codec.get_diskdef(args.format, args.diskdefs)
@@ -199,10 +541,29 @@ Known formats:\n%s"""
         if def_tracks is None:
             def_tracks = util.TrackSet('c=0-81:h=0-1')
         if args.revs is None: args.revs = 3
+        if args.per_rev:
+            error.check(args.fmt_cls is not None,
+                        "--per-rev requires --format")
+            error.check(not (args.stream or args.hard_sectors),
+                        "--per-rev cannot be used with --stream "
+                        "or --hard-sectors")
+        error.check(args.jobs == 1 or args.per_rev
+                    or args.replay is not None,
+                    "--jobs requires --per-rev or --replay")
         if args.tracks is not None:
             def_tracks.update_from_trackspec(args.tracks.trackspec)
         args.tracks = def_tracks
 
+        if args.replay is not None:
+            error.check(args.archive is None,
+                        "--replay cannot be used with --archive")
+            replay_archive(args)
+            return
+
+        usb = util.usb_open(args.device)
+        args.flux_archive = None
+        if args.archive is not None:
+            args.flux_archive = FluxArchiveWriter(args.archive)
         try:
             if args.densel is not None or args.gen_tg43:
                 prev_pin2 = usb.get_pin(2)
@@ -213,6 +574,8 @@ Known formats:\n%s"""
         finally:
             if args.densel is not None or args.gen_tg43:
                 usb.set_pin(2, prev_pin2)
+            if args.flux_archive is not None:
+                args.flux_archive.close()
     except USB.CmdError as err:
         print("Command Failed: %s" % err)
 
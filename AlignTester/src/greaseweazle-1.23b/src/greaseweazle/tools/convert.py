@@ -7,9 +7,10 @@
 
 description = "Convert between image formats."
 
-from typing import Dict, Tuple, Optional, Type
+from typing import Dict, Tuple, Optional, Type, Iterator
 
-import sys, copy
+import sys, copy, io, contextlib
+from concurrent.futures import ProcessPoolExecutor
 
 import greaseweazle.tools.read
 from greaseweazle.tools import util
@@ -92,18 +93,83 @@ def process_input_track(
     return dat
 
 
+# Per-process state of a --jobs worker: The arguments and its own handle
+# on the input image.
+worker_args = None
+worker_image: Optional[Image] = None
+
+def init_worker(args, image_class: Type[Image], _plls) -> None:
+    global worker_args, worker_image
+    plls[:] = _plls
+    worker_args = args
+    # The parent has already opened the image and printed any messages.
+    with contextlib.redirect_stdout(io.StringIO()):
+        worker_image = open_input_image(args, image_class)
+
+
+def process_input_track_worker(
+        t: TrackIdentity
+) -> Tuple[str, Optional[HasFlux]]:
+    """Runs process_input_track() in a --jobs worker. Console output is
+    captured and handed back along with the result, for the parent to
+    print in track order."""
+    assert worker_image is not None
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        dat = process_input_track(worker_args, t, worker_image)
+    return out.getvalue(), dat
+
+
+def process_input_tracks(
+        args,
+        in_image_class: Type[Image]
+) -> Iterator[Optional[HasFlux]]:
+    """Decodes the input tracks needed by args.out_tracks in a pool of
+    args.jobs processes. Results are yielded in output-track order, with
+    at most 2*args.jobs tracks decoded ahead of the consumer."""
+    todo = []
+    for t in args.out_tracks:
+        cyl, head = t.cyl, t.head
+        if (cyl, head) in args.tracks and (cyl, head) not in todo:
+            todo.append((cyl, head))
+    with ProcessPoolExecutor(
+            args.jobs, initializer=init_worker,
+            initargs=(args, in_image_class, plls)) as pool:
+        pending = []
+        for cyl, head in todo:
+            pending.append(pool.submit(
+                process_input_track_worker,
+                TrackIdentity(args.tracks, cyl, head)))
+            if len(pending) < 2*args.jobs:
+                continue
+            output, dat = pending.pop(0).result()
+            print(output, end='')
+            yield dat
+        for fut in pending:
+            output, dat = fut.result()
+            print(output, end='')
+            yield dat
+
+
 def convert(args, in_image: Image, out_image: Image) -> None:
 
     summary: Dict[Tuple[int,int],codec.Codec] = dict()
     dat: Optional[HasFlux]
 
+    results = None
+    if args.jobs > 1:
+        results = process_input_tracks(args, type(in_image))
+
     for t in args.out_tracks:
         cyl, head = t.cyl, t.head
         if (cyl, head) in summary:
             dat = summary[cyl, head]
         elif (cyl, head) in args.tracks:
-            dat = process_input_track(
-                args, TrackIdentity(args.tracks, cyl, head), in_image)
+            if results is not None:
+                dat = next(results)
+            else:
+                dat = process_input_track(
+                    args, TrackIdentity(args.tracks, cyl, head), in_image)
             if dat is None:
                 continue
             if args.fmt_cls is not None:
@@ -143,6 +209,8 @@ def main(argv) -> None:
                         help="convert index positions to hard sectors")
     parser.add_argument("--reverse", action="store_true",
                         help="reverse track data (flippy disk)")
+    parser.add_argument("--jobs", type=util.min_int(1), default=1,
+                        metavar="N", help="decode tracks in N processes")
     parser.add_argument("in_file", help="input filename")
     parser.add_argument("out_file", help="output filename")
     parser.description = description
@@ -193,8 +261,12 @@ Known formats:\n%s"""
         print("Format " + args.format)
     print("Converting %s -> %s" % (args.tracks, args.out_tracks))
 
-    with open_output_image(args, out_image_class) as out_image:
-        convert(args, in_image, out_image)
+    try:
+        with open_output_image(args, out_image_class) as out_image:
+            convert(args, in_image, out_image)
+        in_image.verify()
+    finally:
+        in_image.close()
 
 
 # Local variables:
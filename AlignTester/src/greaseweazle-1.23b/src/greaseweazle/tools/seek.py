@@ -7,26 +7,53 @@
 # This is free and unencumbered software released into the public domain.
 # See the file COPYING for more details, or visit <http://unlicense.org>.
 
-description = "Seek to the specified cylinder."
+description = "Seek to the specified cylinder(s)."
 
-import struct, sys
+import struct, sys, time
+from typing import Optional
 
 from greaseweazle.tools import util
+from greaseweazle.tools.delays import Delays
 from greaseweazle import error
 from greaseweazle import usb as USB
 from greaseweazle.flux import Flux
 
 
+def current_cyl(usb: USB.Unit) -> Optional[int]:
+    """Returns the firmware's idea of the head position, if it has one.
+    """
+    try:
+        return usb.get_current_drive_info().cyl
+    except USB.CmdError:
+        # GetInfo.CurrentDrive is unsupported by older firmwares.
+        return None
+
+
 def seek(usb: USB.Unit, args) -> None:
-    """Seeks to the cylinder specified in args.
+    """Seeks to each cylinder specified in args, in order, within a
+    single drive-select session.
     """
-    usb.seek(args.cylinder, 0)
+    if args.report:
+        delays = Delays(usb)
+        print(f'Delays: step={delays.step}us settle={delays.seek_settle}ms')
+        cur = current_cyl(usb)
+    for i, cyl in enumerate(args.cylinder):
+        if i and args.dwell:
+            time.sleep(args.dwell / 1000)
+        t = time.perf_counter()
+        usb.seek(cyl, 0)
+        t = time.perf_counter() - t
+        if args.report:
+            # Steps are unknown if the firmware must first recalibrate.
+            frm = '?' if cur is None else str(cur)
+            print(f'Seek {frm} -> {cyl}: {t*1000:.2f}ms', flush=True)
+            cur = cyl
 
 
 def main(argv) -> None:
 
     epilog = (util.drive_desc)
-    parser = util.ArgumentParser(usage='%(prog)s [options] cylinder',
+    parser = util.ArgumentParser(usage='%(prog)s [options] cylinder...',
                                  epilog=epilog)
     parser.add_argument("--device", help="device name (COM/serial port)")
     parser.add_argument("--drive", type=util.Drive(), default='A',
@@ -35,15 +62,21 @@ def main(argv) -> None:
                         help="allow extreme cylinders with no prompt")
     parser.add_argument("--motor-on", action="store_true",
                         help="seek with drive motor activated")
-    parser.add_argument("cylinder", type=util.uint, help="cylinder to seek")
+    parser.add_argument("--dwell", type=util.uint, metavar="N", default=0,
+                        help="pause N msecs between seeks")
+    parser.add_argument("--report", action="store_true",
+                        help="report drive delays and time taken by each seek")
+    parser.add_argument("cylinder", type=util.uint, nargs='+',
+                        help="cylinder(s) to seek, in order")
     parser.description = description
     parser.prog += ' ' + argv[1]
     args = parser.parse_args(argv[2:])
 
-    if not 0 <= args.cylinder <= 83 and not args.force:
-        answer = input("Seek to extreme cylinder %d, Yes/No? " % args.cylinder)
-        if answer != "Yes":
-            return
+    for cyl in args.cylinder:
+        if not 0 <= cyl <= 83 and not args.force:
+            answer = input("Seek to extreme cylinder %d, Yes/No? " % cyl)
+            if answer != "Yes":
+                return
     
     try:
         usb = util.usb_open(args.device)
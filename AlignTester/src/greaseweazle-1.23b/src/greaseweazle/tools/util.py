@@ -480,9 +480,15 @@ def usb_open(devicename, is_update=False, mode_check=True):
 
     if devicename is None:
         devicename = find_port()
-    
-    usb = USB.Unit(serial.Serial(devicename))
-    usb.port_info = port_info(devicename)
+
+    if devicename.startswith('sim:'):
+        from greaseweazle import sim
+        ser = sim.SimSerial(devicename)
+        usb = USB.Unit(ser)
+        usb.port_info = ser.port_info
+    else:
+        usb = USB.Unit(serial.Serial(devicename))
+        usb.port_info = port_info(devicename)
     is_win7 = (platform.system() == 'Windows' and platform.release() == '7')
     usb.jumperless_update = ((usb.hw_model, usb.hw_submodel) != (1, 0)
                              and not is_win7)
@@ -9,13 +9,15 @@
 
 description = "Write a disk from the specified image file."
 
-from typing import cast, Optional, List, Type
+from typing import cast, Any, Optional, List, Tuple, Type
 
 import sys, copy
+from concurrent.futures import Future, ThreadPoolExecutor
 
 from greaseweazle.tools import util
 from greaseweazle import error, track
 from greaseweazle import usb as USB
+from greaseweazle.flux import Flux, WriteoutFlux
 from greaseweazle.codec import codec
 from greaseweazle.image import image
 from greaseweazle.image.img import IMG
@@ -25,8 +27,83 @@ from greaseweazle.track import HasVerify, MasterTrack
 def open_image(args, image_class: Type[image.Image]) -> image.Image:
     return image_class.from_file(args.file, args.fmt_cls, args.file_opts)
 
+# A track made ready for writing, ahead of the drive.
+class PreparedTrack:
+    def __init__(self, t, tspec: str) -> None:
+        self.t = t
+        self.tspec = tspec
+        self.message: Optional[str] = None # Printed when the track comes up
+        self.skip = False
+        self.track: Any = None
+        self.wflux: Optional[WriteoutFlux] = None
+        self.dat: Optional[bytes] = None # Encoded stream; None means erase
+        self.verify: Optional[HasVerify] = None
+
+# prepare_track:
+# Loads a track from the image and builds its encoded flux stream. This is
+# CPU work only, so it runs on a worker while the previous track is written.
+def prepare_track(usb: USB.Unit, args, image: image.Image, t,
+                  drive_ticks_per_rev: float) -> PreparedTrack:
+
+    cyl, head = t.cyl, t.head
+    tspec = f'T{cyl}.{head}'
+    if t.physical_cyl != cyl or t.physical_head != head:
+        tspec += f' -> Drive {t.physical_cyl}.{t.physical_head}'
+    p = PreparedTrack(t, tspec)
+
+    track = image.get_track(cyl, head)
+    if track is None:
+        p.skip = not args.erase_empty
+        return p
+
+    if not isinstance(track, codec.Codec) and args.fmt_cls is not None:
+        track = args.fmt_cls.decode_flux(cyl, head, track)
+        if track is None:
+            p.message = ("%s: WARNING: Out of range for format '%s': Track "
+                         "skipped" % (tspec, args.format))
+            p.skip = True
+            return p
+        assert isinstance(track, codec.Codec)
+        error.check(track.nr_missing() == 0,
+                    '%s: %u missing sectors in input image'
+                    % (tspec, track.nr_missing()))
+    if isinstance(track, codec.Codec):
+        track = track.master_track()
+
+    if isinstance(track, MasterTrack):
+        if args.reverse:
+            track.reverse()
+        if args.precomp is not None:
+            track.precomp = args.precomp.track_precomp(cyl)
+    elif args.reverse:
+        track = track.flux()
+        track.reverse()
+    wflux = track.flux_for_writeout(cue_at_index = args.fake_index is None)
+
+    # @factor adjusts flux times for speed variations between the
+    # read-in and write-out drives.
+    factor = drive_ticks_per_rev / wflux.ticks_to_index
+
+    # Convert the flux samples to Greaseweazle sample frequency.
+    rem = 0.0
+    wflux_list = []
+    for x in wflux.list:
+        y = x * factor + rem
+        val = round(y)
+        rem = y - val
+        wflux_list.append(val)
+
+    p.track, p.wflux = track, wflux
+    p.dat = usb.encode_track(wflux_list)
+    if not args.no_verify and isinstance(track, MasterTrack):
+        p.verify = track.verify
+    return p
+
 # write_from_image:
 # Writes the specified image file to floppy disk.
+# The work is pipelined: track N+1 is loaded and encoded while track N is
+# written, and track N is verified (decoded) while the drive moves on to
+# track N+1. Only a verify failure sends the drive back to retry a track.
 def write_from_image(usb: USB.Unit, args, image: image.Image) -> None:
 
     hard_sector_ticks = 0
@@ -50,118 +127,113 @@ def write_from_image(usb: USB.Unit, args, image: image.Image) -> None:
 
     verified_count, not_verified_count = 0, 0
 
-    for t in args.tracks:
-
-        cyl, head = t.cyl, t.head
-
-        track = image.get_track(cyl, head)
-        if track is None and not args.erase_empty:
-            continue
-
-        tspec = f'T{cyl}.{head}'
-        if t.physical_cyl != cyl or t.physical_head != head:
-            tspec += f' -> Drive {t.physical_cyl}.{t.physical_head}'
-
-        usb.seek(t.physical_cyl, t.physical_head)
-
+    def seek(p: PreparedTrack) -> None:
+        usb.seek(p.t.physical_cyl, p.t.physical_head)
         if args.gen_tg43:
-            usb.set_pin(2, cyl < 43)
-
-        if track is None:
-            print(f'{tspec}: Erasing Track')
+            usb.set_pin(2, p.t.cyl < 43)
+
+    # Write a prepared track, and read it back for verify (if possible).
+    def write_track(p: PreparedTrack, retry: int) -> Optional[Flux]:
+        assert p.dat is not None and p.wflux is not None # mypy
+        seek(p)
+        if args.pre_erase:
+            print(f'{p.tspec}: Erasing Track')
             usb.erase_track(drive_ticks_per_rev * 1.1)
-            continue
-
-        if not isinstance(track, codec.Codec) and args.fmt_cls is not None:
-            track = args.fmt_cls.decode_flux(cyl, head, track)
-            if track is None:
-                print("%s: WARNING: Out of range for format '%s': Track "
-                      "skipped" % (tspec, args.format))
+        s = f'{p.tspec}: Writing Track'
+        if retry != 0:
+            s += " (Verify Failure: Retry #%u)" % retry
+        else:
+            s += " (%s)" % p.wflux.summary_string()
+        print(s)
+        usb.write_track(flux_list = p.dat,
+                        cue_at_index = p.wflux.index_cued,
+                        terminate_at_index = p.wflux.terminate_at_index,
+                        hard_sector_ticks = hard_sector_ticks)
+        verify = p.verify
+        if verify is None:
+            return None
+        v_revs, v_ticks = verify.verify_revs, 0
+        if isinstance(v_revs, float):
+            v_ticks = int(drive_ticks_per_rev * v_revs)
+            v_revs = 2
+        if args.hard_sectors:
+            v_ticks = 0
+            v_revs = cast(int, (args.hard_sectors + 1) * 2)
+        if no_index:
+            drive_tpr = int(drive_ticks_per_rev)
+            pre_index = int(usb.sample_freq * 0.5e-3)
+            if v_ticks == 0:
+                v_ticks = v_revs*drive_tpr + 2*pre_index
+            v_flux = usb.read_track(revs = 0, ticks = v_ticks)
+            index_list = (
+                [pre_index]
+                + [drive_tpr] * ((v_ticks-pre_index)//drive_tpr))
+            v_flux.index_list = cast(List[float], index_list) # mypy
+        else:
+            v_flux = usb.read_track(revs = v_revs, ticks = v_ticks)
+        v_flux._ticks_per_rev = drive_ticks_per_rev
+        if args.reverse:
+            v_flux.reverse()
+        if args.hard_sectors:
+            v_flux.identify_hard_sectors()
+        return v_flux
+
+    # Collect a track's background verify result. On failure, go back and
+    # retry the track in order, verifying each retry before moving on.
+    def finish_verify(p: PreparedTrack, fut: Future) -> None:
+        nonlocal verified_count
+        verified = fut.result()
+        retry = 0
+        while not verified and retry < args.retries:
+            retry += 1
+            v_flux = write_track(p, retry)
+            assert p.verify is not None and v_flux is not None # mypy
+            verified = p.verify.verify_track(v_flux)
+        error.check(verified, "Failed to verify Track %u.%u"
+                    % (p.t.cyl, p.t.head))
+        verified_count += 1
+
+    # The TrackSet iterator updates and returns the same object each time:
+    # take a copy per track, as tracks are now handled out of step.
+    tracks = [copy.copy(t) for t in args.tracks]
+    with ThreadPoolExecutor(2) as pool:
+
+        def prepare(i: int) -> Optional[Future]:
+            if i >= len(tracks):
+                return None
+            return pool.submit(prepare_track, usb, args, image,
+                               tracks[i], drive_ticks_per_rev)
+
+        verifying: Optional[Tuple[PreparedTrack, Future]] = None
+        next_p = prepare(0)
+        for i in range(len(tracks)):
+            assert next_p is not None # mypy
+            p = next_p.result()
+            next_p = prepare(i+1)
+
+            if p.message is not None:
+                print(p.message)
+            if p.skip:
                 continue
-            assert isinstance(track, codec.Codec)
-            error.check(track.nr_missing() == 0,
-                        '%s: %u missing sectors in input image'
-                        % (tspec, track.nr_missing()))
-        if isinstance(track, codec.Codec):
-            track = track.master_track()
-
-        if isinstance(track, MasterTrack):
-            if args.reverse:
-                track.reverse()
-            if args.precomp is not None:
-                track.precomp = args.precomp.track_precomp(cyl)
-        elif args.reverse:
-            track = track.flux()
-            track.reverse()
-        wflux = track.flux_for_writeout(cue_at_index = not no_index)
-
-        # @factor adjusts flux times for speed variations between the
-        # read-in and write-out drives.
-        factor = drive_ticks_per_rev / wflux.ticks_to_index
-
-        # Convert the flux samples to Greaseweazle sample frequency.
-        rem = 0.0
-        wflux_list = []
-        for x in wflux.list:
-            y = x * factor + rem
-            val = round(y)
-            rem = y - val
-            wflux_list.append(val)
-
-        # Encode the flux times for Greaseweazle, and write them out.
-        verified = False
-        for retry in range(args.retries+1):
-            if args.pre_erase:
-                print(f'{tspec}: Erasing Track')
+
+            if p.dat is None:
+                seek(p)
+                print(f'{p.tspec}: Erasing Track')
                 usb.erase_track(drive_ticks_per_rev * 1.1)
-            s = f'{tspec}: Writing Track'
-            if retry != 0:
-                s += " (Verify Failure: Retry #%u)" % retry
-            else:
-                s += " (%s)" % wflux.summary_string()
-            print(s)
-            usb.write_track(flux_list = wflux_list,
-                            cue_at_index = wflux.index_cued,
-                            terminate_at_index = wflux.terminate_at_index,
-                            hard_sector_ticks = hard_sector_ticks)
-            verify: Optional[HasVerify] = None
-            no_verify = (args.no_verify
-                         or not isinstance(track, MasterTrack)
-                         or (verify := track.verify) is None)
-            if no_verify:
+                continue
+
+            v_flux = write_track(p, 0)
+            if v_flux is None:
                 not_verified_count += 1
-                verified = True
-                break
-            assert verify is not None # mypy
-            v_revs, v_ticks = verify.verify_revs, 0
-            if isinstance(v_revs, float):
-                v_ticks = int(drive_ticks_per_rev * v_revs)
-                v_revs = 2
-            if args.hard_sectors:
-                v_ticks = 0
-                v_revs = cast(int, (args.hard_sectors + 1) * 2)
-            if no_index:
-                drive_tpr = int(drive_ticks_per_rev)
-                pre_index = int(usb.sample_freq * 0.5e-3)
-                if v_ticks == 0:
-                    v_ticks = v_revs*drive_tpr + 2*pre_index
-                v_flux = usb.read_track(revs = 0, ticks = v_ticks)
-                index_list = (
-                    [pre_index]
-                    + [drive_tpr] * ((v_ticks-pre_index)//drive_tpr))
-                v_flux.index_list = cast(List[float], index_list) # mypy
-            else:
-                v_flux = usb.read_track(revs = v_revs, ticks = v_ticks)
-            v_flux._ticks_per_rev = drive_ticks_per_rev
-            if args.reverse:
-                v_flux.reverse()
-            if args.hard_sectors:
-                v_flux.identify_hard_sectors()
-            verified = verify.verify_track(v_flux)
-            if verified:
-                verified_count += 1
-                break
-        error.check(verified, "Failed to verify Track %u.%u" % (cyl, head))
+                continue
+            assert p.verify is not None # mypy
+            fut = pool.submit(p.verify.verify_track, v_flux)
+            if verifying is not None:
+                finish_verify(*verifying)
+            verifying = (p, fut)
+
+        if verifying is not None:
+            finish_verify(*verifying)
 
     if not_verified_count == 0:
         print("All tracks verified")
@@ -291,9 +363,11 @@ Known formats:\n%s"""
                 usb.set_pin(2, args.densel)
             util.with_drive_selected(
                 lambda: write_from_image(usb, args, image), usb, args.drive)
+            image.verify()
         finally:
             if args.densel is not None or args.gen_tg43:
                 usb.set_pin(2, prev_pin2)
+            image.close()
     except USB.CmdError as err:
         print("Command Failed: %s" % err)
 
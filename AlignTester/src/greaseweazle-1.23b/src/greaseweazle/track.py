@@ -5,8 +5,10 @@
 # This is free and unencumbered software released into the public domain.
 # See the file COPYING for more details, or visit <http://unlicense.org>.
 
-from typing import Any, List, Optional, Tuple, Union, Protocol
+from typing import Any, Callable, Iterator, List, Optional, Tuple, Union
+from typing import Protocol
 import binascii
+import functools
 import itertools as it
 from bitarray import bitarray
 from greaseweazle.flux import Flux, WriteoutFlux
@@ -50,31 +52,102 @@ class Precomp:
     FM  = 1
     GCR = 2
     TYPESTRING = [ 'MFM', 'FM', 'GCR' ]
+    # Bit patterns to precompensate, in order of application, with the
+    # offsets of the bitcells to shorten (-t) and lengthen (+t) for each match.
+    # The first two patterns apply to MFM only. The others are primarily for
+    # GCR and FM which permit adjacent 1s (and have correspondingly slower
+    # bit times). However they may be useful for illegal MFM sequences too,
+    # especially on Amiga (custom syncwords, 4us-bitcell tracks). Normal MFM
+    # should not trigger these patterns.
+    PATTERNS_MFM = [ ('10100', 2, 3), ('00101', 3, 2) ]
+    PATTERNS = [ ('110', 1, 2), ('011', 2, 1) ]
     def __str__(self) -> str:
         return "Precomp: %s, %dns" % (Precomp.TYPESTRING[self.type], self.ns)
     def __init__(self, type: int, ns: float):
         self.type = type
         self.ns = ns
-    def apply(self, bits: bitarray, bit_ticks: List[float],
-              scale: float) -> None:
-        t = self.ns * scale
+    def patterns(self) -> List[Tuple[str, int, int]]:
         if self.type == Precomp.MFM:
-            for i in bits.search(bitarray('10100', endian='big')):
-                bit_ticks[i+2] -= t
-                bit_ticks[i+3] += t
-            for i in bits.search(bitarray('00101', endian='big')):
-                bit_ticks[i+2] += t
-                bit_ticks[i+3] -= t
-        # This is primarily for GCR and FM which permit adjacent 1s (and
-        # have correspondingly slower bit times). However it may be useful
-        # for illegal MFM sequences too, especially on Amiga (custom syncwords,
-        # 4us-bitcell tracks). Normal MFM should not trigger these patterns.
-        for i in bits.search(bitarray('110', endian='big')):
-            bit_ticks[i+1] -= t
-            bit_ticks[i+2] += t
-        for i in bits.search(bitarray('011', endian='big')):
-            bit_ticks[i+1] += t
-            bit_ticks[i+2] -= t
+            return Precomp.PATTERNS_MFM + Precomp.PATTERNS
+        return Precomp.PATTERNS
+    # Returns the precompensated bit_ticks: @bit_ticks is adjusted in place,
+    # or None means every bitcell is one tick and a new list is returned.
+    def apply(self, bits: bitarray, bit_ticks: Optional[List[float]],
+              scale: float) -> List[float]:
+        t = self.ns * scale
+        patterns = tuple(self.patterns())
+        if bit_ticks is None:
+            return list(_uniform_precomp_ticks(
+                bits.tobytes(), len(bits), patterns, t))
+        for pattern, minus, plus in patterns:
+            for i in bits.search(bitarray(pattern, endian='big')):
+                bit_ticks[i+minus] -= t
+                bit_ticks[i+plus] += t
+        return bit_ticks
+
+# Bitmap of the positions at which @pattern matches @bits.
+def _match_mask(bits: bitarray, pattern: str) -> bitarray:
+    mask = bitarray(len(bits), endian='big')
+    mask.setall(True)
+    for k, c in enumerate(pattern):
+        shifted = bits << k
+        mask &= shifted if c == '1' else ~shifted
+    # No match may run off the end of the track.
+    mask[max(0, len(bits)-len(pattern)+1):] = False
+    return mask
+
+# Precompensated ticks of a track whose bitcells are all one tick long.
+# A bitcell's adjustment depends only on which patterns match around it, so
+# pattern matches are found as bitmaps over the whole track and merged into
+# one code byte per bitcell (two bits per pattern: shortened, lengthened).
+# Ticks are then looked up per code. The table applies the same -t/+t steps
+# in the same order as the per-match loop, so the results are identical.
+# Cached, so writing the same track again does not redo the work.
+@functools.lru_cache(maxsize=8)
+def _uniform_precomp_ticks(data: bytes, nbits: int,
+                           patterns: Tuple[Tuple[str, int, int], ...],
+                           t: float) -> Tuple[float, ...]:
+    bits = bitarray(endian='big')
+    bits.frombytes(data)
+    del bits[nbits:]
+    codes = 0
+    for p, (pattern, minus, plus) in enumerate(patterns):
+        mask = _match_mask(bits, pattern)
+        for shift, code in ((minus, 1 << (2*p)), (plus, 2 << (2*p))):
+            codes |= int.from_bytes((mask >> shift).unpack(one=bytes([code])),
+                                    'big')
+    table: List[float] = []
+    for code in range(256):
+        x: float = 1
+        for p in range(len(patterns)):
+            if code & (1 << (2*p)):
+                x -= t
+            if code & (2 << (2*p)):
+                x += t
+        table.append(x)
+    return tuple(map(table.__getitem__, codes.to_bytes(nbits, 'big')))
+
+# Convert bitcells to flux: the ticks up to and including each 1 bit, plus
+# the ticks trailing the final 1.
+# bit_ticks=None: Every bitcell is exactly one tick. Each flux is then the
+#  length of a run of 0s plus its terminating 1, and the runs are found by
+#  C-level splitting instead of a per-bitcell loop.
+# Otherwise the ticks are summed left to right per flux, exactly as before:
+# cumulative-sum differences would not be bit-identical for float ticks.
+def bits_to_flux(bits: bitarray, bit_ticks: Optional[List[float]]
+                 ) -> Tuple[List[Any], Any]:
+    if bit_ticks is None:
+        runs = list(map(len, bits.to01().encode().replace(b'1', b'1,')
+                        .split(b',')))
+        return runs, runs.pop()
+    flux_list: List[float] = []
+    flux_ticks: float = 0
+    for bit, ticks in zip(bits, bit_ticks):
+        flux_ticks += ticks
+        if bit:
+            flux_list.append(flux_ticks)
+            flux_ticks = 0
+    return flux_list, flux_ticks
 
 class HasVerify(Protocol):
     verify_revs: float
@@ -180,10 +253,12 @@ class MasterTrack:
         bits = self.bits.copy()
         bitlen = len(bits)
 
-        # Also copy the bit_ticks array (or create a dummy one), and remember
-        # the total ticks that it contains.
-        bit_ticks = self.bit_ticks.copy() if self.bit_ticks else [1] * bitlen
-        ticks_to_index = sum(bit_ticks)
+        # Also copy the bit_ticks array, and remember the total ticks that it
+        # contains. With no bit_ticks every bitcell is one tick: a dummy array
+        # is only created if the ticks need adjusting (long weak regions,
+        # precompensation).
+        bit_ticks = self.bit_ticks.copy() if self.bit_ticks else None
+        ticks_to_index = sum(bit_ticks) if bit_ticks is not None else bitlen
 
         # Weak regions need special processing for correct flux representation.
         for s, n in self.weak:
@@ -205,6 +280,8 @@ class MasterTrack:
                 # MFM 0001001010010101 = 1295 = byte 0x47
                 pattern.frombytes(b"\x12\xA5")
                 bits[s:e] = (pattern * (n//16+1))[:n]
+                if bit_ticks is None:
+                    bit_ticks = [1] * bitlen
                 for i in range(0, n-10, 16):
                     x, y = bit_ticks[s+i+10], bit_ticks[s+i+11]
                     bit_ticks[s+i+10], bit_ticks[s+i+11] = x+y*0.5, y*0.5
@@ -220,7 +297,8 @@ class MasterTrack:
             index = -self.splice % bitlen
             if index != 0:
                 bits = bits[index:] + bits[:index]
-                bit_ticks = bit_ticks[index:] + bit_ticks[:index]
+                if bit_ticks is not None:
+                    bit_ticks = bit_ticks[index:] + bit_ticks[:index]
             splice_at_index = index < 4 or bitlen - index < 4
         else:
             assert for_writeout
@@ -237,7 +315,8 @@ class MasterTrack:
             pos = 4
             # We stretch by 10 percent, which is way more than enough.
             rep = bitlen // (10 * 32)
-            bit_ticks = bit_ticks[pos:pos+32] * rep + bit_ticks[pos:]
+            if bit_ticks is not None:
+                bit_ticks = bit_ticks[pos:pos+32] * rep + bit_ticks[pos:]
             bits = bits[pos:pos+32] * rep + bits[pos:]
         elif splice_at_index:
             # Splice is at the index (or within a few bitcells of it).
@@ -248,7 +327,8 @@ class MasterTrack:
             pos = (self.splice - 4) % bitlen
             # We stretch by 10 percent, which is way more than enough.
             rep = bitlen // (10 * 32)
-            bit_ticks = bit_ticks[:pos] + bit_ticks[pos-32:pos] * rep
+            if bit_ticks is not None:
+                bit_ticks = bit_ticks[:pos] + bit_ticks[pos-32:pos] * rep
             bits = bits[:pos] + bits[pos-32:pos] * rep
         else:
             # Splice is not at the index. We will write more than one
@@ -258,7 +338,8 @@ class MasterTrack:
             # spins slower than expected and the write ends before the original
             # splice position.
             # Thus if the drive spins slow, the track gets a longer header.
-            bit_ticks += bit_ticks[:self.splice-4]
+            if bit_ticks is not None:
+                bit_ticks += bit_ticks[:self.splice-4]
             bits += bits[:self.splice-4]
             pos = self.splice+4
             fill_pattern = bits[pos:pos+32]
@@ -267,18 +348,11 @@ class MasterTrack:
                 bits[pos:pos+32] = fill_pattern
 
         if for_writeout and self.precomp is not None:
-            self.precomp.apply(bits, bit_ticks,
-                               ticks_to_index / (self.time_per_rev*1e9))
+            bit_ticks = self.precomp.apply(
+                bits, bit_ticks, ticks_to_index / (self.time_per_rev*1e9))
 
         # Convert the stretched track data into flux.
-        bit_ticks_i = iter(bit_ticks)
-        flux_list = []
-        flux_ticks: float = 0
-        for bit in bits:
-            flux_ticks += next(bit_ticks_i)
-            if bit:
-                flux_list.append(flux_ticks)
-                flux_ticks = 0
+        flux_list, flux_ticks = bits_to_flux(bits, bit_ticks)
 
         # Package up WriteoutFlux.
         if for_writeout:
@@ -297,14 +371,18 @@ class MasterTrack:
             revs = 1 if splice_at_index else 2
         assert revs is not None and revs > 0
         if revs > 1:
-            l = flux_list
-            for i in range(revs-1):
-                flux_list = l + [flux_ticks+flux_list[0]] + flux_list[1:]
+            # Each further revolution joins the previous one's trailing
+            # ticks onto its first flux.
+            rev = [flux_ticks+flux_list[0]] + flux_list[1:]
+            flux_list = flux_list + rev * (revs-1)
             index_list *= revs
         flux = Flux(index_list, flux_list,
                     sample_freq = ticks_to_index / self.time_per_rev,
                     index_cued = True)
-        flux.splice = sum(bit_ticks[:self.splice])
+        if bit_ticks is not None:
+            flux.splice = sum(bit_ticks[:self.splice])
+        else:
+            flux.splice = len(bits[:self.splice])
         return flux
 
 class PLLRevolution:
@@ -320,9 +398,13 @@ class PLLTrack:
     # data: Flux object, or a form convertible to a Flux object
     # time_per_rev: Expected time per revolution, in seconds (optional, float)
     # lowpass_thresh: Merge short fluxes with adjacent fluxes (optional, float)
+    # scan: Called with the bitcells decoded so far at each index pulse;
+    #       returns True to stop the PLL early (optional)
     def __init__(self, clock: float, data, time_per_rev=None, pll=None,
-                 lowpass_thresh=None):
+                 lowpass_thresh=None,
+                 scan: Optional[Callable[[bitarray], bool]] = None):
         self.clock = clock
+        self.scan = scan
         self.time_per_rev = time_per_rev
         self.clock_max_adj = 0.10
         if pll is None: pll = plls[0]
@@ -399,7 +481,11 @@ class PLLTrack:
         # Make sure there's enough time in the flux list to cover all
         # revolutions by appending a "large enough" final flux value.
         tail = max(0, sum(flux.index_list) - sum(flux_list) + clock*freq*2)
-        flux_iter = it.chain(flux_list, [tail])
+        if self.scan is None:
+            flux_iter = it.chain(flux_list, [tail])
+        else:
+            flux_iter = it.chain.from_iterable(
+                self.scan_chunks(flux_list, flux.index_list, tail))
 
         revolutions: List[int] = []
         try:
@@ -434,6 +520,29 @@ class PLLTrack:
             self.revolutions.append(PLLRevolution(nr_bits, hardsector_bits))
 
 
+    def scan_chunks(self, flux_list, index_list,
+                    tail) -> Iterator[Iterator[float]]:
+        # Feed the PLL about one revolution at a time. The PLL pulls the
+        # next chunk only when it has consumed the previous one, so after
+        # each chunk the scan callback sees every bitcell decoded so far.
+        # Ending the chunks ends the PLL decode. Chunk boundaries are
+        # estimated from the mean flux length: they need not be exact.
+        assert self.scan is not None
+        flux_iter = iter(flux_list)
+        total = sum(flux_list)
+        pos = 0
+        for index in it.accumulate(index_list):
+            if total <= 0 or index >= total:
+                break
+            nr = round(len(flux_list) * index / total)
+            yield it.islice(flux_iter, nr - pos)
+            pos = nr
+            if self.scan(self.bitarray):
+                return
+        yield flux_iter
+        yield iter([tail])
+
+
 def flux_to_bitcells(bit_array, time_array, revolutions,
                      index_iter, flux_iter,
                      freq, clock_centre, clock_min, clock_max,
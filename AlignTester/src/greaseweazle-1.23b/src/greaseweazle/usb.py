@@ -5,10 +5,9 @@
 # This is free and unencumbered software released into the public domain.
 # See the file COPYING for more details, or visit <http://unlicense.org>.
 
-from typing import Any, List, Tuple, Union
+from typing import Any, Callable, List, Optional, Tuple, Union
 
-import struct
-import itertools as it
+import re, struct
 from enum import Enum
 from greaseweazle import error
 from greaseweazle.flux import Flux
@@ -179,8 +178,168 @@ class CmdError(Exception):
         return "%s: %s" % (self.cmd_str(), self.errcode_str())
 
 
+## FluxStreamDecoder: Incrementally decodes a ReadFlux data stream.
+## The stream may be fed in chunks of any size, as it arrives from the
+## device. Partial opcodes at the end of a chunk are held over until the
+## next chunk completes them.
+class FluxStreamDecoder:
+
+    # Runs of single-byte flux samples.
+    simple_run = re.compile(rb'[\x01-\xf9]+')
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        """Discards all decoded and partial state."""
+        self.flux_list: List[float] = []
+        self.index_list: List[float] = []
+        # Number of flux samples preceding each index pulse.
+        self.index_pos: List[int] = []
+        self.done = False
+        self._pending = b''
+        self._ticks = 0
+        self._ticks_since_index = 0
+
+    def feed(self, dat: Union[bytes, memoryview]
+             ) -> Tuple[List[float], List[float]]:
+        """Decodes the next chunk of the stream. Returns the flux samples
+        and index pulses completed by this chunk. Decoded values are also
+        accumulated in flux_list and index_list."""
+        flux: List[float] = []
+        index: List[float] = []
+        if self.done:
+            return flux, index
+        buf = self._pending + dat if self._pending else dat
+        ticks, ticks_since_index = self._ticks, self._ticks_since_index
+        i, n = 0, len(buf)
+        while i < n:
+            x = buf[i]
+            if 0 < x < 250:
+                run = self.simple_run.match(buf, i)
+                assert run is not None
+                vals = list(buf[i:run.end()])
+                vals[0] += ticks
+                ticks = 0
+                flux += vals
+                ticks_since_index += sum(vals)
+                i = run.end()
+            elif x == 0:
+                # End of Stream
+                self.done = True
+                i = n
+            elif x < 255:
+                if i+2 > n:
+                    break
+                val = 250 + (x - 250) * 255 + buf[i+1] - 1
+                ticks += val
+                flux.append(ticks)
+                ticks_since_index += ticks
+                ticks = 0
+                i += 2
+            else:
+                if i+6 > n:
+                    break
+                opcode = buf[i+1]
+                val =  (buf[i+2] & 254) >>  1
+                val += (buf[i+3] & 254) <<  6
+                val += (buf[i+4] & 254) << 13
+                val += (buf[i+5] & 254) << 20
+                if opcode == FluxOp.Index:
+                    index.append(ticks_since_index + ticks + val)
+                    self.index_pos.append(len(self.flux_list) + len(flux))
+                    ticks_since_index = -(ticks + val)
+                elif opcode == FluxOp.Space:
+                    ticks += val
+                else:
+                    raise error.Fatal("Bad opcode in flux stream (%d)"
+                                      % opcode)
+                i += 6
+        self._pending = bytes(buf[i:])
+        self._ticks, self._ticks_since_index = ticks, ticks_since_index
+        self.flux_list += flux
+        self.index_list += index
+        return flux, index
+
+
+## FluxStreamEncoder: Encodes flux timings into a WriteFlux data stream.
+## The encoding of a flux timing depends only on its value, so encodings of
+## all timings up to the two-byte form are precomputed in a table, and a
+## stream is built by table lookup and a single join. Rare longer timings
+## (long spaces, no-flux areas) are encoded individually.
+class FluxStreamEncoder:
+
+    # Timings below this are encoded by table lookup.
+    table_size = 250 + 5*255
+
+    def __init__(self, sample_freq: int) -> None:
+        self.sample_freq = sample_freq
+        self.nfa_thresh = round(150e-6 * sample_freq)  # 150us
+        self.nfa_period = round(1.25e-6 * sample_freq) # 1.25us
+        # A dummy final flux value. This is never written to disk because
+        # the write is aborted immediately the final flux is loaded into the
+        # WDATA timer. The dummy flux is sacrificial, ensuring that the real
+        # final flux gets written in full.
+        self.dummy_flux = round(100e-6 * sample_freq)
+        self.table = [self.encode_value(val)
+                      for val in range(self.table_size)]
+
+    def encode_value(self, val: int) -> bytes:
+        """Encodes a single flux timing (nothing for a zero timing)."""
+        dat = bytearray()
+        def _write_28bit(x):
+            dat.append(1 | (x<<1) & 255)
+            dat.append(1 | (x>>6) & 255)
+            dat.append(1 | (x>>13) & 255)
+            dat.append(1 | (x>>20) & 255)
+        if val == 0:
+            pass
+        elif val < 250:
+            dat.append(val)
+        elif val > self.nfa_thresh:
+            dat.append(255)
+            dat.append(FluxOp.Space)
+            _write_28bit(val)
+            dat.append(255)
+            dat.append(FluxOp.Astable)
+            _write_28bit(self.nfa_period)
+        else:
+            high = (val-250) // 255
+            if high < 5:
+                dat.append(250 + high)
+                dat.append(1 + (val-250) % 255)
+            else:
+                dat.append(255)
+                dat.append(FluxOp.Space)
+                _write_28bit(val - 249)
+                dat.append(249)
+        return bytes(dat)
+
+    def encode(self, flux: List[int]) -> bytearray:
+        """Encodes flux timings (non-negative integers) into a stream,
+        including the dummy final flux and the End of Stream marker."""
+        table, n = self.table, self.table_size
+        # A negative timing would silently index the table from its end.
+        if min(flux, default=0) < 0:
+            raise ValueError("Negative flux timing")
+        try:
+            dat = bytearray().join(map(table.__getitem__, flux))
+        except IndexError:
+            # At least one long timing: Encode those individually.
+            dat = bytearray().join([table[val] if val < n
+                                    else self.encode_value(val)
+                                    for val in flux])
+        dat += self.encode_value(self.dummy_flux)
+        dat.append(0) # End of Stream
+        return dat
+
+
 class Unit:
 
+    # Write-stream encoder, created for the unit's sample frequency on
+    # first use.
+    encoder: Optional[FluxStreamEncoder] = None
+
     ## Unit information, instance variables:
     ##  major, minor: Greaseweazle firmware version number
     ##  max_cmd:      Maximum Cmd number accepted by this unit
@@ -361,117 +520,83 @@ Track0 signal %s after seek to cylinder %d
 
     ## _decode_flux:
     ## Decode the Greaseweazle data stream into a list of flux samples.
-    def _decode_flux(self, dat: bytes) -> Tuple[List[float], List[float]]:
-        flux: List[float] = []
-        index: List[float] = []
+    def _decode_flux(self, dat: Union[bytes, memoryview]
+                     ) -> Tuple[List[float], List[float]]:
         assert dat[-1] == 0
-        dat_i = it.islice(dat, 0, len(dat)-1)
-        ticks, ticks_since_index = 0, 0
-        def _read_28bit():
-            val =  (next(dat_i) & 254) >>  1
-            val += (next(dat_i) & 254) <<  6
-            val += (next(dat_i) & 254) << 13
-            val += (next(dat_i) & 254) << 20
-            return val
-        try:
-            while True:
-                i = next(dat_i)
-                if i == 255:
-                    opcode = next(dat_i)
-                    if opcode == FluxOp.Index:
-                        val = _read_28bit()
-                        index.append(ticks_since_index + ticks + val)
-                        ticks_since_index = -(ticks + val)
-                    elif opcode == FluxOp.Space:
-                        ticks += _read_28bit()
-                    else:
-                        raise error.Fatal("Bad opcode in flux stream (%d)"
-                                          % opcode)
-                else:
-                    if i < 250:
-                        val = i
-                    else:
-                        val = 250 + (i - 250) * 255
-                        val += next(dat_i) - 1
-                    ticks += val
-                    flux.append(ticks)
-                    ticks_since_index += ticks
-                    ticks = 0
-        except StopIteration:
-            pass
-        return flux, index
+        decoder = FluxStreamDecoder()
+        decoder.feed(dat)
+        return decoder.flux_list, decoder.index_list
 
 
     ## _encode_flux:
     ## Convert the given flux timings into an encoded data stream.
     def _encode_flux(self, flux: List[int]) -> bytes:
-        nfa_thresh = round(150e-6 * self.sample_freq)  # 150us
-        nfa_period = round(1.25e-6 * self.sample_freq) # 1.25us
-        dat = bytearray()
-        def _write_28bit(x):
-            dat.append(1 | (x<<1) & 255)
-            dat.append(1 | (x>>6) & 255)
-            dat.append(1 | (x>>13) & 255)
-            dat.append(1 | (x>>20) & 255)
-        # Emit a dummy final flux value. This is never written to disk because
-        # the write is aborted immediately the final flux is loaded into the
-        # WDATA timer. The dummy flux is sacrificial, ensuring that the real
-        # final flux gets written in full.
-        dummy_flux = round(100e-6 * self.sample_freq)
-        for val in it.chain(flux, [dummy_flux]):
-            if val == 0:
-                pass
-            elif val < 250:
-                dat.append(val)
-            elif val > nfa_thresh:
-                dat.append(255)
-                dat.append(FluxOp.Space)
-                _write_28bit(val)
-                dat.append(255)
-                dat.append(FluxOp.Astable)
-                _write_28bit(nfa_period)
-            else:
-                high = (val-250) // 255
-                if high < 5:
-                    dat.append(250 + high)
-                    dat.append(1 + (val-250) % 255)
-                else:
-                    dat.append(255)
-                    dat.append(FluxOp.Space)
-                    _write_28bit(val - 249)
-                    dat.append(249)
-        dat.append(0) # End of Stream
-        return dat
+        encoder = self.encoder
+        if encoder is None or encoder.sample_freq != self.sample_freq:
+            encoder = self.encoder = FluxStreamEncoder(self.sample_freq)
+        return encoder.encode(flux)
 
 
     ## _read_track:
     ## Private helper which issues command requests to Greaseweazle.
-    def _read_track(self, revs, ticks) -> bytes:
+    ## The stream is received into a preallocated buffer, which grows only if
+    ## the initial estimate is exceeded. If given, on_data is passed a view
+    ## of each chunk as it arrives (the view must not be retained).
+    def _read_track(self, revs, ticks,
+                    on_data: Optional[Callable[[memoryview], Any]] = None
+                    ) -> memoryview:
+
+        # Estimate the stream size: Each flux is usually encoded in one byte,
+        # and a high-density track carries up to 100k flux per revolution.
+        if revs == 0:
+            est = ticks * 500000 // self.sample_freq
+        else:
+            est = (revs + 1) * 100000
+        buf = bytearray(max(est, 65536))
+        view = memoryview(buf)
+        pos = 0
 
         # Request and read all flux timings for this track.
-        dat = bytearray()
         self._send_cmd(struct.pack("<2BIH", Cmd.ReadFlux, 8,
                                    ticks, 0 if revs==0 else revs+1))
         while True:
-            dat += self.ser.read(1)
-            dat += self.ser.read(self.ser.in_waiting)
-            if dat[-1] == 0:
+            # Block for at least one byte, then take all that is available.
+            want = max(1, self.ser.in_waiting)
+            if pos + want > len(buf):
+                view.release()
+                buf += bytes(max(want, len(buf)))
+                view = memoryview(buf)
+            nr = self.ser.readinto(view[pos:pos+want])
+            if not nr:
+                continue
+            if on_data is not None:
+                on_data(view[pos:pos+nr])
+            pos += nr
+            if buf[pos-1] == 0:
                 break
 
         # Check flux status. An exception is raised if there was an error.
         self._send_cmd(struct.pack("2B", Cmd.GetFluxStatus, 2))
 
-        return dat
+        return view[:pos]
 
 
     ## read_track:
     ## Read and decode flux and index timings for the current track.
-    def read_track(self, revs:int, ticks:int=0, nr_retries:int=5) -> Flux:
+    ## If a decoder is given, the stream is decoded as it arrives: the
+    ## decoder may be polled (or subclassed) to analyse revolutions while
+    ## the read is still in progress.
+    def read_track(self, revs:int, ticks:int=0, nr_retries:int=5,
+                   decoder: Optional[FluxStreamDecoder] = None) -> Flux:
 
         retry = 0
         while True:
             try:
-                dat = self._read_track(revs, ticks)
+                if decoder is None:
+                    dat = self._read_track(revs, ticks)
+                else:
+                    decoder.reset()
+                    self._read_track(revs, ticks, decoder.feed)
             except CmdError as error:
                 # An error occurred. We may retry on transient overflows.
                 if error.code == Ack.FluxOverflow and retry < nr_retries:
@@ -482,24 +607,38 @@ Track0 signal %s after seek to cylinder %d
                 # Success!
                 break
 
-        try:
-            # Decode the flux list and read the index-times list.
-            flux_list, index_list = optimised.decode_flux(dat)
-        except AttributeError:
-            flux_list, index_list = self._decode_flux(dat)
+        if decoder is not None:
+            flux_list, index_list = decoder.flux_list, decoder.index_list
+        else:
+            try:
+                # Decode the flux list and read the index-times list.
+                flux_list, index_list = optimised.decode_flux(dat)
+            except AttributeError:
+                flux_list, index_list = self._decode_flux(dat)
 
         # Success: Return the requested full index-to-index revolutions.
         return Flux(index_list, flux_list, self.sample_freq, index_cued=False)
 
 
+    ## encode_track:
+    ## Encode flux timings into a data stream for write_track. This may be
+    ## done ahead of time (eg. while another track is being written).
+    def encode_track(self, flux_list: List[int]) -> bytes:
+        return self._encode_flux(flux_list)
+
+
     ## write_track:
     ## Write the given flux stream to the current track via Greaseweazle.
+    ## flux_list may be a data stream already encoded by encode_track.
     def write_track(self, flux_list, terminate_at_index,
                     cue_at_index=True, nr_retries=5,
                     hard_sector_ticks=0) -> None:
 
         # Create encoded data stream.
-        dat = self._encode_flux(flux_list)
+        if isinstance(flux_list, (bytes, bytearray)):
+            dat = flux_list
+        else:
+            dat = self._encode_flux(flux_list)
         
         retry = 0
         while True:
@@ -3,9 +3,12 @@ Configuration pytest pour les tests AlignTester
 """
 
 import sys
+import asyncio
+import subprocess
 from pathlib import Path
 import pytest
 from typing import AsyncGenerator
+from unittest.mock import Mock
 
 # Ajouter le chemin du backend aux imports
 BACKEND_DIR = Path(__file__).parent.parent / "src" / "backend"
@@ -52,6 +55,94 @@ def sample_statistics():
         "values": []
     }
 
+# Ligne de gw align pour une lecture de piste
+GW_LINE = "T{cyl}.{head}: IBM MFM ({sectors}/18 sectors) from Raw Flux ({flux} flux in 200.01ms)"
+
+@pytest.fixture
+def gw_line():
+    """Construit une ligne de gw align : gw_line(cyl, head, sectors=18, flux=99998)"""
+    def line(cyl=0, head=0, sectors=18, flux=99998):
+        return GW_LINE.format(cyl=cyl, head=head, sectors=sectors, flux=flux)
+    return line
+
+@pytest.fixture
+def session_values(gw_line):
+    """Lectures et statistiques d'une session simulée : session_values(cylinders=3, reads=2, sectors=18)"""
+    from api.alignment_parser import AlignmentParser
+
+    def values(cylinders=3, reads=2, sectors=18):
+        output = "\n".join(
+            gw_line(cyl, head, sectors)
+            for cyl in range(cylinders) for head in (0, 1) for _ in range(reads)
+        )
+        parsed = AlignmentParser.parse_output(output)
+        statistics = AlignmentParser.calculate_statistics(parsed, limit=cylinders * 2)
+        statistics["quality"] = AlignmentParser.get_alignment_quality(statistics["average"])
+        return parsed, statistics
+    return values
+
+@pytest.fixture
+def make_executor(gw_line):
+    """
+    Fabrique d'exécuteurs factices (GreaseweazleExecutor)
+
+    - run_align lit chaque cylindre demandé (cylinder_list, sinon range(cylinders))
+      `retries` fois en alternant les faces comme gw (lecture n : face n % 2),
+      avec sectors(cyl, head) secteurs et flux(cyl, head, lecture) transitions. Les tours (rounds), les archives et
+      la concurrence par device (running, max_running, max_total) sont relevés.
+    - run_command émet `lines` (jusqu'à ce que should_stop retourne True) puis
+      retourne `returncode` ; les commandes sont relevées dans calls
+    - les sondes (version, ports, connexion...) sont des Mock
+    """
+    def factory(sectors=lambda cyl, head: 18, flux=lambda cyl, head, read: 99998,
+                duration=0.05, lines=(), returncode=0):
+        executor = Mock()
+        executor.gw_path = "gw"
+        executor.check_version.return_value = "1.23"
+        executor.check_align_available.return_value = True
+        executor.get_device_info.return_value = {"port": "/dev/ttyACM0", "connected": True}
+        executor.check_connection.return_value = {"connected": True, "port": "/dev/ttyACM0"}
+        executor.detect_serial_ports.return_value = [{"device": "/dev/ttyACM0"}]
+        executor.rounds = []
+        executor.archives = []
+        executor.calls = []
+        executor.running = {}
+        executor.max_running = {}
+        executor.max_total = 0
+
+        async def run_align(cylinders=80, retries=3, format_type="ibm.1440",
+                            diskdefs_path=None, on_output=None, device=None, drive=None,
+                            sampler=None, cylinder_list=None, archive_path=None):
+            cylinder_list = list(cylinder_list if cylinder_list is not None else range(cylinders))
+            executor.rounds.append(cylinder_list)
+            executor.archives.append(archive_path)
+            executor.running[device] = executor.running.get(device, 0) + 1
+            executor.max_running[device] = max(executor.max_running.get(device, 0),
+                                               executor.running[device])
+            executor.max_total = max(executor.max_total, sum(executor.running.values()))
+            try:
+                for cyl in cylinder_list:
+                    for read in range(retries):
+                        head = read % 2
+                        on_output(gw_line(cyl, head, sectors(cyl, head), flux(cyl, head, read)))
+                    await asyncio.sleep(duration / max(1, len(cylinder_list)))
+            finally:
+                executor.running[device] -= 1
+            return {"returncode": 0, "stdout": "", "stderr": "", "success": True}
+
+        async def run_command(args, on_output=None, timeout=None, should_stop=None):
+            executor.calls.append(args)
+            for line in lines:
+                on_output(line)
+                if should_stop and should_stop():
+                    break
+            return subprocess.CompletedProcess(args, returncode, "\n".join(lines), "")
+
+        executor.run_align = run_align
+        executor.run_command = run_command
+        return executor
+    return factory
+
 # Note: pytest-asyncio gère automatiquement l'event loop
 # Pas besoin de fixture event_loop personnalisée si pytest-asyncio est installé
 
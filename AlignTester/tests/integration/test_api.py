@@ -21,6 +21,15 @@ def client():
     return TestClient(app)
 
 
+@pytest.fixture(autouse=True)
+def reset_device_discovery():
+    """Vide le cache de découverte pour que chaque test voie ses propres mocks"""
+    from api.routes import device_discovery
+    device_discovery.invalidate()
+    yield
+    device_discovery.invalidate()
+
+
 class TestHealthCheck:
     """Tests pour le health check"""
     
@@ -238,3 +247,23 @@ class TestCancelEndpoint:
         assert response.status_code == 400
         assert "aucun alignement" in response.json()["detail"].lower()
 
+
+
+class TestTrack0Endpoint:
+    """Tests pour l'endpoint /api/track0/verify"""
+
+    @patch('api.track0_verifier.Track0Verifier.verify_track0_sensor')
+    @patch('api.routes.executor.check_connection')
+    def test_verify_adaptive(self, mock_connection, mock_verify, client):
+        """Le mode adaptatif est transmis au vérificateur"""
+        mock_connection.return_value = {"connected": True}
+        mock_verify.return_value = {
+            "sensor_ok": True, "seek_tests": [], "read_tests": {},
+            "warnings": [], "suggestions": []
+        }
+
+        response = client.post("/api/track0/verify", json={"adaptive": True})
+
+        assert response.status_code == 200
+        assert mock_verify.call_args.kwargs["adaptive"] is True
+        assert response.json()["sensor_ok"] is True
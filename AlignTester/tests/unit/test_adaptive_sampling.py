@@ -0,0 +1,135 @@
+"""
+Tests unitaires pour adaptive_sampling.py
+"""
+
+import pytest
+import subprocess
+from unittest.mock import AsyncMock, Mock
+from api.adaptive_sampling import SequentialSampler, t_critical
+from api.alignment_parser import AlignmentParser
+from api.greaseweazle import GreaseweazleExecutor
+from api.track0_verifier import Track0Verifier
+
+
+@pytest.fixture
+def reading(gw_line):
+    """Construit une lecture parsée"""
+    def parse(cyl=0, head=0, sectors=18, flux=99998):
+        return AlignmentParser.parse_line(gw_line(cyl, head, sectors, flux))
+    return parse
+
+
+class TestSequentialSampler:
+    """Tests pour SequentialSampler"""
+
+    def test_t_critical(self):
+        """Table de Student : valeur tabulée inférieure, puis loi normale"""
+        assert t_critical(0) == float("inf")
+        assert t_critical(2) == 4.303
+        assert t_critical(11) == 2.228
+        assert t_critical(100) == 1.96
+
+    def test_stable_track_stops_at_min_reads(self, reading):
+        """Une piste stable converge dès min_reads lectures"""
+        sampler = SequentialSampler(min_reads=3, max_reads=15)
+        for _ in range(2):
+            sampler.add(reading())
+            assert not sampler.is_converged("0.0")
+        sampler.add(reading())
+
+        summary = sampler.track_summary("0.0")
+        assert summary["converged"]
+        assert summary["reads"] == 3
+        assert summary["ci_half_width"] == 0
+
+    def test_noisy_track_reads_until_cap(self, reading):
+        """Une piste bruitée est lue jusqu'au plafond"""
+        sampler = SequentialSampler(min_reads=3, max_reads=6)
+        for i in range(5):
+            sampler.add(reading(sectors=18 if i % 2 else 12))
+            assert not sampler.is_converged("0.0")
+        sampler.add(reading(sectors=15))
+
+        assert sampler.is_converged("0.0")
+        assert sampler.summary()["noisy_tracks"] == ["0.0"]
+
+    def test_flux_variation_blocks_convergence(self, reading):
+        """Un CV de flux trop élevé empêche la convergence"""
+        sampler = SequentialSampler(min_reads=3, max_reads=15, cv_target=1.0)
+        for flux in (90000, 100000, 110000):
+            sampler.add(reading(flux=flux))
+
+        summary = sampler.track_summary("0.0")
+        assert summary["ci_half_width"] == 0
+        assert summary["cv"] > 1.0
+        assert not summary["converged"]
+
+    def test_summary(self, reading):
+        """Bilan global et lectures économisées"""
+        sampler = SequentialSampler(min_reads=3, max_reads=10)
+        for head in (0, 1):
+            for _ in range(3):
+                sampler.add(reading(head=head))
+
+        assert sampler.all_converged(["0.0", "0.1"])
+        assert not sampler.all_converged(["0.0", "1.0"])
+        summary = sampler.summary()
+        assert summary["total_reads"] == 6
+        assert summary["max_reads"] == 20
+        assert summary["reads_saved"] == 14
+        assert summary["noisy_tracks"] == []
+
+
+@pytest.mark.asyncio
+class TestAdaptiveRunAlign:
+    """Tests pour run_align avec échantillonnage adaptatif"""
+
+    async def test_stops_when_cylinder_converged(self, gw_line):
+        """gw est arrêté dès que les deux faces du cylindre ont convergé"""
+        executor = GreaseweazleExecutor(gw_path="gw")
+        calls = []
+
+        async def run_command(args, on_output=None, timeout=None, should_stop=None):
+            calls.append(args)
+            lines = []
+            for i in range(20):
+                line = gw_line(0, i % 2)
+                lines.append(line)
+                on_output(line)
+                if should_stop():
+                    break
+            return subprocess.CompletedProcess(args, 0, "\n".join(lines), "")
+
+        executor.run_command = run_command
+        sampler = SequentialSampler(min_reads=3, max_reads=10)
+        seen = []
+
+        result = await executor.run_align(cylinders=1, on_output=seen.append, sampler=sampler)
+
+        assert result["success"]
+        assert "--reads=20" in calls[0]
+        assert len(seen) == 6
+        assert sampler.summary()["reads_saved"] == 14
+
+
+@pytest.mark.asyncio
+class TestAdaptiveTrack0:
+    """Tests pour la vérification Track 0 avec échantillonnage adaptatif"""
+
+    @pytest.mark.parametrize("adaptive", [False, True])
+    async def test_sampler_only_when_adaptive(self, adaptive):
+        """Les lectures de piste 0 ne sont échantillonnées qu'en mode adaptatif"""
+        executor = Mock()
+        executor.run_seek_plan = AsyncMock(return_value={
+            "timing": None, "seeks": [], "failed_at": None, "output": ""
+        })
+        executor.run_align = AsyncMock(return_value={"stdout": "", "returncode": 0})
+
+        await Track0Verifier(executor).verify_track0_sensor(
+            test_positions=[10, 20], reads_per_test=5, adaptive=adaptive
+        )
+
+        sampler = executor.run_align.call_args.kwargs["sampler"]
+        assert (sampler is not None) == adaptive
+        if adaptive:
+            assert sampler.max_reads == 5
@@ -0,0 +1,160 @@
+"""
+Tests unitaires pour alignment_scheduler.py
+"""
+
+import pytest
+import asyncio
+from unittest.mock import AsyncMock, Mock
+from api import alignment_scheduler
+from api.alignment_scheduler import AlignmentScheduler, unit_lock
+from api.manual_alignment import ManualAlignmentMode
+from api.track0_verifier import Track0Verifier
+from api.alignment_state import AlignmentStatus
+
+
+@pytest.mark.asyncio
+class TestAlignmentScheduler:
+    """Tests pour AlignmentScheduler"""
+
+    async def test_same_unit_serialised(self, make_executor):
+        """Les lecteurs A et B d'un même Greaseweazle passent l'un après l'autre"""
+        executor = make_executor()
+        scheduler = AlignmentScheduler(executor)
+
+        job_a = scheduler.submit(device="/dev/ttyACM0", drive="A", cylinders=2, retries=2)
+        job_b = scheduler.submit(device="/dev/ttyACM0", drive="B", cylinders=2, retries=2)
+        await asyncio.gather(job_a.task, job_b.task)
+
+        assert executor.max_running["/dev/ttyACM0"] == 1
+        for job in (job_a, job_b):
+            state = await job.state.get_state()
+            assert state.status == AlignmentStatus.COMPLETED
+            assert len(state.values) == 4
+
+    async def test_devices_run_in_parallel(self, make_executor):
+        """Des Greaseweazle différents travaillent en parallèle"""
+        executor = make_executor()
+        scheduler = AlignmentScheduler(executor)
+
+        jobs = [scheduler.submit(device=f"/dev/ttyACM{i}", drive="A", cylinders=2)
+                for i in range(3)]
+        await asyncio.gather(*(job.task for job in jobs))
+
+        assert executor.max_total == 3
+
+    async def test_survey_archive(self, make_executor):
+        """Un relevé avec archive enregistre les captures de chaque tour"""
+        executor = make_executor()
+        scheduler = AlignmentScheduler(executor)
+
+        job = scheduler.submit(device="/dev/ttyACM0", drive="A", cylinders=20,
+                               survey=True, archive_path="survey.gwfa")
+        await job.task
+
+        state = await job.state.get_state()
+        assert state.status == AlignmentStatus.COMPLETED
+        assert executor.archives and executor.archives == ["survey.gwfa"] * len(executor.archives)
+
+    async def test_unit_lock_shared(self, make_executor):
+        """Un job attend que l'unité soit libérée par /align ou le mode manuel"""
+        executor = make_executor()
+        scheduler = AlignmentScheduler(executor)
+
+        async with unit_lock("/dev/ttyACM0"):
+            job = scheduler.submit(device="/dev/ttyACM0", drive="A", cylinders=2)
+            await asyncio.sleep(0.05)
+            assert executor.archives == []
+        await job.task
+        assert executor.archives == [None]
+
+    async def test_manual_commands_take_unit_lock(self):
+        """Chaque commande gw du mode manuel prend le verrou de l'unité"""
+        executor = Mock()
+        executor.run_command = AsyncMock(return_value="done")
+        manual = ManualAlignmentMode(executor)
+
+        async with unit_lock():
+            command = asyncio.create_task(manual._run_gw(["align"]))
+            await asyncio.sleep(0.05)
+            assert not executor.run_command.called
+        assert await command == "done"
+
+    async def test_track0_seeks_take_unit_lock(self):
+        """Le plan de seek de la vérification Track 0 attend que l'unité soit libre"""
+        executor = Mock()
+        executor.run_seek_plan = AsyncMock(return_value={
+            "timing": None, "seeks": [], "failed_at": None, "output": ""
+        })
+        executor.run_align = AsyncMock(return_value={"stdout": "", "returncode": 0})
+        verifier = Track0Verifier(executor)
+
+        async with unit_lock():
+            verify = asyncio.create_task(verifier.verify_track0_sensor(test_positions=[10]))
+            await asyncio.sleep(0.05)
+            assert not executor.run_seek_plan.called
+        await verify
+        assert executor.run_seek_plan.called and executor.run_align.called
+
+    async def test_finished_jobs_pruned(self, monkeypatch, make_executor):
+        """Seuls les derniers jobs terminés restent dans le registre"""
+        monkeypatch.setattr(alignment_scheduler, "MAX_FINISHED_JOBS", 2)
+        scheduler = AlignmentScheduler(make_executor())
+
+        jobs = []
+        for _ in range(4):
+            job = scheduler.submit(device="/dev/ttyACM0", drive="A", cylinders=1)
+            await job.task
+            jobs.append(job)
+
+        assert [job.job_id for job in scheduler.list_jobs()] == [j.job_id for j in jobs[1:]]
+        assert scheduler.get_session("/dev/ttyACM0", "A") is jobs[-1]
+
+    async def test_duplicate_session_rejected(self, make_executor):
+        """Un seul job actif par couple (device, lecteur)"""
+        scheduler = AlignmentScheduler(make_executor())
+
+        job = scheduler.submit(device="/dev/ttyACM0", drive="A", cylinders=2)
+        with pytest.raises(ValueError):
+            scheduler.submit(device="/dev/ttyACM0", drive="A", cylinders=2)
+        await job.task
+
+        # Une fois terminé, la session peut être relancée
+        again = scheduler.submit(device="/dev/ttyACM0", drive="A", cylinders=2)
+        assert scheduler.get_session("/dev/ttyACM0", "A") is again
+        await again.task
+
+    async def test_cancel_running_and_queued(self, make_executor):
+        """L'annulation arrête le job en cours et le job en attente"""
+        scheduler = AlignmentScheduler(make_executor(duration=10))
+        events = []
+
+        async def on_event(event):
+            events.append(event)
+        scheduler.on_event = on_event
+
+        running = scheduler.submit(device="/dev/ttyACM0", drive="A", cylinders=4)
+        queued = scheduler.submit(device="/dev/ttyACM0", drive="B", cylinders=4)
+        await asyncio.sleep(0.05)
+        assert (await queued.to_dict())["state"]["status"] == "queued"
+
+        assert await scheduler.cancel(queued.job_id)
+        assert await scheduler.cancel(running.job_id)
+        assert not await scheduler.cancel(running.job_id)
+
+        for job in (running, queued):
+            state = await job.state.get_state()
+            assert state.status == AlignmentStatus.CANCELLED
+        cancelled = [e["job_id"] for e in events if e["type"] == "job_cancelled"]
+        assert sorted(cancelled) == sorted([running.job_id, queued.job_id])
+
+    async def test_results_stream(self, make_executor):
+        """Le flux de résultats d'un job se termine avec le job"""
+        scheduler = AlignmentScheduler(make_executor())
+        job = scheduler.submit(device="/dev/ttyACM0", drive="A", cylinders=3, retries=2)
+
+        values = [value async for value in scheduler.stream(job.job_id)]
+
+        assert [v["track"] for v in values] == ["0.0", "0.1", "1.0", "1.1", "2.0", "2.1"]
+        data = await job.to_dict(include_values=True)
+        assert data["state"]["status"] == "completed"
+        assert len(data["values"]) == 6
@@ -0,0 +1,102 @@
+"""
+Tests unitaires pour alignment_survey.py
+"""
+
+import pytest
+from api.alignment_survey import AlignmentSurvey
+
+
+@pytest.mark.asyncio
+class TestAlignmentSurvey:
+    """Tests pour AlignmentSurvey"""
+
+    async def test_good_drive_reads_coarse_set_only(self, make_executor):
+        """Un lecteur parfait : seul le relevé grossier est lu"""
+        executor = make_executor()
+        survey = AlignmentSurvey(executor, cylinders=80)
+
+        result = await survey.run(retries=3)
+
+        assert result["success"]
+        assert executor.rounds == [[0, 10, 20, 30, 40, 50, 60, 70, 79]]
+        summary = survey.summary()
+        assert summary["cylinders_read"] == 9
+        assert summary["flagged"] == []
+
+    async def test_refines_around_drop(self, make_executor):
+        """Une chute de qualité est encadrée par bissections successives"""
+        executor = make_executor(lambda cyl, head: 14 if 37 <= cyl <= 43 else 18)
+        survey = AlignmentSurvey(executor, cylinders=80)
+
+        await survey.run(retries=3)
+
+        read = set(survey.attempted())
+        flagged = survey.flagged_cylinders()
+        # Les bords de la zone sont encadrés exactement : 36 et 44 sont lus
+        # sains, 37 et 43 sont les premier et dernier cylindres signalés
+        assert {36, 44} <= read
+        assert min(flagged) == 37 and max(flagged) == 43
+        assert 36 not in flagged and 44 not in flagged
+        # Le reste du disque n'est pas relu
+        assert len(read) < 25
+        for cyl in read - set(range(30, 51)):
+            assert cyl % 10 == 0 or cyl == 79
+
+    async def test_refines_around_azimuth(self, make_executor):
+        """Un écart d'azimut est signalé même quand le pourcentage reste correct"""
+        # gw alterne les faces : lectures 2k et 2k+1 sur les faces 0 et 1
+        spread = {0: -1000, 1: 0, 2: 1000}
+        executor = make_executor(flux=lambda cyl, head, read:
+                                 100000 + (spread[read // 2 % 3] if cyl == 40 else 0))
+        survey = AlignmentSurvey(executor, cylinders=80)
+
+        await survey.run(retries=6)
+
+        percentages = survey.track_percentages()[40]
+        assert min(percentages.values()) > survey.quality_threshold
+        assert 40 in survey.flagged_cylinders()
+        assert executor.rounds[1] == [35, 45]
+
+    async def test_archive_every_round(self, make_executor):
+        """Les captures de tous les tours vont dans la même archive de flux"""
+        executor = make_executor(lambda cyl, head: 14 if 37 <= cyl <= 43 else 18)
+        survey = AlignmentSurvey(executor, cylinders=80)
+
+        await survey.run(retries=3, archive_path="survey.gwfa")
+
+        assert len(executor.rounds) > 1
+        assert executor.archives == ["survey.gwfa"] * len(executor.rounds)
+
+    async def test_refines_head_difference(self, make_executor):
+        """Un écart entre les faces déclenche un raffinement"""
+        executor = make_executor(lambda cyl, head: 17 if head == 1 and cyl == 70 else 18)
+        survey = AlignmentSurvey(executor, cylinders=80)
+
+        await survey.run(retries=3)
+
+        assert 70 in survey.summary()["flagged"]
+        assert executor.rounds[1] == [65, 74]
+
+    async def test_confidence_map(self, make_executor):
+        """Pistes lues à 1, pistes interpolées moins sûres loin des lectures"""
+        executor = make_executor()
+        survey = AlignmentSurvey(executor, cylinders=80)
+        await survey.run(retries=3)
+
+        confidence_map = {e["track"]: e for e in survey.confidence_map()}
+        assert len(confidence_map) == 160
+        assert confidence_map["10.0"]["measured"]
+        assert confidence_map["10.0"]["confidence"] == 1.0
+        assert not confidence_map["15.1"]["measured"]
+        assert confidence_map["15.1"]["percentage"] == confidence_map["10.1"]["percentage"]
+        assert confidence_map["11.0"]["confidence"] > confidence_map["15.0"]["confidence"]
+
+    async def test_confidence_lower_across_jump(self, make_executor):
+        """Entre deux lectures différentes, l'estimation est moins sûre"""
+        executor = make_executor(lambda cyl, head: 17 if cyl == 79 else 18)
+        survey = AlignmentSurvey(executor, cylinders=80, max_rounds=0)
+        await survey.run(retries=3)
+
+        confidence_map = {e["track"]: e for e in survey.confidence_map()}
+        assert confidence_map["75.0"]["confidence"] < confidence_map["15.0"]["confidence"]
+        assert 94.0 < confidence_map["75.0"]["percentage"] < 100.0
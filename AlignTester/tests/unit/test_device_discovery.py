@@ -0,0 +1,129 @@
+"""
+Tests unitaires pour device_discovery.py
+"""
+
+import pytest
+import asyncio
+import time
+from api.device_discovery import DeviceDiscoveryService
+
+
+@pytest.mark.asyncio
+class TestDeviceDiscoveryService:
+    """Tests pour DeviceDiscoveryService"""
+    
+    async def test_probe_cached(self, make_executor):
+        """Une sonde n'est exécutée qu'une fois tant que le TTL court"""
+        executor = make_executor()
+        service = DeviceDiscoveryService(executor, poll_interval=0)
+        
+        assert await service.get_version() == "1.23"
+        assert await service.get_version() == "1.23"
+        
+        executor.check_version.assert_called_once()
+    
+    async def test_concurrent_probes_single_flight(self, make_executor):
+        """Des requêtes concurrentes partagent une seule sonde"""
+        executor = make_executor()
+        def slow_info():
+            time.sleep(0.05)
+            return {"port": "COM3", "connected": True}
+        executor.get_device_info.side_effect = slow_info
+        service = DeviceDiscoveryService(executor, poll_interval=0)
+        
+        results = await asyncio.gather(*[service.get_device_info() for _ in range(5)])
+        
+        assert all(r["port"] == "COM3" for r in results)
+        executor.get_device_info.assert_called_once()
+    
+    async def test_probe_does_not_block_event_loop(self, make_executor):
+        """La sonde tourne hors de l'event loop"""
+        executor = make_executor()
+        executor.check_version.side_effect = lambda: time.sleep(0.2) or "1.23"
+        service = DeviceDiscoveryService(executor, poll_interval=0)
+        
+        ticks = 0
+        async def ticker():
+            nonlocal ticks
+            for _ in range(5):
+                await asyncio.sleep(0.01)
+                ticks += 1
+        
+        await asyncio.gather(service.get_version(), ticker())
+        
+        assert ticks == 5
+    
+    async def test_expired_entry_served_while_refreshing(self, make_executor):
+        """Une entrée expirée est retournée et rafraîchie en arrière-plan"""
+        executor = make_executor()
+        service = DeviceDiscoveryService(executor, ttl=0.01, poll_interval=0)
+        
+        assert await service.get_version() == "1.23"
+        executor.check_version.return_value = "1.24"
+        await asyncio.sleep(0.02)
+        
+        assert await service.get_version() == "1.23"
+        for _ in range(50):
+            await asyncio.sleep(0.01)
+            if executor.check_version.call_count == 2:
+                break
+        await asyncio.sleep(0.01)
+        assert await service.get_version() == "1.24"
+    
+    async def test_gw_path_change_invalidates(self, make_executor):
+        """Changer le chemin vers gw vide le cache"""
+        executor = make_executor()
+        service = DeviceDiscoveryService(executor, poll_interval=0)
+        
+        await service.get_align_available()
+        executor.gw_path = "/opt/gw/gw"
+        executor.check_align_available.return_value = False
+        
+        assert await service.get_align_available() is False
+        assert executor.check_align_available.call_count == 2
+    
+    async def test_invalidate(self, make_executor):
+        """invalidate() force une nouvelle sonde"""
+        executor = make_executor()
+        service = DeviceDiscoveryService(executor, poll_interval=0)
+        
+        await service.get_connection()
+        service.invalidate("test")
+        await service.get_connection()
+        
+        assert executor.check_connection.call_count == 2
+    
+    async def test_hotplug_invalidates(self, make_executor):
+        """Un changement de la liste des ports invalide le cache"""
+        executor = make_executor()
+        service = DeviceDiscoveryService(executor, poll_interval=0)
+        
+        assert service._poll_ports() is False  # Relevé initial
+        await service.get_device_info()
+        assert service._poll_ports() is False
+        
+        executor.detect_serial_ports.return_value = [
+            {"device": "/dev/ttyACM0"}, {"device": "/dev/ttyACM1"}
+        ]
+        assert service._poll_ports() is True
+        
+        # La nouvelle liste est déjà en cache, le reste sera sondé à nouveau
+        ports = await service.get_ports()
+        assert len(ports) == 2
+        await service.get_device_info()
+        assert executor.get_device_info.call_count == 2
+        assert executor.detect_serial_ports.call_count == 3
+    
+    async def test_watcher_thread(self, make_executor):
+        """Le thread de surveillance détecte un branchement"""
+        executor = make_executor()
+        service = DeviceDiscoveryService(executor, poll_interval=0.01)
+        
+        await service.get_version()
+        await asyncio.sleep(0.05)
+        executor.detect_serial_ports.return_value = []
+        await asyncio.sleep(0.05)
+        service.stop_watcher()
+        
+        await service.get_version()
+        assert executor.check_version.call_count == 2
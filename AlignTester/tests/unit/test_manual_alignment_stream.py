@@ -0,0 +1,137 @@
+"""
+Tests unitaires pour le mode Stream de manual_alignment.py
+"""
+
+import pytest
+from unittest.mock import Mock
+from api.manual_alignment import ManualAlignmentMode, AlignmentMode, MODE_CONFIG
+
+
+STREAM_OUTPUT = [
+    "Aligning T20.0, reading 5 times, revs=5",
+    "Format ibm.1440",
+    "T20.0: IBM MFM (18/18 sectors) from Raw Flux (99998 flux in 200.01ms)",
+    "T20.0: IBM MFM (17/18 sectors) from Raw Flux (99990 flux in 199.98ms)",
+    "T20.0: IBM MFM (18/18 sectors) from Raw Flux (99995 flux in 200.00ms)",
+]
+
+
+@pytest.mark.asyncio
+class TestStreamMode:
+    """Tests pour le mode Stream (une lecture par révolution)"""
+
+    async def test_one_reading_per_revolution(self, make_executor):
+        """Chaque révolution produit une lecture et une notification"""
+        executor = make_executor(lines=STREAM_OUTPUT)
+        mode = ManualAlignmentMode(executor)
+        mode.set_alignment_mode(AlignmentMode.STREAM)
+        mode.state.is_running = True
+        mode.state.current_track = 20
+        mode.state.diskdefs_path = None
+        updates = []
+        mode.set_update_callback(updates.append)
+
+        await mode._read_track_stream()
+
+        args = executor.calls[0]
+        assert "--stream" in args
+        assert f"--reads={MODE_CONFIG[AlignmentMode.STREAM]['stream_reads']}" in args
+        assert f"--revs={MODE_CONFIG[AlignmentMode.STREAM]['stream_revs']}" in args
+
+        complete = [u for u in updates if u["type"] == "direct_reading_complete"]
+        assert [u["timing"]["revolution"] for u in complete] == [1, 2, 3]
+        assert [r.sectors_detected for r in mode.state.readings] == [18, 17, 18]
+        assert mode.state.last_reading.percentage == 100.0
+
+    async def test_session_stops_on_track_change(self, make_executor):
+        """La session gw s'arrête dès que la piste change"""
+        executor = make_executor(lines=STREAM_OUTPUT)
+        mode = ManualAlignmentMode(executor)
+        mode.set_alignment_mode(AlignmentMode.STREAM)
+        mode.state.is_running = True
+        mode.state.current_track = 20
+        mode.state.diskdefs_path = None
+
+        def on_update(update):
+            if update["type"] == "direct_reading_complete":
+                mode.state.current_track = 21
+        mode.set_update_callback(on_update)
+
+        await mode._read_track_stream()
+
+        assert [r.sectors_detected for r in mode.state.readings] == [18]
+
+    async def test_session_stops_on_pause(self, make_executor):
+        """La session gw s'arrête quand la lecture est mise en pause (seek, recal)"""
+        executor = make_executor(lines=STREAM_OUTPUT)
+        mode = ManualAlignmentMode(executor)
+        mode.set_alignment_mode(AlignmentMode.STREAM)
+        mode.state.is_running = True
+        mode.state.diskdefs_path = None
+
+        def on_update(update):
+            if len(mode.state.readings) == 2:
+                mode._reading_paused = True
+        mode.set_update_callback(on_update)
+
+        await mode._read_track_stream()
+
+        assert [r.sectors_detected for r in mode.state.readings] == [18, 17]
+
+    async def test_history_is_bounded(self, make_executor):
+        """L'historique est limité à max_readings_history"""
+        line = STREAM_OUTPUT[2]
+        executor = make_executor(lines=[line] * 30)
+        mode = ManualAlignmentMode(executor)
+        mode.set_alignment_mode(AlignmentMode.STREAM)
+        mode.state.is_running = True
+        mode.state.diskdefs_path = None
+
+        await mode._read_track_stream()
+
+        assert len(mode.state.readings) == MODE_CONFIG[AlignmentMode.STREAM]["max_readings_history"]
+
+    async def test_history_sized_per_mode(self, make_executor):
+        """L'historique est dimensionné au changement de mode, pas à chaque lecture"""
+        mode = ManualAlignmentMode(make_executor(lines=STREAM_OUTPUT))
+        assert mode.state.history.capacity == MODE_CONFIG[AlignmentMode.DIRECT]["max_readings_history"]
+        for alignment_mode in AlignmentMode:
+            mode.set_alignment_mode(alignment_mode)
+            assert mode.state.history.capacity == MODE_CONFIG[alignment_mode]["max_readings_history"]
+
+        mode.set_alignment_mode(AlignmentMode.STREAM)
+        mode.state.is_running = True
+        mode.state.diskdefs_path = None
+        mode.state.history.set_capacity = Mock(side_effect=AssertionError("redimensionnement"))
+        await mode._read_track_stream()
+        assert len(mode.state.readings) == 3
+
+    async def test_error_without_revolution(self, make_executor):
+        """Une commande en échec sans aucune révolution est signalée"""
+        executor = make_executor(lines=["Command Failed: ReadFlux: No Index"], returncode=1)
+        mode = ManualAlignmentMode(executor)
+        mode.set_alignment_mode(AlignmentMode.STREAM)
+        mode.state.diskdefs_path = None
+        updates = []
+        mode.set_update_callback(updates.append)
+
+        await mode._read_track_stream()
+
+        assert updates[-1]["type"] == "reading_error"
+        assert mode.state.readings == []
+
+    async def test_archive_path(self, make_executor):
+        """Avec une archive de flux, chaque capture y est enregistrée"""
+        executor = make_executor(lines=STREAM_OUTPUT)
+        mode = ManualAlignmentMode(executor)
+        mode.set_alignment_mode(AlignmentMode.STREAM)
+        mode.state.diskdefs_path = None
+        mode.set_archive_path("manual.gwfa")
+
+        await mode._read_track_stream()
+        mode.set_archive_path("")
+        await mode._read_track_stream()
+
+        assert "--archive=manual.gwfa" in executor.calls[0]
+        assert not any(a.startswith("--archive") for a in executor.calls[1])
+        assert mode.get_state()["archive_path"] is None
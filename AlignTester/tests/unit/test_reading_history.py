@@ -0,0 +1,130 @@
+"""
+Tests unitaires pour reading_history.py
+"""
+
+import math
+import random
+import sys
+from api.reading_history import RunningWindow, ReadingHistory
+from api.manual_alignment import TrackReading
+
+
+def brute_force(values):
+    """Agrégats recalculés à partir des valeurs"""
+    n = len(values)
+    mean = sum(values) / n
+    std_dev = math.sqrt(sum((v - mean) ** 2 for v in values) / n)
+    mean_i = (n - 1) / 2
+    slope = (sum((i - mean_i) * (v - mean) for i, v in enumerate(values))
+             / sum((i - mean_i) ** 2 for i in range(n))) if n > 1 else None
+    return {"min": min(values), "max": max(values), "mean": mean,
+            "std_dev": std_dev, "slope": slope}
+
+
+def make_reading(track=0, head=0, percentage=99.0, flux=100000):
+    return TrackReading(track=track, head=head, timestamp=0.0, percentage=percentage,
+                        sectors_detected=18, sectors_expected=18, flux_transitions=flux,
+                        time_per_rev=200.0, raw_output="")
+
+
+class TestRunningWindow:
+    """Tests pour RunningWindow"""
+
+    def test_aggregates_match_brute_force(self):
+        """Les agrégats glissants correspondent au recalcul complet, après éviction"""
+        rng = random.Random(42)
+        window = RunningWindow(7)
+        pushed = []
+        for _ in range(50):
+            value = rng.uniform(90, 100)
+            window.push(value)
+            pushed.append(value)
+            expected = brute_force(pushed[-7:])
+            assert window.values() == pushed[-7:]
+            assert window.count == len(pushed[-7:])
+            assert math.isclose(window.mean, expected["mean"], rel_tol=1e-9)
+            assert math.isclose(window.std_dev, expected["std_dev"], rel_tol=1e-6, abs_tol=1e-9)
+            snapshot = window.snapshot(decimals=9)
+            assert snapshot["min"] == round(expected["min"], 9)
+            assert snapshot["max"] == round(expected["max"], 9)
+            if expected["slope"] is not None:
+                assert math.isclose(window.slope, expected["slope"], rel_tol=1e-6, abs_tol=1e-9)
+
+    def test_trend_slope(self):
+        """Pente d'une série linéaire"""
+        window = RunningWindow(5)
+        for i in range(20):
+            window.push(90 + 0.5 * i)
+        assert math.isclose(window.slope, 0.5)
+        assert window.snapshot()["min"] == 97.5
+
+    def test_empty_window(self):
+        """Fenêtre vide : pas d'agrégats"""
+        snapshot = RunningWindow(3).snapshot()
+        assert snapshot["count"] == 0
+        assert snapshot["mean"] is None and snapshot["slope"] is None
+
+    def test_resized_keeps_latest(self):
+        """Réduire la capacité garde les valeurs les plus récentes"""
+        window = RunningWindow(10)
+        for i in range(10):
+            window.push(i)
+        smaller = window.resized(3)
+        assert smaller.values() == [7.0, 8.0, 9.0]
+        assert smaller.mean == 8.0
+
+
+class TestReadingHistory:
+    """Tests pour ReadingHistory"""
+
+    def test_per_track_windows(self):
+        """Une fenêtre par (piste, tête)"""
+        history = ReadingHistory(capacity=4)
+        for i in range(10):
+            history.add(make_reading(track=0, head=0, percentage=90 + i))
+            history.add(make_reading(track=1, head=1, percentage=50.0))
+
+        assert len(history) == 4
+        assert history.total == 20
+        snapshot = history.snapshot(0, 0)
+        assert snapshot["percentage"]["count"] == 4
+        assert snapshot["percentage"]["min"] == 96.0
+        assert snapshot["percentage"]["mean"] == 97.5
+        assert history.snapshot(1, 1)["percentage"]["std_dev"] == 0.0
+        assert history.snapshot(2, 0) is None
+        assert history.previous.track == 0
+
+    def test_capacity_change(self):
+        """Le changement de mode ajuste la capacité de toutes les fenêtres"""
+        history = ReadingHistory(capacity=100)
+        for i in range(50):
+            history.add(make_reading(percentage=float(i)), capacity=100)
+        history.add(make_reading(percentage=50.0), capacity=20)
+
+        assert len(history) == 20
+        assert history.snapshot(0, 0)["percentage"]["count"] == 20
+        assert history.snapshot(0, 0)["percentage"]["min"] == 31.0
+
+    def test_memory_bounded(self):
+        """Une longue session ne fait pas grossir l'historique"""
+        history = ReadingHistory(capacity=20)
+        for i in range(200):
+            history.add(make_reading(percentage=95.0 + (i % 5)))
+        window = history._tracks[(0, 0)].percentage
+        size = sys.getsizeof(window._data)
+        for i in range(5000):
+            history.add(make_reading(percentage=95.0 + (i % 5)))
+
+        assert len(history) == 20
+        assert sys.getsizeof(window._data) == size
+        assert len(window._min) <= 20 and len(window._max) <= 20
+        assert history.snapshot(0, 0)["percentage"]["mean"] == 97.0
+
+    def test_clear(self):
+        """La réinitialisation vide l'historique"""
+        history = ReadingHistory()
+        history.add(make_reading())
+        history.clear()
+        assert len(history) == 0
+        assert history.total == 0
+        assert history.snapshot(0, 0) is None
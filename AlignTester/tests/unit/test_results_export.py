@@ -0,0 +1,188 @@
+"""
+Tests unitaires pour results_export.py
+"""
+
+import json
+import math
+import struct
+import zipfile
+import pytest
+from api.results_export import ResultsStore, TABLES, KINDS, export_session, parse_track
+
+
+class TestResultsStore:
+    """Tests pour ResultsStore"""
+
+    def test_roundtrip(self, tmp_path, session_values):
+        """Les lectures, pistes et statistiques sont relues colonne par colonne"""
+        values, statistics = session_values()
+        store = ResultsStore(str(tmp_path / "results"))
+        session_id = store.append_session(values, statistics, device="/dev/ttyACM0",
+                                          drive="A", format_type="ibm.1440")
+
+        reads = store.read("reads")
+        assert len(reads["percentage"]) == len(values) == 12
+        assert reads["session_id"] == [session_id] * 12
+        assert reads["cylinder"][:4] == [0, 0, 0, 0]
+        assert reads["head"][:4] == [0, 0, 1, 1]
+        assert reads["sectors_detected"] == [18] * 12
+        assert reads["base"] == [None] * 12  # Absent en format gw align
+
+        tracks = store.read("tracks")
+        assert len(tracks["cylinder"]) == 6
+        assert tracks["num_readings"] == [2] * 6
+        details = statistics["values"][0]["calculation_details"]
+        assert tracks["score_raw_sector"][0] == details["scores_raw"]["sector"]
+        assert tracks["weight_quality"][0] == details["weights"]["quality"]
+        assert tracks["is_in_format_range"] == [True] * 6
+
+        sessions = store.read("sessions")
+        assert sessions["device"] == ["/dev/ttyACM0"]
+        assert sessions["average"] == [statistics["average"]]
+        assert sessions["quality"] == [statistics["quality"]]
+
+    def test_columns_are_npy(self, tmp_path, session_values):
+        """Chaque partie est une archive .npz : un tableau .npy 1-D typé par colonne"""
+        values, statistics = session_values()
+        path = tmp_path / "results"
+        ResultsStore(str(path)).append_session(values, statistics)
+
+        schema = json.loads((path / "schema.json").read_text(encoding="utf-8"))
+        assert schema["tables"]["reads"]["rows"] == 12
+        for table, columns in TABLES.items():
+            part, = schema["tables"][table]["parts"]
+            rows = part["rows"]
+            assert rows == schema["tables"][table]["rows"]
+            with zipfile.ZipFile(path / part["file"]) as z:
+                assert z.namelist() == [f"{name}.npy" for name, _, _ in columns]
+                for name, kind, _ in columns:
+                    data = z.read(f"{name}.npy")
+                    assert data[:8] == b"\x93NUMPY\x01\x00"
+                    header_len, = struct.unpack("<H", data[8:10])
+                    header = data[10:10 + header_len].decode("latin1")
+                    assert (10 + header_len) % 64 == 0 and header.endswith("\n")
+                    assert f"'descr': '{KINDS[kind]}'" in header
+                    assert f"'shape': ({rows},)" in header
+                    assert len(data) - 10 - header_len == rows * int(KINDS[kind][2:])
+        assert ResultsStore(str(path)).column("reads", "percentage").typecode == "d"
+        assert math.isnan(ResultsStore(str(path)).column("reads", "base")[0])
+
+    def test_numpy_load(self, tmp_path, session_values):
+        """Les archives se relisent avec numpy.load, sans pickle"""
+        np = pytest.importorskip("numpy")
+        values, statistics = session_values()
+        path = tmp_path / "results"
+        store = ResultsStore(str(path))
+        store.append_session(values, statistics)
+        store.append_session(values, statistics)
+
+        for table, columns in TABLES.items():
+            parts = [np.load(path / part["file"], allow_pickle=False) for part in store.parts(table)]
+            for name, kind, _ in columns:
+                column = np.concatenate([arrays[name] for arrays in parts])
+                assert column.dtype == np.dtype(KINDS[kind])
+                np.testing.assert_array_equal(column, list(store.column(table, name)))
+            for arrays in parts:
+                arrays.close()
+
+    def test_append_sessions(self, tmp_path, session_values):
+        """Les sessions suivantes sont ajoutées à la fin, les dictionnaires étendus"""
+        path = str(tmp_path / "results")
+        values, statistics = session_values()
+        first = ResultsStore(path).append_session(values, statistics, format_type="ibm.1440")
+        values, statistics = session_values(cylinders=2, sectors=17)
+        second = ResultsStore(path).append_session(values, statistics, format_type="ibm.720")
+
+        store = ResultsStore(path)
+        assert store.rows("reads") == 12 + 8
+        assert store.rows("tracks") == 6 + 4
+        assert store.read("sessions")["session_id"] == [first, second]
+        assert store.read("sessions")["format_type"] == ["ibm.1440", "ibm.720"]
+        assert store.read("reads")["sectors_detected"][12:] == [17] * 8
+        assert list(store.column("sessions", "format_type")) == [0, 1]
+
+    def test_append_writes_new_part(self, tmp_path, session_values):
+        """Un ajout écrit une nouvelle partie, sans réécrire les précédentes"""
+        path = tmp_path / "results"
+        values, statistics = session_values()
+        ResultsStore(str(path)).append_session(values, statistics)
+        first = {table: (path / table / "000000.npz").read_bytes() for table in TABLES}
+        values, statistics = session_values(cylinders=2)
+        store = ResultsStore(str(path))
+        store.append_session(values, statistics)
+
+        for table in TABLES:
+            assert (path / table / "000000.npz").read_bytes() == first[table]
+        assert store.parts("reads") == [{"file": "reads/000000.npz", "rows": 12},
+                                        {"file": "reads/000001.npz", "rows": 8}]
+        with zipfile.ZipFile(path / "reads" / "000001.npz") as z:
+            assert b"'shape': (8,)" in z.read("percentage.npy")
+
+    def test_version_1_store(self, tmp_path, session_values):
+        """Un magasin de version 1 (une archive par table) est lu puis complété"""
+        path = tmp_path / "results"
+        values, statistics = session_values()
+        ResultsStore(str(path)).append_session(values, statistics)
+        schema = json.loads((path / "schema.json").read_text(encoding="utf-8"))
+        schema["version"] = 1
+        for table, info in schema["tables"].items():
+            del info["parts"]
+            (path / table / "000000.npz").rename(path / f"{table}.npz")
+        (path / "schema.json").write_text(json.dumps(schema), encoding="utf-8")
+
+        store = ResultsStore(str(path))
+        assert store.read("reads")["percentage"] == [100.0] * 12
+        store.append_session(values, statistics)
+        store = ResultsStore(str(path))
+        assert store.schema["version"] == 2
+        assert store.parts("reads") == [{"file": "reads.npz", "rows": 12},
+                                        {"file": "reads/000001.npz", "rows": 12}]
+        assert store.read("reads")["percentage"] == [100.0] * 24
+
+    def test_interrupted_append_is_ignored(self, tmp_path, session_values):
+        """Les lignes d'un ajout interrompu avant le schéma sont ignorées puis écrasées"""
+        path = tmp_path / "results"
+        values, statistics = session_values()
+        ResultsStore(str(path)).append_session(values, statistics)
+        schema = (path / "schema.json").read_text(encoding="utf-8")
+        values_17, statistics_17 = session_values(sectors=17)
+        ResultsStore(str(path)).append_session(values_17, statistics_17)
+        (path / "schema.json").write_text(schema, encoding="utf-8")
+
+        store = ResultsStore(str(path))
+        assert len(store.read("reads")["percentage"]) == 12
+        store.append_session(values, statistics)
+        assert ResultsStore(str(path)).read("reads")["percentage"] == [100.0] * 24
+
+    def test_incompatible_schema(self, tmp_path):
+        """Un magasin d'une autre version de schéma est refusé"""
+        path = tmp_path / "results"
+        path.mkdir()
+        (path / "schema.json").write_text(json.dumps({"version": 99}), encoding="utf-8")
+        with pytest.raises(ValueError):
+            ResultsStore(str(path))
+
+    def test_parse_track(self):
+        """Conversion des pistes "XX.Y" en (cylindre, face)"""
+        assert parse_track("79.1") == (79, 1)
+        assert parse_track("") == (-1, -1)
+        assert parse_track(None) == (-1, -1)
+
+
+@pytest.mark.asyncio
+class TestExportSession:
+    """Tests pour export_session"""
+
+    async def test_export_session(self, tmp_path, session_values):
+        """L'export retourne l'identifiant de la session ajoutée"""
+        values, statistics = session_values()
+        result = await export_session(str(tmp_path / "results"), values, statistics, drive="B")
+        assert ResultsStore(result["path"]).read("sessions")["session_id"] == [result["session_id"]]
+
+    async def test_export_error(self, tmp_path, session_values):
+        """Une erreur d'export est retournée sans être levée"""
+        target = tmp_path / "file"
+        target.write_text("")
+        values, statistics = session_values()
+        result = await export_session(str(target), values, statistics)
+        assert "error" in result
@@ -0,0 +1,135 @@
+"""
+Tests unitaires pour seek_planner.py
+"""
+
+import pytest
+import subprocess
+from api.seek_planner import (
+    SeekTiming, SeekPlan, parse_seek_report, cylinder_spec,
+    plan_visits, plan_sweep, plan_track0_verify, plan_sequence
+)
+from api.greaseweazle import GreaseweazleExecutor
+
+
+REPORT = """Delays: step=3000us settle=15ms
+Seek ? -> 20: 75.35ms
+Seek 20 -> 0: 75.47ms
+Seek 0 -> 40: 135.30ms
+Seek 40 -> 0: 135.29ms"""
+
+
+class TestSeekTiming:
+    """Tests pour le modèle de coût des seeks"""
+
+    def test_cost(self):
+        """Distance x step + stabilisation, rien si la tête ne bouge pas"""
+        timing = SeekTiming(step_ms=3.0, settle_ms=15.0)
+        assert timing.cost_ms(10, 10) == 0
+        assert timing.cost_ms(0, 20) == 75.0
+        assert timing.cost_ms(20, 0) == 75.0
+
+    def test_fit(self):
+        """Les mesures donnent step et stabilisation"""
+        timing = SeekTiming.fit([(10, 45.0), (20, 75.0), (40, 135.0)])
+        assert timing.source == "measured"
+        assert timing.step_ms == pytest.approx(3.0)
+        assert timing.settle_ms == pytest.approx(15.0)
+
+    def test_fit_needs_two_distances(self):
+        """Une seule distance mesurée ne suffit pas : modèle de repli"""
+        fallback = SeekTiming(step_ms=6.0, settle_ms=20.0, source="drive")
+        assert SeekTiming.fit([(20, 75.0), (20, 76.0)], fallback=fallback) is fallback
+
+    def test_parse_report(self):
+        """Délais du lecteur puis ajustement sur les seeks chronométrés"""
+        report = parse_seek_report(REPORT)
+        assert [s["to"] for s in report.seeks] == [20, 0, 40, 0]
+        assert report.seeks[0]["from"] is None
+        assert report.timing.source == "measured"
+        assert report.timing.step_ms == pytest.approx(3.0, abs=0.01)
+
+        drive_only = parse_seek_report("Delays: step=6000us settle=20ms\nSeek ? -> 5: 50.00ms")
+        assert drive_only.timing.to_dict() == {"step_ms": 6.0, "settle_ms": 20.0, "source": "drive"}
+
+
+class TestPlanner:
+    """Tests pour les plans de visite"""
+
+    def test_visits_nearest_end_first(self):
+        """La tête part vers l'extrémité la plus proche puis balaye l'autre côté"""
+        plan = plan_visits([70, 5, 40, 60], start=50)
+        assert plan.cylinders == [60, 70, 40, 5]
+        assert plan.travel() == 20 + 65
+
+        plan = plan_visits([70, 5, 40, 60], start=10)
+        assert plan.cylinders == [5, 40, 60, 70]
+
+    def test_visits_is_optimal(self):
+        """Aucun autre ordre n'a un trajet plus court"""
+        import itertools
+        targets, start = [3, 17, 30, 55, 79], 33
+        best = min(SeekPlan("x", start, list(p)).travel()
+                   for p in itertools.permutations(targets))
+        assert plan_visits(targets, start=start).travel() == best
+
+    def test_sweep(self):
+        """Balayage depuis la piste 0 (position inconnue) : ordre croissant"""
+        plan = plan_sweep(80)
+        assert plan.cylinders == list(range(80))
+        assert plan.travel() == 79
+        assert cylinder_spec(plan.cylinders) == "0-79"
+        assert cylinder_spec([0, 1, 2, 5, 7, 8]) == "0-2,5,7-8"
+
+    def test_track0_verify(self):
+        """Allers-retours vers 0, en commençant par la position la plus proche"""
+        plan = plan_track0_verify([19, 39, 59, 78], start=60)
+        assert plan.cylinders == [59, 0, 19, 0, 39, 0, 78, 0]
+        assert plan_track0_verify([19, 39]).cylinders == [19, 0, 39, 0]
+
+    def test_sequence_keeps_order(self):
+        """Séquence imposée : ordre conservé, pauses comptées dans l'estimation"""
+        plan = plan_sequence([0, 20, 0, 10], start=0, dwell_ms=100)
+        assert plan.cylinders == [20, 0, 10]
+        timing = SeekTiming(step_ms=3.0, settle_ms=15.0)
+        assert plan.estimated_ms(timing) == 75 + 75 + 45 + 2 * 100
+
+
+@pytest.mark.asyncio
+class TestRunSeekPlan:
+    """Tests pour GreaseweazleExecutor.run_seek_plan"""
+
+    def make_executor(self, output, returncode=0):
+        executor = GreaseweazleExecutor(gw_path="gw")
+        executor.calls = []
+
+        async def run_command(args, on_output=None, timeout=None, should_stop=None):
+            executor.calls.append(args)
+            return subprocess.CompletedProcess(args, returncode, output, "")
+
+        executor.run_command = run_command
+        return executor
+
+    async def test_single_session(self):
+        """Tous les seeks du plan partent dans une seule commande gw seek"""
+        executor = self.make_executor(REPORT)
+        plan = plan_track0_verify([20, 40])
+
+        result = await executor.run_seek_plan(plan, device="/dev/ttyACM0")
+
+        assert len(executor.calls) == 1
+        args = executor.calls[0]
+        assert args[0] == "seek" and "--report" in args
+        assert args[-4:] == ["20", "0", "40", "0"]
+        assert result["success"] and result["failed_at"] is None
+        assert executor.seek_timing.source == "measured"
+
+    async def test_failure_position(self):
+        """Le premier seek non rapporté est celui en échec"""
+        output = "\n".join(REPORT.split("\n")[:3]) + "\nFATAL ERROR:\nTrack0 signal asserted after seek to cylinder 40"
+        executor = self.make_executor(output, returncode=1)
+
+        result = await executor.run_seek_plan(plan_track0_verify([20, 40]))
+
+        assert not result["success"]
+        assert len(result["seeks"]) == 2
+        assert result["failed_at"] == 40